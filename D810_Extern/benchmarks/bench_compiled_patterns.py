@@ -0,0 +1,62 @@
+# Compare the generated pattern matchers (CompiledPattern with generated code) with the generic (interpreted) matchers
+# for each rule file (rewrite_xor.py, rewrite_add.py, ...)
+# Usage: in IDA, put the cursor in an obfuscated function and run this script (File > Script file...)
+import logging
+from bench_utils import generate_microcode, get_all_asts, timeit
+
+from d810.optimizers.instructions.pattern_matching import PATTERN_MATCHING_RULES
+from d810.ast_canonical import CompiledPattern, get_canonical_ast
+
+logging.getLogger('D810.pattern_search').setLevel(logging.ERROR)
+
+
+def get_compiled_patterns_by_rule_file(rules, generate_code):
+    compiled_patterns_by_rule_file = {}
+    for rule in rules:
+        rule_file = rule.__class__.__module__.split(".")[-1]
+        compiled_patterns = compiled_patterns_by_rule_file.setdefault(rule_file, [])
+        for compiled_pattern in rule.compiled_patterns:
+            compiled_patterns.append(CompiledPattern(compiled_pattern.pattern,
+                                                     compiled_pattern.canonical_pattern is not None,
+                                                     generate_code=generate_code))
+    return compiled_patterns_by_rule_file
+
+
+def match_all(compiled_patterns, ast_list):
+    nb_matches = 0
+    for ast, canonical_ast in ast_list:
+        for compiled_pattern in compiled_patterns:
+            if compiled_pattern.match(ast, canonical_ast) is not None:
+                nb_matches += 1
+    return nb_matches
+
+
+def main():
+    mba = generate_microcode()
+    if mba is None:
+        return
+    ast_list = [(ast, get_canonical_ast(ast)) for ast in get_all_asts(mba)]
+    rules = PATTERN_MATCHING_RULES
+    for rule in rules:
+        rule.configure({})
+    interpreted_patterns = get_compiled_patterns_by_rule_file(rules, False)
+    generated_patterns = get_compiled_patterns_by_rule_file(rules, True)
+    print("{0} instructions".format(len(ast_list)))
+    print("{0:<20} {1:>9} {2:>16} {3:>16} {4:>8} {5:>8}"
+          .format("Rule file", "patterns", "interpreted m/s", "generated m/s", "speedup", "matches"))
+    for rule_file in sorted(interpreted_patterns.keys()):
+        nb_patterns = len(interpreted_patterns[rule_file])
+        nb_attempts = nb_patterns * len(ast_list)
+        if nb_attempts == 0:
+            continue
+        ref_time, ref_nb_matches = timeit(match_all, interpreted_patterns[rule_file], ast_list)
+        new_time, new_nb_matches = timeit(match_all, generated_patterns[rule_file], ast_list)
+        if ref_nb_matches != new_nb_matches:
+            print("  {0}: {1} matches (interpreted) vs {2} matches (generated)"
+                  .format(rule_file, ref_nb_matches, new_nb_matches))
+        print("{0:<20} {1:>9} {2:>16.0f} {3:>16.0f} {4:>7.2f}x {5:>8}"
+              .format(rule_file, nb_patterns, nb_attempts / ref_time, nb_attempts / new_time, ref_time / new_time,
+                      new_nb_matches))
+
+
+main()
@@ -0,0 +1,75 @@
+# Compare the greedy application of the pattern matching rules (first matching rule wins, repeated until no rule
+# matches) with the equality saturation mode of PatternOptimizer (use_egraph) on the instructions of a function:
+# time spent, number of rewrite passes and size (opcodes, depth) of the resulting instructions
+# Usage: in IDA, put the cursor in an obfuscated function and run this script (File > Script file...)
+import logging
+import time
+import ida_hexrays as hr
+from bench_utils import generate_microcode, get_all_instructions, print_comparison
+
+from d810.ast import minsn_to_ast, get_ast_statistics
+from d810.optimizers.instructions.pattern_matching import PATTERN_MATCHING_RULES, PatternOptimizer
+from d810.hexrays_hooks import DEFAULT_OPTIMIZATION_PATTERN_MATURITIES, DEFAULT_MAX_REWRITE_ITERATIONS
+
+logging.getLogger('D810.optimizer').setLevel(logging.ERROR)
+logging.getLogger('D810.pattern_search').setLevel(logging.ERROR)
+
+
+def get_instruction_cost(ins):
+    ast = minsn_to_ast(ins)
+    if ast is None:
+        return 0, 0
+    ast_statistics = get_ast_statistics(ast)
+    if ins.opcode == hr.m_mov:
+        return ast_statistics.nb_opcodes - 1, ast_statistics.depth - 1
+    return ast_statistics.nb_opcodes, ast_statistics.depth
+
+
+def optimize_all(optimizer, ins_list):
+    # Each instruction is rewritten until no rule matches, as InstructionOptimizerManager.optimize_until_fixpoint does
+    # Returns the time spent, the number of rewrites and the sum of the costs of the resulting instructions
+    nb_rewrites = 0
+    total_nb_opcodes = total_depth = 0
+    elapsed_time = 0.0
+    for blk, ins in ins_list:
+        cur_ins = hr.minsn_t(ins)
+        start_time = time.perf_counter()
+        for _ in range(DEFAULT_MAX_REWRITE_ITERATIONS):
+            new_ins = optimizer.get_optimized_instruction(blk, cur_ins)
+            if new_ins is None:
+                break
+            cur_ins = new_ins
+            nb_rewrites += 1
+        elapsed_time += time.perf_counter() - start_time
+        nb_opcodes, depth = get_instruction_cost(cur_ins)
+        total_nb_opcodes += nb_opcodes
+        total_depth += depth
+    return elapsed_time, nb_rewrites, total_nb_opcodes, total_depth
+
+
+def main():
+    mba = generate_microcode()
+    if mba is None:
+        return
+    ins_list = get_all_instructions(mba)
+    greedy_optimizer = PatternOptimizer(DEFAULT_OPTIMIZATION_PATTERN_MATURITIES)
+    egraph_optimizer = PatternOptimizer(DEFAULT_OPTIMIZATION_PATTERN_MATURITIES)
+    for rule in PATTERN_MATCHING_RULES:
+        rule.configure({})
+        greedy_optimizer.add_rule(rule)
+        egraph_optimizer.add_rule(rule)
+    egraph_optimizer.configure_egraph(True)
+    orig_nb_opcodes = sum(get_instruction_cost(ins)[0] for _, ins in ins_list)
+    print("{0} instructions, {1} opcodes".format(len(ins_list), orig_nb_opcodes))
+
+    greedy_time, greedy_nb_rewrites, greedy_nb_opcodes, greedy_depth = optimize_all(greedy_optimizer, ins_list)
+    egraph_time, egraph_nb_rewrites, egraph_nb_opcodes, egraph_depth = optimize_all(egraph_optimizer, ins_list)
+    print_comparison("Instruction simplification", "first matching rule", greedy_time, "equality saturation",
+                     egraph_time)
+    print("Rewrites: {0} -> {1}".format(greedy_nb_rewrites, egraph_nb_rewrites))
+    print("Opcodes after simplification: {0} -> {1}".format(greedy_nb_opcodes, egraph_nb_opcodes))
+    print("Sum of depths after simplification: {0} -> {1}".format(greedy_depth, egraph_depth))
+    print("Equality saturation: {0}".format(egraph_optimizer.egraph_statistics))
+
+
+main()
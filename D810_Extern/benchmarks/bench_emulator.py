@@ -0,0 +1,91 @@
+# Compare the hashed MopMapping of the emulator with the previous list-based mapping (each access scans all the known
+# mops with equal_mops_ignore_size) when the register and stack variables of a function are defined, read and
+# assigned in a MicroCodeEnvironment, as done while emulating the dispatcher of a flattened function
+# Usage: in IDA, put the cursor in an obfuscated function and run this script (File > Script file...)
+import logging
+import time
+import ida_hexrays as hr
+from bench_utils import generate_microcode, get_all_instructions, print_comparison
+
+from d810.hexrays_helpers import get_mop_index, AND_TABLE
+from d810.emulator import MicroCodeEnvironment
+
+logging.getLogger('D810.emulator').setLevel(logging.ERROR)
+
+NB_PASSES = 10
+
+
+class ListMopMapping(object):
+    # MopMapping before it was hashed
+    def __init__(self):
+        self.mops = []
+        self.mops_values = []
+
+    def __setitem__(self, mop, mop_value):
+        mop_index = get_mop_index(mop, self.mops)
+        mop_value &= AND_TABLE[mop.size]
+        if mop_index != -1:
+            self.mops_values[mop_index] = mop_value
+            return
+        self.mops.append(mop)
+        self.mops_values.append(mop_value)
+
+    def get(self, mop, default=None):
+        mop_index = get_mop_index(mop, self.mops)
+        if mop_index == -1:
+            return default
+        return self.mops_values[mop_index]
+
+    def items(self):
+        return [(x, y) for x, y in zip(self.mops, self.mops_values)]
+
+
+def get_variable_accesses(ins_list):
+    # Returns the (read mops, written mop) of each instruction using register or stack variables
+    variable_types = [hr.mop_r, hr.mop_S]
+    access_list = []
+    for _, ins in ins_list:
+        read_mops = [x for x in [ins.l, ins.r] if x is not None and x.t in variable_types]
+        written_mop = ins.d if ins.d is not None and ins.d.t in variable_types else None
+        if len(read_mops) > 0 or written_mop is not None:
+            access_list.append((read_mops, written_mop))
+    return access_list
+
+
+def run_accesses(environment, access_list):
+    # Returns the time spent and the final state of the environment
+    start_time = time.perf_counter()
+    value = 1
+    for _ in range(NB_PASSES):
+        for read_mops, written_mop in access_list:
+            for mop in read_mops:
+                mop_value = environment.lookup(mop, raise_exception=False)
+                if mop_value is None:
+                    environment.define(mop, value)
+                else:
+                    value = (value * 3 + mop_value) & 0xffffffffffffffff
+            if written_mop is not None:
+                environment.assign(written_mop, value, auto_define=True)
+    elapsed_time = time.perf_counter() - start_time
+    return elapsed_time, [(x.dstr(), y) for x, y in environment.items()]
+
+
+def main():
+    mba = generate_microcode()
+    if mba is None:
+        return
+    access_list = get_variable_accesses(get_all_instructions(mba))
+    list_environment = MicroCodeEnvironment()
+    list_environment.mop_r_record = ListMopMapping()
+    list_environment.mop_S_record = ListMopMapping()
+    hashed_environment = MicroCodeEnvironment()
+
+    list_time, list_state = run_accesses(list_environment, access_list)
+    hashed_time, hashed_state = run_accesses(hashed_environment, access_list)
+    print("{0} instructions using variables, {1} passes, {2} variables".format(len(access_list), NB_PASSES,
+                                                                             len(hashed_state)))
+    print_comparison("Environment accesses", "list MopMapping", list_time, "hashed MopMapping", hashed_time)
+    print("Same final state: {0}".format(list_state == hashed_state))
+
+
+main()
@@ -0,0 +1,328 @@
+# Check that the table-driven dispatch of MicroCodeInterpreter gives the same results as the previous dispatch (a chain
+# of opcode comparisons, preceded by the control flow and helper call checks) when the paths recorded by MopTracker
+# for the variables compared by the conditional jumps of a function (as the unflattening rules do) are executed again,
+# and compare the time spent
+# Usage: in IDA, put the cursor in a flattened function (e.g. demo/hello_ollvm_fla or one of demo/d810_samples) and
+# run this script (File > Script file...)
+import logging
+import time
+from typing import Union
+import ida_hexrays as hr
+from bench_utils import generate_microcode, print_comparison
+
+from d810.utils import unsigned_to_signed, signed_to_unsigned, get_add_cf, get_add_of, get_sub_of, ror, get_parity_flag
+from d810.hexrays_helpers import AND_TABLE, CONTROL_FLOW_OPCODES, CONDITIONAL_JUMP_OPCODES
+from d810.hexrays_formatters import format_minsn_t, format_mop_t, mop_type_to_string, opcode_to_string
+from d810.cfg_utils import get_block_serials_by_address
+from d810.errors import EmulationException, EmulationIndirectJumpException
+from d810.emulator import MicroCodeEnvironment, MicroCodeInterpreter
+from d810.microcode_ir import DecodedInstruction, DecodedMop
+from d810.tracker import MopTracker
+
+logging.getLogger('D810.tracker').setLevel(logging.ERROR)
+logging.getLogger('D810.emulator').setLevel(logging.ERROR)
+emulator_log = logging.getLogger('D810.emulator')
+
+NB_PASSES = 10
+
+
+class ChainMicroCodeInterpreter(MicroCodeInterpreter):
+    # MicroCodeInterpreter before the dispatch was table-driven
+    def _eval_instruction(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> Union[None, int]:
+        if ins is None:
+            return None
+        is_flow_instruction = self._eval_control_flow_instruction(ins, environment)
+        if is_flow_instruction:
+            return None
+        call_helper_res = self._eval_call_helper(ins, environment)
+        if call_helper_res is not None:
+            return call_helper_res
+        if ins.opcode == hr.m_call:
+            return self._eval_call(ins, environment)
+        elif ins.opcode == hr.m_icall:
+            return self._eval_call(ins, environment)
+        res_mask = AND_TABLE[ins.d.size]
+        if ins.opcode == hr.m_ldx:
+            return self._eval_load(ins, environment)
+        elif ins.opcode == hr.m_stx:
+            return self._eval_store(ins, environment)
+        elif ins.opcode == hr.m_mov:
+            return (self.eval(ins.l, environment)) & res_mask
+        elif ins.opcode == hr.m_neg:
+            return (- self.eval(ins.l, environment)) & res_mask
+        elif ins.opcode == hr.m_lnot:
+            return self.eval(ins.l, environment) != 0
+        elif ins.opcode == hr.m_bnot:
+            return (self.eval(ins.l, environment) ^ res_mask) & res_mask
+        elif ins.opcode == hr.m_xds:
+            left_value_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            return signed_to_unsigned(left_value_signed, ins.d.size) & res_mask
+        elif ins.opcode == hr.m_xdu:
+            return (self.eval(ins.l, environment)) & res_mask
+        elif ins.opcode == hr.m_low:
+            return (self.eval(ins.l, environment)) & res_mask
+        elif ins.opcode == hr.m_add:
+            return (self.eval(ins.l, environment) + self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_sub:
+            return (self.eval(ins.l, environment) - self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_mul:
+            return (self.eval(ins.l, environment) * self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_udiv:
+            return (self.eval(ins.l, environment) // self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_sdiv:
+            return (self.eval(ins.l, environment) // self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_umod:
+            return (self.eval(ins.l, environment) % self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_smod:
+            return (self.eval(ins.l, environment) % self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_or:
+            return (self.eval(ins.l, environment) | self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_and:
+            return (self.eval(ins.l, environment) & self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_xor:
+            return (self.eval(ins.l, environment) ^ self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_shl:
+            return (self.eval(ins.l, environment) << self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_shr:
+            return (self.eval(ins.l, environment) >> self.eval(ins.r, environment)) & res_mask
+        elif ins.opcode == hr.m_sar:
+            res_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size) >> self.eval(ins.r, environment)
+            return signed_to_unsigned(res_signed, ins.d.size) & res_mask
+        elif ins.opcode == hr.m_cfadd:
+            tmp = get_add_cf(self.eval(ins.l, environment), self.eval(ins.r, environment), ins.l.size)
+            return tmp & res_mask
+        elif ins.opcode == hr.m_ofadd:
+            tmp = get_add_of(self.eval(ins.l, environment), self.eval(ins.r, environment), ins.l.size)
+            return tmp & res_mask
+        elif ins.opcode == hr.m_sets:
+            left_value_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            res = 1 if left_value_signed < 0 else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_seto:
+            left_value_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            right_value_signed = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+            sub_overflow = get_sub_of(left_value_signed, right_value_signed, ins.l.size)
+            return sub_overflow & res_mask
+        elif ins.opcode == hr.m_setnz:
+            res = 1 if self.eval(ins.l, environment) != self.eval(ins.r, environment) else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_setz:
+            res = 1 if self.eval(ins.l, environment) == self.eval(ins.r, environment) else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_setae:
+            res = 1 if self.eval(ins.l, environment) >= self.eval(ins.r, environment) else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_setb:
+            res = 1 if self.eval(ins.l, environment) < self.eval(ins.r, environment) else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_seta:
+            res = 1 if self.eval(ins.l, environment) > self.eval(ins.r, environment) else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_setbe:
+            res = 1 if self.eval(ins.l, environment) <= self.eval(ins.r, environment) else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_setg:
+            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+            res = 1 if left_value > right_value else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_setge:
+            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+            res = 1 if left_value >= right_value else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_setl:
+            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+            res = 1 if left_value < right_value else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_setle:
+            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+            res = 1 if left_value <= right_value else 0
+            return res & res_mask
+        elif ins.opcode == hr.m_setp:
+            res = get_parity_flag(self.eval(ins.l, environment), self.eval(ins.r, environment), ins.l.size)
+            return res & res_mask
+        raise EmulationException("Unsupported instruction opcode '{0}': '{1}'"
+                                 .format(opcode_to_string(ins.opcode), format_minsn_t(ins.ins)))
+
+    @staticmethod
+    def _get_blk_serial(mop: DecodedMop) -> int:
+        if mop.t == hr.mop_b:
+            return mop.b
+        raise EmulationException("Get block serial with an unsupported mop type '{0}': '{1}'"
+                                 .format(hr.mop_type_to_string(mop.t), format_mop_t(mop.mop)))
+
+    def _eval_conditional_jump(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> Union[None, int]:
+        if ins.opcode not in CONDITIONAL_JUMP_OPCODES:
+            return None
+        if ins.opcode == hr.m_jtbl:
+            # This is not handled the same way
+            return None
+        cur_blk = environment.cur_blk
+        direct_child_serial = cur_blk.serial + 1
+        if ins.opcode == hr.m_jcnd:
+            jump_taken = self.eval(ins.l, environment) != 0
+        elif ins.opcode == hr.m_jnz:
+            jump_taken = self.eval(ins.l, environment) != self.eval(ins.r, environment)
+        elif ins.opcode == hr.m_jz:
+            jump_taken = self.eval(ins.l, environment) == self.eval(ins.r, environment)
+        elif ins.opcode == hr.m_jae:
+            jump_taken = self.eval(ins.l, environment) >= self.eval(ins.r, environment)
+        elif ins.opcode == hr.m_jb:
+            jump_taken = self.eval(ins.l, environment) < self.eval(ins.r, environment)
+        elif ins.opcode == hr.m_ja:
+            jump_taken = self.eval(ins.l, environment) > self.eval(ins.r, environment)
+        elif ins.opcode == hr.m_jbe:
+            jump_taken = self.eval(ins.l, environment) <= self.eval(ins.r, environment)
+        elif ins.opcode == hr.m_jg:
+            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+            jump_taken = left_value > right_value
+        elif ins.opcode == hr.m_jge:
+            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+            jump_taken = left_value >= right_value
+        elif ins.opcode == hr.m_jl:
+            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+            jump_taken = left_value < right_value
+        elif ins.opcode == hr.m_jle:
+            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+            jump_taken = left_value <= right_value
+        else:
+            # This should never happen
+            raise EmulationException("Unhandled conditional jump:  '{0}'".format(format_minsn_t(ins.ins)))
+        return self._get_blk_serial(ins.d) if jump_taken else direct_child_serial
+
+    def _eval_control_flow_instruction(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        if ins.opcode not in CONTROL_FLOW_OPCODES:
+            return False
+        cur_blk = environment.cur_blk
+        if cur_blk is None:
+            raise EmulationException("Can't evaluate control flow instruction with null block:  '{0}'"
+                                     .format(format_minsn_t(ins.ins)))
+
+        next_blk_serial = self._eval_conditional_jump(ins, environment)
+        if next_blk_serial is not None:
+            next_blk = cur_blk.mba.get_mblock(next_blk_serial)
+            next_ins = next_blk.head
+            environment.set_next_flow(next_blk, next_ins)
+            return True
+
+        if ins.opcode == hr.m_goto:
+            next_blk_serial = self._get_blk_serial(ins.l)
+        elif ins.opcode == hr.m_jtbl:
+            left_value = self.eval(ins.l, environment)
+            cases = ins.r.cases
+            # Initialize to default case
+            next_blk_serial = cases[-1][1]
+            for possible_values, target_block_serial in cases:
+                for test_value in possible_values:
+                    if left_value == test_value:
+                        next_blk_serial = target_block_serial
+                        break
+        elif ins.opcode == hr.m_ijmp:
+            ijmp_dest_ea = self.eval(ins.d, environment)
+            dest_block_serials = get_block_serials_by_address(environment.cur_blk.mba, ijmp_dest_ea)
+            if len(dest_block_serials) == 0:
+                raise EmulationIndirectJumpException("No blocks found at address {0:x}".format(ijmp_dest_ea),
+                                                     ijmp_dest_ea, dest_block_serials)
+
+            if len(dest_block_serials) > 1:
+                raise EmulationIndirectJumpException("Multiple blocks at address {0:x}: {1}".format(ijmp_dest_ea,
+                                                                                                    dest_block_serials),
+                                                     ijmp_dest_ea, dest_block_serials)
+            next_blk_serial = dest_block_serials[0]
+
+        if next_blk_serial is None:
+            return False
+        next_blk = cur_blk.mba.get_mblock(next_blk_serial)
+        next_ins = next_blk.head
+        environment.set_next_flow(next_blk, next_ins)
+        return True
+
+    def _eval_call_helper(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> Union[None, int]:
+        # Currently, we only support helper calls, (but end goal is to allow to hook calls)
+        if ins.opcode != hr.m_call or ins.l.t != hr.mop_h:
+            return None
+        res_mask = AND_TABLE[ins.d.size]
+        helper_name = ins.l.helper
+        args_list = ins.d
+
+        emulator_log.debug("Call helper for {0}".format(helper_name))
+        # and we support only __ROR4__ (we should add other Hex-Rays created helper calls)
+        if helper_name == "__ROR4__":
+            data_1 = self.eval(args_list.args[0], environment)
+            data_2 = self.eval(args_list.args[1], environment)
+            return ror(data_1, data_2, 8 * args_list.args[0].size) & res_mask
+        elif helper_name == "__readfsqword":
+            return 0
+        return None
+
+
+def get_compared_variables(mba):
+    # Returns the (predecessor block, compared mop) for the conditional jumps comparing a variable with a constant
+    search_list = []
+    for blk_serial in range(mba.qty):
+        blk = mba.get_mblock(blk_serial)
+        if blk.tail is None or not hr.is_mcode_jcond(blk.tail.opcode) or blk.tail.r.t != hr.mop_n:
+            continue
+        if blk.tail.l.t not in [hr.mop_r, hr.mop_S]:
+            continue
+        for pred_serial in blk.predset:
+            search_list.append((mba.get_mblock(pred_serial), hr.mop_t(blk.tail.l)))
+    return search_list
+
+
+def record_traces(search_list):
+    # Returns the (initial environment, [(block, instruction), ...]) of each path found by MopTracker
+    trace_list = []
+    for pred_blk, compared_mop in search_list:
+        tracker = MopTracker([compared_mop], max_nb_block=100, max_path=1000)
+        tracker.reset()
+        for history in tracker.search_backward(pred_blk, pred_blk.tail):
+            trace = [(blk_info.blk, blk_ins) for blk_info in history.history for blk_ins in blk_info.ins_list]
+            trace_list.append((history._mc_initial_environment, trace))
+    return trace_list
+
+
+def replay_traces(interpreter, trace_list):
+    # Returns the time spent and, for each trace, the result and the next block of each instruction and the final
+    # state of the environment
+    results = []
+    start_time = time.perf_counter()
+    for _ in range(NB_PASSES):
+        results = []
+        for initial_environment, trace in trace_list:
+            environment = initial_environment.get_copy()
+            trace_result = []
+            for blk, ins in trace:
+                is_ok = interpreter.eval_instruction(blk, ins, environment)
+                next_serial = environment.next_blk.serial if environment.next_blk is not None else None
+                trace_result.append((is_ok, next_serial))
+            results.append((trace_result, [(x.dstr(), y) for x, y in environment.items()]))
+    elapsed_time = time.perf_counter() - start_time
+    return elapsed_time, results
+
+
+def main():
+    mba = generate_microcode(maturity=hr.MMAT_GLBOPT1)
+    if mba is None:
+        return
+    trace_list = record_traces(get_compared_variables(mba))
+    nb_instructions = sum([len(trace) for _, trace in trace_list])
+    print("{0} traces recorded ({1} instructions), {2} passes".format(len(trace_list), nb_instructions, NB_PASSES))
+
+    chain_time, chain_results = replay_traces(ChainMicroCodeInterpreter(), trace_list)
+    table_time, table_results = replay_traces(MicroCodeInterpreter(), trace_list)
+    print_comparison("Trace replay", "opcode comparison chain", chain_time, "dispatch table", table_time)
+    print("Instructions per second: {0:.0f} -> {1:.0f}".format(NB_PASSES * nb_instructions / chain_time,
+                                                                 NB_PASSES * nb_instructions / table_time))
+    nb_different_traces = len([x for x, y in zip(chain_results, table_results) if x != y])
+    print("Traces with different results: {0}".format(nb_different_traces))
+
+
+main()
@@ -0,0 +1,92 @@
+# Compare the number of instructions evaluated per second by MicroCodeInterpreter when each instruction is decoded
+# each time it is executed (all fields read again through the SWIG proxies, as before the decoded IR was cached) and
+# when the decoded blocks are cached (see microcode_ir), while executing each block of a function several times (as
+# the dispatcher blocks are emulated once per dispatcher father)
+# Usage: in IDA, put the cursor in an obfuscated function and run this script (File > Script file...)
+import logging
+import time
+import ida_hexrays as hr
+from bench_utils import generate_microcode, print_comparison
+
+from d810.emulator import MicroCodeEnvironment, MicroCodeInterpreter
+from d810.microcode_ir import DecodedInstruction, decoded_block_cache
+
+logging.getLogger('D810.emulator').setLevel(logging.ERROR)
+
+NB_PASSES = 20
+
+
+def get_variables(mop, variable_list):
+    if mop is None:
+        return
+    if mop.t in [hr.mop_r, hr.mop_S]:
+        variable_list.append(hr.mop_t(mop))
+    elif mop.t == hr.mop_d:
+        get_variables(mop.d.l, variable_list)
+        get_variables(mop.d.r, variable_list)
+    elif mop.t == hr.mop_f:
+        for arg in mop.f.args:
+            get_variables(arg, variable_list)
+
+
+def get_initial_environment(mba):
+    # All the variables read by the function are defined, so that most instructions can be evaluated
+    environment = MicroCodeEnvironment()
+    for blk_serial in range(mba.qty):
+        cur_ins = mba.get_mblock(blk_serial).head
+        while cur_ins is not None:
+            variable_list = []
+            get_variables(cur_ins.l, variable_list)
+            get_variables(cur_ins.r, variable_list)
+            for variable in variable_list:
+                if environment.lookup(variable, raise_exception=False) is None:
+                    environment.define(variable, 0x1234)
+            cur_ins = cur_ins.next
+    return environment
+
+
+def run_blocks(mba, initial_environment):
+    # Returns the number of instructions evaluated, the time spent and the final state of the environments
+    interpreter = MicroCodeInterpreter()
+    nb_instructions = 0
+    states = []
+    start_time = time.perf_counter()
+    for _ in range(NB_PASSES):
+        for blk_serial in range(mba.qty):
+            blk = mba.get_mblock(blk_serial)
+            environment = initial_environment.get_copy()
+            cur_ins = blk.head
+            while cur_ins is not None:
+                interpreter.eval_instruction(blk, cur_ins, environment)
+                nb_instructions += 1
+                cur_ins = cur_ins.next
+            states.append([(x.dstr(), y) for x, y in environment.items()])
+    elapsed_time = time.perf_counter() - start_time
+    return nb_instructions, elapsed_time, states
+
+
+def main():
+    mba = generate_microcode(maturity=hr.MMAT_GLBOPT1)
+    if mba is None:
+        return
+    initial_environment = get_initial_environment(mba)
+
+    cached_get_instruction = decoded_block_cache.get_instruction
+    decoded_block_cache.get_instruction = lambda blk, ins: DecodedInstruction(ins)
+    try:
+        nb_instructions, uncached_time, uncached_states = run_blocks(mba, initial_environment)
+    finally:
+        decoded_block_cache.get_instruction = cached_get_instruction
+    decoded_block_cache.invalidate()
+    decoded_block_cache.reset_statistics()
+    _, cached_time, cached_states = run_blocks(mba, initial_environment)
+
+    print("{0} blocks, {1} passes, {2} instructions evaluated".format(mba.qty, NB_PASSES, nb_instructions))
+    print_comparison("Emulation", "decoded at each execution", uncached_time, "cached decoded blocks", cached_time)
+    print("Instructions per second: {0:.0f} -> {1:.0f}".format(nb_instructions / uncached_time,
+                                                                 nb_instructions / cached_time))
+    print("Decoded block cache: {0}".format(decoded_block_cache))
+    print("Same final states: {0}".format(uncached_states == cached_states))
+
+
+main()
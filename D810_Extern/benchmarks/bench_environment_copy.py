@@ -0,0 +1,99 @@
+# Compare the copy-on-write MicroCodeEnvironment.get_copy with the previous copy (each binding defined again in a new
+# environment) while MopTracker searches the values of the variables compared by the conditional jumps of a function
+# (as the unflattening rules do): time spent, number of environment copies and peak memory
+# Usage: in IDA, put the cursor in a flattened function (e.g. demo/hello_ollvm_fla or one of demo/d810_samples) and
+# run this script (File > Script file...)
+import logging
+import time
+import tracemalloc
+import ida_hexrays as hr
+from bench_utils import generate_microcode, print_comparison
+
+from d810.emulator import MicroCodeEnvironment
+from d810.tracker import MopTracker
+from d810.optimizers.flow.flattening.utils import get_all_possibles_values
+
+logging.getLogger('D810.tracker').setLevel(logging.ERROR)
+logging.getLogger('D810.emulator').setLevel(logging.ERROR)
+
+cow_get_copy = MicroCodeEnvironment.get_copy
+nb_copies = 0
+
+
+def full_get_copy(self, copy_parent=True):
+    # MicroCodeEnvironment.get_copy before the records were copy-on-write
+    parent_copy = self.parent
+    if parent_copy is not None and copy_parent:
+        parent_copy = full_get_copy(self.parent, copy_parent=True)
+    new_env = MicroCodeEnvironment(parent_copy)
+    for mop, mop_value in self.mop_r_record.items():
+        new_env.define(mop, mop_value)
+    for mop, mop_value in self.mop_S_record.items():
+        new_env.define(mop, mop_value)
+    new_env.cur_blk = self.cur_blk
+    new_env.cur_ins = self.cur_ins
+    new_env.next_blk = self.next_blk
+    new_env.next_ins = self.next_ins
+    return new_env
+
+
+def counting(get_copy):
+    def counting_get_copy(self, copy_parent=True):
+        global nb_copies
+        nb_copies += 1
+        return get_copy(self, copy_parent)
+    return counting_get_copy
+
+
+def get_compared_variables(mba):
+    # Returns the (predecessor block, compared mop) for the conditional jumps comparing a variable with a constant
+    search_list = []
+    for blk_serial in range(mba.qty):
+        blk = mba.get_mblock(blk_serial)
+        if blk.tail is None or not hr.is_mcode_jcond(blk.tail.opcode) or blk.tail.r.t != hr.mop_n:
+            continue
+        if blk.tail.l.t not in [hr.mop_r, hr.mop_S]:
+            continue
+        for pred_serial in blk.predset:
+            search_list.append((mba.get_mblock(pred_serial), hr.mop_t(blk.tail.l)))
+    return search_list
+
+
+def track_all(search_list, get_copy):
+    # Returns the time spent, the number of environment copies, the peak memory and the values found
+    global nb_copies
+    MicroCodeEnvironment.get_copy = counting(get_copy)
+    nb_copies = 0
+    all_values = []
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    try:
+        for pred_blk, compared_mop in search_list:
+            tracker = MopTracker([compared_mop], max_nb_block=100, max_path=1000)
+            tracker.reset()
+            histories = tracker.search_backward(pred_blk, pred_blk.tail)
+            all_values.append(get_all_possibles_values(histories, [compared_mop]))
+        elapsed_time = time.perf_counter() - start_time
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        MicroCodeEnvironment.get_copy = cow_get_copy
+    return elapsed_time, nb_copies, peak_memory, all_values
+
+
+def main():
+    mba = generate_microcode(maturity=hr.MMAT_GLBOPT1)
+    if mba is None:
+        return
+    search_list = get_compared_variables(mba)
+    print("{0} variables to track".format(len(search_list)))
+
+    full_time, full_nb_copies, full_memory, full_values = track_all(search_list, full_get_copy)
+    cow_time, cow_nb_copies, cow_memory, cow_values = track_all(search_list, cow_get_copy)
+    print_comparison("MopTracker searches", "full environment copies", full_time, "copy-on-write", cow_time)
+    print("Environment copies: {0}".format(cow_nb_copies))
+    print("Peak memory: {0:.1f} KB -> {1:.1f} KB".format(full_memory / 1024, cow_memory / 1024))
+    print("Same values found: {0}".format(full_values == cow_values))
+
+
+main()
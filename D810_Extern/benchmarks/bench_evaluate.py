@@ -0,0 +1,67 @@
+# Compare the AST interpreter (AstNode.evaluate) with the compiled evaluators (compile_ast_evaluator) when the ASTs
+# of a function are evaluated many times on random leaf values (as done by Z3ConstantOptimization)
+# Usage: in IDA, put the cursor in an obfuscated function (e.g. one of demo/d810_samples) and run this script
+# (File > Script file...)
+import random
+from bench_utils import generate_microcode, get_all_asts, print_comparison
+import time
+
+from d810.ast import compile_ast_evaluator
+
+NB_EVALUATIONS = 100
+
+
+def get_evaluation_inputs(ast_list, nb_evaluations):
+    # Only the ASTs with at least one opcode and one variable leaf are kept, each with its random leaf values
+    rnd = random.Random(0)
+    evaluation_inputs = []
+    for ast in ast_list:
+        if ast.is_leaf():
+            continue
+        leaf_info_list, _, _ = ast.get_information()
+        if len(leaf_info_list) == 0:
+            continue
+        leaf_values_list = [[rnd.randrange(0, 1 << (8 * leaf_info.ast.dest_size)) for leaf_info in leaf_info_list]
+                            for _ in range(nb_evaluations)]
+        evaluation_inputs.append((ast, leaf_info_list, leaf_values_list))
+    return evaluation_inputs
+
+
+def evaluate_all(evaluation_inputs, evaluators=None):
+    results = []
+    for i, (ast, leaf_info_list, leaf_values_list) in enumerate(evaluation_inputs):
+        evaluate = ast.evaluate if evaluators is None else evaluators[i]
+        for leaf_values in leaf_values_list:
+            dict_index_to_value = {leaf_info.ast.ast_index: leaf_value
+                                   for leaf_info, leaf_value in zip(leaf_info_list, leaf_values)}
+            try:
+                results.append(evaluate(dict_index_to_value))
+            except ZeroDivisionError:
+                results.append(None)
+    return results
+
+
+def main():
+    mba = generate_microcode()
+    if mba is None:
+        return
+    evaluation_inputs = get_evaluation_inputs(get_all_asts(mba), NB_EVALUATIONS)
+    print("{0} ASTs, {1} evaluations each".format(len(evaluation_inputs), NB_EVALUATIONS))
+
+    start_time = time.perf_counter()
+    ref_results = evaluate_all(evaluation_inputs)
+    ref_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    evaluators = [compile_ast_evaluator(ast) for ast, _, _ in evaluation_inputs]
+    compile_time = time.perf_counter() - start_time
+    new_results = evaluate_all(evaluation_inputs, evaluators)
+    new_time = time.perf_counter() - start_time
+
+    print_comparison("AST evaluation", "interpreted", ref_time, "compiled (compilation included)", new_time)
+    print("Compilation: {0:.6f}s".format(compile_time))
+    nb_differences = sum(1 for ref_res, new_res in zip(ref_results, new_results) if ref_res != new_res)
+    print("Results differing: {0} / {1}".format(nb_differences, len(ref_results)))
+
+
+main()
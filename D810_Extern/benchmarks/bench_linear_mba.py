@@ -0,0 +1,50 @@
+# Compare the pattern matching rules with the linear MBA simplifier (LinearMbaSimplification) on the instructions of a
+# function: time spent and number of instructions simplified by each of them
+# Usage: in IDA, put the cursor in an obfuscated function and run this script (File > Script file...)
+import logging
+from bench_utils import generate_microcode, get_all_instructions, print_comparison
+import time
+
+from d810.optimizers.instructions.pattern_matching import PATTERN_MATCHING_RULES, PatternOptimizer
+from d810.optimizers.instructions.mba import MBA_RULES, MbaOptimizer
+from d810.hexrays_hooks import DEFAULT_OPTIMIZATION_PATTERN_MATURITIES, DEFAULT_OPTIMIZATION_MBA_MATURITIES
+
+logging.getLogger('D810.optimizer').setLevel(logging.ERROR)
+logging.getLogger('D810.pattern_search').setLevel(logging.ERROR)
+
+
+def optimize_all(optimizer, ins_list):
+    # Returns the time spent and the indexes of the instructions optimized
+    optimized_ins_index_list = []
+    start_time = time.perf_counter()
+    for i, (blk, ins) in enumerate(ins_list):
+        if optimizer.get_optimized_instruction(blk, ins) is not None:
+            optimized_ins_index_list.append(i)
+    return time.perf_counter() - start_time, set(optimized_ins_index_list)
+
+
+def main():
+    mba = generate_microcode()
+    if mba is None:
+        return
+    ins_list = get_all_instructions(mba)
+    pattern_optimizer = PatternOptimizer(DEFAULT_OPTIMIZATION_PATTERN_MATURITIES)
+    for rule in PATTERN_MATCHING_RULES:
+        rule.configure({})
+        pattern_optimizer.add_rule(rule)
+    mba_optimizer = MbaOptimizer(DEFAULT_OPTIMIZATION_MBA_MATURITIES)
+    for rule in MBA_RULES:
+        rule.configure({})
+        mba_optimizer.add_rule(rule)
+    print("{0} instructions".format(len(ins_list)))
+
+    pattern_time, pattern_optimized = optimize_all(pattern_optimizer, ins_list)
+    mba_time, mba_optimized = optimize_all(mba_optimizer, ins_list)
+    print_comparison("Instruction simplification", "pattern rules", pattern_time, "linear MBA (Z3 included)", mba_time)
+    print("Instructions simplified: {0} by the pattern rules, {1} by the linear MBA simplifier"
+          .format(len(pattern_optimized), len(mba_optimized)))
+    print("  only by the pattern rules: {0}, only by the linear MBA simplifier: {1}"
+          .format(len(pattern_optimized - mba_optimized), len(mba_optimized - pattern_optimized)))
+
+
+main()
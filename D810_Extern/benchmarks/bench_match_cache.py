@@ -0,0 +1,54 @@
+# Measure the effect of the PatternOptimizer search cache when the same instructions are optimized several times
+# (as Hex-Rays does across maturities and passes)
+# Usage: in IDA, put the cursor in an obfuscated function and run this script (File > Script file...)
+import logging
+from bench_utils import generate_microcode, get_all_instructions, print_comparison
+import time
+
+from d810.optimizers.instructions.pattern_matching import PATTERN_MATCHING_RULES, PatternOptimizer
+from d810.hexrays_hooks import DEFAULT_OPTIMIZATION_PATTERN_MATURITIES
+
+logging.getLogger('D810.optimizer').setLevel(logging.ERROR)
+logging.getLogger('D810.pattern_search').setLevel(logging.ERROR)
+
+NB_PASSES = 4
+
+
+def optimize_all(optimizer, ins_list):
+    nb_optimized = 0
+    for blk, ins in ins_list:
+        if optimizer.get_optimized_instruction(blk, ins) is not None:
+            nb_optimized += 1
+    return nb_optimized
+
+
+def run_passes(optimizer, ins_list):
+    start_time = time.perf_counter()
+    for _ in range(NB_PASSES):
+        nb_optimized = optimize_all(optimizer, ins_list)
+    return time.perf_counter() - start_time, nb_optimized
+
+
+def main():
+    mba = generate_microcode()
+    if mba is None:
+        return
+    ins_list = get_all_instructions(mba)
+    optimizers = []
+    for cache_size in [0, PatternOptimizer.MATCH_CACHE_SIZE]:
+        optimizer = PatternOptimizer(DEFAULT_OPTIMIZATION_PATTERN_MATURITIES)
+        optimizer.match_cache.max_size = cache_size
+        for rule in PATTERN_MATCHING_RULES:
+            rule.configure({})
+            optimizer.add_rule(rule)
+        optimizers.append(optimizer)
+    print("{0} instructions, {1} passes".format(len(ins_list), NB_PASSES))
+
+    ref_time, ref_nb_optimized = run_passes(optimizers[0], ins_list)
+    new_time, new_nb_optimized = run_passes(optimizers[1], ins_list)
+    print_comparison("Pattern search", "without cache", ref_time, "with cache", new_time)
+    print("Instructions optimized: {0} (without cache) vs {1} (with cache)".format(ref_nb_optimized, new_nb_optimized))
+    print("Cache: {0} hits, {1} misses".format(optimizers[1].match_cache.nb_hits, optimizers[1].match_cache.nb_misses))
+
+
+main()
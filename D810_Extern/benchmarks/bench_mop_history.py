@@ -0,0 +1,122 @@
+# Compare the incremental execution of MopHistory (from the last environment checkpoint before the first modified
+# block) with the previous execution (all the instructions of the path from the initial environment each time the
+# history is modified) on the paths found by MopTracker for the variables compared by the conditional jumps of a
+# function. The values of the searched mops are computed again after each edit of the paths:
+# - when each path is built again block by block (the previous execution is quadratic in the length of the path)
+# - when each block of each path is replaced in turn (as duplicate_histories does)
+# Usage: in IDA, put the cursor in a flattened function (e.g. demo/hello_ollvm_fla or one of demo/d810_samples) and
+# run this script (File > Script file...)
+import logging
+import time
+import ida_hexrays as hr
+from bench_utils import generate_microcode, print_comparison
+
+from d810.emulator import MicroCodeInterpreter
+from d810.tracker import MopTracker, MopHistory
+
+logging.getLogger('D810.tracker').setLevel(logging.ERROR)
+logging.getLogger('D810.emulator').setLevel(logging.ERROR)
+
+incremental_execute_microcode = MopHistory._execute_microcode
+interpreter_eval_instruction = MicroCodeInterpreter.eval_instruction
+nb_executed_instructions = 0
+
+
+def full_execute_microcode(self):
+    # MopHistory._execute_microcode before the environment checkpoints
+    if not self._is_dirty:
+        return True
+    self._mc_current_environment = self._mc_initial_environment.get_copy()
+    for blk_info in self.history:
+        for blk_ins in blk_info.ins_list:
+            if not self._mc_interpreter.eval_instruction(blk_info.blk, blk_ins, self._mc_current_environment):
+                self._is_dirty = False
+                return False
+    self._is_dirty = False
+    return True
+
+
+def counting_eval_instruction(self, blk, ins, environment=None, raise_exception=False):
+    global nb_executed_instructions
+    nb_executed_instructions += 1
+    return interpreter_eval_instruction(self, blk, ins, environment, raise_exception)
+
+
+def get_compared_variables(mba):
+    # Returns the (predecessor block, compared mop) for the conditional jumps comparing a variable with a constant
+    search_list = []
+    for blk_serial in range(mba.qty):
+        blk = mba.get_mblock(blk_serial)
+        if blk.tail is None or not hr.is_mcode_jcond(blk.tail.opcode) or blk.tail.r.t != hr.mop_n:
+            continue
+        if blk.tail.l.t not in [hr.mop_r, hr.mop_S]:
+            continue
+        for pred_serial in blk.predset:
+            search_list.append((mba.get_mblock(pred_serial), hr.mop_t(blk.tail.l)))
+    return search_list
+
+
+def get_all_histories(search_list):
+    history_list = []
+    for pred_blk, compared_mop in search_list:
+        tracker = MopTracker([compared_mop], max_nb_block=100, max_path=1000)
+        tracker.reset()
+        history_list += tracker.search_backward(pred_blk, pred_blk.tail)
+    return history_list
+
+
+def build_and_evaluate(original_history, all_values):
+    history = original_history.get_copy()
+    history.history = []
+    for blk_info in original_history.history:
+        history.insert_block_in_path(blk_info.blk, len(history.history))
+        history.history[-1].ins_list = [x for x in blk_info.ins_list]
+        all_values.append([history.get_mop_constant_value(x) for x in history.searched_mop_list])
+
+
+def replace_and_evaluate(original_history, all_values):
+    history = original_history.get_copy()
+    all_values.append([history.get_mop_constant_value(x) for x in history.searched_mop_list])
+    for blk in history.block_path[1:]:
+        history.replace_block_in_path(blk, blk)
+        all_values.append([history.get_mop_constant_value(x) for x in history.searched_mop_list])
+
+
+def edit_and_evaluate(history_list, edit_function, execute_microcode):
+    # Returns the time spent, the number of instructions executed and the values found
+    global nb_executed_instructions
+    MopHistory._execute_microcode = execute_microcode
+    MicroCodeInterpreter.eval_instruction = counting_eval_instruction
+    nb_executed_instructions = 0
+    all_values = []
+    start_time = time.perf_counter()
+    try:
+        for original_history in history_list:
+            edit_function(original_history, all_values)
+        elapsed_time = time.perf_counter() - start_time
+    finally:
+        MopHistory._execute_microcode = incremental_execute_microcode
+        MicroCodeInterpreter.eval_instruction = interpreter_eval_instruction
+    return elapsed_time, nb_executed_instructions, all_values
+
+
+def main():
+    mba = generate_microcode(maturity=hr.MMAT_GLBOPT1)
+    if mba is None:
+        return
+    history_list = get_all_histories(get_compared_variables(mba))
+    path_lengths = [len(x.history) for x in history_list]
+    print("{0} paths (up to {1} blocks)".format(len(history_list), max(path_lengths) if path_lengths else 0))
+
+    for title, edit_function in [("Build paths block by block", build_and_evaluate),
+                                 ("Replace each block of the paths", replace_and_evaluate)]:
+        full_time, full_nb_instructions, full_values = \
+            edit_and_evaluate(history_list, edit_function, full_execute_microcode)
+        incremental_time, incremental_nb_instructions, incremental_values = \
+            edit_and_evaluate(history_list, edit_function, incremental_execute_microcode)
+        print_comparison(title, "full execution", full_time, "from checkpoints", incremental_time)
+        print("Instructions executed: {0} -> {1}".format(full_nb_instructions, incremental_nb_instructions))
+        print("Same values found: {0}".format(full_values == incremental_values))
+
+
+main()
@@ -0,0 +1,161 @@
+# Compare the discrimination tree PatternStorage (with canonical patterns) with the previous signature based storage
+# (with all the fuzzed pattern variations)
+# Usage: in IDA, put the cursor in an obfuscated function and run this script (File > Script file...)
+import logging
+from typing import List
+from bench_utils import generate_microcode, get_all_asts, timeit, print_comparison
+
+from d810.optimizers.instructions.handler import InstructionOptimizationRule
+from d810.optimizers.instructions.pattern_matching import PATTERN_MATCHING_RULES
+from d810.optimizers.instructions.pattern_matching.handler import PatternStorage, RulePatternInfo, ast_generator
+from d810.ast import AstNode
+from d810.ast_canonical import CompiledPattern, get_canonical_ast
+
+pattern_search_logger = logging.getLogger('D810.pattern_search')
+pattern_search_logger.setLevel(logging.ERROR)
+
+
+def signature_generator(ref_sig):
+    for i, x in enumerate(ref_sig):
+        if x not in ["N", "L"]:
+            for sig_suffix in signature_generator(ref_sig[i + 1:]):
+                yield ref_sig[:i] + ["L"] + sig_suffix
+    yield ref_sig
+
+
+class SignaturePatternStorage(object):
+    # Previous PatternStorage implementation (before the discrimination tree), used as the benchmark reference
+    # A SignaturePatternStorage contains a dictionary (next_layer_patterns) where:
+    #  - keys are the signature of a pattern at a specific depth (i.e. the opcodes, the variable and constant)
+    #  - values are SignaturePatternStorage object for the next depth
+    # Additionally, it stores the rule objects which are resolved for the SignaturePatternStorage depth
+    def __init__(self, depth=1):
+        self.depth = depth
+        self.next_layer_patterns = {}
+        self.rule_resolved = []
+
+    def add_pattern_for_rule(self, pattern: AstNode, rule: InstructionOptimizationRule):
+        layer_signature = self.layer_signature_to_key(pattern.get_depth_signature(self.depth))
+        if len(layer_signature.replace(",", "")) == (layer_signature.count("N")):
+            self.rule_resolved.append(RulePatternInfo(rule, CompiledPattern(pattern)))
+        else:
+            if layer_signature not in self.next_layer_patterns.keys():
+                self.next_layer_patterns[layer_signature] = SignaturePatternStorage(self.depth + 1)
+            self.next_layer_patterns[layer_signature].add_pattern_for_rule(pattern, rule)
+
+    @staticmethod
+    def layer_signature_to_key(sig: List[str]) -> str:
+        return ",".join(sig)
+
+    @staticmethod
+    def is_layer_signature_compatible(instruction_signature: str, pattern_signature: str) -> bool:
+        if instruction_signature == pattern_signature:
+            return True
+        instruction_node_list = instruction_signature.split(",")
+        pattern_node_list = pattern_signature.split(",")
+        for ins_node_sig, pattern_node_sig in zip(instruction_node_list, pattern_node_list):
+            if pattern_node_sig not in ["L", "C", "N"] and ins_node_sig != pattern_node_sig:
+                return False
+        return True
+
+    def get_matching_rule_pattern_info(self, pattern: AstNode):
+        pattern_search_logger.info("Searching : {0}".format(pattern))
+        return self.explore_one_level(pattern, 1)
+
+    def explore_one_level(self, searched_pattern: AstNode, cur_level: int):
+        # We need to check if searched_pattern is in self.next_layer_patterns
+        # Easy solution: try/except self.next_layer_patterns[searched_pattern]
+        # Problem is that known patterns may not exactly match the microcode instruction, e.g.
+        #   -> Pattern layer 3 signature is ["L", "N", "15", "L"]
+        #   -> Multiple instruction can match that: ["L", "N", "15", "L"], ["C", "N", "15", "L"], ["C", "N", "15", "13"]
+        # This piece of code tries to handles that in a (semi) efficient way
+        if len(self.next_layer_patterns) == 0:
+            return []
+        searched_layer_signature = searched_pattern.get_depth_signature(cur_level)
+        nb_possible_signature = 2 ** (len(searched_layer_signature) - searched_layer_signature.count("N") - \
+                                searched_layer_signature.count("L"))
+        pattern_search_logger.debug("  Layer {0}: {1} -> {2} variations (storage has {3} signature)"
+                                    .format(cur_level, searched_layer_signature, nb_possible_signature,
+                                            len(self.next_layer_patterns)))
+        matched_rule_pattern_info = []
+        if nb_possible_signature < len(self.next_layer_patterns):
+            pattern_search_logger.debug("  => Using method 1")
+            for possible_sig in signature_generator(searched_layer_signature):
+                try:
+                    test_sig = self.layer_signature_to_key(possible_sig)
+                    pattern_storage = self.next_layer_patterns[test_sig]
+                    pattern_search_logger.info("    Compatible signature: {0} -> resolved: {1}"
+                                               .format(test_sig, pattern_storage.rule_resolved))
+                    matched_rule_pattern_info += pattern_storage.rule_resolved
+                    matched_rule_pattern_info += pattern_storage.explore_one_level(searched_pattern, cur_level + 1)
+                except KeyError:
+                    pass
+        else:
+            pattern_search_logger.debug("  => Using method 2")
+            searched_layer_signature_key = self.layer_signature_to_key(searched_layer_signature)
+            for test_sig, pattern_storage in self.next_layer_patterns.items():
+                if self.is_layer_signature_compatible(searched_layer_signature_key, test_sig):
+                    pattern_search_logger.info("    Compatible signature: {0} -> resolved: {1}"
+                                               .format(test_sig, pattern_storage.rule_resolved))
+                    matched_rule_pattern_info += pattern_storage.rule_resolved
+                    matched_rule_pattern_info += pattern_storage.explore_one_level(searched_pattern, cur_level + 1)
+        return matched_rule_pattern_info
+
+
+def build_signature_storage(storage, rules):
+    for rule in rules:
+        if rule.compiled_patterns[0].canonical_pattern is None:
+            pattern_candidates = rule.pattern_candidates
+        else:
+            pattern_candidates = ast_generator(rule.PATTERN)
+        for pattern in pattern_candidates:
+            storage.add_pattern_for_rule(pattern, rule)
+    return storage
+
+
+def build_storage(storage, rules):
+    for rule in rules:
+        for compiled_pattern in rule.compiled_patterns:
+            storage.add_pattern_for_rule(compiled_pattern, rule)
+    return storage
+
+
+def search_all_signature(storage, ast_list):
+    nb_candidates = 0
+    for ast in ast_list:
+        nb_candidates += len(storage.get_matching_rule_pattern_info(ast))
+    return nb_candidates
+
+
+def search_all(storage, ast_list):
+    nb_candidates = 0
+    for ast in ast_list:
+        nb_candidates += len(storage.get_matching_rule_pattern_info(ast, get_canonical_ast(ast)))
+    return nb_candidates
+
+
+def main():
+    mba = generate_microcode()
+    if mba is None:
+        return
+    ast_list = get_all_asts(mba)
+    rules = PATTERN_MATCHING_RULES
+    for rule in rules:
+        rule.configure({})
+    nb_patterns = sum([len(rule.pattern_candidates) for rule in rules])
+    print("{0} rules, {1} patterns, {2} instructions".format(len(rules), nb_patterns, len(ast_list)))
+
+    ref_build_time, ref_storage = timeit(build_signature_storage, SignaturePatternStorage(), rules, nb_iteration=1)
+    new_build_time, new_storage = timeit(build_storage, PatternStorage(), rules, nb_iteration=1)
+    print_comparison("Storage construction", "SignaturePatternStorage", ref_build_time,
+                     "PatternStorage", new_build_time)
+
+    ref_search_time, ref_nb_candidates = timeit(search_all_signature, ref_storage, ast_list)
+    new_search_time, new_nb_candidates = timeit(search_all, new_storage, ast_list)
+    print_comparison("Search for all instructions", "SignaturePatternStorage", ref_search_time,
+                     "PatternStorage", new_search_time)
+    print("Candidates returned: {0} (signature) vs {1} (discrimination tree)"
+          .format(ref_nb_candidates, new_nb_candidates))
+
+
+main()
@@ -0,0 +1,79 @@
+# Helpers shared by the D-810 benchmark scripts
+# These scripts must be run from IDA (File > Script file...) with the cursor in the function to benchmark
+import os
+import sys
+import time
+
+import ida_funcs
+import ida_kernwin
+import ida_hexrays as hr
+
+D810_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+if D810_DIR not in sys.path:
+    sys.path.append(D810_DIR)
+
+
+def generate_microcode(func_ea=None, maturity=hr.MMAT_LOCOPT):
+    if func_ea is None:
+        func_ea = ida_kernwin.get_screen_ea()
+    pfn = ida_funcs.get_func(func_ea)
+    if pfn is None:
+        print("No function at 0x{0:x}".format(func_ea))
+        return None
+    mbr = hr.mba_ranges_t(pfn)
+    hf = hr.hexrays_failure_t()
+    ml = hr.mlist_t()
+    mba = hr.gen_microcode(mbr, hf, ml, hr.DECOMP_WARNINGS, maturity)
+    if mba is None:
+        print("Microcode generation failed at 0x{0:x}: {1}".format(hf.errea, hf.str))
+    return mba
+
+
+def get_all_instructions(mba):
+    # Returns a list of (blk, ins) for all top-level instructions of the mba
+    ins_list = []
+    for blk_serial in range(mba.qty):
+        blk = mba.get_mblock(blk_serial)
+        cur_ins = blk.head
+        while cur_ins is not None:
+            ins_list.append((blk, cur_ins))
+            cur_ins = cur_ins.next
+    return ins_list
+
+
+def get_all_asts(mba):
+    from d810.ast import minsn_to_ast
+    ast_list = []
+    for blk, ins in get_all_instructions(mba):
+        ast = minsn_to_ast(ins)
+        if ast is not None:
+            ast_list.append(ast)
+    return ast_list
+
+
+def get_relation_corpus(mba):
+    # Returns the (description, relation, mop1, mop2) checked by the Z3 predicate rules on the setz/setnz/jz/jnz
+    # instructions of the mba
+    relation_opcodes = [hr.m_setz, hr.m_setnz, hr.m_jz, hr.m_jnz]
+    corpus = []
+    for blk, ins in get_all_instructions(mba):
+        if ins.opcode not in relation_opcodes:
+            continue
+        for relation in ["eq", "ne"]:
+            corpus.append(("{0:x}: {1}".format(ins.ea, relation), relation, ins.l, ins.r))
+    return corpus
+
+
+def timeit(func, *args, nb_iteration=10):
+    start_time = time.perf_counter()
+    for _ in range(nb_iteration):
+        res = func(*args)
+    return (time.perf_counter() - start_time) / nb_iteration, res
+
+
+def print_comparison(title, ref_name, ref_time, new_name, new_time):
+    print("{0}:".format(title))
+    print("  {0:<30}: {1:.6f}s".format(ref_name, ref_time))
+    print("  {0:<30}: {1:.6f}s".format(new_name, new_time))
+    if new_time > 0:
+        print("  speedup: x{0:.2f}".format(ref_time / new_time))
@@ -0,0 +1,76 @@
+# Compare the Z3 time spent on the queries of a function when each query gets a new solver with the time spent when
+# all the queries share the solver and the variables of the function context (open_z3_function_context, as done
+# during a decompilation by HexraysDecompilationHook)
+# The queries are those of the Z3 predicate rules on the setz/setnz/jz/jnz instructions and those of
+# Z3ConstantOptimization on the instructions with a single variable. The verdict cache and random testing are
+# disabled so that every query reaches Z3.
+# Usage: in IDA, put the cursor in an obfuscated function (e.g. one of demo/d810_samples) and run this script
+# (File > Script file...)
+import ida_hexrays as hr
+from bench_utils import generate_microcode, get_all_asts, get_relation_corpus, print_comparison
+
+from d810.random_testing import configure_random_testing
+from d810.z3_cache import z3_verdict_cache
+from d810.z3_backend import z3_backend_statistics
+from d810.z3_utils import z3_check_mop_relations, open_z3_function_context, close_z3_function_context
+from d810.errors import D810Z3Exception, AstEvaluationException
+
+
+def get_constant_corpus(mba):
+    corpus = []
+    for ast in get_all_asts(mba):
+        if ast.is_leaf() or ast.mop is None:
+            continue
+        leaf_info_list, _, _ = ast.get_information()
+        if len(leaf_info_list) != 1:
+            continue
+        try:
+            value = ast.evaluate_with_leaf_info(leaf_info_list, [0])
+        except (ZeroDivisionError, AstEvaluationException):
+            continue
+        cst_mop = hr.mop_t()
+        cst_mop.make_number(value, ast.mop.size)
+        corpus.append(("{0:x}: cst".format(ast.ea if ast.ea is not None else 0), "eq", ast.mop, cst_mop))
+    return corpus
+
+
+def run_corpus(corpus, use_function_context):
+    z3_backend_statistics.reset()
+    verdicts = []
+    if use_function_context:
+        open_z3_function_context()
+    try:
+        for description, relation, mop1, mop2 in corpus:
+            try:
+                verdicts += z3_check_mop_relations([(relation, mop1, mop2)])
+            except D810Z3Exception:
+                verdicts.append(None)
+    finally:
+        if use_function_context:
+            close_z3_function_context()
+    return z3_backend_statistics.total_time, z3_backend_statistics.nb_unknown, verdicts
+
+
+def main():
+    mba = generate_microcode()
+    if mba is None:
+        return
+    corpus = get_relation_corpus(mba) + get_constant_corpus(mba)
+    print("{0} Z3 queries".format(len(corpus)))
+    z3_verdict_cache.configure(False)
+    configure_random_testing(0)
+    try:
+        ref_time, ref_nb_unknown, ref_verdicts = run_corpus(corpus, False)
+        new_time, new_nb_unknown, new_verdicts = run_corpus(corpus, True)
+    finally:
+        # Settings of options.json are restored when D-810 is started again
+        configure_random_testing()
+    print_comparison("Z3 time for the function", "new solver per query", ref_time,
+                     "shared function context", new_time)
+    print("Unknown or timed out: {0} -> {1}".format(ref_nb_unknown, new_nb_unknown))
+    nb_differences = sum(1 for ref_verdict, new_verdict in zip(ref_verdicts, new_verdicts)
+                         if ref_verdict != new_verdict)
+    print("Verdicts differing: {0} / {1}".format(nb_differences, len(corpus)))
+
+
+main()
@@ -0,0 +1,171 @@
+# Compare the Z3 verdicts and solve times of the previous translation (every expression on 32 bits, xdu/xds/low/high
+# ignored) with the size-accurate translation of ast_to_z3_expression.
+# The corpus contains a synthetic set of relations on 1, 2, 4 and 8 byte registers (MBA identities, opaque predicates
+# and extension/truncation checks, each with its expected verdict) and the relations checked by the Z3 predicate rules
+# on the setz/setnz/jz/jnz instructions of the current function.
+# Usage: in IDA (x86/x64 database), put the cursor in an obfuscated function and run this script
+# (File > Script file...)
+import time
+import z3
+import ida_idp
+import ida_hexrays as hr
+from bench_utils import generate_microcode, get_relation_corpus, print_comparison
+
+from d810.ast import mop_to_ast, AstLeaf
+from d810.hexrays_helpers import get_mop_index
+from d810.errors import D810Z3Exception
+from d810.z3_utils import ast_list_to_z3_expression_list, z3_resize
+
+REGISTER_NAMES = ["rax", "rcx", "rdx"]
+
+
+def reg(index, size):
+    mop = hr.mop_t()
+    mop.make_reg(hr.reg2mreg(ida_idp.str2reg(REGISTER_NAMES[index])), size)
+    return mop
+
+
+def cst(value, size):
+    mop = hr.mop_t()
+    mop.make_number(value & ((1 << (8 * size)) - 1), size)
+    return mop
+
+
+def op(opcode, size, left, right=None):
+    ins = hr.minsn_t(0)
+    ins.opcode = opcode
+    ins.l = left
+    if right is not None:
+        ins.r = right
+    ins.d.size = size
+    mop = hr.mop_t()
+    mop.create_from_insn(ins)
+    return mop
+
+
+def get_synthetic_corpus():
+    # (description, relation, mop1, mop2, expected verdict)
+    corpus = []
+    for size in [1, 2, 4, 8]:
+        x, y = reg(0, size), reg(1, size)
+        corpus += [
+            ("{0}: (x ^ y) + 2 * (x & y) == x + y".format(size), "eq",
+             op(hr.m_add, size, op(hr.m_xor, size, x, y), op(hr.m_mul, size, cst(2, size), op(hr.m_and, size, x, y))),
+             op(hr.m_add, size, x, y), True),
+            ("{0}: (x | y) - (x & y) == x ^ y".format(size), "eq",
+             op(hr.m_sub, size, op(hr.m_or, size, x, y), op(hr.m_and, size, x, y)), op(hr.m_xor, size, x, y), True),
+            ("{0}: (x * (x + 1)) & 1 == 0".format(size), "eq",
+             op(hr.m_and, size, op(hr.m_mul, size, x, op(hr.m_add, size, x, cst(1, size))), cst(1, size)),
+             cst(0, size), True),
+            ("{0}: x * x + 1 != 0".format(size), "ne",
+             op(hr.m_add, size, op(hr.m_mul, size, x, x), cst(1, size)), cst(0, size), True),
+            ("{0}: x >> (8 * size) == 0".format(size), "eq",
+             op(hr.m_shr, size, x, cst(8 * size, 1)), cst(0, size), True),
+            ("{0}: x + 2**(n-1) + 2**(n-1) == x".format(size), "eq",
+             op(hr.m_add, size, op(hr.m_add, size, x, cst(1 << (8 * size - 1), size)), cst(1 << (8 * size - 1), size)),
+             x, True),
+        ]
+    for small_size, big_size in [(1, 4), (2, 4), (4, 8)]:
+        x_big, x_small = reg(0, big_size), reg(0, small_size)
+        corpus += [
+            ("{0}->{1}: xdu(low(x)) == x".format(big_size, small_size), "eq",
+             op(hr.m_xdu, big_size, op(hr.m_low, small_size, x_big)), x_big, False),
+            ("{0}->{1}: low(x) == x_small".format(big_size, small_size), "eq",
+             op(hr.m_low, small_size, x_big), x_small, True),
+            ("{0}->{1}: xds(x_small) != xdu(x_small)".format(small_size, big_size), "ne",
+             op(hr.m_xds, big_size, x_small), op(hr.m_xdu, big_size, x_small), False),
+            ("{0}->{1}: high(xdu(x_small)) == 0".format(small_size, big_size), "eq",
+             op(hr.m_high, big_size - small_size, op(hr.m_xdu, big_size, x_small)), cst(0, big_size - small_size),
+             True),
+        ]
+    return corpus
+
+
+def legacy_ast_to_z3_expression(ast, z3_var_by_leaf_index, known_leaf_mops):
+    # Translation used before the size-accurate one: every expression on 32 bits, extensions/truncations ignored
+    if isinstance(ast, AstLeaf):
+        if ast.is_constant():
+            return z3.BitVecVal(ast.value, 32)
+        leaf_index = get_mop_index(ast.mop, known_leaf_mops)
+        if leaf_index == -1:
+            known_leaf_mops.append(ast.mop)
+            leaf_index = len(known_leaf_mops) - 1
+            z3_var_by_leaf_index[leaf_index] = z3.BitVec("x_{0}".format(leaf_index), 32)
+        return z3_var_by_leaf_index[leaf_index]
+    left = legacy_ast_to_z3_expression(ast.left, z3_var_by_leaf_index, known_leaf_mops)
+    if ast.opcode in [hr.m_xdu, hr.m_xds, hr.m_low, hr.m_high]:
+        return left
+    elif ast.opcode == hr.m_neg:
+        return -left
+    elif ast.opcode == hr.m_bnot:
+        return ~left
+    right = legacy_ast_to_z3_expression(ast.right, z3_var_by_leaf_index, known_leaf_mops)
+    binary_operations = {
+        hr.m_add: lambda a, b: a + b, hr.m_sub: lambda a, b: a - b, hr.m_mul: lambda a, b: a * b,
+        hr.m_udiv: z3.UDiv, hr.m_sdiv: lambda a, b: a / b, hr.m_umod: z3.URem, hr.m_smod: lambda a, b: a % b,
+        hr.m_or: lambda a, b: a | b, hr.m_and: lambda a, b: a & b, hr.m_xor: lambda a, b: a ^ b,
+        hr.m_shl: lambda a, b: a << b, hr.m_shr: z3.LShR, hr.m_sar: lambda a, b: a >> b,
+    }
+    return binary_operations[ast.opcode](left, right)
+
+
+def get_legacy_z3_expressions(mop1, mop2):
+    z3_var_by_leaf_index = {}
+    known_leaf_mops = []
+    return [legacy_ast_to_z3_expression(mop_to_ast(mop), z3_var_by_leaf_index, known_leaf_mops)
+            for mop in [mop1, mop2]]
+
+
+def get_size_accurate_z3_expressions(mop1, mop2):
+    z3_mop1, z3_mop2 = ast_list_to_z3_expression_list([mop_to_ast(mop1), mop_to_ast(mop2)])
+    nb_bits = max(z3_mop1.size(), z3_mop2.size())
+    return z3_resize(z3_mop1, nb_bits), z3_resize(z3_mop2, nb_bits)
+
+
+def solve(relation, z3_mop1, z3_mop2):
+    s = z3.Solver()
+    if relation == "eq":
+        s.add(z3.Not(z3_mop1 == z3_mop2))
+    else:
+        s.add(z3_mop1 == z3_mop2)
+    start_time = time.perf_counter()
+    verdict = s.check() == z3.unsat
+    return verdict, time.perf_counter() - start_time
+
+
+def run_corpus(title, corpus):
+    legacy_time = new_time = 0
+    nb_differences = nb_legacy_wrong = nb_new_wrong = nb_skipped = 0
+    for description, relation, mop1, mop2, expected in corpus:
+        try:
+            legacy_verdict, legacy_solve_time = solve(relation, *get_legacy_z3_expressions(mop1, mop2))
+            new_verdict, new_solve_time = solve(relation, *get_size_accurate_z3_expressions(mop1, mop2))
+        except (KeyError, AttributeError, z3.Z3Exception, D810Z3Exception):
+            # Relations with opcodes that are not translated to Z3 (comparisons, calls, ...)
+            nb_skipped += 1
+            continue
+        legacy_time += legacy_solve_time
+        new_time += new_solve_time
+        if legacy_verdict != new_verdict:
+            nb_differences += 1
+            print("  {0}: 32 bits -> {1}, size-accurate -> {2}".format(description, legacy_verdict, new_verdict))
+        if expected is not None:
+            nb_legacy_wrong += int(legacy_verdict != expected)
+            nb_new_wrong += int(new_verdict != expected)
+    print_comparison("{0} ({1} relations, {2} skipped)".format(title, len(corpus) - nb_skipped, nb_skipped),
+                     "32 bits", legacy_time, "size-accurate", new_time)
+    print("  Verdicts differing: {0}".format(nb_differences))
+    if any(expected is not None for _, _, _, _, expected in corpus):
+        print("  Wrong verdicts: 32 bits {0}, size-accurate {1}".format(nb_legacy_wrong, nb_new_wrong))
+
+
+def main():
+    run_corpus("Synthetic corpus", get_synthetic_corpus())
+    mba = generate_microcode()
+    if mba is None:
+        return
+    run_corpus("Function predicates", [(description, relation, mop1, mop2, None)
+                                       for description, relation, mop1, mop2 in get_relation_corpus(mba)])
+
+
+main()
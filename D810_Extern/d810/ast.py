@@ -7,51 +7,59 @@ from ida_hexrays import *
 from d810.utils import unsigned_to_signed, signed_to_unsigned, \
     get_add_cf, get_add_of, get_sub_of, get_parity_flag
 from d810.hexrays_helpers import OPCODES_INFO, MBA_RELATED_OPCODES, Z3_SPECIAL_OPERANDS, MINSN_TO_AST_FORBIDDEN_OPCODES, \
-    equal_mops_ignore_size, AND_TABLE
+    equal_mops_ignore_size, get_mop_ignore_size_key, AND_TABLE
 from d810.hexrays_formatters import format_minsn_t, format_mop_t
 from d810.errors import AstEvaluationException
 
 logger = logging.getLogger('D810')
 
 
-def check_and_add_to_list(new_ast: Union[AstNode, AstLeaf], known_ast_list: List[Union[AstNode, AstLeaf]]):
-    is_new_ast_known = False
-    for existing_elt in known_ast_list:
+def check_and_add_to_list(new_ast: Union[AstNode, AstLeaf], new_ast_key: Tuple,
+                          known_ast_list: List[Union[AstNode, AstLeaf]],
+                          known_ast_by_key: Dict[Tuple, List[Union[AstNode, AstLeaf]]]):
+    # Hash-consing: new_ast is only compared with the known ASTs which have the same key (see get_mop_ignore_size_key)
+    # instead of all of them, so that building the AST of a large expression does not call equal_insns n^2 times
+    same_key_ast_list = known_ast_by_key.setdefault(new_ast_key, [])
+    for existing_elt in same_key_ast_list:
         if equal_mops_ignore_size(new_ast.mop, existing_elt.mop):
             new_ast.ast_index = existing_elt.ast_index
-            is_new_ast_known = True
-            break
+            return
 
-    if not is_new_ast_known:
-        ast_index = len(known_ast_list)
-        new_ast.ast_index = ast_index
-        known_ast_list.append(new_ast)
+    ast_index = len(known_ast_list)
+    new_ast.ast_index = ast_index
+    known_ast_list.append(new_ast)
+    same_key_ast_list.append(new_ast)
 
 
-def mop_to_ast_internal(mop: mop_t, ast_list: List[Union[AstNode, AstLeaf]]) -> Union[None, AstNode, AstLeaf]:
+def mop_to_ast_internal(mop: mop_t, ast_list: List[Union[AstNode, AstLeaf]],
+                        ast_by_key: Dict[Tuple, List[Union[AstNode, AstLeaf]]]) \
+        -> Tuple[Union[None, AstNode, AstLeaf], Union[None, Tuple]]:
+    # Returns the AST of the mop and its key, the key of an AstNode being built from the key of its children
     if mop is None:
-        return None
+        return None, None
 
     if mop.t != mop_d or (mop.d.opcode not in MBA_RELATED_OPCODES):
         tree = AstLeaf(format_mop_t(mop))
         tree.mop = mop
         dest_size = mop.size if mop.t != mop_d else mop.d.d.size
         tree.dest_size = dest_size
+        tree_key = get_mop_ignore_size_key(mop)
     else:
-        left_ast = mop_to_ast_internal(mop.d.l, ast_list)
-        right_ast = mop_to_ast_internal(mop.d.r, ast_list)
-        dst_ast = mop_to_ast_internal(mop.d.d, ast_list)
+        left_ast, left_key = mop_to_ast_internal(mop.d.l, ast_list, ast_by_key)
+        right_ast, right_key = mop_to_ast_internal(mop.d.r, ast_list, ast_by_key)
+        dst_ast, dst_key = mop_to_ast_internal(mop.d.d, ast_list, ast_by_key)
         tree = AstNode(mop.d.opcode, left_ast, right_ast, dst_ast)
         tree.mop = mop
         tree.dest_size = mop.d.d.size
         tree.ea = mop.d.ea
+        tree_key = (mop_d, mop.d.opcode, left_key, right_key, dst_key)
 
-    check_and_add_to_list(tree, ast_list)
-    return tree
+    check_and_add_to_list(tree, tree_key, ast_list, ast_by_key)
+    return tree, tree_key
 
 
 def mop_to_ast(mop: mop_t) -> Union[None, AstNode, AstLeaf]:
-    mop_ast = mop_to_ast_internal(mop, [])
+    mop_ast, _ = mop_to_ast_internal(mop, [], {})
     mop_ast.compute_sub_ast()
     return mop_ast
 
@@ -90,6 +98,99 @@ class AstInfo(object):
         return "{0} used {1} times: {2}".format(self.ast, self.number_of_use, format_mop_t(self.ast.mop))
 
 
+class AstStatistics(object):
+    # Size of an AST: depth and number of AstNode (nb_opcodes), of leafs (constants included) and of constant leafs.
+    # The mop_z leafs (e.g. the right operand of an unary operation) and the destination operands are not counted.
+    __slots__ = ["depth", "nb_opcodes", "nb_leafs", "nb_constants"]
+
+    def __init__(self, depth: int = 0, nb_opcodes: int = 0, nb_leafs: int = 0, nb_constants: int = 0):
+        self.depth = depth
+        self.nb_opcodes = nb_opcodes
+        self.nb_leafs = nb_leafs
+        self.nb_constants = nb_constants
+
+    def is_at_least(self, other: AstStatistics) -> bool:
+        return self.depth >= other.depth and self.nb_opcodes >= other.nb_opcodes and \
+            self.nb_leafs >= other.nb_leafs and self.nb_constants >= other.nb_constants
+
+    def __str__(self):
+        return "depth={0}, nb_opcodes={1}, nb_leafs={2}, nb_constants={3}"\
+            .format(self.depth, self.nb_opcodes, self.nb_leafs, self.nb_constants)
+
+
+def get_ast_statistics(ast: Union[None, AstNode, AstLeaf]) -> AstStatistics:
+    # Works both for patterns and for minsn_to_ast output
+    if ast is None:
+        return AstStatistics()
+    if ast.is_leaf():
+        if ast.mop is not None and ast.mop.t == mop_z:
+            return AstStatistics()
+        is_constant = isinstance(ast, AstConstant) or ast.is_constant()
+        return AstStatistics(0, 0, 1, 1 if is_constant else 0)
+    left_statistics = get_ast_statistics(ast.left)
+    right_statistics = get_ast_statistics(ast.right)
+    return AstStatistics(1 + max(left_statistics.depth, right_statistics.depth),
+                         1 + left_statistics.nb_opcodes + right_statistics.nb_opcodes,
+                         left_statistics.nb_leafs + right_statistics.nb_leafs,
+                         left_statistics.nb_constants + right_statistics.nb_constants)
+
+
+class AstLeafBinding(object):
+    # Mop bound to a pattern leaf by a successful match
+    __slots__ = ["name", "mop"]
+
+    def __init__(self, name: str, mop: mop_t):
+        self.name = name
+        self.mop = mop
+
+    @property
+    def size(self):
+        return self.mop.size
+
+    @property
+    def dst_mop(self):
+        return self.mop
+
+    @property
+    def value(self):
+        if self.is_constant():
+            return self.mop.nnn.value
+        return None
+
+    def is_constant(self):
+        return self.mop is not None and self.mop.t == mop_n
+
+
+class AstBinding(object):
+    # Result of a successful pattern match: the mop bound to each leaf name of the pattern and information on the
+    # matched instruction. It has the same interface as a matched AstNode (candidate["x_0"].mop, candidate.size,
+    # candidate.dst_mop, candidate.add_constant_leaf(...)), but a new AstBinding is created for each match, so the
+    # pattern AST is never modified.
+    __slots__ = ["mop", "dst_mop", "dest_size", "ea", "leafs_by_name"]
+
+    def __init__(self, mop: mop_t = None, dst_mop: mop_t = None, dest_size: int = None, ea: int = None):
+        self.mop = mop
+        self.dst_mop = dst_mop
+        self.dest_size = dest_size
+        self.ea = ea
+        self.leafs_by_name = {}
+
+    @property
+    def size(self):
+        return self.mop.d.d.size
+
+    def __getitem__(self, leaf_name: str) -> AstLeafBinding:
+        return self.leafs_by_name[leaf_name]
+
+    def add_leaf(self, leaf_name: str, leaf_mop: mop_t):
+        self.leafs_by_name[leaf_name] = AstLeafBinding(leaf_name, leaf_mop)
+
+    def add_constant_leaf(self, leaf_name: str, cst_value: int, cst_size: int):
+        cst_mop = mop_t()
+        cst_mop.make_number(cst_value & AND_TABLE[cst_size], cst_size)
+        self.add_leaf(leaf_name, cst_mop)
+
+
 class AstNode(dict):
     def __init__(self, opcode, left=None, right=None, dst=None):
         super(dict, self).__init__()
@@ -111,6 +212,7 @@ class AstNode(dict):
 
         self.dest_size = None
         self.ea = None
+        self._evaluator = None
 
     @property
     def size(self):
@@ -187,6 +289,7 @@ class AstNode(dict):
 
     def reset_mops(self):
         self.mop = None
+        self._evaluator = None
         if self.left is not None:
             self.left.reset_mops()
         if self.right is not None:
@@ -235,20 +338,21 @@ class AstNode(dict):
                 all_leafs_found = False
         return all_leafs_found
 
-    def create_mop(self, ea: int) -> mop_t:
-        new_ins = self.create_minsn(ea)
+    def create_mop(self, ea: int, binding: Union[None, AstNode, AstBinding] = None) -> mop_t:
+        new_ins = self.create_minsn(ea, binding=binding)
         new_ins_mop = mop_t()
         new_ins_mop.create_from_insn(new_ins)
         return new_ins_mop
 
-    def create_minsn(self, ea: int, dest=None) -> minsn_t:
+    def create_minsn(self, ea: int, dest=None, binding: Union[None, AstNode, AstBinding] = None) -> minsn_t:
+        # If binding is given, leaf mops are taken from it (by leaf name) instead of the leafs of this AST
         new_ins = minsn_t(ea)
         new_ins.opcode = self.opcode
 
         if self.left is not None:
-            new_ins.l = self.left.create_mop(ea)
+            new_ins.l = self.left.create_mop(ea, binding)
             if self.right is not None:
-                new_ins.r = self.right.create_mop(ea)
+                new_ins.r = self.right.create_mop(ea, binding)
 
         new_ins.d = mop_t()
 
@@ -271,9 +375,16 @@ class AstNode(dict):
     def evaluate_with_leaf_info(self, leafs_info, leafs_value):
         dict_index_to_value = {leaf_info.ast.ast_index: leaf_value for leaf_info, leaf_value in
                                zip(leafs_info, leafs_value)}
-        res = self.evaluate(dict_index_to_value)
+        res = self.get_evaluator()(dict_index_to_value)
         return res
 
+    def get_evaluator(self):
+        # The compiled evaluator is built once and cached: the AST must not be modified after the first call
+        # (reset_mops drops it)
+        if self._evaluator is None:
+            self._evaluator = compile_ast_evaluator(self)
+        return self._evaluator
+
     def evaluate(self, dict_index_to_value):
         if self.ast_index in dict_index_to_value:
             return dict_index_to_value[self.ast_index]
@@ -435,6 +546,7 @@ class AstLeaf(object):
 
         self.dest_size = None
         self.ea = None
+        self._evaluator = None
 
         self.sub_ast_info_by_index = {}
 
@@ -481,8 +593,10 @@ class AstLeaf(object):
             return False
         return self.mop.t == mop_n
 
-    def create_mop(self, ea):
+    def create_mop(self, ea, binding=None):
         # Currently, we are not creating a new mop but returning the one defined
+        if binding is not None:
+            return binding[self.name].mop
         return self.mop
 
     def update_leafs_mop(self, other, other2=None):
@@ -506,6 +620,7 @@ class AstLeaf(object):
         self.z3_var = None
         self.z3_var_name = None
         self.mop = None
+        self._evaluator = None
 
     def _copy_mops_from_ast(self, other):
         self.mop = other.mop
@@ -527,9 +642,16 @@ class AstLeaf(object):
     def evaluate_with_leaf_info(self, leafs_info, leafs_value):
         dict_index_to_value = {leaf_info.ast.ast_index: leaf_value for leaf_info, leaf_value in
                                zip(leafs_info, leafs_value)}
-        res = self.evaluate(dict_index_to_value)
+        res = self.get_evaluator()(dict_index_to_value)
         return res
 
+    def get_evaluator(self):
+        # The compiled evaluator is built once and cached: the AST must not be modified after the first call
+        # (reset_mops drops it)
+        if self._evaluator is None:
+            self._evaluator = compile_ast_evaluator(self)
+        return self._evaluator
+
     def evaluate(self, dict_index_to_value):
         if self.is_constant():
             return self.mop.nnn.value
@@ -603,3 +725,96 @@ class AstConstant(AstLeaf):
         except RuntimeError as e:
             logger.info("Error while calling __str__ on AstConstant: {0}".format(e))
             return "Error_AstConstant"
+
+
+def compile_ast_evaluator(ast: Union[AstNode, AstLeaf]):
+    # Compiles ast into nested closures computing the same value as ast.evaluate(dict_index_to_value): the opcode
+    # dispatch, masks, operand sizes and constant values are resolved once here instead of at each evaluation.
+    # dict_index_to_value is only looked up for the (non-constant) leafs, as done by evaluate_with_leaf_info.
+    if ast.is_leaf():
+        if isinstance(ast, AstConstant):
+            cst_value = ast.evaluate()
+            return lambda dict_index_to_value: cst_value
+        if ast.is_constant():
+            cst_value = ast.mop.nnn.value
+            return lambda dict_index_to_value: cst_value
+        leaf_index = ast.ast_index
+        return lambda dict_index_to_value: dict_index_to_value.get(leaf_index)
+
+    opcode = ast.opcode
+    res_mask = AND_TABLE[ast.dest_size]
+    res_size = ast.dest_size
+    left = compile_ast_evaluator(ast.left)
+    left_size = ast.left.dest_size
+    if ast.right is not None:
+        right = compile_ast_evaluator(ast.right)
+        right_size = ast.right.dest_size
+
+    if opcode in [m_mov, m_xdu, m_low]:
+        return lambda d: left(d) & res_mask
+    elif opcode == m_neg:
+        return lambda d: (- left(d)) & res_mask
+    elif opcode == m_lnot:
+        return lambda d: left(d) != 0
+    elif opcode == m_bnot:
+        return lambda d: (left(d) ^ res_mask) & res_mask
+    elif opcode == m_xds:
+        return lambda d: signed_to_unsigned(unsigned_to_signed(left(d), left_size), res_size) & res_mask
+    elif opcode == m_add:
+        return lambda d: (left(d) + right(d)) & res_mask
+    elif opcode == m_sub:
+        return lambda d: (left(d) - right(d)) & res_mask
+    elif opcode == m_mul:
+        return lambda d: (left(d) * right(d)) & res_mask
+    elif opcode in [m_udiv, m_sdiv]:
+        return lambda d: (left(d) // right(d)) & res_mask
+    elif opcode in [m_umod, m_smod]:
+        return lambda d: (left(d) % right(d)) & res_mask
+    elif opcode == m_or:
+        return lambda d: (left(d) | right(d)) & res_mask
+    elif opcode == m_and:
+        return lambda d: (left(d) & right(d)) & res_mask
+    elif opcode == m_xor:
+        return lambda d: (left(d) ^ right(d)) & res_mask
+    elif opcode == m_shl:
+        return lambda d: (left(d) << right(d)) & res_mask
+    elif opcode == m_shr:
+        return lambda d: (left(d) >> right(d)) & res_mask
+    elif opcode == m_sar:
+        return lambda d: signed_to_unsigned(unsigned_to_signed(left(d), left_size) >> right(d), res_size) & res_mask
+    elif opcode == m_cfadd:
+        return lambda d: get_add_cf(left(d), right(d), left_size) & res_mask
+    elif opcode == m_ofadd:
+        return lambda d: get_add_of(left(d), right(d), left_size) & res_mask
+    elif opcode == m_sets:
+        return lambda d: (1 if unsigned_to_signed(left(d), left_size) < 0 else 0) & res_mask
+    elif opcode == m_seto:
+        return lambda d: get_sub_of(unsigned_to_signed(left(d), left_size), unsigned_to_signed(right(d), right_size),
+                                    left_size) & res_mask
+    elif opcode == m_setnz:
+        return lambda d: (1 if left(d) != right(d) else 0) & res_mask
+    elif opcode == m_setz:
+        return lambda d: (1 if left(d) == right(d) else 0) & res_mask
+    elif opcode == m_setae:
+        return lambda d: (1 if left(d) >= right(d) else 0) & res_mask
+    elif opcode == m_setb:
+        return lambda d: (1 if left(d) < right(d) else 0) & res_mask
+    elif opcode == m_seta:
+        return lambda d: (1 if left(d) > right(d) else 0) & res_mask
+    elif opcode == m_setbe:
+        return lambda d: (1 if left(d) <= right(d) else 0) & res_mask
+    elif opcode == m_setg:
+        return lambda d: (1 if unsigned_to_signed(left(d), left_size) > unsigned_to_signed(right(d), right_size)
+                          else 0) & res_mask
+    elif opcode == m_setge:
+        return lambda d: (1 if unsigned_to_signed(left(d), left_size) >= unsigned_to_signed(right(d), right_size)
+                          else 0) & res_mask
+    elif opcode == m_setl:
+        return lambda d: (1 if unsigned_to_signed(left(d), left_size) < unsigned_to_signed(right(d), right_size)
+                          else 0) & res_mask
+    elif opcode == m_setle:
+        return lambda d: (1 if unsigned_to_signed(left(d), left_size) <= unsigned_to_signed(right(d), right_size)
+                          else 0) & res_mask
+    elif opcode == m_setp:
+        return lambda d: get_parity_flag(left(d), right(d), left_size) & res_mask
+    raise AstEvaluationException("Can't evaluate opcode: {0}".format(opcode))
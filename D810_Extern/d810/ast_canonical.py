@@ -0,0 +1,598 @@
+from __future__ import annotations
+import logging
+from typing import List, Union, Dict, Tuple, Callable
+
+from ida_hexrays import *
+
+from d810.ast import AstNode, AstLeaf, AstConstant, AstBinding, AstStatistics, get_ast_statistics
+from d810.hexrays_helpers import equal_mops_ignore_size
+from d810.hexrays_formatters import opcode_to_string
+
+logger = logging.getLogger('D810')
+
+# Canonical form of an AST used for commutative/associative (AC) matching.
+# In the canonical form:
+#  - chains of m_add/m_sub/m_neg are flattened into a single n-ary m_add node (a - b becomes add(a, neg(b)))
+#  - chains of m_xor, m_or, m_and and m_mul are flattened into a single n-ary node
+#  - operands of an n-ary node are sorted (nodes first, then constants, then leafs)
+#  - other opcodes are kept with their operands in order
+# AstLeaf and AstConstant objects are reused as is in the canonical form.
+#
+# Thus, all the orderings/parenthesizations of an expression share the same canonical form, and a pattern can be
+# matched against an instruction with a single canonical-vs-canonical comparison (operands of an n-ary node are matched
+# as a multiset), instead of generating all the permutations of the pattern.
+AC_OPCODES = [m_add, m_xor, m_or, m_and, m_mul]
+ADD_SUB_OPCODES = [m_add, m_sub, m_neg]
+
+
+class CanonicalGroup(object):
+    # A group of operands of an n-ary CanonicalNode which corresponds to a subtree of the original AST.
+    # The original AST value is equal to the operation applied on the group operands (sign = 1),
+    # or to its opposite (sign = -1, only for m_add).
+    # Groups allow a pattern leaf to match a subset of the operands of an instruction (e.g. 'x_0 + x_1' matching
+    # '(a + b) + c' with x_0 = 'a + b'), as the permutation fuzzing did.
+    __slots__ = ["mask", "sign", "ast", "_canonical_ast"]
+
+    def __init__(self, mask: int, sign: int, ast: Union[AstNode, AstLeaf]):
+        self.mask = mask
+        self.sign = sign
+        self.ast = ast
+        self._canonical_ast = None
+
+    @property
+    def canonical_ast(self) -> Union[CanonicalNode, AstLeaf]:
+        if self._canonical_ast is None:
+            self._canonical_ast = get_canonical_ast(self.ast)
+        return self._canonical_ast
+
+
+class CanonicalNode(object):
+    __slots__ = ["opcode", "children", "ast", "groups"]
+
+    def __init__(self, opcode: int, children: List, ast: Union[None, AstNode] = None,
+                 groups: Union[None, List[CanonicalGroup]] = None):
+        self.opcode = opcode
+        self.children = children
+        # ast is the AstNode this canonical node was built from (None if the node has been created during the
+        # canonicalization, e.g. the 'neg(b)' of 'a - b')
+        self.ast = ast
+        self.groups = groups if groups is not None else []
+
+    @staticmethod
+    def is_leaf() -> bool:
+        return False
+
+    @staticmethod
+    def is_constant() -> bool:
+        return False
+
+    def __str__(self):
+        return "{0}({1})".format(opcode_to_string(self.opcode), ", ".join([str(x) for x in self.children]))
+
+
+def get_canonical_sort_key(canonical_ast: Union[CanonicalNode, AstLeaf]):
+    if not canonical_ast.is_leaf():
+        return 0, canonical_ast.opcode, len(canonical_ast.children)
+    if canonical_ast.is_constant():
+        return 1, 0, 0
+    return 2, 0, 0
+
+
+def _collect_ac_operands(ast: Union[AstNode, AstLeaf], ac_opcode: int, sign: int,
+                         operands: List, groups: List[CanonicalGroup]):
+    first_index = len(operands)
+    if ast.is_leaf() or ast.opcode not in (ADD_SUB_OPCODES if ac_opcode == m_add else [ac_opcode]):
+        operand = get_canonical_ast(ast)
+        if sign == -1:
+            operand = CanonicalNode(m_neg, [operand])
+        operands.append(operand)
+        return
+    if ast.opcode == m_neg:
+        _collect_ac_operands(ast.left, ac_opcode, -sign, operands, groups)
+    else:
+        _collect_ac_operands(ast.left, ac_opcode, sign, operands, groups)
+        _collect_ac_operands(ast.right, ac_opcode, -sign if ast.opcode == m_sub else sign, operands, groups)
+    if ast.mop is not None:
+        mask = ((1 << len(operands)) - 1) ^ ((1 << first_index) - 1)
+        groups.append(CanonicalGroup(mask, sign, ast))
+
+
+def _get_canonical_ac_node(ast: AstNode) -> Union[CanonicalNode, AstLeaf]:
+    ac_opcode = m_add if ast.opcode in ADD_SUB_OPCODES else ast.opcode
+    operands = []
+    groups = []
+    _collect_ac_operands(ast, ac_opcode, 1, operands, groups)
+    if len(operands) == 1:
+        # e.g. neg(x) or neg(neg(x))
+        operand = operands[0]
+        if not operand.is_leaf() and operand.ast is None:
+            operand.ast = ast
+        return operand
+
+    sorted_indexes = sorted(range(len(operands)), key=lambda i: get_canonical_sort_key(operands[i]))
+    new_index_of = {old_index: new_index for new_index, old_index in enumerate(sorted_indexes)}
+    for group in groups:
+        new_mask = 0
+        for old_index, new_index in new_index_of.items():
+            if group.mask & (1 << old_index):
+                new_mask |= 1 << new_index
+        group.mask = new_mask
+    return CanonicalNode(ac_opcode, [operands[i] for i in sorted_indexes], ast, groups)
+
+
+def get_canonical_ast(ast: Union[None, AstNode, AstLeaf]) -> Union[None, CanonicalNode, AstLeaf]:
+    # Works both for patterns (AstNode/AstLeaf without mop) and for minsn_to_ast output
+    if ast is None:
+        return None
+    if ast.is_leaf():
+        return ast
+    if ast.opcode in AC_OPCODES or ast.opcode in ADD_SUB_OPCODES:
+        return _get_canonical_ac_node(ast)
+    children = []
+    if ast.left is not None:
+        children.append(get_canonical_ast(ast.left))
+        if ast.right is not None:
+            children.append(get_canonical_ast(ast.right))
+    return CanonicalNode(ast.opcode, children, ast)
+
+
+def is_ac_canonical_node(canonical_ast: Union[CanonicalNode, AstLeaf]) -> bool:
+    # m_neg nodes belong to the m_add family: 'neg(x_0)' may be matched by 'add(neg(a), neg(b))'
+    return (not canonical_ast.is_leaf()) and (canonical_ast.opcode in AC_OPCODES or canonical_ast.opcode == m_neg)
+
+
+def _bind_leaf(name: str, ast: Union[AstNode, AstLeaf], bindings: Dict, trail: List[str]) -> bool:
+    bound_ast = bindings.get(name)
+    if bound_ast is not None:
+        return equal_mops_ignore_size(bound_ast.mop, ast.mop)
+    bindings[name] = ast
+    trail.append(name)
+    return True
+
+
+def _undo_bindings(bindings: Dict, trail: List[str], trail_size: int):
+    while len(trail) > trail_size:
+        del bindings[trail.pop()]
+
+
+# The matching functions are generators: each time they yield, bindings contains a valid assignment of the pattern
+# leafs. When resumed, they undo their own bindings and look for the next assignment. This is needed since a
+# commutative node may be matched in several ways and only some of them are compatible with the rest of the pattern
+# (e.g. 'x_0 ^ (x_0 & x_1)' against 'a ^ (b & a)').
+def _iter_leaf_binding(name: str, ast: Union[AstNode, AstLeaf], bindings: Dict, trail: List[str]):
+    trail_size = len(trail)
+    if _bind_leaf(name, ast, bindings, trail):
+        yield
+    _undo_bindings(bindings, trail, trail_size)
+
+
+def _iter_matches(pattern, canonical_ast, bindings: Dict, trail: List[str]):
+    if isinstance(pattern, AstConstant):
+        if not canonical_ast.is_leaf() or not canonical_ast.is_constant():
+            return
+        if pattern.expected_value is not None and pattern.expected_value != canonical_ast.mop.nnn.value:
+            return
+        yield from _iter_leaf_binding(pattern.name, canonical_ast, bindings, trail)
+        return
+
+    if isinstance(pattern, AstLeaf):
+        ast = canonical_ast if canonical_ast.is_leaf() else canonical_ast.ast
+        if ast is None or ast.mop is None:
+            return
+        yield from _iter_leaf_binding(pattern.name, ast, bindings, trail)
+        return
+
+    if canonical_ast.is_leaf():
+        return
+    if pattern.opcode in AC_OPCODES:
+        if pattern.opcode == canonical_ast.opcode and len(pattern.children) <= len(canonical_ast.children):
+            yield from _iter_ac_operand_matches(pattern.children, 0, canonical_ast, 0, bindings, trail)
+        return
+
+    if pattern.opcode == m_neg and canonical_ast.opcode == m_add:
+        # 'neg(x_0)' against 'neg(a + b)' which has been canonicalized as 'add(neg(a), neg(b))'
+        full_mask = (1 << len(canonical_ast.children)) - 1
+        for group in canonical_ast.groups:
+            if group.sign == -1 and group.mask == full_mask:
+                yield from _iter_matches(pattern.children[0], group.canonical_ast, bindings, trail)
+        return
+
+    if pattern.opcode == canonical_ast.opcode and len(pattern.children) <= len(canonical_ast.children):
+        yield from _iter_ordered_operand_matches(pattern.children, 0, canonical_ast.children, bindings, trail)
+
+
+def _iter_ordered_operand_matches(pattern_operands: List, pattern_index: int, ast_operands: List,
+                                  bindings: Dict, trail: List[str]):
+    if pattern_index == len(pattern_operands):
+        yield
+        return
+    for _ in _iter_matches(pattern_operands[pattern_index], ast_operands[pattern_index], bindings, trail):
+        yield from _iter_ordered_operand_matches(pattern_operands, pattern_index + 1, ast_operands, bindings, trail)
+
+
+def _iter_ac_operand_matches(pattern_operands: List, pattern_index: int, canonical_ast: CanonicalNode,
+                             used_mask: int, bindings: Dict, trail: List[str]):
+    # Multiset matching: each pattern operand takes either one operand of the instruction
+    # or (for a leaf or a neg(leaf)) a group of operands
+    ast_operands = canonical_ast.children
+    full_mask = (1 << len(ast_operands)) - 1
+    if pattern_index == len(pattern_operands):
+        if used_mask == full_mask:
+            yield
+        return
+    nb_remaining_pattern_operands = len(pattern_operands) - pattern_index
+    if bin(full_mask & ~used_mask).count("1") < nb_remaining_pattern_operands:
+        return
+
+    pattern_operand = pattern_operands[pattern_index]
+    for i, ast_operand in enumerate(ast_operands):
+        if used_mask & (1 << i):
+            continue
+        for _ in _iter_matches(pattern_operand, ast_operand, bindings, trail):
+            yield from _iter_ac_operand_matches(pattern_operands, pattern_index + 1, canonical_ast,
+                                                used_mask | (1 << i), bindings, trail)
+
+    if isinstance(pattern_operand, AstConstant):
+        return
+    is_pattern_leaf = isinstance(pattern_operand, AstLeaf)
+    if not is_pattern_leaf and pattern_operand.opcode != m_neg:
+        return
+    expected_sign = 1 if is_pattern_leaf else -1
+    for group in canonical_ast.groups:
+        if group.sign != expected_sign or (group.mask & used_mask) != 0 or group.mask == full_mask:
+            continue
+        new_used_mask = used_mask | group.mask
+        if bin(full_mask & ~new_used_mask).count("1") < nb_remaining_pattern_operands - 1:
+            continue
+        if is_pattern_leaf:
+            group_matches = _iter_leaf_binding(pattern_operand.name, group.ast, bindings, trail)
+        else:
+            group_matches = _iter_matches(pattern_operand.children[0], group.canonical_ast, bindings, trail)
+        for _ in group_matches:
+            yield from _iter_ac_operand_matches(pattern_operands, pattern_index + 1, canonical_ast, new_used_mask,
+                                                bindings, trail)
+
+
+def match_canonical_ast(canonical_pattern, canonical_ast) -> Union[None, Dict[str, Union[AstNode, AstLeaf]]]:
+    # Returns the AST bound to each leaf name of the pattern, or None if the pattern does not match
+    bindings = {}
+    for _ in _iter_matches(canonical_pattern, canonical_ast, bindings, []):
+        return dict(bindings)
+    return None
+
+
+def _match_exact(pattern: Union[AstNode, AstLeaf], ast: Union[AstNode, AstLeaf], bindings: Dict,
+                 trail: List[str]) -> bool:
+    # Ordered matching (same as AstNode.check_pattern_and_copy_mops), used for patterns which must not be fuzzed
+    if isinstance(pattern, AstConstant):
+        if ast.mop is None or ast.mop.t != mop_n:
+            return False
+        if pattern.expected_value is not None and pattern.expected_value != ast.mop.nnn.value:
+            return False
+        return _bind_leaf(pattern.name, ast, bindings, trail)
+    if isinstance(pattern, AstLeaf):
+        return _bind_leaf(pattern.name, ast, bindings, trail)
+    if ast.is_leaf() or pattern.opcode != ast.opcode:
+        return False
+    if pattern.left is not None:
+        if ast.left is None or not _match_exact(pattern.left, ast.left, bindings, trail):
+            return False
+        if pattern.right is not None:
+            if ast.right is None or not _match_exact(pattern.right, ast.right, bindings, trail):
+                return False
+    return True
+
+
+def match_exact_ast(pattern: Union[AstNode, AstLeaf], ast: Union[AstNode, AstLeaf]) \
+        -> Union[None, Dict[str, Union[AstNode, AstLeaf]]]:
+    bindings = {}
+    if not _match_exact(pattern, ast, bindings, []):
+        return None
+    return bindings
+
+
+# Specialized matchers: instead of walking the pattern with the generic matchers above, the source of a function
+# dedicated to one pattern is generated and compiled when the rule is configured. The generated function tests the
+# opcodes in order, binds the leafs to local variables and checks the implicit equalities (leafs appearing several
+# times in the pattern) inline. Backtracking on commutative/associative nodes is done with nested for loops over the
+# possible choices of operands (see _iter_ac_choices).
+# The generated function returns the tuple of the ASTs bound to each leaf name (in the order of
+# PatternCodeGenerator.leaf_names) or None, and finds the same first match as the generic matchers.
+AC_CHOICE_OPERAND = 0
+AC_CHOICE_LEAF = 1
+AC_CHOICE_NEG = 2
+
+
+def _get_neg_operand_candidates(canonical_ast: CanonicalNode) -> List:
+    # Canonical ASTs which may be matched by x_0 in 'neg(x_0)' (see the m_neg case of _iter_matches)
+    if canonical_ast.opcode == m_add:
+        full_mask = (1 << len(canonical_ast.children)) - 1
+        return [group.canonical_ast for group in canonical_ast.groups
+                if group.sign == -1 and group.mask == full_mask]
+    if canonical_ast.opcode == m_neg:
+        return [canonical_ast.children[0]]
+    return []
+
+
+def _iter_ac_choices(canonical_ast: CanonicalNode, used_mask: int, full_mask: int,
+                     nb_remaining_pattern_operands: int, choice_kind: int):
+    # Yields (new_used_mask, ast) for each way a pattern operand may consume operands of canonical_ast, in the same
+    # order as _iter_ac_operand_matches. ast is:
+    #  - AC_CHOICE_OPERAND: the canonical operand, to be matched with the pattern operand
+    #  - AC_CHOICE_LEAF: the AST to bind to the pattern leaf
+    #  - AC_CHOICE_NEG: the canonical AST to be matched with the operand of the pattern m_neg node
+    if bin(full_mask & ~used_mask).count("1") < nb_remaining_pattern_operands:
+        return
+    for i, ast_operand in enumerate(canonical_ast.children):
+        if used_mask & (1 << i):
+            continue
+        if choice_kind == AC_CHOICE_OPERAND:
+            yield used_mask | (1 << i), ast_operand
+        elif choice_kind == AC_CHOICE_LEAF:
+            ast = ast_operand if ast_operand.is_leaf() else ast_operand.ast
+            if ast is not None and ast.mop is not None:
+                yield used_mask | (1 << i), ast
+        elif not ast_operand.is_leaf():
+            for neg_operand in _get_neg_operand_candidates(ast_operand):
+                yield used_mask | (1 << i), neg_operand
+
+    if choice_kind == AC_CHOICE_OPERAND:
+        return
+    expected_sign = 1 if choice_kind == AC_CHOICE_LEAF else -1
+    for group in canonical_ast.groups:
+        if group.sign != expected_sign or (group.mask & used_mask) != 0 or group.mask == full_mask:
+            continue
+        new_used_mask = used_mask | group.mask
+        if bin(full_mask & ~new_used_mask).count("1") < nb_remaining_pattern_operands - 1:
+            continue
+        yield new_used_mask, group.ast if choice_kind == AC_CHOICE_LEAF else group.canonical_ast
+
+
+MATCH_FUNCTION_GLOBALS = {
+    "equal_mops_ignore_size": equal_mops_ignore_size,
+    "_iter_ac_choices": _iter_ac_choices,
+    "_get_neg_operand_candidates": _get_neg_operand_candidates,
+    "mop_n": mop_n,
+}
+MATCH_FUNCTION_NAME = "match_pattern"
+
+
+class PatternCodeGenerator(object):
+    # Generates the source of the specialized matcher of a pattern (see CompiledPattern).
+    # The code is generated in continuation-passing style: each _gen_* method emits the checks of a pattern node and
+    # then calls 'cont' to emit the rest of the pattern inside the innermost block, so that a failing check simply
+    # falls through to the next iteration of the enclosing for loop (i.e. backtracks).
+    def __init__(self, pattern: Union[AstNode, AstLeaf, CanonicalNode], use_canonical_form: bool):
+        self.pattern = pattern
+        self.use_canonical_form = use_canonical_form
+        self.leaf_names = []
+        self.leaf_var_by_name = {}
+        self.lines = []
+        self.nb_vars = 0
+
+    def generate(self) -> str:
+        self.lines = ["def {0}(n0):".format(MATCH_FUNCTION_NAME)]
+        self.nb_vars = 1
+        if self.use_canonical_form:
+            self._gen_canonical(self.pattern, "n0", 1, self._gen_return)
+        else:
+            self._gen_exact(self.pattern, "n0", 1, self._gen_return)
+        self._emit(1, "return None")
+        return "\n".join(self.lines) + "\n"
+
+    def _emit(self, indent: int, line: str):
+        self.lines.append("    " * indent + line)
+
+    def _new_var(self, prefix: str) -> str:
+        var_name = "{0}{1}".format(prefix, self.nb_vars)
+        self.nb_vars += 1
+        return var_name
+
+    def _gen_return(self, indent: int):
+        self._emit(indent, "return ({0},)".format(", ".join([self.leaf_var_by_name[x] for x in self.leaf_names])))
+
+    def _gen_bind(self, leaf_name: str, var: str, indent: int, cont: Callable):
+        leaf_var = self.leaf_var_by_name.get(leaf_name)
+        if leaf_var is not None:
+            self._emit(indent, "if equal_mops_ignore_size({0}.mop, {1}.mop):".format(leaf_var, var))
+            cont(indent + 1)
+            return
+        leaf_var = "v{0}".format(len(self.leaf_names))
+        self.leaf_names.append(leaf_name)
+        self.leaf_var_by_name[leaf_name] = leaf_var
+        self._emit(indent, "{0} = {1}".format(leaf_var, var))
+        cont(indent)
+
+    def _gen_exact(self, pattern: Union[AstNode, AstLeaf], var: str, indent: int, cont: Callable):
+        # Same checks as _match_exact
+        if isinstance(pattern, AstConstant):
+            cond = "{0}.mop is not None and {0}.mop.t == mop_n".format(var)
+            if pattern.expected_value is not None:
+                cond += " and {0}.mop.nnn.value == {1}".format(var, pattern.expected_value)
+            self._emit(indent, "if {0}:".format(cond))
+            self._gen_bind(pattern.name, var, indent + 1, cont)
+            return
+        if isinstance(pattern, AstLeaf):
+            self._gen_bind(pattern.name, var, indent, cont)
+            return
+        self._emit(indent, "if not {0}.is_leaf() and {0}.opcode == {1}:  # {2}"
+                   .format(var, pattern.opcode, opcode_to_string(pattern.opcode)))
+        if pattern.left is None:
+            cont(indent + 1)
+            return
+
+        def gen_right(right_indent: int):
+            if pattern.right is None:
+                cont(right_indent)
+                return
+            right_var = self._new_var("n")
+            self._emit(right_indent, "{0} = {1}.right".format(right_var, var))
+            self._emit(right_indent, "if {0} is not None:".format(right_var))
+            self._gen_exact(pattern.right, right_var, right_indent + 1, cont)
+
+        left_var = self._new_var("n")
+        self._emit(indent + 1, "{0} = {1}.left".format(left_var, var))
+        self._emit(indent + 1, "if {0} is not None:".format(left_var))
+        self._gen_exact(pattern.left, left_var, indent + 2, gen_right)
+
+    def _gen_canonical(self, pattern: Union[CanonicalNode, AstLeaf], var: str, indent: int, cont: Callable):
+        # Same checks as _iter_matches
+        if isinstance(pattern, AstConstant):
+            cond = "{0}.is_leaf() and {0}.is_constant()".format(var)
+            if pattern.expected_value is not None:
+                cond += " and {0}.mop.nnn.value == {1}".format(var, pattern.expected_value)
+            self._emit(indent, "if {0}:".format(cond))
+            self._gen_bind(pattern.name, var, indent + 1, cont)
+            return
+        if isinstance(pattern, AstLeaf):
+            ast_var = self._new_var("a")
+            self._emit(indent, "{0} = {1} if {1}.is_leaf() else {1}.ast".format(ast_var, var))
+            self._emit(indent, "if {0} is not None and {0}.mop is not None:".format(ast_var))
+            self._gen_bind(pattern.name, ast_var, indent + 1, cont)
+            return
+        if pattern.opcode == m_neg:
+            neg_operand_var = self._new_var("n")
+            self._emit(indent, "if not {0}.is_leaf():".format(var))
+            self._emit(indent + 1, "for {0} in _get_neg_operand_candidates({1}):".format(neg_operand_var, var))
+            self._gen_canonical(pattern.children[0], neg_operand_var, indent + 2, cont)
+            return
+        self._emit(indent, "if not {0}.is_leaf() and {0}.opcode == {1} and len({0}.children) >= {2}:  # {3}"
+                   .format(var, pattern.opcode, len(pattern.children), opcode_to_string(pattern.opcode)))
+        if pattern.opcode in AC_OPCODES:
+            full_mask_var = self._new_var("f")
+            self._emit(indent + 1, "{0} = (1 << len({1}.children)) - 1".format(full_mask_var, var))
+            self._gen_ac_operands(pattern.children, 0, var, full_mask_var, "0", indent + 1, cont)
+        else:
+            self._gen_ordered_operands(pattern.children, 0, var, indent + 1, cont)
+
+    def _gen_ordered_operands(self, pattern_operands: List, pattern_index: int, var: str, indent: int,
+                              cont: Callable):
+        if pattern_index == len(pattern_operands):
+            cont(indent)
+            return
+        operand_var = self._new_var("n")
+        self._emit(indent, "{0} = {1}.children[{2}]".format(operand_var, var, pattern_index))
+        self._gen_canonical(pattern_operands[pattern_index], operand_var, indent,
+                            lambda next_indent: self._gen_ordered_operands(pattern_operands, pattern_index + 1, var,
+                                                                           next_indent, cont))
+
+    def _gen_ac_operands(self, pattern_operands: List, pattern_index: int, var: str, full_mask_var: str,
+                         used_mask_var: str, indent: int, cont: Callable):
+        if pattern_index == len(pattern_operands):
+            self._emit(indent, "if {0} == {1}:".format(used_mask_var, full_mask_var))
+            cont(indent + 1)
+            return
+        pattern_operand = pattern_operands[pattern_index]
+        if isinstance(pattern_operand, AstConstant):
+            choice_kind = AC_CHOICE_OPERAND
+        elif isinstance(pattern_operand, AstLeaf):
+            choice_kind = AC_CHOICE_LEAF
+        elif pattern_operand.opcode == m_neg:
+            choice_kind = AC_CHOICE_NEG
+        else:
+            choice_kind = AC_CHOICE_OPERAND
+        new_used_mask_var = self._new_var("u")
+        choice_var = self._new_var("n")
+        self._emit(indent, "for {0}, {1} in _iter_ac_choices({2}, {3}, {4}, {5}, {6}):"
+                   .format(new_used_mask_var, choice_var, var, used_mask_var, full_mask_var,
+                           len(pattern_operands) - pattern_index, choice_kind))
+
+        def gen_next_operands(next_indent: int):
+            self._gen_ac_operands(pattern_operands, pattern_index + 1, var, full_mask_var, new_used_mask_var,
+                                  next_indent, cont)
+
+        if choice_kind == AC_CHOICE_LEAF:
+            self._gen_bind(pattern_operand.name, choice_var, indent + 1, gen_next_operands)
+        elif choice_kind == AC_CHOICE_NEG:
+            self._gen_canonical(pattern_operand.children[0], choice_var, indent + 1, gen_next_operands)
+        else:
+            self._gen_canonical(pattern_operand, choice_var, indent + 1, gen_next_operands)
+
+
+class CompiledPattern(object):
+    # Matcher built once from a rule pattern, either for exact (ordered) matching or for matching on the canonical
+    # form of the instruction. match() never modifies the pattern AST: each successful match returns a new AstBinding.
+    # By default, a specialized matcher is generated for the pattern (see PatternCodeGenerator), the generic matchers
+    # are used if generate_code is False or if the generated code can not be compiled.
+    __slots__ = ["pattern", "canonical_pattern", "leaf_names", "source", "match_function"]
+
+    def __init__(self, pattern: Union[AstNode, AstLeaf], use_canonical_form: bool = False,
+                 generate_code: bool = True):
+        self.pattern = pattern
+        self.canonical_pattern = get_canonical_ast(pattern) if use_canonical_form else None
+        self.leaf_names = None
+        self.source = None
+        self.match_function = None
+        if generate_code:
+            self._generate_match_function()
+
+    def _generate_match_function(self):
+        if self.canonical_pattern is not None:
+            code_generator = PatternCodeGenerator(self.canonical_pattern, True)
+        else:
+            code_generator = PatternCodeGenerator(self.pattern, False)
+        try:
+            source = code_generator.generate()
+            namespace = dict(MATCH_FUNCTION_GLOBALS)
+            exec(compile(source, "<pattern {0}>".format(self.pattern), "exec"), namespace)
+        except (SyntaxError, RecursionError) as e:
+            # e.g. too many statically nested blocks for a huge pattern
+            logger.warning("Can't generate matcher for pattern {0}, using generic matcher: {1}"
+                           .format(self.pattern, e))
+            return
+        self.leaf_names = code_generator.leaf_names
+        self.source = source
+        self.match_function = namespace[MATCH_FUNCTION_NAME]
+
+    def get_root_opcodes(self) -> Union[None, List[int]]:
+        # Opcodes of the instructions which may be matched by the pattern (None if the pattern root is a leaf)
+        if self.pattern.is_leaf():
+            return None
+        if self.canonical_pattern is None:
+            return [self.pattern.opcode]
+        if self.canonical_pattern.is_leaf():
+            return None
+        if self.canonical_pattern.opcode in ADD_SUB_OPCODES:
+            # e.g. 'x_0 - x_1' (add(x_0, neg(x_1)) in canonical form) also matches 'a + (-b)'
+            return list(ADD_SUB_OPCODES)
+        return [self.canonical_pattern.opcode]
+
+    def get_min_ast_statistics(self) -> AstStatistics:
+        # Lower bound of the statistics of the AST of the instructions which may be matched by the pattern
+        pattern_statistics = get_ast_statistics(self.pattern)
+        if self.canonical_pattern is None or self.pattern.is_leaf():
+            return pattern_statistics
+        # With the canonical form, 'x_0 + (x_1 + x_2)' matches '(a + b) + c' and '-x_0 + x_1' matches 'b - a', thus
+        # only the number of leafs and of constants of the pattern are lower bounds
+        return AstStatistics(1, 1, pattern_statistics.nb_leafs, pattern_statistics.nb_constants)
+
+    def _get_bound_asts(self, ast: Union[AstNode, AstLeaf],
+                        canonical_ast: Union[None, CanonicalNode, AstLeaf]) \
+            -> Union[None, List[Tuple[str, Union[AstNode, AstLeaf]]]]:
+        if self.canonical_pattern is not None and canonical_ast is None:
+            canonical_ast = get_canonical_ast(ast)
+        if self.match_function is not None:
+            bound_asts = self.match_function(ast if self.canonical_pattern is None else canonical_ast)
+            if bound_asts is None:
+                return None
+            return zip(self.leaf_names, bound_asts)
+        if self.canonical_pattern is None:
+            bindings = match_exact_ast(self.pattern, ast)
+        else:
+            bindings = match_canonical_ast(self.canonical_pattern, canonical_ast)
+        if bindings is None:
+            return None
+        return bindings.items()
+
+    def match(self, ast: Union[AstNode, AstLeaf], canonical_ast: Union[None, CanonicalNode, AstLeaf] = None) \
+            -> Union[None, AstBinding]:
+        bound_asts = self._get_bound_asts(ast, canonical_ast)
+        if bound_asts is None:
+            return None
+        binding = AstBinding(ast.mop, ast.dst_mop, ast.dest_size, ast.ea)
+        for leaf_name, bound_ast in bound_asts:
+            binding.add_leaf(leaf_name, bound_ast.mop)
+        return binding
+
+    def __str__(self):
+        return str(self.pattern)
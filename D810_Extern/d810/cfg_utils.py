@@ -5,6 +5,7 @@ from typing import List, Union, Dict, Tuple
 from d810.errors import ControlFlowException
 from d810.hexrays_helpers import CONDITIONAL_JUMP_OPCODES
 from d810.hexrays_formatters import block_printer
+from d810.microcode_ir import invalidate_decoded_blocks
 
 
 helper_logger = logging.getLogger('D810.helper')
@@ -21,6 +22,7 @@ def log_block_info(blk: mblock_t, logger_func=helper_logger.info):
 
 
 def insert_goto_instruction(blk: mblock_t, goto_blk_serial: int, nop_previous_instruction=False):
+    invalidate_decoded_blocks()
     if blk.tail is not None:
         goto_ins = minsn_t(blk.tail)
     else:
@@ -60,6 +62,7 @@ def change_1way_call_block_successor(call_blk: mblock_t, call_blk_successor_seri
     if previous_call_blk_successor.serial != mba.qty - 1:
         previous_call_blk_successor.mark_lists_dirty()
 
+    invalidate_decoded_blocks()
     mba.mark_chains_dirty()
     try:
         mba.verify(True)
@@ -117,6 +120,7 @@ def change_1way_block_successor(blk: mblock_t, blk_successor_serial: int) -> boo
     if new_blk_successor.serial != mba.qty - 1:
         new_blk_successor.mark_lists_dirty()
 
+    invalidate_decoded_blocks()
     mba.mark_chains_dirty()
     try:
         mba.verify(True)
@@ -154,6 +158,7 @@ def change_0way_block_successor(blk: mblock_t, blk_successor_serial: int) -> boo
     if new_blk_successor.serial != mba.qty - 1:
         new_blk_successor.mark_lists_dirty()
 
+    invalidate_decoded_blocks()
     mba.mark_chains_dirty()
     try:
         mba.verify(True)
@@ -191,6 +196,7 @@ def change_2way_block_conditional_successor(blk: mblock_t, blk_successor_serial:
         new_blk_conditional_successor.mark_lists_dirty()
 
     # Step4: Final stuff and checks
+    invalidate_decoded_blocks()
     mba.mark_chains_dirty()
     try:
         mba.verify(True)
@@ -246,6 +252,7 @@ def make_2way_block_goto(blk: mblock_t, blk_successor_serial: int) -> bool:
     if new_blk_successor.serial != mba.qty - 1:
         new_blk_successor.mark_lists_dirty()
 
+    invalidate_decoded_blocks()
     mba.mark_chains_dirty()
     try:
         mba.verify(True)
@@ -276,6 +283,7 @@ def create_block(blk: mblock_t, blk_ins: List[minsn_t], is_0_way: bool = False)
             prev_succ.mark_lists_dirty()
 
     new_blk.mark_lists_dirty()
+    invalidate_decoded_blocks()
     mba.mark_chains_dirty()
     try:
         mba.verify(True)
@@ -314,6 +322,7 @@ def update_block_successors(blk: mblock_t, blk_succ_serial_list: List[int]):
             new_blk_successor.mark_lists_dirty()
 
     blk.mark_lists_dirty()
+    invalidate_decoded_blocks()
 
 
 def insert_nop_blk(blk: mblock_t) -> mblock_t:
@@ -345,6 +354,7 @@ def insert_nop_blk(blk: mblock_t) -> mblock_t:
     if new_blk_successor.serial != mba.qty - 1:
         new_blk_successor.mark_lists_dirty()
 
+    invalidate_decoded_blocks()
     mba.mark_chains_dirty()
     try:
         mba.verify(True)
@@ -368,6 +378,7 @@ def ensure_last_block_is_goto(mba: mbl_array_t) -> int:
 
 def duplicate_block(block_to_duplicate: mblock_t) -> Tuple[mblock_t, mblock_t]:
     mba = block_to_duplicate.mba
+    invalidate_decoded_blocks()
     duplicated_blk = mba.copy_block(block_to_duplicate, mba.qty - 1)
     helper_logger.debug("  Duplicated {0} -> {1}".format(block_to_duplicate.serial, duplicated_blk.serial))
     duplicated_blk_default = None
@@ -389,6 +400,7 @@ def duplicate_block(block_to_duplicate: mblock_t) -> Tuple[mblock_t, mblock_t]:
 
 def change_block_address(block: mblock_t, new_ea: int):
     # Can be used to fix error 50357
+    invalidate_decoded_blocks()
     mb_curr = block.head
     while mb_curr:
         mb_curr.ea = new_ea
@@ -444,6 +456,7 @@ def mba_deep_cleaning(mba: mbl_array_t, call_mba_combine_block=True) -> int:
         # Doing this optimization before MMAT_CALLS may create blocks with call instruction (not last instruction)
         # IDA does like that and will raise a 50864 error
         return 0
+    invalidate_decoded_blocks()
     if call_mba_combine_block:
         # Ideally we want IDA to simplify the graph for us with combine_blocks
         # However, We observe several crashes when this option is activated
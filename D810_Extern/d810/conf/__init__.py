@@ -1,6 +1,9 @@
 import os
 import json
 
+# Default value of D810Configuration.get when the option must be in the options.json file
+_REQUIRED_OPTION = object()
+
 
 class D810Configuration(object):
     def __init__(self):
@@ -9,9 +12,12 @@ class D810Configuration(object):
         with open(self.config_file, "r") as fp:
             self._options = json.load(fp)
 
-    def get(self, name):
+    def get(self, name, default=_REQUIRED_OPTION):
         if (name == "log_dir") and (self._options[name] is None):
             return os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+        if default is not _REQUIRED_OPTION:
+            # For options added after the options.json file was written
+            return self._options.get(name, default)
         return self._options[name]
 
     def set(self, name, value):
@@ -62,6 +68,8 @@ class ProjectConfiguration(object):
         self.description = project_conf["description"]
         self.ins_rules = [RuleConfiguration.from_dict(x) for x in project_conf["ins_rules"]]
         self.blk_rules = [RuleConfiguration.from_dict(x) for x in project_conf["blk_rules"]]
+        # Optional options of the instruction/block optimizer managers (e.g. max_rewrite_iterations)
+        self.additional_configuration = project_conf.get("additional_configuration", {})
 
     def save(self):
         project_conf = {
@@ -69,5 +77,7 @@ class ProjectConfiguration(object):
             "ins_rules": [x.to_dict() for x in self.ins_rules],
             "blk_rules": [x.to_dict() for x in self.blk_rules],
         }
+        if len(self.additional_configuration) > 0:
+            project_conf["additional_configuration"] = self.additional_configuration
         with open(self.path, "w") as fp:
             json.dump(project_conf, fp, indent=2)
@@ -0,0 +1,433 @@
+from __future__ import annotations
+import time
+import logging
+from typing import List, Union, Dict, Tuple, Callable
+
+from ida_hexrays import *
+
+from d810.ast import AstNode, AstLeaf, AstConstant, AstBinding
+from d810.ast_canonical import AC_OPCODES
+from d810.hexrays_helpers import equal_mops_ignore_size, get_mop_ignore_size_key
+
+logger = logging.getLogger('D810.egraph')
+
+# Equality saturation on the AST of an instruction.
+# An e-graph stores many equivalent expressions at once: an e-class is a set of equivalent e-nodes and an e-node is an
+# opcode applied to e-classes (or a leaf mop). Instead of rewriting the instruction with the first rule which matches
+# (the result then depends on the rule order), every rewrite is applied on every matching term and its result is added
+# to the e-class of the matched term. When no rewrite adds anything (saturation) or when a budget is exhausted, the
+# cheapest term of the instruction e-class is extracted.
+#
+# E-nodes are tuples: (opcode, child class id[, child class id]) for operations and (None, leaf index) for leafs.
+# m_mov nodes are not stored: mov(x) is the e-class of x.
+# The size of an e-node is the size of its e-class: it is part of the hashcons key (e.g. low.1(x) and low.2(x) are
+# different terms) and e-classes of different sizes are never merged.
+DEFAULT_EGRAPH_MAX_NODES = 2000
+DEFAULT_EGRAPH_TIMEOUT_MS = 200
+DEFAULT_EGRAPH_MAX_ITERATIONS = 16
+
+EGRAPH_SATURATED = "saturated"
+EGRAPH_NODE_LIMIT = "node limit"
+EGRAPH_TIME_LIMIT = "time limit"
+EGRAPH_ITERATION_LIMIT = "iteration limit"
+
+COMMUTATIVE_OPCODES = AC_OPCODES
+
+
+class EGraphRewrite(object):
+    # Each match of pattern is checked with check_candidate (same interface as PatternMatchingRule.check_candidate,
+    # which may add constant leafs to the binding) and replacement_pattern is then added to the e-class of the
+    # matched term
+    def __init__(self, name: str, pattern: AstNode, replacement_pattern: AstNode,
+                 check_candidate: Union[None, Callable[[AstBinding], bool]] = None):
+        self.name = name
+        self.pattern = pattern
+        self.replacement_pattern = replacement_pattern
+        self.check_candidate = check_candidate
+        self.constant_names = set([leaf.name for leaf in pattern.get_leaf_list() if isinstance(leaf, AstConstant)])
+
+
+def get_ac_rewrites() -> List[EGraphRewrite]:
+    # Rewrites playing the role of the canonical form used by the pattern matching (see d810.ast_canonical):
+    # commutativity is handled by the e-matching, these rewrites add the other parenthesizations of AC chains
+    # and the 'x - y' <=> 'x + (-y)' equivalence
+    ac_rewrites = []
+    for opcode in AC_OPCODES:
+        ac_rewrites.append(EGraphRewrite("Associativity",
+                                         AstNode(opcode, AstNode(opcode, AstLeaf("x_0"), AstLeaf("x_1")),
+                                                 AstLeaf("x_2")),
+                                         AstNode(opcode, AstLeaf("x_0"), AstNode(opcode, AstLeaf("x_1"),
+                                                                                 AstLeaf("x_2")))))
+    ac_rewrites.append(EGraphRewrite("SubToAddNeg", AstNode(m_sub, AstLeaf("x_0"), AstLeaf("x_1")),
+                                     AstNode(m_add, AstLeaf("x_0"), AstNode(m_neg, AstLeaf("x_1")))))
+    ac_rewrites.append(EGraphRewrite("AddNegToSub", AstNode(m_add, AstLeaf("x_0"), AstNode(m_neg, AstLeaf("x_1"))),
+                                     AstNode(m_sub, AstLeaf("x_0"), AstLeaf("x_1"))))
+    return ac_rewrites
+
+
+class EClass(object):
+    __slots__ = ["nodes", "size", "constant_mop"]
+
+    def __init__(self, nodes: List[Tuple], size: int, constant_mop: Union[None, mop_t] = None):
+        self.nodes = nodes
+        self.size = size
+        # Set if one of the e-nodes is a constant leaf, used to match the AstConstant of the patterns
+        self.constant_mop = constant_mop
+
+
+class EGraphStatistics(object):
+    def __init__(self):
+        self.nb_runs = 0
+        self.nb_improved = 0
+        self.nb_stops = {}
+        self.nb_iterations = 0
+        self.nb_rewrites = 0
+        self.nb_nodes = 0
+        self.max_nb_nodes = 0
+        self.total_time = 0.0
+
+    def reset(self):
+        self.__init__()
+
+    def record(self, egraph: EGraph, stop_reason: str, is_improved: bool):
+        self.nb_runs += 1
+        self.nb_improved += int(is_improved)
+        self.nb_stops[stop_reason] = self.nb_stops.get(stop_reason, 0) + 1
+        self.nb_iterations += egraph.nb_iterations
+        self.nb_rewrites += egraph.nb_rewrites
+        self.nb_nodes += egraph.nb_nodes
+        self.max_nb_nodes = max(self.max_nb_nodes, egraph.nb_nodes)
+        self.total_time += egraph.elapsed_time
+
+    def __str__(self):
+        stops = ", ".join(["{0} {1}".format(nb_stops, stop_reason) for stop_reason, nb_stops in self.nb_stops.items()])
+        return "{0} runs in {1:.3f}s, {2} improved ({3}), {4} iterations, {5} rewrites, {6:.1f} nodes on average " \
+               "(max {7})".format(self.nb_runs, self.total_time, self.nb_improved, stops, self.nb_iterations,
+                                  self.nb_rewrites, self.nb_nodes / max(self.nb_runs, 1), self.max_nb_nodes)
+
+
+class EGraph(object):
+    def __init__(self, ea: int = 0):
+        self.ea = ea
+        # Union-find over the e-class ids: only the root ids are keys of classes
+        self.parents = []
+        self.classes = {}
+        self.hashcons = {}
+        self.leaf_mops = []
+        self.leaf_indexes_by_key = {}
+        self.nb_nodes = 0
+        self.nb_iterations = 0
+        self.nb_rewrites = 0
+        self.elapsed_time = 0.0
+        # Modification counter: saturation is reached when an iteration does not change it
+        self.version = 0
+        # Cheapest e-node and its cost (nb_opcodes, depth) for each e-class, see compute_costs
+        self.costs = {}
+        self.best_nodes = {}
+        self._class_mops = {}
+
+    def find(self, class_id: int) -> int:
+        root_id = class_id
+        while self.parents[root_id] != root_id:
+            root_id = self.parents[root_id]
+        while self.parents[class_id] != root_id:
+            self.parents[class_id], class_id = root_id, self.parents[class_id]
+        return root_id
+
+    def _canonicalize(self, enode: Tuple) -> Tuple:
+        if enode[0] is None:
+            return enode
+        return (enode[0],) + tuple([self.find(child_id) for child_id in enode[1:]])
+
+    @staticmethod
+    def _get_hashcons_key(enode: Tuple, size: int) -> Tuple:
+        return (enode[0], size) + enode[1:]
+
+    def add_enode(self, enode: Tuple, size: int, constant_mop: Union[None, mop_t] = None) -> int:
+        enode = self._canonicalize(enode)
+        hashcons_key = self._get_hashcons_key(enode, size)
+        class_id = self.hashcons.get(hashcons_key)
+        if class_id is not None:
+            return self.find(class_id)
+        class_id = len(self.parents)
+        self.parents.append(class_id)
+        self.classes[class_id] = EClass([enode], size, constant_mop)
+        self.hashcons[hashcons_key] = class_id
+        self.nb_nodes += 1
+        self.version += 1
+        return class_id
+
+    def add_mop_leaf(self, mop: mop_t) -> int:
+        same_key_leaf_indexes = self.leaf_indexes_by_key.setdefault(get_mop_ignore_size_key(mop), [])
+        for leaf_index in same_key_leaf_indexes:
+            leaf_mop = self.leaf_mops[leaf_index]
+            if leaf_mop.size == mop.size and equal_mops_ignore_size(leaf_mop, mop):
+                return self.find(self.hashcons[self._get_hashcons_key((None, leaf_index), mop.size)])
+        leaf_index = len(self.leaf_mops)
+        self.leaf_mops.append(mop)
+        same_key_leaf_indexes.append(leaf_index)
+        return self.add_enode((None, leaf_index), mop.size, mop if mop.t == mop_n else None)
+
+    def add_ast(self, ast: Union[AstNode, AstLeaf]) -> int:
+        if ast.is_leaf():
+            return self.add_mop_leaf(ast.mop)
+        if ast.opcode == m_mov:
+            return self.add_ast(ast.left)
+        left_id = self.add_ast(ast.left)
+        if ast.right is None or (ast.right.is_leaf() and ast.right.mop.t == mop_z):
+            return self.add_enode((ast.opcode, left_id), ast.dest_size)
+        return self.add_enode((ast.opcode, left_id, self.add_ast(ast.right)), ast.dest_size)
+
+    def union(self, class_id1: int, class_id2: int) -> bool:
+        class_id1 = self.find(class_id1)
+        class_id2 = self.find(class_id2)
+        if class_id1 == class_id2:
+            return False
+        if self.classes[class_id1].size != self.classes[class_id2].size:
+            # e.g. a rewrite replacing a term by one of its leafs with another size: the terms are not equal
+            logger.debug("Not merging e-classes of sizes {0} and {1}"
+                         .format(self.classes[class_id1].size, self.classes[class_id2].size))
+            return False
+        if len(self.classes[class_id1].nodes) < len(self.classes[class_id2].nodes):
+            class_id1, class_id2 = class_id2, class_id1
+        merged_class = self.classes.pop(class_id2)
+        self.parents[class_id2] = class_id1
+        root_class = self.classes[class_id1]
+        root_class.nodes += merged_class.nodes
+        if root_class.constant_mop is None:
+            root_class.constant_mop = merged_class.constant_mop
+        self.version += 1
+        return True
+
+    def rebuild(self):
+        # Restores the congruence invariant after unions: e-nodes are canonicalized and two e-classes containing the
+        # same e-node are merged, until a fixpoint is reached
+        is_merged = True
+        while is_merged:
+            is_merged = False
+            new_hashcons = {}
+            for class_id in list(self.classes.keys()):
+                if class_id not in self.classes:
+                    continue
+                eclass = self.classes[class_id]
+                eclass.nodes = list(dict.fromkeys([self._canonicalize(enode) for enode in eclass.nodes]))
+                for enode in eclass.nodes:
+                    hashcons_key = self._get_hashcons_key(enode, eclass.size)
+                    other_class_id = new_hashcons.get(hashcons_key)
+                    if other_class_id is None:
+                        new_hashcons[hashcons_key] = class_id
+                    elif self.union(other_class_id, class_id):
+                        is_merged = True
+            self.hashcons = new_hashcons
+
+    def _get_enode_cost(self, enode: Tuple) -> Union[None, Tuple[int, int]]:
+        # Cost model: number of opcodes of the term, then its depth (same definitions as AstStatistics)
+        if enode[0] is None:
+            return 0, 0
+        nb_opcodes = 1
+        depth = 0
+        for child_id in enode[1:]:
+            child_cost = self.costs.get(child_id)
+            if child_cost is None:
+                return None
+            nb_opcodes += child_cost[0]
+            depth = max(depth, child_cost[1])
+        return nb_opcodes, depth + 1
+
+    def compute_costs(self):
+        # Must be called on a rebuilt e-graph. The cost of an e-node is strictly greater than the cost of its
+        # children, thus following the best e-nodes from any e-class never loops.
+        self.costs = {}
+        self.best_nodes = {}
+        self._class_mops = {}
+        is_modified = True
+        while is_modified:
+            is_modified = False
+            for class_id, eclass in self.classes.items():
+                for enode in eclass.nodes:
+                    enode_cost = self._get_enode_cost(enode)
+                    if enode_cost is None:
+                        continue
+                    class_cost = self.costs.get(class_id)
+                    if class_cost is None or enode_cost < class_cost:
+                        self.costs[class_id] = enode_cost
+                        self.best_nodes[class_id] = enode
+                        is_modified = True
+
+    def get_cost(self, class_id: int) -> Tuple[int, int]:
+        return self.costs[self.find(class_id)]
+
+    def _create_enode_mop(self, enode: Tuple, size: int) -> mop_t:
+        if enode[0] is None:
+            return self.leaf_mops[enode[1]]
+        new_ins = minsn_t(self.ea)
+        new_ins.opcode = enode[0]
+        new_ins.l = self.get_class_mop(enode[1])
+        if len(enode) > 2:
+            new_ins.r = self.get_class_mop(enode[2])
+        new_ins.d.size = size
+        new_mop = mop_t()
+        new_mop.create_from_insn(new_ins)
+        return new_mop
+
+    def get_class_mop(self, class_id: int) -> mop_t:
+        # Mop of the cheapest term of the e-class (valid until the next call to compute_costs)
+        class_id = self.find(class_id)
+        class_mop = self._class_mops.get(class_id)
+        if class_mop is None:
+            class_mop = self._create_enode_mop(self.best_nodes[class_id], self.classes[class_id].size)
+            self._class_mops[class_id] = class_mop
+        return class_mop
+
+    def create_minsn(self, class_id: int, dest: mop_t) -> minsn_t:
+        class_id = self.find(class_id)
+        best_node = self.best_nodes[class_id]
+        new_ins = minsn_t(self.ea)
+        if best_node[0] is None:
+            new_ins.opcode = m_mov
+            new_ins.l = self.leaf_mops[best_node[1]]
+        else:
+            new_ins.opcode = best_node[0]
+            new_ins.l = self.get_class_mop(best_node[1])
+            if len(best_node) > 2:
+                new_ins.r = self.get_class_mop(best_node[2])
+        new_ins.d = dest
+        return new_ins
+
+    def _bind(self, name: str, class_id: int, subst: Dict[str, int]):
+        bound_class_id = subst.get(name)
+        if bound_class_id is None:
+            subst[name] = class_id
+            yield
+            del subst[name]
+        elif bound_class_id == class_id:
+            yield
+
+    def _iter_matches(self, pattern: Union[AstNode, AstLeaf], class_id: int, subst: Dict[str, int]):
+        # E-matching: yields each time subst is a valid assignment of the pattern leafs to e-classes
+        if isinstance(pattern, AstConstant):
+            constant_mop = self.classes[class_id].constant_mop
+            if constant_mop is None:
+                return
+            if pattern.expected_value is not None and constant_mop.nnn.value != pattern.expected_value:
+                return
+            yield from self._bind(pattern.name, class_id, subst)
+            return
+        if pattern.is_leaf():
+            yield from self._bind(pattern.name, class_id, subst)
+            return
+        for enode in self.classes[class_id].nodes:
+            if enode[0] != pattern.opcode:
+                continue
+            if pattern.right is None:
+                if len(enode) == 2:
+                    yield from self._iter_matches(pattern.left, enode[1], subst)
+                continue
+            if len(enode) != 3:
+                continue
+            operand_orders = [(enode[1], enode[2])]
+            if pattern.opcode in COMMUTATIVE_OPCODES and enode[1] != enode[2]:
+                operand_orders.append((enode[2], enode[1]))
+            for left_id, right_id in operand_orders:
+                for _ in self._iter_matches(pattern.left, left_id, subst):
+                    yield from self._iter_matches(pattern.right, right_id, subst)
+
+    def _create_binding(self, rewrite: EGraphRewrite, class_id: int, subst: Dict[str, int]) -> AstBinding:
+        # The binding is built from the cheapest term of each e-class, so that the checks of the rules can
+        # inspect the mops as they do during the pattern matching
+        # (binding.mop is built from an e-node with the pattern root opcode, so that candidate.size is available)
+        size = self.classes[class_id].size
+        binding = AstBinding(None, None, size, self.ea)
+        for enode in self.classes[class_id].nodes:
+            if enode[0] == rewrite.pattern.opcode:
+                binding.mop = self._create_enode_mop(enode, size)
+                break
+        for leaf_name, leaf_class_id in subst.items():
+            if leaf_name in rewrite.constant_names:
+                binding.add_leaf(leaf_name, self.classes[leaf_class_id].constant_mop)
+            else:
+                binding.add_leaf(leaf_name, self.get_class_mop(leaf_class_id))
+        return binding
+
+    def _add_replacement(self, replacement: Union[AstNode, AstLeaf], subst: Dict[str, int],
+                         binding: Union[None, AstBinding], size: Union[None, int]) -> Union[None, int]:
+        if replacement.is_leaf():
+            if replacement.name in subst:
+                return subst[replacement.name]
+            if binding is None or replacement.name not in binding.leafs_by_name:
+                return None
+            return self.add_mop_leaf(binding[replacement.name].mop)
+        if replacement.opcode == m_mov:
+            return self._add_replacement(replacement.left, subst, binding, size)
+        left_id = self._add_replacement(replacement.left, subst, binding, None)
+        if left_id is None:
+            return None
+        if size is None:
+            # Same convention as AstNode.create_minsn: the result has the size of the left operand
+            size = self.classes[self.find(left_id)].size
+        if replacement.right is None:
+            return self.add_enode((replacement.opcode, left_id), size)
+        right_id = self._add_replacement(replacement.right, subst, binding, None)
+        if right_id is None:
+            return None
+        return self.add_enode((replacement.opcode, left_id, right_id), size)
+
+    def saturate(self, rewrites: List[EGraphRewrite], max_nodes: int = DEFAULT_EGRAPH_MAX_NODES,
+                 timeout_ms: int = DEFAULT_EGRAPH_TIMEOUT_MS,
+                 max_iterations: int = DEFAULT_EGRAPH_MAX_ITERATIONS) -> str:
+        # Returns the reason why the saturation stopped, the costs are up to date when this function returns
+        start_time = time.perf_counter()
+        deadline = start_time + timeout_ms / 1000.0
+        stop_reason = EGRAPH_ITERATION_LIMIT
+        rewrites_by_opcode = {}
+        for rewrite in rewrites:
+            rewrites_by_opcode.setdefault(rewrite.pattern.opcode, []).append(rewrite)
+        self.rebuild()
+        self.compute_costs()
+        while self.nb_iterations < max_iterations:
+            self.nb_iterations += 1
+            start_version = self.version
+            # All the matches are searched (and checked) on the e-graph of the previous iteration, then applied
+            matches = []
+            for class_id, eclass in list(self.classes.items()):
+                class_opcodes = set([enode[0] for enode in eclass.nodes])
+                for opcode in class_opcodes:
+                    for rewrite in rewrites_by_opcode.get(opcode, []):
+                        match_subst = {}
+                        for _ in self._iter_matches(rewrite.pattern, class_id, match_subst):
+                            subst = dict(match_subst)
+                            binding = None
+                            if rewrite.check_candidate is not None:
+                                binding = self._create_binding(rewrite, class_id, subst)
+                                if not rewrite.check_candidate(binding):
+                                    continue
+                            matches.append((rewrite, class_id, subst, binding))
+                if time.perf_counter() > deadline:
+                    stop_reason = EGRAPH_TIME_LIMIT
+                    break
+            for rewrite, class_id, subst, binding in matches:
+                new_class_id = self._add_replacement(rewrite.replacement_pattern, subst, binding,
+                                                     self.classes[self.find(class_id)].size)
+                if new_class_id is not None and self.union(class_id, new_class_id):
+                    self.nb_rewrites += 1
+                if self.nb_nodes >= max_nodes:
+                    stop_reason = EGRAPH_NODE_LIMIT
+                    break
+                if time.perf_counter() > deadline:
+                    stop_reason = EGRAPH_TIME_LIMIT
+                    break
+            self.rebuild()
+            self.compute_costs()
+            if stop_reason != EGRAPH_ITERATION_LIMIT:
+                break
+            if self.version == start_version:
+                stop_reason = EGRAPH_SATURATED
+                break
+            if time.perf_counter() > deadline:
+                stop_reason = EGRAPH_TIME_LIMIT
+                break
+        self.elapsed_time = time.perf_counter() - start_time
+        logger.debug("E-graph {0} after {1} iterations: {2} nodes, {3} classes, {4} rewrites in {5:.3f}s"
+                     .format(stop_reason, self.nb_iterations, self.nb_nodes, len(self.classes), self.nb_rewrites,
+                             self.elapsed_time))
+        return stop_reason
@@ -1,19 +1,36 @@
 from __future__ import annotations
 import logging
-from typing import List, Union, Dict
+from typing import List, Union
 from idaapi import getseg, get_qword, SEGPERM_WRITE
 from ida_hexrays import *
 
 from d810.utils import unsigned_to_signed, signed_to_unsigned, get_add_cf, get_add_of, get_sub_of, ror, get_parity_flag
-from d810.hexrays_helpers import equal_mops_ignore_size, get_mop_index, AND_TABLE, CONTROL_FLOW_OPCODES, \
-    CONDITIONAL_JUMP_OPCODES
+from d810.hexrays_helpers import equal_mops_ignore_size, get_mop_ignore_size_key, AND_TABLE
 from d810.hexrays_formatters import format_minsn_t, format_mop_t, mop_type_to_string, opcode_to_string
 from d810.cfg_utils import get_block_serials_by_address
+from d810.microcode_ir import DecodedMop, DecodedInstruction, decoded_block_cache, ENVIRONMENT_MOP_TYPES, \
+    INS_KIND_CONTROL_FLOW, INS_KIND_HELPER_CALL, INS_KIND_OTHER
 from d810.errors import EmulationException, EmulationIndirectJumpException, UnresolvedMopException, \
     WritableMemoryReadException
 
 emulator_log = logging.getLogger('D810.emulator')
 
+# Mop types for which get_mop_ignore_size_key(lo) == get_mop_ignore_size_key(ro) implies equal_mops_ignore_size(lo, ro)
+EXACT_KEY_MOP_TYPES = [mop_r, mop_S, mop_n, mop_b]
+
+
+def format_any_mop(mop: Union[mop_t, DecodedMop]) -> str:
+    return format_mop_t(mop.mop if isinstance(mop, DecodedMop) else mop)
+
+
+def get_setxx_handler(condition):
+    # Handler of a setXX instruction from the condition of the corresponding conditional jump
+    def eval_setxx(interpreter: MicroCodeInterpreter, ins: DecodedInstruction, environment: MicroCodeEnvironment,
+                   res_mask: int) -> int:
+        res = 1 if condition(interpreter, ins, environment) else 0
+        return res & res_mask
+    return eval_setxx
+
 
 class MicroCodeInterpreter(object):
     def __init__(self, global_environment=None):
@@ -21,209 +38,216 @@ class MicroCodeInterpreter(object):
 
     def _eval_instruction_and_update_environment(self, blk: mblock_t, ins: minsn_t, environment: MicroCodeEnvironment) -> Union[None, int]:
         environment.set_cur_flow(blk, ins)
-        res = self._eval_instruction(ins, environment)
+        decoded_ins = decoded_block_cache.get_instruction(blk, ins)
+        res = self._eval_instruction(decoded_ins, environment)
         if res is not None:
-            if (ins.d is not None) and ins.d.t != mop_z:
-                environment.assign(ins.d, res, auto_define=True)
+            if decoded_ins.d.t != mop_z:
+                environment.assign(decoded_ins.d, res, auto_define=True)
         return res
 
-    def _eval_instruction(self, ins: minsn_t, environment: MicroCodeEnvironment) -> Union[None, int]:
+    # The methods below work on the decoded microcode (DecodedInstruction and DecodedMop, see microcode_ir), the
+    # original minsn_t and mop_t (ins.ins and mop.mop) are only used for logging
+    def _eval_instruction(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> Union[None, int]:
         if ins is None:
             return None
-        is_flow_instruction = self._eval_control_flow_instruction(ins, environment)
-        if is_flow_instruction:
+        # The kind of the instruction is computed when it is decoded, and the other instructions are evaluated with
+        # the handler of their opcode (see OPCODE_HANDLERS)
+        ins_kind = ins.kind
+        if ins_kind == INS_KIND_OTHER:
+            res_mask = AND_TABLE[ins.d.size]
+            opcode_handler = self.OPCODE_HANDLERS.get(ins.opcode)
+            if opcode_handler is not None:
+                return opcode_handler(self, ins, environment, res_mask)
+        elif ins_kind == INS_KIND_CONTROL_FLOW:
+            self._eval_control_flow_instruction(ins, environment)
             return None
-        call_helper_res = self._eval_call_helper(ins, environment)
-        if call_helper_res is not None:
-            return call_helper_res
-        if ins.opcode == m_call:
+        elif ins_kind == INS_KIND_HELPER_CALL:
+            call_helper_res = self._eval_call_helper(ins, environment)
+            if call_helper_res is not None:
+                return call_helper_res
             return self._eval_call(ins, environment)
-        elif ins.opcode == m_icall:
+        else:
             return self._eval_call(ins, environment)
-        res_mask = AND_TABLE[ins.d.size]
-        if ins.opcode == m_ldx:
-            return self._eval_load(ins, environment)
-        elif ins.opcode == m_stx:
-            return self._eval_store(ins, environment)
-        elif ins.opcode == m_mov:
-            return (self.eval(ins.l, environment)) & res_mask
-        elif ins.opcode == m_neg:
-            return (- self.eval(ins.l, environment)) & res_mask
-        elif ins.opcode == m_lnot:
-            return self.eval(ins.l, environment) != 0
-        elif ins.opcode == m_bnot:
-            return (self.eval(ins.l, environment) ^ res_mask) & res_mask
-        elif ins.opcode == m_xds:
-            left_value_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            return signed_to_unsigned(left_value_signed, ins.d.size) & res_mask
-        elif ins.opcode == m_xdu:
-            return (self.eval(ins.l, environment)) & res_mask
-        elif ins.opcode == m_low:
-            return (self.eval(ins.l, environment)) & res_mask
-        elif ins.opcode == m_add:
-            return (self.eval(ins.l, environment) + self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_sub:
-            return (self.eval(ins.l, environment) - self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_mul:
-            return (self.eval(ins.l, environment) * self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_udiv:
-            return (self.eval(ins.l, environment) // self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_sdiv:
-            return (self.eval(ins.l, environment) // self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_umod:
-            return (self.eval(ins.l, environment) % self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_smod:
-            return (self.eval(ins.l, environment) % self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_or:
-            return (self.eval(ins.l, environment) | self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_and:
-            return (self.eval(ins.l, environment) & self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_xor:
-            return (self.eval(ins.l, environment) ^ self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_shl:
-            return (self.eval(ins.l, environment) << self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_shr:
-            return (self.eval(ins.l, environment) >> self.eval(ins.r, environment)) & res_mask
-        elif ins.opcode == m_sar:
-            res_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size) >> self.eval(ins.r, environment)
-            return signed_to_unsigned(res_signed, ins.d.size) & res_mask
-        elif ins.opcode == m_cfadd:
-            tmp = get_add_cf(self.eval(ins.l, environment), self.eval(ins.r, environment), ins.l.size)
-            return tmp & res_mask
-        elif ins.opcode == m_ofadd:
-            tmp = get_add_of(self.eval(ins.l, environment), self.eval(ins.r, environment), ins.l.size)
-            return tmp & res_mask
-        elif ins.opcode == m_sets:
-            left_value_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            res = 1 if left_value_signed < 0 else 0
-            return res & res_mask
-        elif ins.opcode == m_seto:
-            left_value_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            right_value_signed = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
-            sub_overflow = get_sub_of(left_value_signed, right_value_signed, ins.l.size)
-            return sub_overflow & res_mask
-        elif ins.opcode == m_setnz:
-            res = 1 if self.eval(ins.l, environment) != self.eval(ins.r, environment) else 0
-            return res & res_mask
-        elif ins.opcode == m_setz:
-            res = 1 if self.eval(ins.l, environment) == self.eval(ins.r, environment) else 0
-            return res & res_mask
-        elif ins.opcode == m_setae:
-            res = 1 if self.eval(ins.l, environment) >= self.eval(ins.r, environment) else 0
-            return res & res_mask
-        elif ins.opcode == m_setb:
-            res = 1 if self.eval(ins.l, environment) < self.eval(ins.r, environment) else 0
-            return res & res_mask
-        elif ins.opcode == m_seta:
-            res = 1 if self.eval(ins.l, environment) > self.eval(ins.r, environment) else 0
-            return res & res_mask
-        elif ins.opcode == m_setbe:
-            res = 1 if self.eval(ins.l, environment) <= self.eval(ins.r, environment) else 0
-            return res & res_mask
-        elif ins.opcode == m_setg:
-            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
-            res = 1 if left_value > right_value else 0
-            return res & res_mask
-        elif ins.opcode == m_setge:
-            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
-            res = 1 if left_value >= right_value else 0
-            return res & res_mask
-        elif ins.opcode == m_setl:
-            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
-            res = 1 if left_value < right_value else 0
-            return res & res_mask
-        elif ins.opcode == m_setle:
-            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
-            res = 1 if left_value <= right_value else 0
-            return res & res_mask
-        elif ins.opcode == m_setp:
-            res = get_parity_flag(self.eval(ins.l, environment), self.eval(ins.r, environment), ins.l.size)
-            return res & res_mask
         raise EmulationException("Unsupported instruction opcode '{0}': '{1}'"
-                                 .format(opcode_to_string(ins.opcode), format_minsn_t(ins)))
+                                 .format(opcode_to_string(ins.opcode), format_minsn_t(ins.ins)))
+
+    def _eval_ldx(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> Union[None, int]:
+        return self._eval_load(ins, environment)
+
+    def _eval_stx(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> Union[None, int]:
+        return self._eval_store(ins, environment)
+
+    def _eval_mov(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment)) & res_mask
+
+    def _eval_neg(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (- self.eval(ins.l, environment)) & res_mask
+
+    def _eval_lnot(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> bool:
+        return self.eval(ins.l, environment) != 0
+
+    def _eval_bnot(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) ^ res_mask) & res_mask
+
+    def _eval_xds(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        left_value_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+        return signed_to_unsigned(left_value_signed, ins.d.size) & res_mask
+
+    def _eval_add(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) + self.eval(ins.r, environment)) & res_mask
+
+    def _eval_sub(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) - self.eval(ins.r, environment)) & res_mask
+
+    def _eval_mul(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) * self.eval(ins.r, environment)) & res_mask
+
+    def _eval_div(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) // self.eval(ins.r, environment)) & res_mask
+
+    def _eval_mod(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) % self.eval(ins.r, environment)) & res_mask
+
+    def _eval_or(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) | self.eval(ins.r, environment)) & res_mask
+
+    def _eval_and(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) & self.eval(ins.r, environment)) & res_mask
+
+    def _eval_xor(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) ^ self.eval(ins.r, environment)) & res_mask
+
+    def _eval_shl(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) << self.eval(ins.r, environment)) & res_mask
+
+    def _eval_shr(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        return (self.eval(ins.l, environment) >> self.eval(ins.r, environment)) & res_mask
+
+    def _eval_sar(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        res_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size) >> self.eval(ins.r, environment)
+        return signed_to_unsigned(res_signed, ins.d.size) & res_mask
+
+    def _eval_cfadd(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        tmp = get_add_cf(self.eval(ins.l, environment), self.eval(ins.r, environment), ins.l.size)
+        return tmp & res_mask
+
+    def _eval_ofadd(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        tmp = get_add_of(self.eval(ins.l, environment), self.eval(ins.r, environment), ins.l.size)
+        return tmp & res_mask
+
+    def _eval_sets(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        left_value_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+        res = 1 if left_value_signed < 0 else 0
+        return res & res_mask
+
+    def _eval_seto(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        left_value_signed = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+        right_value_signed = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+        sub_overflow = get_sub_of(left_value_signed, right_value_signed, ins.l.size)
+        return sub_overflow & res_mask
+
+    def _eval_setp(self, ins: DecodedInstruction, environment: MicroCodeEnvironment, res_mask: int) -> int:
+        res = get_parity_flag(self.eval(ins.l, environment), self.eval(ins.r, environment), ins.l.size)
+        return res & res_mask
+
+    # The setXX instructions and the conditional jumps share the same comparisons
+    def _is_nz(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        return self.eval(ins.l, environment) != self.eval(ins.r, environment)
+
+    def _is_z(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        return self.eval(ins.l, environment) == self.eval(ins.r, environment)
+
+    def _is_ae(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        return self.eval(ins.l, environment) >= self.eval(ins.r, environment)
+
+    def _is_b(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        return self.eval(ins.l, environment) < self.eval(ins.r, environment)
+
+    def _is_a(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        return self.eval(ins.l, environment) > self.eval(ins.r, environment)
+
+    def _is_be(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        return self.eval(ins.l, environment) <= self.eval(ins.r, environment)
+
+    def _is_g(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+        right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+        return left_value > right_value
+
+    def _is_ge(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+        right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+        return left_value >= right_value
+
+    def _is_l(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+        right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+        return left_value < right_value
+
+    def _is_le(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
+        right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
+        return left_value <= right_value
+
+    def _is_cnd(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> bool:
+        return self.eval(ins.l, environment) != 0
+
+    # opcode -> handler(interpreter, ins, environment, res_mask) for the instructions of kind INS_KIND_OTHER
+    OPCODE_HANDLERS = {
+        m_ldx: _eval_ldx, m_stx: _eval_stx,
+        m_mov: _eval_mov, m_neg: _eval_neg, m_lnot: _eval_lnot, m_bnot: _eval_bnot,
+        m_xds: _eval_xds, m_xdu: _eval_mov, m_low: _eval_mov,
+        m_add: _eval_add, m_sub: _eval_sub, m_mul: _eval_mul,
+        m_udiv: _eval_div, m_sdiv: _eval_div, m_umod: _eval_mod, m_smod: _eval_mod,
+        m_or: _eval_or, m_and: _eval_and, m_xor: _eval_xor,
+        m_shl: _eval_shl, m_shr: _eval_shr, m_sar: _eval_sar,
+        m_cfadd: _eval_cfadd, m_ofadd: _eval_ofadd,
+        m_sets: _eval_sets, m_seto: _eval_seto, m_setp: _eval_setp,
+        m_setnz: get_setxx_handler(_is_nz), m_setz: get_setxx_handler(_is_z),
+        m_setae: get_setxx_handler(_is_ae), m_setb: get_setxx_handler(_is_b),
+        m_seta: get_setxx_handler(_is_a), m_setbe: get_setxx_handler(_is_be),
+        m_setg: get_setxx_handler(_is_g), m_setge: get_setxx_handler(_is_ge),
+        m_setl: get_setxx_handler(_is_l), m_setle: get_setxx_handler(_is_le),
+    }
+
+    # conditional jump opcode -> condition(interpreter, ins, environment) (m_jtbl is not handled the same way)
+    JUMP_CONDITIONS = {
+        m_jcnd: _is_cnd, m_jnz: _is_nz, m_jz: _is_z, m_jae: _is_ae, m_jb: _is_b, m_ja: _is_a, m_jbe: _is_be,
+        m_jg: _is_g, m_jge: _is_ge, m_jl: _is_l, m_jle: _is_le,
+    }
 
     @staticmethod
-    def _get_blk_serial(mop: mop_t) -> int:
+    def _get_blk_serial(mop: DecodedMop) -> int:
         if mop.t == mop_b:
             return mop.b
         raise EmulationException("Get block serial with an unsupported mop type '{0}': '{1}'"
-                                 .format(mop_type_to_string(mop.t), format_mop_t(mop)))
+                                 .format(mop_type_to_string(mop.t), format_mop_t(mop.mop)))
 
-    def _eval_conditional_jump(self, ins: minsn_t, environment: MicroCodeEnvironment) -> Union[None, int]:
-        if ins.opcode not in CONDITIONAL_JUMP_OPCODES:
-            return None
-        if ins.opcode == m_jtbl:
-            # This is not handled the same way
-            return None
-        cur_blk = environment.cur_blk
-        direct_child_serial = cur_blk.serial + 1
-        if ins.opcode == m_jcnd:
-            jump_taken = self.eval(ins.l, environment) != 0
-        elif ins.opcode == m_jnz:
-            jump_taken = self.eval(ins.l, environment) != self.eval(ins.r, environment)
-        elif ins.opcode == m_jz:
-            jump_taken = self.eval(ins.l, environment) == self.eval(ins.r, environment)
-        elif ins.opcode == m_jae:
-            jump_taken = self.eval(ins.l, environment) >= self.eval(ins.r, environment)
-        elif ins.opcode == m_jb:
-            jump_taken = self.eval(ins.l, environment) < self.eval(ins.r, environment)
-        elif ins.opcode == m_ja:
-            jump_taken = self.eval(ins.l, environment) > self.eval(ins.r, environment)
-        elif ins.opcode == m_jbe:
-            jump_taken = self.eval(ins.l, environment) <= self.eval(ins.r, environment)
-        elif ins.opcode == m_jg:
-            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
-            jump_taken = left_value > right_value
-        elif ins.opcode == m_jge:
-            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
-            jump_taken = left_value >= right_value
-        elif ins.opcode == m_jl:
-            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
-            jump_taken = left_value < right_value
-        elif ins.opcode == m_jle:
-            left_value = unsigned_to_signed(self.eval(ins.l, environment), ins.l.size)
-            right_value = unsigned_to_signed(self.eval(ins.r, environment), ins.r.size)
-            jump_taken = left_value <= right_value
-        else:
-            # This should never happen
-            raise EmulationException("Unhandled conditional jump:  '{0}'".format(format_minsn_t(ins)))
-        return self._get_blk_serial(ins.d) if jump_taken else direct_child_serial
-
-    def _eval_control_flow_instruction(self, ins: minsn_t, environment: MicroCodeEnvironment) -> bool:
-        if ins.opcode not in CONTROL_FLOW_OPCODES:
-            return False
+    def _eval_control_flow_instruction(self, ins: DecodedInstruction, environment: MicroCodeEnvironment):
         cur_blk = environment.cur_blk
         if cur_blk is None:
             raise EmulationException("Can't evaluate control flow instruction with null block:  '{0}'"
-                                     .format(format_minsn_t(ins)))
-
-        next_blk_serial = self._eval_conditional_jump(ins, environment)
-        if next_blk_serial is not None:
-            next_blk = cur_blk.mba.get_mblock(next_blk_serial)
-            next_ins = next_blk.head
-            environment.set_next_flow(next_blk, next_ins)
-            return True
+                                     .format(format_minsn_t(ins.ins)))
 
-        if ins.opcode == m_goto:
+        jump_condition = self.JUMP_CONDITIONS.get(ins.opcode)
+        if jump_condition is not None:
+            if jump_condition(self, ins, environment):
+                next_blk_serial = self._get_blk_serial(ins.d)
+            else:
+                next_blk_serial = cur_blk.serial + 1
+        elif ins.opcode == m_goto:
             next_blk_serial = self._get_blk_serial(ins.l)
         elif ins.opcode == m_jtbl:
             left_value = self.eval(ins.l, environment)
-            cases = ins.r.c
+            cases = ins.r.cases
             # Initialize to default case
-            next_blk_serial = [x for x in cases.targets][-1]
-            for possible_values, target_block_serial in zip(cases.values, cases.targets):
+            next_blk_serial = cases[-1][1]
+            for possible_values, target_block_serial in cases:
                 for test_value in possible_values:
                     if left_value == test_value:
                         next_blk_serial = target_block_serial
                         break
-        elif ins.opcode == m_ijmp:
+        else:
             ijmp_dest_ea = self.eval(ins.d, environment)
             dest_block_serials = get_block_serials_by_address(environment.cur_blk.mba, ijmp_dest_ea)
             if len(dest_block_serials) == 0:
@@ -236,17 +260,12 @@ class MicroCodeInterpreter(object):
                                                      ijmp_dest_ea, dest_block_serials)
             next_blk_serial = dest_block_serials[0]
 
-        if next_blk_serial is None:
-            return False
         next_blk = cur_blk.mba.get_mblock(next_blk_serial)
         next_ins = next_blk.head
         environment.set_next_flow(next_blk, next_ins)
-        return True
 
-    def _eval_call_helper(self, ins: minsn_t, environment: MicroCodeEnvironment) -> Union[None, int]:
+    def _eval_call_helper(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> Union[None, int]:
         # Currently, we only support helper calls, (but end goal is to allow to hook calls)
-        if ins.opcode != m_call or ins.l.t != mop_h:
-            return None
         res_mask = AND_TABLE[ins.d.size]
         helper_name = ins.l.helper
         args_list = ins.d
@@ -254,18 +273,18 @@ class MicroCodeInterpreter(object):
         emulator_log.debug("Call helper for {0}".format(helper_name))
         # and we support only __ROR4__ (we should add other Hex-Rays created helper calls)
         if helper_name == "__ROR4__":
-            data_1 = self.eval(args_list.f.args[0], environment)
-            data_2 = self.eval(args_list.f.args[1], environment)
-            return ror(data_1, data_2, 8 * args_list.f.args[0].size) & res_mask
+            data_1 = self.eval(args_list.args[0], environment)
+            data_2 = self.eval(args_list.args[1], environment)
+            return ror(data_1, data_2, 8 * args_list.args[0].size) & res_mask
         elif helper_name == "__readfsqword":
             return 0
         return None
 
-    def _eval_load(self, ins: minsn_t, environment: MicroCodeEnvironment) -> Union[None, int]:
+    def _eval_load(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> Union[None, int]:
         res_mask = AND_TABLE[ins.d.size]
         if ins.opcode == m_ldx:
             load_address = self.eval(ins.r, environment)
-            formatted_seg_register = format_mop_t(ins.l)
+            formatted_seg_register = format_mop_t(ins.l.mop)
             if formatted_seg_register == "ss.2":
                 stack_mop = mop_t()
                 stack_mop.erase()
@@ -285,51 +304,53 @@ class MicroCodeInterpreter(object):
                                        .format(load_address, memory_value & res_mask))
                     return memory_value & res_mask
 
-    def _eval_store(self, ins: minsn_t, environment: MicroCodeEnvironment) -> Union[None, int]:
+    def _eval_store(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> Union[None, int]:
         # TODO: implement
-        emulator_log.warning("Evaluation of {0} not implemented: bypassing".format(format_minsn_t(ins)))
+        emulator_log.warning("Evaluation of {0} not implemented: bypassing".format(format_minsn_t(ins.ins)))
         return None
 
-    def _eval_call(self, ins: minsn_t, environment: MicroCodeEnvironment) -> Union[None, int]:
+    def _eval_call(self, ins: DecodedInstruction, environment: MicroCodeEnvironment) -> Union[None, int]:
         # TODO: implement
-        emulator_log.warning("Evaluation of {0} not implemented: bypassing".format(format_minsn_t(ins)))
+        emulator_log.warning("Evaluation of {0} not implemented: bypassing".format(format_minsn_t(ins.ins)))
         return None
 
-    def eval(self, mop: mop_t, environment: MicroCodeEnvironment) -> Union[None, int]:
+    def eval(self, mop: DecodedMop, environment: MicroCodeEnvironment) -> Union[None, int]:
         if mop.t == mop_n:
-            return mop.nnn.value
-        elif mop.t in [mop_r, mop_S]:
+            return mop.value
+        elif mop.t in ENVIRONMENT_MOP_TYPES:
             return environment.lookup(mop)
         elif mop.t == mop_d:
-            return self._eval_instruction(mop.d, environment)
+            return self._eval_instruction(mop.sub_ins, environment)
         elif mop.t == mop_a:
-            if mop.a.t == mop_v:
-                emulator_log.debug("Reading a mop_a '{0}' -> {1:x}".format(format_mop_t(mop), mop.a.g))
-                return mop.a.g
-            elif mop.a.t == mop_S:
-                emulator_log.debug("Reading a mop_a '{0}' -> {1:x}".format(format_mop_t(mop), mop.a.s.off))
-                return mop.a.s.off
+            if mop.a_t == mop_v:
+                emulator_log.debug("Reading a mop_a '{0}' -> {1:x}".format(format_mop_t(mop.mop), mop.value))
+                return mop.value
+            elif mop.a_t == mop_S:
+                emulator_log.debug("Reading a mop_a '{0}' -> {1:x}".format(format_mop_t(mop.mop), mop.value))
+                return mop.value
             raise UnresolvedMopException("Calling get_cst with unsupported mop type {0} - {1}: '{2}'"
-                                         .format(mop.t, mop.a.t, format_mop_t(mop)))
+                                         .format(mop.t, mop.a_t, format_mop_t(mop.mop)))
         elif mop.t == mop_v:
             mem_seg = getseg(mop.g)
             seg_perm = mem_seg.perm
             if (seg_perm & SEGPERM_WRITE) != 0:
-                emulator_log.debug("Reading a (writable) mop_v {0}".format(format_mop_t(mop)))
+                emulator_log.debug("Reading a (writable) mop_v {0}".format(format_mop_t(mop.mop)))
                 return environment.lookup(mop)
             else:
                 memory_value = get_qword(mop.g)
                 emulator_log.debug("Reading a mop_v {0:x} (non writable -> return {1:x})".format(mop.g, memory_value))
                 return mop.g
         raise EmulationException("Unsupported mop type '{0}': '{1}'"
-                                 .format(mop_type_to_string(mop.t), format_mop_t(mop)))
+                                 .format(mop_type_to_string(mop.t), format_mop_t(mop.mop)))
 
     def eval_instruction(self, blk: mblock_t, ins: minsn_t, environment: Union[None, MicroCodeEnvironment] = None,
                          raise_exception: bool = False) -> bool:
         try:
             if environment is None:
                 environment = self.global_environment
-            emulator_log.info("Evaluating microcode instruction : '{0}'".format(format_minsn_t(ins)))
+            # Formatting the instruction is as costly as evaluating it: only done if it is logged
+            if emulator_log.isEnabledFor(logging.INFO):
+                emulator_log.info("Evaluating microcode instruction : '{0}'".format(format_minsn_t(ins)))
             if ins is None:
                 return False
             self._eval_instruction_and_update_environment(blk, ins, environment)
@@ -349,7 +370,8 @@ class MicroCodeInterpreter(object):
         try:
             if environment is None:
                 environment = self.global_environment
-            res = self.eval(mop, environment)
+            # Not cached: the mop may not belong to an instruction of the microcode
+            res = self.eval(DecodedMop(mop), environment)
             return res
         except EmulationException as e:
             emulator_log.warning("Can't get constant mop value: '{0}': {1}".format(format_mop_t(mop), e))
@@ -366,59 +388,141 @@ class MicroCodeInterpreter(object):
 
 
 class MopMapping(object):
+    # Mapping mop -> value where mops are compared with equal_mops_ignore_size (as get_mop_index does).
+    # Entries are hashed by get_mop_ignore_size_key (register number for mop_r, stack offset for mop_S, ...): mops with
+    # the same key are still compared with equal_mops_ignore_size, since for some mop types only the type is hashed.
+    # The first mop stored for a key is kept as the key (with its size), values are masked with the size of the mop
+    # used to set them.
+    # Mops can also be given as DecodedMop (as done by MicroCodeInterpreter): their key is already computed, and the
+    # underlying mop_t is stored.
+    # Copies are copy-on-write: a copy shares the dict of its source until one of them is modified, then the modified
+    # one copies the dict (the entries are tuples, thus the dict only needs a shallow copy). Copying is O(1), which
+    # matters since MopHistory copies its environments each time a tracker forks or re-executes its path.
     def __init__(self):
-        self.mops = []
-        self.mops_values = []
-
-    def __setitem__(self, mop: mop_t, mop_value: int):
-        mop_index = get_mop_index(mop, self.mops)
-        mop_value &= AND_TABLE[mop.size]
-        if mop_index != -1:
-            self.mops_values[mop_index] = mop_value
-            return
-        self.mops.append(mop)
-        self.mops_values.append(mop_value)
+        # key -> tuple of (mop, value, mop size), keys are in insertion order
+        self.entries_by_key = {}
+        self.nb_entries = 0
+        # True if entries_by_key may be shared with another MopMapping
+        self.is_shared = False
+        # True if a value was set with a mop larger than the stored one: a copy masks it with the size of the stored
+        # mop (as setting each entry in a new mapping does), so the entries can not be shared as they are
+        self.has_larger_values = False
+
+    @staticmethod
+    def _get_key(mop: Union[mop_t, DecodedMop]):
+        if isinstance(mop, DecodedMop):
+            return mop.key if mop.key is not None else get_mop_ignore_size_key(mop.mop)
+        return get_mop_ignore_size_key(mop)
 
-    def __getitem__(self, mop: mop_t) -> int:
-        mop_index = get_mop_index(mop, self.mops)
-        if mop_index == -1:
+    @staticmethod
+    def _get_entry_index(mop: Union[mop_t, DecodedMop], entry_list) -> int:
+        if mop.t in EXACT_KEY_MOP_TYPES:
+            return 0
+        if isinstance(mop, DecodedMop):
+            mop = mop.mop
+        for i, entry in enumerate(entry_list):
+            if equal_mops_ignore_size(mop, entry[0]):
+                return i
+        return -1
+
+    def _find(self, mop: Union[mop_t, DecodedMop]) -> Union[None, tuple]:
+        entry_list = self.entries_by_key.get(self._get_key(mop))
+        if entry_list is None:
+            return None
+        entry_index = self._get_entry_index(mop, entry_list)
+        return entry_list[entry_index] if entry_index != -1 else None
+
+    def _get_writable_entries(self) -> dict:
+        if self.is_shared:
+            self.entries_by_key = dict(self.entries_by_key)
+            self.is_shared = False
+        return self.entries_by_key
+
+    def __setitem__(self, mop: Union[mop_t, DecodedMop], mop_value: int):
+        mop_size = mop.size
+        mop_value &= AND_TABLE[mop_size]
+        mop_key = self._get_key(mop)
+        entries_by_key = self._get_writable_entries()
+        entry_list = entries_by_key.get(mop_key)
+        if entry_list is None:
+            stored_mop = mop.mop if isinstance(mop, DecodedMop) else mop
+            entries_by_key[mop_key] = ((stored_mop, mop_value, mop_size),)
+            self.nb_entries += 1
+            return
+        entry_index = self._get_entry_index(mop, entry_list)
+        if entry_index == -1:
+            stored_mop = mop.mop if isinstance(mop, DecodedMop) else mop
+            entries_by_key[mop_key] = entry_list + ((stored_mop, mop_value, mop_size),)
+            self.nb_entries += 1
+            return
+        stored_mop, _, stored_mop_size = entry_list[entry_index]
+        if mop_value > AND_TABLE[stored_mop_size]:
+            self.has_larger_values = True
+        entries_by_key[mop_key] = entry_list[:entry_index] + ((stored_mop, mop_value, stored_mop_size),) + \
+            entry_list[entry_index + 1:]
+
+    def __getitem__(self, mop: Union[mop_t, DecodedMop]) -> int:
+        entry = self._find(mop)
+        if entry is None:
             raise KeyError
-        return self.mops_values[mop_index]
+        return entry[1]
+
+    def get(self, mop: Union[mop_t, DecodedMop], default=None):
+        entry = self._find(mop)
+        if entry is None:
+            return default
+        return entry[1]
 
     def __len__(self):
-        return len(self.mops)
+        return self.nb_entries
 
-    def __delitem__(self, mop: mop_t):
-        mop_index = get_mop_index(mop, self.mops)
-        if mop_index == -1:
+    def __delitem__(self, mop: Union[mop_t, DecodedMop]):
+        mop_key = self._get_key(mop)
+        entry_list = self.entries_by_key.get(mop_key)
+        entry_index = self._get_entry_index(mop, entry_list) if entry_list is not None else -1
+        if entry_index == -1:
             raise KeyError
-        del self.mops[mop_index]
-        del self.mops_values[mop_index]
+        entries_by_key = self._get_writable_entries()
+        if len(entry_list) == 1:
+            del entries_by_key[mop_key]
+        else:
+            entries_by_key[mop_key] = entry_list[:entry_index] + entry_list[entry_index + 1:]
+        self.nb_entries -= 1
 
     def clear(self):
-        self.mops = []
-        self.mops_values = []
-
-    def copy(self):
+        self.entries_by_key = {}
+        self.nb_entries = 0
+        self.is_shared = False
+        self.has_larger_values = False
+
+    def copy(self, exact_values=False):
+        # With exact_values, values larger than their stored mop are kept as they are (e.g. for a snapshot of an
+        # environment during an execution)
         new_mapping = MopMapping()
-        for mop, mop_value in self.items():
-            new_mapping[mop] = mop_value
+        if self.has_larger_values and not exact_values:
+            for mop, mop_value in self.items():
+                new_mapping[mop] = mop_value
+            return new_mapping
+        new_mapping.entries_by_key = self.entries_by_key
+        new_mapping.nb_entries = self.nb_entries
+        new_mapping.has_larger_values = self.has_larger_values
+        new_mapping.is_shared = True
+        self.is_shared = True
         return new_mapping
 
-    def has_key(self, mop: mop_t):
-        mop_index = get_mop_index(mop, self.mops)
-        return mop_index != -1
+    def has_key(self, mop: Union[mop_t, DecodedMop]):
+        return self._find(mop) is not None
 
     def keys(self) -> List[mop_t]:
-        return self.mops
+        return [entry[0] for entry_list in self.entries_by_key.values() for entry in entry_list]
 
     def values(self) -> List[int]:
-        return self.mops_values
+        return [entry[1] for entry_list in self.entries_by_key.values() for entry in entry_list]
 
     def items(self):
-        return [(x, y) for x, y in zip(self.mops, self.mops_values)]
+        return [(entry[0], entry[1]) for entry_list in self.entries_by_key.values() for entry in entry_list]
 
-    def __contains__(self, mop: mop_t):
+    def __contains__(self, mop: Union[mop_t, DecodedMop]):
         return self.has_key(mop)
 
 
@@ -436,15 +540,14 @@ class MicroCodeEnvironment(object):
     def items(self):
         return [x for x in self.mop_r_record.items() + self.mop_S_record.items()]
 
-    def get_copy(self, copy_parent=True) -> MicroCodeEnvironment:
+    def get_copy(self, copy_parent=True, exact_values=False) -> MicroCodeEnvironment:
         parent_copy = self.parent
         if parent_copy is not None and copy_parent:
-            parent_copy = self.parent.get_copy(copy_parent=True)
+            parent_copy = self.parent.get_copy(copy_parent=True, exact_values=exact_values)
         new_env = MicroCodeEnvironment(parent_copy)
-        for mop, mop_value in self.mop_r_record.items():
-            new_env.define(mop, mop_value)
-        for mop, mop_value in self.mop_S_record.items():
-            new_env.define(mop, mop_value)
+        # O(1): the records are copy-on-write
+        new_env.mop_r_record = self.mop_r_record.copy(exact_values)
+        new_env.mop_S_record = self.mop_S_record.copy(exact_values)
         new_env.cur_blk = self.cur_blk
         new_env.cur_ins = self.cur_ins
         new_env.next_blk = self.next_blk
@@ -463,14 +566,15 @@ class MicroCodeEnvironment(object):
             if self.next_ins is None:
                 self.next_blk = self.cur_blk.mba.get_mblock(self.cur_blk.serial + 1)
                 self.next_ins = self.next_blk.head
-        emulator_log.debug(
-            "Setting next block {0} and next ins {1}".format(self.next_blk.serial, format_minsn_t(self.next_ins)))
+        if emulator_log.isEnabledFor(logging.DEBUG):
+            emulator_log.debug(
+                "Setting next block {0} and next ins {1}".format(self.next_blk.serial, format_minsn_t(self.next_ins)))
 
     def set_next_flow(self, next_blk: mblock_t, next_ins: minsn_t):
         self.next_blk = next_blk
         self.next_ins = next_ins
 
-    def define(self, mop: mblock_t, value: int) -> int:
+    def define(self, mop: Union[mop_t, DecodedMop], value: int) -> int:
         if mop.t == mop_r:
             self.mop_r_record[mop] = value
             return value
@@ -478,34 +582,34 @@ class MicroCodeEnvironment(object):
             self.mop_S_record[mop] = value
             return value
         raise EmulationException("Defining an unsupported mop type '{0}': '{1}'"
-                                 .format(mop_type_to_string(mop.t), format_mop_t(mop)))
-
-    def _lookup_mop(self, searched_mop: mop_t, mop_value_dict: Dict[mop_t, int], new_mop_value: Union[None, int] = None,
-                    auto_define=True, raise_exception=True) -> int:
-        for known_mop, mop_value in mop_value_dict.items():
-            if equal_mops_ignore_size(searched_mop, known_mop):
-                if new_mop_value is not None:
-                    mop_value_dict[searched_mop] = new_mop_value
-                    return new_mop_value
-                return mop_value
+                                 .format(mop_type_to_string(mop.t), format_any_mop(mop)))
+
+    def _lookup_mop(self, searched_mop: Union[mop_t, DecodedMop], mop_value_dict: MopMapping,
+                    new_mop_value: Union[None, int] = None, auto_define=True, raise_exception=True) -> int:
+        mop_value = mop_value_dict.get(searched_mop)
+        if mop_value is not None:
+            if new_mop_value is not None:
+                mop_value_dict[searched_mop] = new_mop_value
+                return new_mop_value
+            return mop_value
         if (new_mop_value is not None) and auto_define:
             self.define(searched_mop, new_mop_value)
             return new_mop_value
         if raise_exception:
-            raise EmulationException("Variable '{0}' is not defined".format(format_mop_t(searched_mop)))
+            raise EmulationException("Variable '{0}' is not defined".format(format_any_mop(searched_mop)))
         else:
             return None
 
-    def lookup(self, mop: mop_t, raise_exception=True) -> int:
+    def lookup(self, mop: Union[mop_t, DecodedMop], raise_exception=True) -> int:
         if mop.t == mop_r:
             return self._lookup_mop(mop, self.mop_r_record, raise_exception=raise_exception)
         elif mop.t == mop_S:
             return self._lookup_mop(mop, self.mop_S_record, raise_exception=raise_exception)
 
-    def assign(self, mop: mop_t, value: int, auto_define=True) -> int:
+    def assign(self, mop: Union[mop_t, DecodedMop], value: int, auto_define=True) -> int:
         if mop.t == mop_r:
             return self._lookup_mop(mop, self.mop_r_record, value, auto_define)
         elif mop.t == mop_S:
             return self._lookup_mop(mop, self.mop_S_record, value, auto_define)
         raise EmulationException("Assigning an unsupported mop type '{0}': '{1}'"
-                                 .format(mop_type_to_string(mop.t), format_mop_t(mop)))
+                                 .format(mop_type_to_string(mop.t), format_any_mop(mop)))
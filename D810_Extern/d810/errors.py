@@ -14,6 +14,10 @@ class D810Z3Exception(D810Exception):
     pass
 
 
+class RuleVerificationException(D810Exception):
+    pass
+
+
 class ControlFlowException(D810Exception):
     pass
 
@@ -2,6 +2,7 @@ import os
 import logging
 from typing import List
 
+from d810.log_writer import async_log_writer
 from d810.hexrays_helpers import OPCODES_INFO, MATURITY_TO_STRING_DICT, STRING_TO_MATURITY_DICT, MOP_TYPE_TO_STRING_DICT
 from ida_hexrays import minsn_t, mop_t, vd_printer_t, mbl_array_t
 
@@ -76,20 +77,26 @@ class block_printer(vd_printer_t):
         return 1
 
 
-def write_mc_to_file(mba: mbl_array_t, filename: str, mba_flags: int = 0) -> bool:
-    if not mba:
-        return False
-
+def get_mc_lines(mba: mbl_array_t, mba_flags: int = 0) -> List[str]:
     vp = mba_printer()
     mba.set_mba_flags(mba_flags)
     mba._print(vp)
+    return vp.get_mc()
+
+
+def write_mc_to_file(mba: mbl_array_t, filename: str, mba_flags: int = 0) -> bool:
+    if not mba:
+        return False
 
     with open(filename, "w") as f:
-        f.writelines(vp.get_mc())
+        f.writelines(get_mc_lines(mba, mba_flags))
     return True
 
 
 def dump_microcode_for_debug(mba: mbl_array_t, log_dir_path: str, name: str = ""):
+    # The microcode is printed now (it is modified afterwards), the file is written by the log writer thread
     mc_filename = os.path.join(log_dir_path, "{0:x}_maturity_{1}_{2}.log".format(mba.entry_ea, mba.maturity, name))
     logger.info("Dumping microcode in file {0}...".format(mc_filename))
-    write_mc_to_file(mba, mc_filename)
+    if not mba:
+        return
+    async_log_writer.write(mc_filename, "".join(get_mc_lines(mba)), truncate=True)
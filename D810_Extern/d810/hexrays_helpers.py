@@ -240,6 +240,87 @@ def equal_mops_ignore_size(lo: mop_t, ro: mop_t) -> bool:
         return False
 
 
+def get_mop_ignore_size_key(mop: mop_t):
+    # Hashable key of a mop such that equal_mops_ignore_size(lo, ro) implies that lo and ro have the same key.
+    # Sizes are ignored and mops whose content can not be hashed are only keyed by their type, thus two mops with the
+    # same key must still be compared with equal_mops_ignore_size.
+    if mop.t == mop_n:
+        return mop_n, mop.nnn.value
+    elif mop.t == mop_r:
+        return mop_r, mop.r
+    elif mop.t == mop_S:
+        return mop_S, mop.s.off
+    elif mop.t == mop_v:
+        return mop_v, mop.g
+    elif mop.t == mop_l:
+        return mop_l, mop.l.idx, mop.l.off
+    elif mop.t == mop_d:
+        return get_minsn_ignore_size_key(mop.d)
+    elif mop.t == mop_b:
+        return mop_b, mop.b
+    elif mop.t == mop_a:
+        return mop_a, get_mop_ignore_size_key(mop.a)
+    elif mop.t == mop_h:
+        return mop_h, mop.helper
+    elif mop.t == mop_str:
+        return mop_str, mop.cstr
+    elif mop.t == mop_p:
+        return mop_p, get_mop_ignore_size_key(mop.pair.lop), get_mop_ignore_size_key(mop.pair.hop)
+    return mop.t,
+
+
+def get_minsn_ignore_size_key(ins: minsn_t):
+    return mop_d, ins.opcode, get_mop_ignore_size_key(ins.l), get_mop_ignore_size_key(ins.r), \
+        get_mop_ignore_size_key(ins.d)
+
+
+def get_mop_structural_key(mop: mop_t):
+    # Hashable key describing a mop: opcode tree, leaf kinds and identities, constants and sizes (ea are ignored)
+    # Two mops with the same key are the same expression. Returns None for unsupported mop types.
+    if mop.t == mop_z:
+        return mop_z,
+    elif mop.t == mop_n:
+        return mop_n, mop.nnn.value, mop.size
+    elif mop.t == mop_r:
+        return mop_r, mop.r, mop.size
+    elif mop.t == mop_S:
+        return mop_S, mop.s.off, mop.size
+    elif mop.t == mop_v:
+        return mop_v, mop.g, mop.size
+    elif mop.t == mop_l:
+        return mop_l, mop.l.idx, mop.l.off, mop.size
+    elif mop.t == mop_d:
+        ins_key = get_minsn_structural_key(mop.d)
+        if ins_key is None:
+            return None
+        return mop_d, ins_key, mop.size
+    elif mop.t == mop_b:
+        return mop_b, mop.b
+    elif mop.t == mop_a:
+        addr_key = get_mop_structural_key(mop.a)
+        if addr_key is None:
+            return None
+        return mop_a, addr_key, mop.a.insize, mop.a.outsize, mop.size
+    elif mop.t == mop_h:
+        return mop_h, mop.helper, mop.size
+    elif mop.t == mop_str:
+        return mop_str, mop.cstr, mop.size
+    return None
+
+
+def get_minsn_structural_key(ins: minsn_t):
+    l_key = get_mop_structural_key(ins.l)
+    if l_key is None:
+        return None
+    r_key = get_mop_structural_key(ins.r)
+    if r_key is None:
+        return None
+    d_key = get_mop_structural_key(ins.d)
+    if d_key is None:
+        return None
+    return ins.opcode, l_key, r_key, d_key
+
+
 def is_check_mop(lo: mop_t) -> bool:
     if lo.t != mop_d:
         return False
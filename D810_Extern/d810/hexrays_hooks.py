@@ -1,15 +1,23 @@
 from __future__ import annotations
+import time
 import logging
 
 from ida_hexrays import *
 
 from d810.optimizers.instructions import PatternOptimizer, ChainOptimizer, Z3Optimizer, EarlyOptimizer, \
-    InstructionAnalyzer
-from d810.hexrays_helpers import check_ins_mop_size_are_ok, append_mop_if_not_in_list
+    InstructionAnalyzer, MbaOptimizer
+from d810.optimizers.instructions.handler import InstructionInfo
+from d810.hexrays_helpers import check_ins_mop_size_are_ok, append_mop_if_not_in_list, get_minsn_structural_key
 from d810.hexrays_formatters import format_minsn_t, format_mop_t, maturity_to_string, mop_type_to_string, \
     dump_microcode_for_debug
 from d810.errors import D810Exception
-from d810.z3_utils import log_z3_instructions
+from d810.z3_utils import log_z3_instructions, open_z3_function_context, close_z3_function_context
+from d810.random_testing import DEFAULT_NB_TESTS, configure_random_testing
+from d810.z3_cache import z3_verdict_cache
+from d810.log_writer import async_log_writer
+from d810.microcode_ir import invalidate_decoded_blocks
+from d810.z3_backend import DEFAULT_Z3_TIMEOUT_MS, configure_z3_backend
+from d810.egraph import DEFAULT_EGRAPH_MAX_NODES, DEFAULT_EGRAPH_TIMEOUT_MS, DEFAULT_EGRAPH_MAX_ITERATIONS
 
 from typing import TYPE_CHECKING, List
 if TYPE_CHECKING:
@@ -23,10 +31,15 @@ helper_logger = logging.getLogger('D810.helper')
 
 DEFAULT_OPTIMIZATION_PATTERN_MATURITIES = [MMAT_PREOPTIMIZED, MMAT_LOCOPT, MMAT_CALLS, MMAT_GLBOPT1]
 DEFAULT_OPTIMIZATION_CHAIN_MATURITIES = [MMAT_PREOPTIMIZED, MMAT_LOCOPT, MMAT_CALLS, MMAT_GLBOPT1]
+DEFAULT_OPTIMIZATION_MBA_MATURITIES = [MMAT_PREOPTIMIZED, MMAT_LOCOPT, MMAT_CALLS, MMAT_GLBOPT1]
 DEFAULT_OPTIMIZATION_Z3_MATURITIES = [MMAT_LOCOPT, MMAT_CALLS, MMAT_GLBOPT1]
 DEFAULT_OPTIMIZATION_EARLY_MATURITIES = [MMAT_GENERATED, MMAT_PREOPTIMIZED]
 DEFAULT_ANALYZER_MATURITIES = [MMAT_PREOPTIMIZED, MMAT_LOCOPT, MMAT_CALLS, MMAT_GLBOPT1]
 
+# Maximum number of bottom-up rewrite passes done on an instruction in a single optimizer callback
+# (0 to only do one rewrite per callback, as Hex-Rays calls the optimizer again after each successful optimization)
+DEFAULT_MAX_REWRITE_ITERATIONS = 16
+
 
 class InstructionDefUseCollector(mop_visitor_t):
     def __init__(self):
@@ -80,11 +93,17 @@ class InstructionOptimizerManager(optinsn_t):
         self.current_blk_serial = None
         self.generate_z3_code = False
         self.dump_intermediate_microcode = False
+        self.max_rewrite_iterations = DEFAULT_MAX_REWRITE_ITERATIONS
+        self.nb_callbacks_with_rewrite = 0
+        self.nb_rewrites = 0
+        self.max_rewrites_per_callback = 0
+        self.nb_rewrite_limit_reached = 0
 
         self.instruction_optimizers = []
         self.optimizer_usage_info = {}
         self.add_optimizer(PatternOptimizer(DEFAULT_OPTIMIZATION_PATTERN_MATURITIES, log_dir=self.manager.log_dir))
         self.add_optimizer(ChainOptimizer(DEFAULT_OPTIMIZATION_CHAIN_MATURITIES, log_dir=self.manager.log_dir))
+        self.add_optimizer(MbaOptimizer(DEFAULT_OPTIMIZATION_MBA_MATURITIES, log_dir=self.manager.log_dir))
         self.add_optimizer(Z3Optimizer(DEFAULT_OPTIMIZATION_Z3_MATURITIES, log_dir=self.manager.log_dir))
         self.add_optimizer(EarlyOptimizer(DEFAULT_OPTIMIZATION_EARLY_MATURITIES, log_dir=self.manager.log_dir))
         self.analyzer = InstructionAnalyzer(DEFAULT_ANALYZER_MATURITIES, log_dir=self.manager.log_dir)
@@ -92,10 +111,12 @@ class InstructionOptimizerManager(optinsn_t):
     def func(self, blk: mblock_t, ins: minsn_t) -> bool:
         self.log_info_on_input(blk, ins)
         try:
-            optimization_performed = self.optimize(blk, ins)
-
-            if not optimization_performed:
-                optimization_performed = ins.for_all_insns(self.instruction_visitor)
+            if self.max_rewrite_iterations > 0:
+                optimization_performed = self.optimize_until_fixpoint(blk, ins)
+            else:
+                optimization_performed = self.optimize(blk, ins)
+                if not optimization_performed:
+                    optimization_performed = ins.for_all_insns(self.instruction_visitor)
 
             if optimization_performed:
                 ins.optimize_solo()
@@ -118,12 +139,21 @@ class InstructionOptimizerManager(optinsn_t):
         for ins_optimizer in self.instruction_optimizers:
             self.optimizer_usage_info[ins_optimizer.name] = 0
             ins_optimizer.reset_rule_usage_statistic()
+        self.nb_callbacks_with_rewrite = 0
+        self.nb_rewrites = 0
+        self.max_rewrites_per_callback = 0
+        self.nb_rewrite_limit_reached = 0
 
     def show_rule_usage_statistic(self):
         for optimizer_name, optimizer_nb_match in self.optimizer_usage_info.items():
             if optimizer_nb_match > 0:
                 main_logger.info("Instruction optimizer '{0}' has been used {1} times"
                                  .format(optimizer_name, optimizer_nb_match))
+        if self.nb_callbacks_with_rewrite > 0:
+            main_logger.info("Instruction rewrites: {0} in {1} callbacks (max {2} per callback, iteration limit "
+                             "reached {3} times)".format(self.nb_rewrites, self.nb_callbacks_with_rewrite,
+                                                         self.max_rewrites_per_callback,
+                                                         self.nb_rewrite_limit_reached))
         for ins_optimizer in self.instruction_optimizers:
             ins_optimizer.show_rule_usage_statistic()
 
@@ -149,6 +179,7 @@ class InstructionOptimizerManager(optinsn_t):
             self.current_blk_serial = blk.serial
 
     def add_optimizer(self, optimizer: InstructionOptimizer):
+        optimizer.profiler = self.manager.rule_profiler
         self.instruction_optimizers.append(optimizer)
         self.optimizer_usage_info[optimizer.name] = 0
 
@@ -158,15 +189,29 @@ class InstructionOptimizerManager(optinsn_t):
             ins_optimizer.add_rule(rule)
         self.analyzer.add_rule(rule)
 
-    def configure(self, generate_z3_code=False, dump_intermediate_microcode=False, **kwargs):
+    def configure(self, generate_z3_code=False, dump_intermediate_microcode=False,
+                  max_rewrite_iterations=DEFAULT_MAX_REWRITE_ITERATIONS, random_testing_nb_tests=DEFAULT_NB_TESTS,
+                  use_z3_verdict_cache=True, z3_verdict_cache_path=None, z3_timeout_ms=DEFAULT_Z3_TIMEOUT_MS,
+                  z3_nb_workers=0, z3_worker_python=None, use_egraph=False,
+                  egraph_max_nodes=DEFAULT_EGRAPH_MAX_NODES, egraph_timeout_ms=DEFAULT_EGRAPH_TIMEOUT_MS,
+                  egraph_max_iterations=DEFAULT_EGRAPH_MAX_ITERATIONS, **kwargs):
         self.generate_z3_code = generate_z3_code
         self.dump_intermediate_microcode = dump_intermediate_microcode
+        self.max_rewrite_iterations = max_rewrite_iterations
+        configure_random_testing(random_testing_nb_tests)
+        z3_verdict_cache.configure(use_z3_verdict_cache, z3_verdict_cache_path)
+        configure_z3_backend(z3_timeout_ms, z3_nb_workers, z3_worker_python)
+        for ins_optimizer in self.instruction_optimizers:
+            if isinstance(ins_optimizer, PatternOptimizer):
+                ins_optimizer.configure_egraph(use_egraph, egraph_max_nodes, egraph_timeout_ms, egraph_max_iterations)
 
     def optimize(self, blk: mblock_t, ins: minsn_t) -> bool:
         # optimizer_log.info("Trying to optimize {0}".format(format_minsn_t(ins)))
+        # The AST of the instruction is built at most once and shared by all the optimizers
+        ins_info = InstructionInfo(ins)
         for ins_optimizer in self.instruction_optimizers:
             self._last_optimizer_tried = ins_optimizer
-            new_ins = ins_optimizer.get_optimized_instruction(blk, ins)
+            new_ins = ins_optimizer.get_optimized_instruction(blk, ins, ins_info)
 
             if new_ins is not None:
                 if not check_ins_mop_size_are_ok(new_ins):
@@ -186,9 +231,47 @@ class InstructionOptimizerManager(optinsn_t):
                             pass
                     return True
 
-        self.analyzer.analyze(blk, ins)
+        self.analyzer.analyze(blk, ins, ins_info)
         return False
 
+    def optimize_until_fixpoint(self, blk: mblock_t, ins: minsn_t) -> bool:
+        # Rewrites the sub-instructions of ins bottom-up and then ins itself, until no rule applies anymore or
+        # max_rewrite_iterations passes have been done. Each rewrite is done in place (ins.swap), so a single final
+        # instruction is verified by func, instead of waiting for a Hex-Rays callback after each rewrite.
+        # Sub-instructions already known to be in normal form (by structural key) are not visited again.
+        normal_form_keys = set()
+        nb_rewrites = 0
+        nb_iterations = 0
+        while nb_iterations < self.max_rewrite_iterations:
+            nb_new_rewrites = self._rewrite_bottom_up(blk, ins, normal_form_keys)
+            if nb_new_rewrites == 0:
+                break
+            nb_rewrites += nb_new_rewrites
+            nb_iterations += 1
+        if nb_rewrites == 0:
+            return False
+        if nb_iterations == self.max_rewrite_iterations:
+            self.nb_rewrite_limit_reached += 1
+            optimizer_logger.debug("Rewrite iteration limit reached for {0}".format(format_minsn_t(ins)))
+        self.nb_callbacks_with_rewrite += 1
+        self.nb_rewrites += nb_rewrites
+        self.max_rewrites_per_callback = max(self.max_rewrites_per_callback, nb_rewrites)
+        return True
+
+    def _rewrite_bottom_up(self, blk: mblock_t, ins: minsn_t, normal_form_keys: set) -> int:
+        ins_key = get_minsn_structural_key(ins)
+        if ins_key is not None and ins_key in normal_form_keys:
+            return 0
+        nb_rewrites = 0
+        for sub_mop in [ins.l, ins.r, ins.d]:
+            if sub_mop is not None and sub_mop.t == mop_d:
+                nb_rewrites += self._rewrite_bottom_up(blk, sub_mop.d, normal_form_keys)
+        if self.optimize(blk, ins):
+            return nb_rewrites + 1
+        if nb_rewrites == 0 and ins_key is not None:
+            normal_form_keys.add(ins_key)
+        return nb_rewrites
+
 
 class InstructionVisitorManager(minsn_visitor_t):
     def __init__(self, optimizer: InstructionOptimizerManager):
@@ -206,12 +289,15 @@ class BlockOptimizerManager(optblock_t):
         super().__init__()
         self.manager = manager
         self.cfg_rules = set()
+        self.profiler = self.manager.rule_profiler
 
         self.current_maturity = None
         self.cfg_rules_usage_info = {}
 
     def func(self, blk: mblock_t):
         self.log_info_on_input(blk)
+        # The microcode may have been modified since the last call (by Hex-Rays or by the instruction optimizers)
+        invalidate_decoded_blocks()
         nb_patch = self.optimize(blk)
         return nb_patch
 
@@ -239,13 +325,28 @@ class BlockOptimizerManager(optblock_t):
     def optimize(self, blk: mblock_t):
         for cfg_rule in self.cfg_rules:
             if self.check_if_rule_is_activated_for_address(cfg_rule, blk.mba.entry_ea):
-                nb_patch = cfg_rule.optimize(blk)
+                if self.profiler is not None:
+                    nb_patch = self.optimize_with_profiling(cfg_rule, blk)
+                else:
+                    nb_patch = cfg_rule.optimize(blk)
                 if nb_patch > 0:
                     optimizer_logger.info("Rule {0} matched: {1} patches".format(cfg_rule.name, nb_patch))
                     self.cfg_rules_usage_info[cfg_rule.name].append(nb_patch)
                     return nb_patch
         return 0
 
+    def optimize_with_profiling(self, cfg_rule: FlowOptimizationRule, blk: mblock_t) -> int:
+        start_time = time.perf_counter()
+        try:
+            nb_patch = cfg_rule.optimize(blk)
+        except Exception:
+            self.profiler.record(self.__class__.__name__, cfg_rule.name, blk.mba.maturity,
+                                 time.perf_counter() - start_time, nb_exceptions=1)
+            raise
+        self.profiler.record(self.__class__.__name__, cfg_rule.name, blk.mba.maturity,
+                             time.perf_counter() - start_time, nb_matches=int(nb_patch > 0))
+        return nb_patch
+
     def add_rule(self, cfg_rule: FlowOptimizationRule):
         optimizer_logger.info("Adding cfg rule {0}".format(cfg_rule))
         self.cfg_rules.add(cfg_rule)
@@ -271,10 +372,21 @@ class HexraysDecompilationHook(Hexrays_Hooks):
         main_logger.info("Starting decompilation of function at 0x{0:x}".format(mba.entry_ea))
         self.manager.instruction_optimizer.reset_rule_usage_statistic()
         self.manager.block_optimizer.reset_rule_usage_statistic()
+        if self.manager.rule_profiler is not None:
+            self.manager.rule_profiler.start_function(mba.entry_ea)
+        open_z3_function_context()
+        invalidate_decoded_blocks()
         return 0
 
     def glbopt(self, mba: mbl_array_t) -> "int":
         main_logger.info("glbopt finished for function at 0x{0:x}".format(mba.entry_ea))
         self.manager.instruction_optimizer.show_rule_usage_statistic()
         self.manager.block_optimizer.show_rule_usage_statistic()
+        z3_verdict_cache.flush()
+        close_z3_function_context()
+        async_log_writer.flush()
+        invalidate_decoded_blocks()
+        if self.manager.rule_profiler is not None:
+            self.manager.rule_profiler.show_summary()
+            self.manager.rule_profiler.save()
         return 0
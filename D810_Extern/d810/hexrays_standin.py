@@ -0,0 +1,172 @@
+import sys
+import types
+
+# Minimal stand-in of the ida_hexrays and idaapi modules, used to load the d810 rules outside of IDA (e.g. by the
+# rule verifier, see d810.rule_verifier). It only implements the part of the microcode API used to build, match and
+# rewrite instructions made of registers and numbers: nothing is decompiled.
+# Opcode, mop type and maturity values follow hexrays.hpp.
+MCODE_NAMES = ["nop", "stx", "ldx", "ldc", "mov", "neg", "lnot", "bnot", "xds", "xdu", "low", "high", "add", "sub",
+               "mul", "udiv", "sdiv", "umod", "smod", "or", "and", "xor", "shl", "shr", "sar", "cfadd", "ofadd",
+               "cfshl", "cfshr", "sets", "seto", "setp", "setnz", "setz", "setae", "setb", "seta", "setbe", "setg",
+               "setge", "setl", "setle", "jcnd", "jnz", "jz", "jae", "jb", "ja", "jbe", "jg", "jge", "jl", "jle",
+               "jtbl", "ijmp", "goto", "call", "icall", "ret", "push", "pop", "und", "ext", "f2i", "f2u", "i2f",
+               "u2f", "f2f", "fneg", "fadd", "fsub", "fmul", "fdiv"]
+MOP_TYPE_NAMES = ["z", "r", "n", "str", "d", "S", "v", "b", "f", "l", "a", "h", "c", "fn", "p", "sc"]
+MATURITY_NAMES = ["ZERO", "GENERATED", "PREOPTIMIZED", "LOCOPT", "CALLS", "GLBOPT1", "GLBOPT2", "GLBOPT3", "LVARS"]
+
+MOP_Z, MOP_R, MOP_N, MOP_D, MOP_S = 0, 1, 2, 4, 5
+
+
+class mnumber_t(object):
+    def __init__(self, value):
+        self.value = value
+
+
+class stkvar_ref_t(object):
+    def __init__(self, off):
+        self.off = off
+
+    def __eq__(self, other):
+        return isinstance(other, stkvar_ref_t) and other.off == self.off
+
+
+class mop_t(object):
+    def __init__(self, other=None):
+        self.t = MOP_Z
+        self.size = 0
+        self.nnn = None
+        self.r = None
+        self.s = None
+        self.d = None
+        self.g = None
+        self.b = None
+        self.helper = None
+        if other is not None:
+            self.__dict__.update(other.__dict__)
+
+    def make_number(self, value, size):
+        self.t = MOP_N
+        self.nnn = mnumber_t(value)
+        self.size = size
+
+    def make_reg(self, reg, size):
+        self.t = MOP_R
+        self.r = reg
+        self.size = size
+
+    def make_stkvar(self, off, size):
+        self.t = MOP_S
+        self.s = stkvar_ref_t(off)
+        self.size = size
+
+    def create_from_insn(self, ins):
+        self.t = MOP_D
+        self.d = ins
+        self.size = ins.d.size
+
+    def erase(self):
+        self.__init__()
+
+    def dstr(self):
+        if self.t == MOP_N:
+            value = self.nnn.value
+            # The value may also be a symbolic integer
+            value = "0x{0:x}".format(value) if isinstance(value, int) else str(value)
+            return "#{0}.{1}".format(value, self.size)
+        if self.t == MOP_R:
+            return "r{0}.{1}".format(self.r, self.size)
+        if self.t == MOP_S:
+            return "stk{0:x}.{1}".format(self.s.off, self.size)
+        if self.t == MOP_D:
+            return "({0})".format(self.d._print())
+        if self.t == MOP_Z:
+            return ""
+        return "mop_{0}".format(MOP_TYPE_NAMES[self.t])
+
+
+class minsn_t(object):
+    def __init__(self, ea=0):
+        if isinstance(ea, minsn_t):
+            self.__dict__.update(ea.__dict__)
+            return
+        self.ea = ea
+        self.opcode = 0
+        self.l = mop_t()
+        self.r = mop_t()
+        self.d = mop_t()
+        self.next = None
+        self.prev = None
+
+    def _print(self):
+        return "{0} {1}, {2}, {3}".format(MCODE_NAMES[self.opcode], self.l.dstr(), self.r.dstr(), self.d.dstr())
+
+    def dstr(self):
+        return self._print()
+
+    def equal_insns(self, other, eqflags):
+        from d810.hexrays_helpers import equal_mops_ignore_size
+        return self.opcode == other.opcode and equal_mops_ignore_size(self.l, other.l) and \
+            equal_mops_ignore_size(self.r, other.r)
+
+    def swap(self, other):
+        self.__dict__, other.__dict__ = other.__dict__, self.__dict__
+
+
+class _NotImplementedInStandin(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+def _create_ida_hexrays_module():
+    module = types.ModuleType("ida_hexrays")
+    module.__doc__ = "Stand-in of ida_hexrays (see d810.hexrays_standin)"
+    for opcode, name in enumerate(MCODE_NAMES):
+        setattr(module, "m_" + name, opcode)
+    for mop_type, name in enumerate(MOP_TYPE_NAMES):
+        setattr(module, "mop_" + name, mop_type)
+    for maturity, name in enumerate(MATURITY_NAMES):
+        setattr(module, "MMAT_" + name, maturity)
+    module.EQ_IGNSIZE = 0x01
+    module.EQ_IGNCODE = 0x02
+    module.MUST_ACCESS = 0x00
+    module.MAY_ACCESS = 0x01
+    module.FULL_XDSU = 0x0100
+    module.is_mcode_jcond = lambda opcode: module.m_jcnd <= opcode <= module.m_jle
+    module.mnumber_t = mnumber_t
+    module.mop_t = mop_t
+    module.minsn_t = minsn_t
+    for class_name in ["mblock_t", "mbl_array_t", "mlist_t", "mop_visitor_t", "minsn_visitor_t", "optinsn_t",
+                       "optblock_t", "Hexrays_Hooks", "vd_printer_t"]:
+        setattr(module, class_name, type(class_name, (_NotImplementedInStandin,), {}))
+    module.__all__ = [name for name in dir(module) if not name.startswith("_")]
+    return module
+
+
+def _create_idaapi_module():
+    module = types.ModuleType("idaapi")
+    module.__doc__ = "Stand-in of idaapi (see d810.hexrays_standin)"
+    module.SEGPERM_EXEC = 1
+    module.SEGPERM_WRITE = 2
+    module.SEGPERM_READ = 4
+    module.XREF_DATA = 1
+    module.dr_W = 2
+    module.getseg = lambda ea: None
+    module.get_qword = lambda ea: 0
+    module.is_loaded = lambda ea: False
+    module.require = lambda name: None
+    for class_name in ["xrefblk_t", "segment_t"]:
+        setattr(module, class_name, type(class_name, (_NotImplementedInStandin,), {}))
+    return module
+
+
+def install_hexrays_standin() -> bool:
+    # Registers the stand-in modules if the IDA modules can not be imported. Must be called before importing the
+    # d810 modules. Returns True if the stand-in is used.
+    try:
+        import ida_hexrays
+        return False
+    except ImportError:
+        pass
+    sys.modules["ida_hexrays"] = _create_ida_hexrays_module()
+    sys.modules["idaapi"] = _create_idaapi_module()
+    return True
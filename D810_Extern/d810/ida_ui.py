@@ -49,6 +49,9 @@ class PluginConfigurationFileForm_t(QtWidgets.QDialog):
         self.checkbox_dump_intermediate_microcode = QtWidgets.QCheckBox("Dump functions microcode at each maturity", self)
         self.checkbox_dump_intermediate_microcode.setChecked(self.state.d810_config.get("dump_intermediate_microcode"))
         self.config_layout.addWidget(self.checkbox_dump_intermediate_microcode)
+        self.checkbox_use_z3_verdict_cache = QtWidgets.QCheckBox("Remember Z3 verdicts across sessions", self)
+        self.checkbox_use_z3_verdict_cache.setChecked(self.state.d810_config.get("use_z3_verdict_cache", True))
+        self.config_layout.addWidget(self.checkbox_use_z3_verdict_cache)
         self.checkbox_erase_logs_on_reload = QtWidgets.QCheckBox("Erase log directory content when plugin is reloaded", self)
         self.checkbox_erase_logs_on_reload.setChecked(self.state.d810_config.get("erase_logs_on_reload"))
         self.config_layout.addWidget(self.checkbox_erase_logs_on_reload)
@@ -82,6 +85,7 @@ class PluginConfigurationFileForm_t(QtWidgets.QDialog):
         self.state.d810_config.set("erase_logs_on_reload", self.checkbox_erase_logs_on_reload.isChecked())
         self.state.d810_config.set("generate_z3_code", self.checkbox_generate_z3_code.isChecked())
         self.state.d810_config.set("dump_intermediate_microcode", self.checkbox_dump_intermediate_microcode.isChecked())
+        self.state.d810_config.set("use_z3_verdict_cache", self.checkbox_use_z3_verdict_cache.isChecked())
         self.state.d810_config.save()
         self.accept()
 
@@ -290,6 +294,70 @@ class EditConfigurationFileForm_t(QtWidgets.QDialog):
         return activated_rule_names
 
 
+class RuleProfileForm_t(QtWidgets.QDialog):
+    def __init__(self, parent, state):
+        logger.debug("Initializing RuleProfileForm_t")
+        super().__init__(parent)
+        self.state = state
+
+        self.resize(1000, 500)
+        self.setWindowTitle("Rule Profile")
+
+        self.profile_layout = QtWidgets.QVBoxLayout(self)
+        self.lbl_profile_info = QtWidgets.QLabel(self)
+        self.profile_layout.addWidget(self.lbl_profile_info)
+        self.table_rule_profile = QtWidgets.QTableWidget(self)
+        self.profile_layout.addWidget(self.table_rule_profile)
+
+        self.layout_button = QtWidgets.QHBoxLayout()
+        self.button_refresh = QtWidgets.QPushButton(self)
+        self.button_refresh.setText("Refresh")
+        self.button_refresh.clicked.connect(self.update_table)
+        self.layout_button.addWidget(self.button_refresh)
+        self.button_close = QtWidgets.QPushButton(self)
+        self.button_close.setText("Close")
+        self.button_close.clicked.connect(self.accept)
+        self.layout_button.addWidget(self.button_close)
+        self.profile_layout.addLayout(self.layout_button)
+
+        self.setLayout(self.profile_layout)
+        self.update_table()
+
+    def update_table(self):
+        logger.debug("Calling update_table")
+        rule_profiler = self.state.manager.rule_profiler
+        if rule_profiler is None:
+            self.lbl_profile_info.setText("Rule profiling is disabled: set \"profile_rules\" to true in the "
+                                          "additional configuration of the project and restart D-810")
+            summary = []
+        else:
+            self.lbl_profile_info.setText("Rule profile of {0} functions (saved in {1})"
+                                          .format(len(rule_profiler.profiles), rule_profiler.log_dir))
+            summary = rule_profiler.get_summary()
+        self.table_rule_profile.setSortingEnabled(False)
+        self.table_rule_profile.setRowCount(len(summary))
+        self.table_rule_profile.setColumnCount(8)
+        self.table_rule_profile.setHorizontalHeaderLabels(("Rule", "Optimizer", "Attempts", "Candidates", "Matches",
+                                                           "Exceptions", "Total time (ms)", "Max time (ms)"))
+        for i, (optimizer_name, rule_name, rule_profile) in enumerate(summary):
+            row_values = [rule_name, optimizer_name, rule_profile.nb_attempts, rule_profile.nb_candidates,
+                          rule_profile.nb_matches, rule_profile.nb_exceptions, 1000 * rule_profile.total_time,
+                          1000 * rule_profile.max_time]
+            for j, value in enumerate(row_values):
+                cell = QtWidgets.QTableWidgetItem()
+                # Numbers are stored as data (not text) so that sorting is numeric
+                if isinstance(value, float):
+                    cell.setData(QtCore.Qt.DisplayRole, round(value, 3))
+                elif isinstance(value, int):
+                    cell.setData(QtCore.Qt.DisplayRole, value)
+                else:
+                    cell.setText(value)
+                cell.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
+                self.table_rule_profile.setItem(i, j, cell)
+        self.table_rule_profile.setSortingEnabled(True)
+        self.table_rule_profile.resizeColumnsToContents()
+
+
 class D810ConfigForm_t(ida_kernwin.PluginForm):
     def __init__(self, state):
         super().__init__()
@@ -382,6 +450,9 @@ class D810ConfigForm_t(ida_kernwin.PluginForm):
         self.btn_config.clicked.connect(self._configure_plugin)
         btn_split.addWidget(self.btn_config)
 
+        self.btn_rule_profile = QtWidgets.QPushButton('Rule profile')
+        self.btn_rule_profile.clicked.connect(self._show_rule_profile)
+        btn_split.addWidget(self.btn_rule_profile)
 
         self.btn_start = QtWidgets.QPushButton('Start')
         self.btn_start.clicked.connect(self._start_d810)
@@ -478,6 +549,8 @@ class D810ConfigForm_t(ida_kernwin.PluginForm):
         editdlg.update_form(description, start_ins_rules, start_blk_rules, path)
         if editdlg.exec_() == QtWidgets.QDialog.Accepted:
             new_config = ProjectConfiguration(editdlg.config_path, editdlg.config_description, editdlg.config_ins_rules, editdlg.config_blk_rules)
+            if old_conf is not None:
+                new_config.additional_configuration = old_conf.additional_configuration
             new_config.save()
             if old_conf is None:
                 self.state.add_project(new_config)
@@ -507,6 +580,11 @@ class D810ConfigForm_t(ida_kernwin.PluginForm):
             return
         return
 
+    def _show_rule_profile(self):
+        logger.debug("Calling _show_rule_profile")
+        profiledlg = RuleProfileForm_t(self.parent, self.state)
+        profiledlg.exec_()
+
     def _start_d810(self):
         logger.debug("Calling _start_d810")
         self.state.start_d810()
@@ -0,0 +1,283 @@
+import logging
+from typing import Dict, List, Tuple, Union
+from ida_hexrays import *
+
+from d810.ast import AstNode, AstLeaf, AstConstant
+from d810.hexrays_helpers import AND_TABLE
+
+logger = logging.getLogger('D810')
+
+# Linear MBA simplification (see SiMBA, "Efficient Deobfuscation of Linear Mixed Boolean-Arithmetic Expressions"):
+# a linear MBA expression is a linear combination a_0 + a_1 * e_1(x) + ... + a_k * e_k(x) of bitwise expressions e_i of
+# the variables x = (x_1, ..., x_t). Each bit of a bitwise expression only depends on the same bit of the variables, so
+# the expression is fully described by its "truth values" F(v) = sum(a_i * e_i(v)) on the 2^t vectors v of {0, 1}^t
+# (the constant a_0 being a_0 * -1 with -1 the bitwise expression whose bits are all set):
+#   expression(x) = sum over the bits b of 2^b * F(bits b of x)
+# Writing F as a sum of conjunctions (F(v) = sum over the subsets S of c_S * AND(v_i for i in S)) gives the linear
+# combination expression = sum(c_S * AND(x_i for i in S)) (with AND() = -1), from which the smallest equivalent
+# expression is built.
+
+BITWISE_OPCODES = [m_and, m_or, m_xor, m_bnot]
+DEFAULT_MAX_NB_VARIABLES = 4
+# Bitwise expressions with at most MAX_BITWISE_EXPRESSION_COST operations are searched for each truth table
+MAX_BITWISE_EXPRESSION_COST = 4
+
+# A bitwise expression is either a variable index or a tuple (opcode, left[, right]) of bitwise expressions
+BitwiseExpression = Union[int, Tuple]
+# A linear combination is a list of (coefficient, bitwise expression) terms and a constant
+LinearCombination = Tuple[List[Tuple[int, BitwiseExpression]], int]
+
+_bitwise_expression_tables = {}
+
+
+def is_linear_mba(ast: Union[AstNode, AstLeaf], size: int) -> bool:
+    # True if ast is a linear combination of bitwise expressions whose variables and operations are size bytes wide.
+    # The constants inside bitwise expressions must be 0 or -1, since other constants don't have the same value on
+    # each bit
+    if ast.is_leaf():
+        return ast.mop is not None and ast.mop.size == size
+    if ast.dest_size != size:
+        return False
+    if ast.opcode in [m_add, m_sub]:
+        return is_linear_mba(ast.left, size) and is_linear_mba(ast.right, size)
+    elif ast.opcode in [m_neg, m_mov]:
+        return is_linear_mba(ast.left, size)
+    elif ast.opcode == m_mul:
+        if ast.left.is_leaf() and ast.left.is_constant():
+            return is_linear_mba(ast.right, size)
+        if ast.right.is_leaf() and ast.right.is_constant():
+            return is_linear_mba(ast.left, size)
+        return False
+    return _is_bitwise(ast, size)
+
+
+def _is_bitwise(ast: Union[AstNode, AstLeaf], size: int) -> bool:
+    if ast.is_leaf():
+        if ast.mop is None or ast.mop.size != size:
+            return False
+        return not ast.is_constant() or ast.value in [0, AND_TABLE[size]]
+    if ast.dest_size != size or ast.opcode not in BITWISE_OPCODES + [m_mov]:
+        return False
+    if ast.opcode in [m_bnot, m_mov]:
+        return _is_bitwise(ast.left, size)
+    return _is_bitwise(ast.left, size) and _is_bitwise(ast.right, size)
+
+
+def get_ast_cost(ast: Union[None, AstNode, AstLeaf]) -> int:
+    # Number of operations of an expression (m_mov excepted)
+    if ast is None or ast.is_leaf():
+        return 0
+    cost = 0 if ast.opcode == m_mov else 1
+    return cost + get_ast_cost(ast.left) + get_ast_cost(ast.right)
+
+
+def get_truth_values(ast: AstNode, variable_ast_index_list: List[int], size: int) -> List[int]:
+    # F(v) for each v in {0, 1}^t (bit i of the index of F is the value of variable i).
+    # The expression is evaluated with each variable equal to 0 or 1: on these inputs the bits 1 to n-1 of the
+    # variables are 0, so expression(v) = F(v) + (2^n - 2) * F(0), i.e. F(0) = -expression(0) and
+    # F(v) = expression(v) - 2 * expression(0)
+    mask = AND_TABLE[size]
+    evaluator = ast.get_evaluator()
+    values = []
+    for v in range(1 << len(variable_ast_index_list)):
+        values.append(evaluator({ast_index: (v >> i) & 1 for i, ast_index in enumerate(variable_ast_index_list)}))
+    return [(value - 2 * values[0]) & mask for value in values]
+
+
+def get_conjunction_coefficients(truth_values: List[int], nb_variables: int, size: int) -> List[int]:
+    # c_S for each subset S of the variables (bit i of the index of c is set if variable i is in S), computed with the
+    # Moebius transform of F
+    mask = AND_TABLE[size]
+    coefficients = list(truth_values)
+    for i in range(nb_variables):
+        for subset in range(1 << nb_variables):
+            if subset & (1 << i):
+                coefficients[subset] = (coefficients[subset] - coefficients[subset ^ (1 << i)]) & mask
+    return coefficients
+
+
+def get_bitwise_expression_table(nb_variables: int) -> Dict[int, BitwiseExpression]:
+    # Cheapest bitwise expression (with at most MAX_BITWISE_EXPRESSION_COST operations) of each truth table reachable,
+    # the truth table of an expression being the integer whose bit v is the value of the expression on v.
+    # Built once for each number of variables, by increasing cost
+    if nb_variables in _bitwise_expression_tables.keys():
+        return _bitwise_expression_tables[nb_variables]
+    all_ones = (1 << (1 << nb_variables)) - 1
+    table = {}
+    truth_tables_by_cost = [[]]
+    for i in range(nb_variables):
+        truth_table = sum(1 << v for v in range(1 << nb_variables) if (v >> i) & 1)
+        table[truth_table] = i
+        truth_tables_by_cost[0].append(truth_table)
+
+    for cost in range(1, MAX_BITWISE_EXPRESSION_COST + 1):
+        new_truth_tables = []
+        for truth_table in truth_tables_by_cost[cost - 1]:
+            _add_bitwise_expression(table, new_truth_tables, ~truth_table & all_ones, (m_bnot, table[truth_table]))
+        for left_cost in range((cost - 1) // 2 + 1):
+            right_cost = cost - 1 - left_cost
+            for left_truth_table in truth_tables_by_cost[left_cost]:
+                for right_truth_table in truth_tables_by_cost[right_cost]:
+                    left, right = table[left_truth_table], table[right_truth_table]
+                    _add_bitwise_expression(table, new_truth_tables, left_truth_table & right_truth_table,
+                                            (m_and, left, right))
+                    _add_bitwise_expression(table, new_truth_tables, left_truth_table | right_truth_table,
+                                            (m_or, left, right))
+                    _add_bitwise_expression(table, new_truth_tables, left_truth_table ^ right_truth_table,
+                                            (m_xor, left, right))
+        truth_tables_by_cost.append(new_truth_tables)
+    _bitwise_expression_tables[nb_variables] = table
+    return table
+
+
+def _add_bitwise_expression(table: Dict[int, BitwiseExpression], new_truth_tables: List[int], truth_table: int,
+                            expression: BitwiseExpression):
+    if truth_table not in table.keys():
+        table[truth_table] = expression
+        new_truth_tables.append(truth_table)
+
+
+def get_bitwise_expression_cost(expression: BitwiseExpression) -> int:
+    if isinstance(expression, int):
+        return 0
+    return 1 + sum(get_bitwise_expression_cost(operand) for operand in expression[1:])
+
+
+def get_linear_combination_cost(linear_combination: LinearCombination, size: int) -> int:
+    # Number of operations of the expression built by linear_combination_to_ast
+    terms, constant = linear_combination
+    mask = AND_TABLE[size]
+    cost = 0
+    for i, (coefficient, expression) in enumerate(_get_ordered_terms(terms, size)):
+        cost += get_bitwise_expression_cost(expression)
+        if i > 0:
+            # m_add or m_sub
+            cost += 1
+            if _is_negative(coefficient, size):
+                coefficient = -coefficient & mask
+        if coefficient != 1:
+            # m_neg or m_mul
+            cost += 1
+    if len(terms) > 0 and constant != 0:
+        cost += 1
+    return cost
+
+
+def _is_negative(value: int, size: int) -> bool:
+    return value & (1 << (8 * size - 1)) != 0
+
+
+def _get_ordered_terms(terms: List[Tuple[int, BitwiseExpression]], size: int) -> List[Tuple[int, BitwiseExpression]]:
+    # The terms whose coefficient is "negative" (sign bit set) are put last, to be subtracted
+    return [term for term in terms if not _is_negative(term[0], size)] + \
+           [term for term in terms if _is_negative(term[0], size)]
+
+
+def get_linear_combination_candidates(truth_values: List[int], nb_variables: int, size: int) \
+        -> List[LinearCombination]:
+    mask = AND_TABLE[size]
+    all_ones = (1 << (1 << nb_variables)) - 1
+    # Sum of conjunctions: always available
+    coefficients = get_conjunction_coefficients(truth_values, nb_variables, size)
+    terms = []
+    for subset in range(1, 1 << nb_variables):
+        if coefficients[subset] == 0:
+            continue
+        conjunction = None
+        for i in range(nb_variables):
+            if subset & (1 << i):
+                conjunction = i if conjunction is None else (m_and, conjunction, i)
+        terms.append((coefficients[subset], conjunction))
+    candidates = [(terms, -coefficients[0] & mask)]
+
+    # Sum of indicators: F(v) = base + sum over the other values u of F of (u - base) * [F(v) == u], thus
+    # expression = -base + sum((u - base) * e_u(x)) with e_u the bitwise expression of the truth table [F(v) == u]
+    table = get_bitwise_expression_table(nb_variables)
+    distinct_values = sorted(set(truth_values))
+    for base in distinct_values + ([0] if 0 not in distinct_values else []):
+        terms = []
+        constant = -base & mask
+        for value in distinct_values:
+            if value == base:
+                continue
+            truth_table = sum(1 << v for v, truth_value in enumerate(truth_values) if truth_value == value)
+            if truth_table == all_ones:
+                constant = (constant - (value - base)) & mask
+                continue
+            if truth_table not in table.keys():
+                terms = None
+                break
+            terms.append(((value - base) & mask, table[truth_table]))
+        if terms is not None:
+            candidates.append((terms, constant))
+    return candidates
+
+
+def get_simplest_linear_combination(truth_values: List[int], nb_variables: int, size: int) -> LinearCombination:
+    candidates = get_linear_combination_candidates(truth_values, nb_variables, size)
+    return min(candidates, key=lambda candidate: get_linear_combination_cost(candidate, size))
+
+
+def linear_combination_to_ast(linear_combination: LinearCombination, variable_ast_list: List[AstLeaf],
+                              size: int) -> Union[AstNode, AstLeaf]:
+    # Builds the expression term_1 +/- term_2 ... +/- constant, with term_i = coefficient * bitwise expression
+    terms, constant = linear_combination
+    mask = AND_TABLE[size]
+    res = None
+    for coefficient, expression in _get_ordered_terms(terms, size):
+        is_subtracted = res is not None and _is_negative(coefficient, size)
+        if is_subtracted:
+            coefficient = -coefficient & mask
+        term = _bitwise_expression_to_ast(expression, variable_ast_list)
+        if coefficient == mask:
+            term = AstNode(m_neg, term)
+        elif coefficient != 1:
+            term = AstNode(m_mul, term, _create_constant_leaf(coefficient, size))
+        if res is None:
+            res = term
+        else:
+            res = AstNode(m_sub if is_subtracted else m_add, res, term)
+    if res is None:
+        return _create_constant_leaf(constant, size)
+    if constant == 0:
+        return res
+    if _is_negative(constant, size):
+        return AstNode(m_sub, res, _create_constant_leaf(-constant & mask, size))
+    return AstNode(m_add, res, _create_constant_leaf(constant, size))
+
+
+def _bitwise_expression_to_ast(expression: BitwiseExpression, variable_ast_list: List[AstLeaf]) \
+        -> Union[AstNode, AstLeaf]:
+    if isinstance(expression, int):
+        variable_leaf = AstLeaf(variable_ast_list[expression].name)
+        variable_leaf.mop = variable_ast_list[expression].mop
+        return variable_leaf
+    if expression[0] == m_bnot:
+        return AstNode(m_bnot, _bitwise_expression_to_ast(expression[1], variable_ast_list))
+    return AstNode(expression[0], _bitwise_expression_to_ast(expression[1], variable_ast_list),
+                   _bitwise_expression_to_ast(expression[2], variable_ast_list))
+
+
+def _create_constant_leaf(value: int, size: int) -> AstConstant:
+    cst_mop = mop_t()
+    cst_mop.make_number(value, size)
+    cst_leaf = AstConstant("c_0x{0:x}".format(value), value, size)
+    cst_leaf.mop = cst_mop
+    return cst_leaf
+
+
+def simplify_linear_mba(ast: AstNode, size: int, max_nb_variables: int = DEFAULT_MAX_NB_VARIABLES) \
+        -> Union[None, AstNode, AstLeaf]:
+    # Returns an expression equivalent to ast with fewer operations, or None if ast is not a linear MBA expression
+    # (of at most max_nb_variables variables) or if it can't be simplified
+    if not is_linear_mba(ast, size):
+        return None
+    leaf_info_list, _, _ = ast.get_information()
+    if len(leaf_info_list) == 0 or len(leaf_info_list) > max_nb_variables:
+        return None
+    variable_ast_list = [leaf_info.ast for leaf_info in leaf_info_list]
+    truth_values = get_truth_values(ast, [variable_ast.ast_index for variable_ast in variable_ast_list], size)
+    linear_combination = get_simplest_linear_combination(truth_values, len(variable_ast_list), size)
+    if get_linear_combination_cost(linear_combination, size) >= get_ast_cost(ast):
+        return None
+    return linear_combination_to_ast(linear_combination, variable_ast_list, size)
@@ -4,12 +4,15 @@ import logging
 import logging.config
 from pathlib import Path
 
+from d810.log_writer import async_log_writer
+
 LOG_CONFIG_FILENAME = "log.ini"
 LOG_FILENAME = "d810.log"
 Z3_TEST_FILENAME = "z3_check_instructions_substitution.py"
 
 
 def clear_logs(log_dir):
+    async_log_writer.flush()
     shutil.rmtree(log_dir, ignore_errors=True)
 
 
@@ -0,0 +1,114 @@
+import sys
+import queue
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+# Files written during decompilation (Z3 substitution log, pattern guess log, microcode dumps) are written by a
+# background thread, so that the optimizer callbacks only pay for an enqueue.
+# This module is not in manager_info.json: it is not reloaded with the plugin, so that there is a single writer thread
+# (and a single queue) for the whole IDA session.
+
+# Maximum number of pending writes: when the queue is full, the callbacks wait for the writer thread
+DEFAULT_LOG_QUEUE_SIZE = 16384
+# Maximum number of writes grouped before the files are opened and written
+DEFAULT_LOG_BATCH_SIZE = 1024
+
+_STOP = object()
+
+
+class AsyncLogWriter(object):
+    def __init__(self, max_queue_size: int = DEFAULT_LOG_QUEUE_SIZE, batch_size: int = DEFAULT_LOG_BATCH_SIZE):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.batch_size = batch_size
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        self.nb_writes = 0
+        self.nb_batches = 0
+
+    def _start(self):
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="D810 log writer", daemon=True)
+                self.thread.start()
+
+    def write(self, path: str, text: str, truncate: bool = False):
+        # Appends text to the file, or replaces its content if truncate is True. Writes are done in order.
+        if self.thread is None or not self.thread.is_alive():
+            self._start()
+        self.queue.put((path, text, truncate))
+
+    def flush(self):
+        # Waits until all the pending writes are on disk
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.join()
+
+    def close(self):
+        with self.thread_lock:
+            thread = self.thread
+            self.thread = None
+        if thread is None or not thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        thread.join()
+
+    def _get_batch(self) -> List:
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        is_stopped = False
+        while not is_stopped:
+            batch = self._get_batch()
+            is_stopped = batch[-1] is _STOP
+            try:
+                self._write_batch([x for x in batch if x is not _STOP])
+            except Exception as e:
+                # The writer thread must survive, otherwise flush would wait forever
+                sys.stderr.write("D-810 log writer error: {0}\n".format(e))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write_batch(self, batch: List[Tuple[str, str, bool]]):
+        # Each file is opened once per batch: its writes are concatenated (a truncation drops the previous ones)
+        chunks_by_path = {}  # type: Dict[str, Tuple[str, List[str]]]
+        for path, text, truncate in batch:
+            if truncate or path not in chunks_by_path.keys():
+                chunks_by_path[path] = ("w" if truncate else "a", [])
+            chunks_by_path[path][1].append(text)
+        for path, (mode, chunks) in chunks_by_path.items():
+            try:
+                with open(path, mode) as f:
+                    f.write("".join(chunks))
+            except OSError as e:
+                sys.stderr.write("D-810 log writer can't write {0}: {1}\n".format(path, e))
+        self.nb_writes += len(batch)
+        self.nb_batches += 1
+
+
+async_log_writer = AsyncLogWriter()
+
+
+class AsyncFileHandler(logging.Handler):
+    # Replacement of logging.FileHandler whose records are written by async_log_writer (used in log.ini)
+    def __init__(self, filename: str, mode: str = "a"):
+        super().__init__()
+        self.filename = filename
+        if mode == "w":
+            async_log_writer.write(self.filename, "", truncate=True)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            async_log_writer.write(self.filename, self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        async_log_writer.flush()
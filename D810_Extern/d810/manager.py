@@ -1,6 +1,7 @@
 from __future__ import annotations
 import os
 import json
+import time
 import logging
 import idaapi
 
@@ -40,6 +41,7 @@ class D810Manager(object):
         self.hx_decompiler_hook = None
         self.log_dir = log_dir
         self.config = {}
+        self.rule_profiler = None
 
     def configure(self, **kwargs):
         self.config = kwargs
@@ -47,9 +49,14 @@ class D810Manager(object):
     def reload(self):
         self.stop()
         logger.debug("Reloading manager...")
+        start_time = time.perf_counter()
 
         from d810.hexrays_hooks import InstructionOptimizerManager, BlockOptimizerManager, HexraysDecompilationHook
+        from d810.profiler import RuleProfiler
 
+        self.rule_profiler = None
+        if self.config.get("profile_rules", False):
+            self.rule_profiler = RuleProfiler(log_dir=self.log_dir)
         self.instruction_optimizer = InstructionOptimizerManager(self)
         self.instruction_optimizer.configure(**self.instruction_optimizer_config)
         self.block_optimizer = BlockOptimizerManager(self)
@@ -68,6 +75,9 @@ class D810Manager(object):
 
         self.hx_decompiler_hook = HexraysDecompilationHook(self)
         self.hx_decompiler_hook.hook()
+        logger.info("Manager reloaded in {0:.3f}s ({1} instruction rules, {2} block rules)"
+                    .format(time.perf_counter() - start_time, len(self.instruction_optimizer_rules),
+                            len(self.block_optimizer_rules)))
 
     def configure_instruction_optimizer(self, rules, **kwargs):
         self.instruction_optimizer_rules = [rule for rule in rules]
@@ -78,6 +88,14 @@ class D810Manager(object):
         self.block_optimizer_config = kwargs
 
     def stop(self):
+        if self.rule_profiler is not None:
+            self.rule_profiler.save()
+        from d810.z3_cache import z3_verdict_cache
+        z3_verdict_cache.close()
+        from d810.z3_backend import close_z3_backend
+        close_z3_backend()
+        from d810.log_writer import async_log_writer
+        async_log_writer.close()
         if self.instruction_optimizer is not None:
             logger.debug("Removing InstructionOptimizer...")
             self.instruction_optimizer.remove()
@@ -145,6 +163,7 @@ class D810State(object):
         os.remove(config.path)
 
     def load_project(self, project_index: int):
+        start_time = time.perf_counter()
         self.current_project_index = project_index
         self.current_project = self.projects[project_index]
         self.current_ins_rules = []
@@ -165,14 +184,25 @@ class D810State(object):
                     self.current_blk_rules.append(blk_rule)
         logger.debug("Block rules configured")
         self.manager.configure(**self.current_project.additional_configuration)
-        logger.debug("Project loaded.")
+        logger.info("Project {0} loaded in {1:.3f}s".format(self.current_project.path,
+                                                            time.perf_counter() - start_time))
 
     def start_d810(self):
         print("D-810 ready to deobfuscate...")
+        from d810.z3_cache import Z3_VERDICT_CACHE_FILENAME
+        z3_verdict_cache_path = None
+        if self.d810_config.get("use_z3_verdict_cache", True):
+            # In the IDA user directory: not in the log directory, which may be erased when the plugin is reloaded,
+            # nor in the plugin directory (the default log directory)
+            z3_verdict_cache_path = os.path.join(idaapi.get_user_idadir(), Z3_VERDICT_CACHE_FILENAME)
         self.manager.configure_instruction_optimizer([rule for rule in self.current_ins_rules],
                                                      generate_z3_code=self.d810_config.get("generate_z3_code"),
                                                      dump_intermediate_microcode=self.d810_config.get(
                                                          "dump_intermediate_microcode"),
+                                                     use_z3_verdict_cache=z3_verdict_cache_path is not None,
+                                                     z3_verdict_cache_path=z3_verdict_cache_path,
+                                                     z3_nb_workers=self.d810_config.get("z3_nb_workers", 0),
+                                                     z3_worker_python=self.d810_config.get("z3_worker_python", None),
                                                      **self.current_project.additional_configuration)
         self.manager.configure_block_optimizer([rule for rule in self.current_blk_rules],
                                                **self.current_project.additional_configuration)
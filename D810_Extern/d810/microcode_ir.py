@@ -0,0 +1,160 @@
+from typing import Union, Dict
+from ida_hexrays import *
+
+from d810.hexrays_helpers import get_mop_ignore_size_key, CONTROL_FLOW_OPCODES
+
+# Compact representation of the microcode executed by the emulator (see MicroCodeInterpreter): each minsn_t is decoded
+# once into a DecodedInstruction whose fields (opcode, operand types, sizes, constants, register/stack keys, ...) are
+# plain Python values, instead of being read through the SWIG proxies each time the instruction is executed.
+# Since the same dispatcher blocks are emulated once per dispatcher father (and the same paths are executed again by
+# each MopHistory), decoded blocks are cached per (mba, block serial) in decoded_block_cache.
+# The cache must be invalidated each time the microcode is modified: the functions of cfg_utils modifying the CFG and
+# BlockOptimizerManager call invalidate_decoded_blocks.
+
+# Mop types whose value is found in a MicroCodeEnvironment
+ENVIRONMENT_MOP_TYPES = [mop_r, mop_S]
+
+# How an instruction is evaluated by MicroCodeInterpreter
+INS_KIND_CONTROL_FLOW = 0
+INS_KIND_HELPER_CALL = 1
+INS_KIND_CALL = 2
+INS_KIND_OTHER = 3
+
+
+class DecodedMop(object):
+    # Only the fields meaningful for the mop type are set:
+    #  - mop_n: value
+    #  - mop_r, mop_S: key (get_mop_ignore_size_key of the mop, used by MopMapping)
+    #  - mop_d: sub_ins (DecodedInstruction)
+    #  - mop_a: a_t (type of the address operand) and value (its global address or stack offset)
+    #  - mop_v: g
+    #  - mop_b: b
+    #  - mop_h: helper
+    #  - mop_f: args (list of DecodedMop)
+    #  - mop_c: cases (list of (values, target block serial))
+    # mop is the original mop_t, it is used for logging and stored as key in the environments.
+    __slots__ = ["t", "size", "mop", "key", "value", "sub_ins", "a_t", "g", "b", "helper", "args", "cases"]
+
+    def __init__(self, mop: mop_t):
+        self.t = mop.t
+        self.size = mop.size
+        self.mop = mop
+        self.key = None
+        self.value = None
+        self.sub_ins = None
+        self.a_t = None
+        self.g = None
+        self.b = None
+        self.helper = None
+        self.args = None
+        self.cases = None
+        if self.t == mop_n:
+            self.value = mop.nnn.value
+        elif self.t in ENVIRONMENT_MOP_TYPES:
+            self.key = get_mop_ignore_size_key(mop)
+        elif self.t == mop_d:
+            self.sub_ins = DecodedInstruction(mop.d)
+        elif self.t == mop_a:
+            self.a_t = mop.a.t
+            if self.a_t == mop_v:
+                self.value = mop.a.g
+            elif self.a_t == mop_S:
+                self.value = mop.a.s.off
+        elif self.t == mop_v:
+            self.g = mop.g
+        elif self.t == mop_b:
+            self.b = mop.b
+        elif self.t == mop_h:
+            self.helper = mop.helper
+        elif self.t == mop_f:
+            self.args = [DecodedMop(x) for x in mop.f.args]
+        elif self.t == mop_c:
+            self.cases = [([x for x in values], target) for values, target in zip(mop.c.values, mop.c.targets)]
+
+
+def get_instruction_kind(opcode: int, l: DecodedMop) -> int:
+    if opcode in CONTROL_FLOW_OPCODES:
+        return INS_KIND_CONTROL_FLOW
+    if opcode == m_call:
+        return INS_KIND_HELPER_CALL if l.t == mop_h else INS_KIND_CALL
+    if opcode == m_icall:
+        return INS_KIND_CALL
+    return INS_KIND_OTHER
+
+
+class DecodedInstruction(object):
+    # ins is the original minsn_t: it is used for logging and returned to the callers of the emulator
+    __slots__ = ["opcode", "kind", "ea", "l", "r", "d", "ins"]
+
+    def __init__(self, ins: minsn_t):
+        self.opcode = ins.opcode
+        self.ea = ins.ea
+        self.l = DecodedMop(ins.l)
+        self.r = DecodedMop(ins.r)
+        self.d = DecodedMop(ins.d)
+        self.kind = get_instruction_kind(self.opcode, self.l)
+        self.ins = ins
+
+
+def get_instruction_id(ins: minsn_t) -> int:
+    # Address of the underlying C++ object: different proxies of the same instruction have the same id
+    return int(ins.this)
+
+
+class DecodedBlockCache(object):
+    def __init__(self):
+        # (mba entry ea, block serial) -> {instruction id: DecodedInstruction}
+        self.decoded_blocks = {}  # type: Dict[tuple, Dict[int, DecodedInstruction]]
+        self.nb_decoded_blocks = 0
+        self.nb_decoded_instructions = 0
+        self.nb_hits = 0
+        self.nb_invalidations = 0
+
+    def _decode_block(self, blk: mblock_t) -> Dict[int, DecodedInstruction]:
+        decoded_block = {}
+        cur_ins = blk.head
+        while cur_ins is not None:
+            decoded_block[get_instruction_id(cur_ins)] = DecodedInstruction(cur_ins)
+            cur_ins = cur_ins.next
+        self.nb_decoded_blocks += 1
+        self.nb_decoded_instructions += len(decoded_block)
+        return decoded_block
+
+    def get_instruction(self, blk: Union[None, mblock_t], ins: minsn_t) -> DecodedInstruction:
+        if blk is None:
+            self.nb_decoded_instructions += 1
+            return DecodedInstruction(ins)
+        block_key = (blk.mba.entry_ea, blk.serial)
+        decoded_block = self.decoded_blocks.get(block_key)
+        if decoded_block is None:
+            decoded_block = self._decode_block(blk)
+            self.decoded_blocks[block_key] = decoded_block
+        decoded_ins = decoded_block.get(get_instruction_id(ins))
+        if decoded_ins is None:
+            # Instruction which is not in the block (e.g. added to a MopHistory)
+            self.nb_decoded_instructions += 1
+            return DecodedInstruction(ins)
+        self.nb_hits += 1
+        return decoded_ins
+
+    def invalidate(self):
+        if len(self.decoded_blocks) > 0:
+            self.decoded_blocks = {}
+            self.nb_invalidations += 1
+
+    def reset_statistics(self):
+        self.nb_decoded_blocks = 0
+        self.nb_decoded_instructions = 0
+        self.nb_hits = 0
+        self.nb_invalidations = 0
+
+    def __str__(self):
+        return "{0} blocks ({1} instructions) decoded, {2} cache hits, {3} invalidations" \
+            .format(self.nb_decoded_blocks, self.nb_decoded_instructions, self.nb_hits, self.nb_invalidations)
+
+
+decoded_block_cache = DecodedBlockCache()
+
+
+def invalidate_decoded_blocks():
+    decoded_block_cache.invalidate()
@@ -166,7 +166,8 @@ class GenericDispatcherInfo(object):
         cur_ins = cur_blk.head
         # We will continue emulation while we are in one of the dispatcher blocks
         while self.should_emulation_continue(cur_blk):
-            unflat_logger.debug("  Executing: {0}.{1}".format(cur_blk.serial, format_minsn_t(cur_ins)))
+            if unflat_logger.isEnabledFor(logging.DEBUG):
+                unflat_logger.debug("  Executing: {0}.{1}".format(cur_blk.serial, format_minsn_t(cur_ins)))
             # We evaluate the current instruction of the dispatcher to determine
             # which block and instruction should be executed next
             is_ok = microcode_interpreter.eval_instruction(cur_blk, cur_ins, microcode_environment)
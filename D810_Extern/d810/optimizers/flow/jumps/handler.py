@@ -30,6 +30,7 @@ class JumpOptimizationRule(InstructionOptimizationRule):
         self.fuzz_patterns = self.FUZZ_PATTERNS
         self.left_pattern_candidates = []
         self.right_pattern_candidates = []
+        self._candidates_fuzz_patterns = None
         self.jump_original_block_serial = None
         self.direct_block_serial = None
         self.jump_replacement_block_serial = None
@@ -42,6 +43,10 @@ class JumpOptimizationRule(InstructionOptimizationRule):
 
     def _generate_pattern_candidates(self):
         self.fuzz_patterns = self.FUZZ_PATTERNS
+        if self._candidates_fuzz_patterns == self.fuzz_patterns:
+            # Candidates were already generated with the same fuzz setting (e.g. when switching project)
+            return
+        self._candidates_fuzz_patterns = self.fuzz_patterns
         if self.LEFT_PATTERN is not None:
             self.LEFT_PATTERN.reset_mops()
             if not self.fuzz_patterns:
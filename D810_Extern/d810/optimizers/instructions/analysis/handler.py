@@ -1,7 +1,7 @@
 import logging
 from ida_hexrays import *
 from d810.hexrays_formatters import format_minsn_t
-from d810.optimizers.instructions.handler import InstructionOptimizer, InstructionOptimizationRule
+from d810.optimizers.instructions.handler import InstructionOptimizer, InstructionOptimizationRule, InstructionInfo
 
 
 optimizer_logger = logging.getLogger('D810.optimizer')
@@ -11,6 +11,11 @@ class InstructionAnalysisRule(InstructionOptimizationRule):
     def analyze_instruction(self, blk, ins):
         raise NotImplementedError
 
+    def analyze_instruction_info(self, blk, ins_info: InstructionInfo):
+        # Called by InstructionAnalyzer: rules using the AST of the instruction should override this method to use
+        # the AST shared by all optimizers (ins_info.ast)
+        return self.analyze_instruction(blk, ins_info.ins)
+
 
 class InstructionAnalyzer(InstructionOptimizer):
     RULE_CLASSES = [InstructionAnalysisRule]
@@ -20,16 +25,20 @@ class InstructionAnalyzer(InstructionOptimizer):
         for rule in self.rules:
             rule.set_maturity(self.cur_maturity)
 
-    def analyze(self, blk: mblock_t, ins: minsn_t):
+    def analyze(self, blk: mblock_t, ins: minsn_t, ins_info: InstructionInfo = None):
         if blk is not None:
             self.cur_maturity = blk.mba.maturity
 
         if self.cur_maturity not in self.maturities:
             return None
 
-        for rule in self.rules:
+        if ins_info is None:
+            ins_info = InstructionInfo(ins)
+        for rule in self.get_candidate_rules(ins_info):
+            if not rule.may_optimize(ins_info):
+                continue
             try:
-                rule.analyze_instruction(blk, ins)
+                rule.analyze_instruction_info(blk, ins_info)
             except RuntimeError:
                 optimizer_logger.error("error during rule {0} for instruction {1}".format(rule, format_minsn_t(ins)))
         return None
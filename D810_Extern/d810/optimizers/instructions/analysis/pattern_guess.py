@@ -1,9 +1,10 @@
 import os
 
-from d810.ast import minsn_to_ast
+from d810.log_writer import async_log_writer
 from d810.hexrays_formatters import format_minsn_t, format_mop_t, maturity_to_string
 
 from d810.optimizers.handler import DEFAULT_INSTRUCTION_MATURITIES
+from d810.optimizers.instructions.handler import InstructionInfo
 from d810.optimizers.instructions.analysis.handler import InstructionAnalysisRule
 from d810.optimizers.instructions.analysis.utils import get_possible_patterns
 
@@ -26,8 +27,7 @@ class ExampleGuessingRule(InstructionAnalysisRule):
         self.pattern_filename_path = None
 
     def log_info(self, message):
-        with open(self.pattern_filename_path, "a") as f:
-            f.write('{0}\n'.format(message))
+        async_log_writer.write(self.pattern_filename_path, '{0}\n'.format(message))
 
     def set_maturity(self, maturity):
         self.log_info("Patterns guessed at maturity {0}".format(maturity_to_string(maturity)))
@@ -36,8 +36,7 @@ class ExampleGuessingRule(InstructionAnalysisRule):
     def set_log_dir(self, log_dir):
         super().set_log_dir(log_dir)
         self.pattern_filename_path = os.path.join(self.log_dir, "pattern_guess.log")
-        f = open(self.pattern_filename_path, "w")
-        f.close()
+        async_log_writer.write(self.pattern_filename_path, "", truncate=True)
 
     def configure(self, kwargs):
         super().configure(kwargs)
@@ -56,12 +55,15 @@ class ExampleGuessingRule(InstructionAnalysisRule):
             self.max_nb_diff_opcodes = 0xff
 
     def analyze_instruction(self, blk, ins):
+        return self.analyze_instruction_info(blk, InstructionInfo(ins))
+
+    def analyze_instruction_info(self, blk, ins_info: InstructionInfo):
         if self.cur_maturity not in self.maturities:
             return None
-        formatted_ins = str(format_minsn_t(ins))
+        formatted_ins = str(format_minsn_t(ins_info.ins))
         if formatted_ins in self.cur_ins_guessed:
             return False
-        tmp = minsn_to_ast(ins)
+        tmp = ins_info.ast
         if tmp is None:
             return False
         is_good_candidate = self.check_if_possible_pattern(tmp)
@@ -341,6 +341,7 @@ class ArithmeticChainSimplification(object):
 
 class XorChain(ChainSimplificationRule):
     DESCRIPTION = "Remove XOR chains with common terms. E.g. x ^ 4 ^ y ^ 6 ^ 5 ^ x ==> y ^ 7"
+    ROOT_OPCODES = [m_xor]
 
     def check_and_replace(self, blk, ins):
         xor_simplifier = ChainSimplification(m_xor)
@@ -350,6 +351,7 @@ class XorChain(ChainSimplificationRule):
 
 class AndChain(ChainSimplificationRule):
     DESCRIPTION = "Remove AND chains with common terms. E.g. x & 4 & y & 6 & 5 & x ==> x & y & 4"
+    ROOT_OPCODES = [m_and]
 
     def check_and_replace(self, blk, ins):
         and_simplifier = ChainSimplification(m_and)
@@ -359,6 +361,7 @@ class AndChain(ChainSimplificationRule):
 
 class OrChain(ChainSimplificationRule):
     DESCRIPTION = "Remove OR chains with common terms. E.g. x | 4 | y | 6 | 5 | x ==> x | y | 7"
+    ROOT_OPCODES = [m_or]
 
     def check_and_replace(self, blk, ins):
         or_simplifier = ChainSimplification(m_or)
@@ -368,6 +371,7 @@ class OrChain(ChainSimplificationRule):
 
 class ArithmeticChain(ChainSimplificationRule):
     DESCRIPTION = "Remove arithmetic chains with common terms. E.g. x + 4 + y - (6 + x - 5) ==>  y + 3"
+    ROOT_OPCODES = [m_add, m_sub]
 
     def check_and_replace(self, blk, ins):
         arithmetic_simplifier = ArithmeticChainSimplification()
@@ -1,11 +1,13 @@
 from __future__ import annotations
+import time
 import logging
-from typing import List
+from typing import List, Union
 from ida_hexrays import *
 
 from d810.optimizers.handler import OptimizationRule
 from d810.hexrays_formatters import format_minsn_t
-from d810.ast import minsn_to_ast, AstNode
+from d810.ast import minsn_to_ast, AstNode, AstLeaf, AstBinding, AstStatistics, get_ast_statistics
+from d810.ast_canonical import CanonicalNode, CompiledPattern, get_canonical_ast
 from d810.errors import D810Exception
 
 
@@ -13,14 +15,66 @@ d810_logger = logging.getLogger('D810')
 optimizer_logger = logging.getLogger('D810.optimizer')
 
 
+class InstructionInfo(object):
+    # Instruction being optimized, shared by all the instruction optimizers and rules: its AST (and canonical AST) is
+    # built at most once, and only if a rule needs it
+    __slots__ = ["ins", "_ast", "_is_ast_computed", "_canonical_ast", "_statistics"]
+
+    def __init__(self, ins: minsn_t):
+        self.ins = ins
+        self._ast = None
+        self._is_ast_computed = False
+        self._canonical_ast = None
+        self._statistics = None
+
+    @property
+    def ast(self) -> Union[None, AstNode, AstLeaf]:
+        if not self._is_ast_computed:
+            self._ast = minsn_to_ast(self.ins)
+            self._is_ast_computed = True
+        return self._ast
+
+    @property
+    def canonical_ast(self) -> Union[None, CanonicalNode, AstLeaf]:
+        if self._canonical_ast is None:
+            self._canonical_ast = get_canonical_ast(self.ast)
+        return self._canonical_ast
+
+    @property
+    def statistics(self) -> Union[None, AstStatistics]:
+        if self._statistics is None and self.ast is not None:
+            self._statistics = get_ast_statistics(self.ast)
+        return self._statistics
+
+
 class InstructionOptimizationRule(OptimizationRule):
+    # Opcodes of the instructions the rule may optimize (None if the rule accepts all opcodes)
+    ROOT_OPCODES = None
+
     def __init__(self):
         super().__init__()
         self.maturities = []
+        # Used by InstructionOptimizer to only call the rule on instructions it may optimize:
+        # root_opcodes is the list of accepted opcodes (None for all opcodes) and, if set, min_ast_statistics is a
+        # lower bound of the size of the AST of the instructions the rule may optimize
+        self.root_opcodes = self.ROOT_OPCODES
+        self.min_ast_statistics = None
+
+    def may_optimize(self, ins_info: InstructionInfo) -> bool:
+        if self.min_ast_statistics is None:
+            return True
+        if ins_info.statistics is None:
+            return False
+        return ins_info.statistics.is_at_least(self.min_ast_statistics)
 
     def check_and_replace(self, blk, ins):
         return None
 
+    def check_info_and_replace(self, blk: mblock_t, ins_info: InstructionInfo):
+        # Called by the optimizers: rules using the AST of the instruction should override this method to use the
+        # AST shared by all optimizers (ins_info.ast)
+        return self.check_and_replace(blk, ins_info.ins)
+
 
 class GenericPatternRule(InstructionOptimizationRule):
     PATTERN = None
@@ -32,35 +86,68 @@ class GenericPatternRule(InstructionOptimizationRule):
         self.pattern_candidates = [self.PATTERN]
         if self.PATTERNS is not None:
             self.pattern_candidates += self.PATTERNS
+        self.compiled_patterns = [CompiledPattern(x) for x in self.pattern_candidates if x is not None]
+        self.update_instruction_filter()
 
-    def check_candidate(self, candidate: AstNode):
+    def update_instruction_filter(self):
+        # Computes root_opcodes and min_ast_statistics from the patterns of the rule
+        if len(self.compiled_patterns) == 0:
+            return
+        root_opcodes = []
+        min_ast_statistics = None
+        for compiled_pattern in self.compiled_patterns:
+            pattern_root_opcodes = compiled_pattern.get_root_opcodes()
+            if pattern_root_opcodes is None or root_opcodes is None:
+                root_opcodes = None
+            else:
+                root_opcodes += [x for x in pattern_root_opcodes if x not in root_opcodes]
+            pattern_statistics = compiled_pattern.get_min_ast_statistics()
+            if min_ast_statistics is None:
+                min_ast_statistics = pattern_statistics
+            else:
+                min_ast_statistics = AstStatistics(min(min_ast_statistics.depth, pattern_statistics.depth),
+                                                   min(min_ast_statistics.nb_opcodes, pattern_statistics.nb_opcodes),
+                                                   min(min_ast_statistics.nb_leafs, pattern_statistics.nb_leafs),
+                                                   min(min_ast_statistics.nb_constants,
+                                                       pattern_statistics.nb_constants))
+        self.root_opcodes = root_opcodes
+        self.min_ast_statistics = min_ast_statistics
+
+    def check_candidate(self, candidate: AstBinding):
         # Perform rule specific checks
         return False
 
-    def get_valid_candidates(self, instruction: minsn_t, stop_early=True):
+    def get_valid_candidates(self, instruction: minsn_t, stop_early=True, ins_info: InstructionInfo = None):
         valid_candidates = []
-        tmp = minsn_to_ast(instruction)
+        if ins_info is None:
+            ins_info = InstructionInfo(instruction)
+        tmp = ins_info.ast
         if tmp is None:
             return []
-        for candidate_pattern in self.pattern_candidates:
-            if not candidate_pattern.check_pattern_and_copy_mops(tmp):
+        for compiled_pattern in self.compiled_patterns:
+            candidate = compiled_pattern.match(tmp)
+            if candidate is None:
                 continue
-            if not self.check_candidate(candidate_pattern):
+            if not self.check_candidate(candidate):
                 continue
-            valid_candidates.append(candidate_pattern)
+            valid_candidates.append(candidate)
             if stop_early:
                 return valid_candidates
         return []
 
-    def get_replacement(self, candidate: AstNode):
-        is_ok = self.REPLACEMENT_PATTERN.update_leafs_mop(candidate)
-        if not is_ok:
-            return None
-        new_ins = self.REPLACEMENT_PATTERN.create_minsn(candidate.ea, candidate.dst_mop)
+    def get_replacement(self, candidate: Union[AstNode, AstBinding]):
+        # The replacement is built directly from the candidate leafs: REPLACEMENT_PATTERN is not modified
+        for leaf in self.REPLACEMENT_PATTERN.get_leaf_list():
+            if leaf.name not in candidate.leafs_by_name:
+                return None
+        new_ins = self.REPLACEMENT_PATTERN.create_minsn(candidate.ea, candidate.dst_mop, candidate)
         return new_ins
 
     def check_and_replace(self, blk: mblock_t, instruction: minsn_t):
-        valid_candidates = self.get_valid_candidates(instruction, stop_early=True)
+        return self.check_info_and_replace(blk, InstructionInfo(instruction))
+
+    def check_info_and_replace(self, blk: mblock_t, ins_info: InstructionInfo):
+        valid_candidates = self.get_valid_candidates(ins_info.ins, stop_early=True, ins_info=ins_info)
         if len(valid_candidates) == 0:
             return None
         new_instruction = self.get_replacement(valid_candidates[0])
@@ -83,10 +170,15 @@ class InstructionOptimizer(object):
 
     def __init__(self, maturities: List[int], log_dir=None):
         self.rules = set()
+        # Dispatch table: rules which may optimize an instruction with a given opcode (in insertion order)
+        self.rules_by_opcode = {}
+        self.any_opcode_rules = []
         self.rules_usage_info = {}
         self.maturities = maturities
         self.log_dir = log_dir
         self.cur_maturity = MMAT_PREOPTIMIZED
+        # RuleProfiler set by the InstructionOptimizerManager when rule profiling is enabled
+        self.profiler = None
 
     def add_rule(self, rule: InstructionOptimizationRule):
         is_valid_rule_class = False
@@ -100,9 +192,24 @@ class InstructionOptimizer(object):
         if len(rule.maturities) == 0:
             rule.maturities = self.maturities
         self.rules.add(rule)
+        self._add_rule_to_dispatch_table(rule)
         self.rules_usage_info[rule.name] = 0
         return True
 
+    def _add_rule_to_dispatch_table(self, rule: InstructionOptimizationRule):
+        if rule.root_opcodes is None:
+            self.any_opcode_rules.append(rule)
+            for opcode_rules in self.rules_by_opcode.values():
+                opcode_rules.append(rule)
+            return
+        for opcode in rule.root_opcodes:
+            if opcode not in self.rules_by_opcode.keys():
+                self.rules_by_opcode[opcode] = list(self.any_opcode_rules)
+            self.rules_by_opcode[opcode].append(rule)
+
+    def get_candidate_rules(self, ins_info: InstructionInfo) -> List[InstructionOptimizationRule]:
+        return self.rules_by_opcode.get(ins_info.ins.opcode, self.any_opcode_rules)
+
     def reset_rule_usage_statistic(self):
         self.rules_usage_info = {}
         for rule in self.rules:
@@ -113,26 +220,39 @@ class InstructionOptimizer(object):
             if rule_nb_match > 0:
                 d810_logger.info("Instruction Rule '{0}' has been used {1} times".format(rule_name, rule_nb_match))
 
-    def get_optimized_instruction(self, blk: mblock_t, ins: minsn_t):
+    def get_optimized_instruction(self, blk: mblock_t, ins: minsn_t, ins_info: InstructionInfo = None):
         if blk is not None:
             self.cur_maturity = blk.mba.maturity
         # if self.cur_maturity not in self.maturities:
         #     return None
-        for rule in self.rules:
+        if ins_info is None:
+            ins_info = InstructionInfo(ins)
+        for rule in self.get_candidate_rules(ins_info):
             if self.cur_maturity not in rule.maturities:
                 continue
+            if not rule.may_optimize(ins_info):
+                continue
+            if self.profiler is not None:
+                start_time = time.perf_counter()
+            new_ins = None
+            nb_exceptions = 0
             try:
-                new_ins = rule.check_and_replace(blk, ins)
-                if new_ins is not None:
-                    self.rules_usage_info[rule.name] += 1
-                    optimizer_logger.info("Rule {0} matched:".format(rule.name))
-                    optimizer_logger.info("  orig: {0}".format(format_minsn_t(ins)))
-                    optimizer_logger.info("  new : {0}".format(format_minsn_t(new_ins)))
-                    return new_ins
+                new_ins = rule.check_info_and_replace(blk, ins_info)
             except RuntimeError as e:
                 optimizer_logger.error("Runtime error during rule {0} for instruction {1}: {2}".format(rule, format_minsn_t(ins), e))
+                nb_exceptions = 1
             except D810Exception as e:
                 optimizer_logger.error("D810Exception during rule {0} for instruction {1}: {2}".format(rule, format_minsn_t(ins), e))
+                nb_exceptions = 1
+            if self.profiler is not None:
+                self.profiler.record(self.name, rule.name, self.cur_maturity, time.perf_counter() - start_time,
+                                     nb_matches=int(new_ins is not None), nb_exceptions=nb_exceptions)
+            if new_ins is not None:
+                self.rules_usage_info[rule.name] += 1
+                optimizer_logger.info("Rule {0} matched:".format(rule.name))
+                optimizer_logger.info("  orig: {0}".format(format_minsn_t(ins)))
+                optimizer_logger.info("  new : {0}".format(format_minsn_t(new_ins)))
+                return new_ins
         return None
 
     @property
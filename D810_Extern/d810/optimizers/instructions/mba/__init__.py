@@ -0,0 +1,5 @@
+from d810.utils import get_all_subclasses
+from d810.optimizers.instructions.mba.handler import MbaRule, MbaOptimizer
+from d810.optimizers.instructions.mba.linear import *
+
+MBA_RULES = [x() for x in get_all_subclasses(MbaRule)]
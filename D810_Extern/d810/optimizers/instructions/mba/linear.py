@@ -0,0 +1,56 @@
+from ida_hexrays import *
+
+from d810.optimizers.instructions.handler import InstructionInfo
+from d810.optimizers.instructions.mba.handler import MbaRule
+from d810.ast import AstNode, AstStatistics
+from d810.linear_mba import DEFAULT_MAX_NB_VARIABLES, simplify_linear_mba
+from d810.z3_utils import Z3_INSTALLED, z3_check_mop_equality
+
+
+class LinearMbaSimplification(MbaRule):
+    DESCRIPTION = "Simplify linear MBA expressions (linear combinations of bitwise expressions) with their truth table"
+    ROOT_OPCODES = [m_add, m_sub, m_mul, m_neg, m_and, m_or, m_xor, m_bnot, m_mov]
+
+    def __init__(self):
+        super().__init__()
+        self.max_nb_variables = DEFAULT_MAX_NB_VARIABLES
+        self.min_nb_opcode = 2
+        self._update_min_ast_statistics()
+
+    def configure(self, kwargs):
+        super().configure(kwargs)
+        if "max_nb_variables" in kwargs.keys():
+            self.max_nb_variables = kwargs["max_nb_variables"]
+        if "min_nb_opcode" in kwargs.keys():
+            self.min_nb_opcode = kwargs["min_nb_opcode"]
+        self._update_min_ast_statistics()
+
+    def _update_min_ast_statistics(self):
+        self.min_ast_statistics = AstStatistics(nb_opcodes=self.min_nb_opcode, nb_leafs=1)
+
+    def check_info_and_replace(self, blk: mblock_t, ins_info: InstructionInfo):
+        # The simplified expression is only used if Z3 proves that it is equivalent to the original one
+        if not Z3_INSTALLED:
+            return None
+        ins = ins_info.ins
+        tmp = ins_info.ast
+        if tmp is None or tmp.is_leaf() or ins.d.size <= 0:
+            return None
+        new_ast = simplify_linear_mba(tmp, ins.d.size, self.max_nb_variables)
+        if new_ast is None:
+            return None
+        if new_ast.is_leaf():
+            new_ast = AstNode(m_mov, new_ast)
+        new_ins = new_ast.create_minsn(ins.ea, ins.d)
+        if not z3_check_mop_equality(get_expression_mop(ins), get_expression_mop(new_ins)):
+            return None
+        return new_ins
+
+
+def get_expression_mop(ins: minsn_t) -> mop_t:
+    # Mop of the value computed by the instruction
+    if ins.opcode == m_mov:
+        return ins.l
+    ins_mop = mop_t()
+    ins_mop.create_from_insn(ins)
+    return ins_mop
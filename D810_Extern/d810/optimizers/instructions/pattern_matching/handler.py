@@ -1,10 +1,18 @@
+from __future__ import annotations
+import time
 import logging
 import itertools
 from ida_hexrays import *
 from typing import List, Union
-from d810.optimizers.instructions.handler import GenericPatternRule, InstructionOptimizer, InstructionOptimizationRule
-from d810.ast import minsn_to_ast, AstNode, AstLeaf
+from d810.optimizers.instructions.handler import GenericPatternRule, InstructionOptimizer, \
+    InstructionOptimizationRule, InstructionInfo
+from d810.ast import AstNode, AstLeaf, AstConstant, AstBinding
+from d810.ast_canonical import CanonicalNode, CompiledPattern, is_ac_canonical_node
 from d810.hexrays_formatters import format_minsn_t, format_mop_t
+from d810.hexrays_helpers import get_minsn_structural_key
+from d810.egraph import EGraph, EGraphRewrite, EGraphStatistics, get_ac_rewrites, DEFAULT_EGRAPH_MAX_NODES, \
+    DEFAULT_EGRAPH_TIMEOUT_MS, DEFAULT_EGRAPH_MAX_ITERATIONS
+from d810.utils import LRUCache
 
 optimizer_logger = logging.getLogger('D810.optimizer')
 pattern_search_logger = logging.getLogger('D810.pattern_search')
@@ -19,6 +27,7 @@ class PatternMatchingRule(GenericPatternRule):
     def __init__(self):
         super().__init__()
         self.fuzz_pattern = self.FUZZ_PATTERN
+        self._candidates_fuzz_pattern = None
 
     def configure(self, fuzz_pattern=None, **kwargs):
         super().configure(kwargs)
@@ -32,6 +41,11 @@ class PatternMatchingRule(GenericPatternRule):
         self.fuzz_pattern = self.FUZZ_PATTERN
         if self.PATTERN is not None:
             self.PATTERN.reset_mops()
+        if self._candidates_fuzz_pattern == self.fuzz_pattern:
+            # Candidates only depend on the rule patterns and on the fuzz setting:
+            # they are not generated again each time a project is loaded
+            return
+        self._candidates_fuzz_pattern = self.fuzz_pattern
         if not self.fuzz_pattern:
             if self.PATTERN is not None:
                 self.pattern_candidates = [self.PATTERN]
@@ -39,163 +53,418 @@ class PatternMatchingRule(GenericPatternRule):
                     self.pattern_candidates += [x for x in self.PATTERNS]
             else:
                 self.pattern_candidates = [x for x in self.PATTERNS]
+            self.compiled_patterns = [CompiledPattern(x) for x in self.pattern_candidates]
         else:
-            self.pattern_candidates = ast_generator(self.PATTERN)
+            # Instead of generating all the commutative/associative variations of the pattern (ast_generator),
+            # the pattern is matched on the canonical form of the instruction
+            self.pattern_candidates = [self.PATTERN]
+            self.compiled_patterns = [CompiledPattern(self.PATTERN, use_canonical_form=True)]
+        self.update_instruction_filter()
 
-    def check_candidate(self, candidate: AstNode):
+    def check_candidate(self, candidate: AstBinding):
         return True
 
-    def check_pattern_and_replace(self, candidate_pattern: AstNode, test_ast: AstNode):
-        if not candidate_pattern.check_pattern_and_copy_mops(test_ast):
+    def check_pattern_and_replace(self, compiled_pattern: CompiledPattern, test_ast: AstNode,
+                                  canonical_test_ast: Union[None, CanonicalNode, AstLeaf] = None):
+        # The compiled pattern is never modified: the mops found during the match are stored in a new binding
+        candidate = compiled_pattern.match(test_ast, canonical_test_ast)
+        if candidate is None:
             return None
-        if not self.check_candidate(candidate_pattern):
+        if not self.check_candidate(candidate):
             return None
-        new_instruction = self.get_replacement(candidate_pattern)
+        new_instruction = self.get_replacement(candidate)
         return new_instruction
 
 
 class RulePatternInfo(object):
-    def __init__(self, rule, pattern):
+    def __init__(self, rule, pattern: CompiledPattern, priority=(0, 0)):
         self.rule = rule
         self.pattern = pattern
+        # Used to sort matching patterns: most specific patterns first, then by insertion order
+        self.priority = priority
 
 
-def signature_generator(ref_sig):
-    for i, x in enumerate(ref_sig):
-        if x not in ["N", "L"]:
-            for sig_suffix in signature_generator(ref_sig[i + 1:]):
-                yield ref_sig[:i] + ["L"] + sig_suffix
-    yield ref_sig
+PATTERN_LEAF_KEY = "L"
+PATTERN_CONSTANT_KEY = "C"
+PATTERN_AC_KEY = "AC"
 
 
-class PatternStorage(object):
-    # The PatternStorage object is used to store patterns associated to rules
-    # A PatternStorage contains a dictionary (next_layer_patterns) where:
-    #  - keys are the signature of a pattern at a specific depth (i.e. the opcodes, the variable and constant)
-    #  - values are PatternStorage object for the next depth
-    # Additionally, it stores the rule objects which are resolved for the PatternStorage depth
-    def __init__(self, depth=1):
-        self.depth = depth
-        self.next_layer_patterns = {}
+def get_pattern_node_key(pattern: Union[AstNode, AstLeaf]):
+    if isinstance(pattern, AstConstant):
+        return PATTERN_CONSTANT_KEY
+    if isinstance(pattern, AstLeaf):
+        return PATTERN_LEAF_KEY
+    nb_operands = 0
+    if pattern.left is not None:
+        nb_operands += 1
+        if pattern.right is not None:
+            nb_operands += 1
+    return pattern.opcode, nb_operands
+
+
+def get_pattern_keys(pattern: Union[AstNode, AstLeaf]) -> List:
+    # Preorder traversal of the pattern: an AstNode is keyed by (opcode, nb_operands), leafs and constants are wildcards
+    keys = [get_pattern_node_key(pattern)]
+    if isinstance(pattern, AstNode):
+        if pattern.left is not None:
+            keys += get_pattern_keys(pattern.left)
+            if pattern.right is not None:
+                keys += get_pattern_keys(pattern.right)
+    return keys
+
+
+def get_pattern_priority(pattern: Union[AstNode, AstLeaf], pattern_index: int):
+    nb_opcodes = len([key for key in get_pattern_keys(pattern) if key not in [PATTERN_LEAF_KEY, PATTERN_CONSTANT_KEY]])
+    return -nb_opcodes, pattern_index
+
+
+def get_canonical_pattern_node_key(canonical_pattern: Union[CanonicalNode, AstLeaf]):
+    if isinstance(canonical_pattern, AstConstant):
+        return PATTERN_CONSTANT_KEY
+    if isinstance(canonical_pattern, AstLeaf):
+        return PATTERN_LEAF_KEY
+    if is_ac_canonical_node(canonical_pattern):
+        return PATTERN_AC_KEY, m_add if canonical_pattern.opcode == m_neg else canonical_pattern.opcode
+    return canonical_pattern.opcode, len(canonical_pattern.children)
+
+
+def get_canonical_pattern_keys(canonical_pattern: Union[CanonicalNode, AstLeaf]) -> List:
+    # Same as get_pattern_keys, but operands of commutative/associative nodes are not indexed
+    # (they are matched as a multiset by the rule)
+    keys = [get_canonical_pattern_node_key(canonical_pattern)]
+    if not canonical_pattern.is_leaf() and not is_ac_canonical_node(canonical_pattern):
+        for child in canonical_pattern.children:
+            keys += get_canonical_pattern_keys(child)
+    return keys
+
+
+class PatternStorageNode(object):
+    __slots__ = ["next_nodes", "rule_resolved"]
+
+    def __init__(self):
+        self.next_nodes = {}
         self.rule_resolved = []
 
-    def add_pattern_for_rule(self, pattern: AstNode, rule: InstructionOptimizationRule):
-        layer_signature = self.layer_signature_to_key(pattern.get_depth_signature(self.depth))
-        if len(layer_signature.replace(",", "")) == (layer_signature.count("N")):
-            self.rule_resolved.append(RulePatternInfo(rule, pattern))
+    def get_or_create_next_node(self, key) -> PatternStorageNode:
+        next_node = self.next_nodes.get(key)
+        if next_node is None:
+            next_node = PatternStorageNode()
+            self.next_nodes[key] = next_node
+        return next_node
+
+
+class PatternStorage(object):
+    # The PatternStorage object is a discrimination tree used to store patterns associated to rules
+    # Each pattern is flattened in preorder into a list of keys:
+    #  - an AstNode is keyed by (opcode, nb_operands)
+    #  - an AstLeaf is a wildcard ("L") which matches any subtree of the instruction
+    #  - an AstConstant is a wildcard ("C") which matches only constant leafs of the instruction
+    # The keys are used to walk the tree and the (rule, pattern) pairs are stored on the node reached by the last key.
+    #
+    # At runtime, the instruction AST is walked once along the tree: for each instruction node, we follow the
+    # opcode edge (and push its operands) and the wildcard edges (and skip the whole subtree).
+    # Thus, the search cost is linear in the instruction AST size and does not depend on the number of patterns.
+    #
+    # Patterns matched on the canonical form of the instruction (see d810.ast_canonical) are stored in a second tree,
+    # built from the canonical form of the pattern: a commutative/associative node is keyed by ("AC", opcode) and its
+    # operands are not indexed.
+    def __init__(self):
+        self.root = PatternStorageNode()
+        self.canonical_root = PatternStorageNode()
+        self.nb_patterns = 0
+
+    def add_pattern_for_rule(self, compiled_pattern: CompiledPattern, rule: InstructionOptimizationRule):
+        if compiled_pattern.canonical_pattern is None:
+            cur_node = self.root
+            keys = get_pattern_keys(compiled_pattern.pattern)
         else:
-            if layer_signature not in self.next_layer_patterns.keys():
-                self.next_layer_patterns[layer_signature] = PatternStorage(self.depth + 1)
-            self.next_layer_patterns[layer_signature].add_pattern_for_rule(pattern, rule)
-
-    @staticmethod
-    def layer_signature_to_key(sig: List[str]) -> str:
-        return ",".join(sig)
-
-    @staticmethod
-    def is_layer_signature_compatible(instruction_signature: str, pattern_signature: str) -> bool:
-        if instruction_signature == pattern_signature:
-            return True
-        instruction_node_list = instruction_signature.split(",")
-        pattern_node_list = pattern_signature.split(",")
-        for ins_node_sig, pattern_node_sig in zip(instruction_node_list, pattern_node_list):
-            if pattern_node_sig not in ["L", "C", "N"] and ins_node_sig != pattern_node_sig:
-                return False
-        return True
+            cur_node = self.canonical_root
+            keys = get_canonical_pattern_keys(compiled_pattern.canonical_pattern)
+        for key in keys:
+            cur_node = cur_node.get_or_create_next_node(key)
+        priority = get_pattern_priority(compiled_pattern.pattern, self.nb_patterns)
+        cur_node.rule_resolved.append(RulePatternInfo(rule, compiled_pattern, priority))
+        self.nb_patterns += 1
+
+    def get_matching_rule_pattern_info(self, pattern: Union[AstNode, AstLeaf],
+                                       canonical_pattern: Union[None, CanonicalNode, AstLeaf] = None) \
+            -> List[RulePatternInfo]:
+        if pattern_search_logger.isEnabledFor(logging.INFO):
+            pattern_search_logger.info("Searching : {0}".format(pattern))
+        matched_rule_pattern_info = self._search_patterns(pattern)
+        if canonical_pattern is not None and len(self.canonical_root.next_nodes) > 0:
+            matched_rule_pattern_info += self._search_canonical_patterns(canonical_pattern)
+        matched_rule_pattern_info.sort(key=lambda x: x.priority)
+        pattern_search_logger.debug("  {0} compatible patterns found".format(len(matched_rule_pattern_info)))
+        return matched_rule_pattern_info
 
-    def get_matching_rule_pattern_info(self, pattern: AstNode):
-        pattern_search_logger.info("Searching : {0}".format(pattern))
-        return self.explore_one_level(pattern, 1)
-
-    def explore_one_level(self, searched_pattern: AstNode, cur_level: int):
-        # We need to check if searched_pattern is in self.next_layer_patterns
-        # Easy solution: try/except self.next_layer_patterns[searched_pattern]
-        # Problem is that known patterns may not exactly match the microcode instruction, e.g.
-        #   -> Pattern layer 3 signature is ["L", "N", "15", "L"]
-        #   -> Multiple instruction can match that: ["L", "N", "15", "L"], ["C", "N", "15", "L"], ["C", "N", "15", "13"]
-        # This piece of code tries to handles that in a (semi) efficient way
-        if len(self.next_layer_patterns) == 0:
-            return []
-        searched_layer_signature = searched_pattern.get_depth_signature(cur_level)
-        nb_possible_signature = 2 ** (len(searched_layer_signature) - searched_layer_signature.count("N") - \
-                                searched_layer_signature.count("L"))
-        pattern_search_logger.debug("  Layer {0}: {1} -> {2} variations (storage has {3} signature)"
-                                    .format(cur_level, searched_layer_signature, nb_possible_signature,
-                                            len(self.next_layer_patterns)))
+    def _search_patterns(self, pattern: Union[AstNode, AstLeaf]) -> List[RulePatternInfo]:
         matched_rule_pattern_info = []
-        if nb_possible_signature < len(self.next_layer_patterns):
-            pattern_search_logger.debug("  => Using method 1")
-            for possible_sig in signature_generator(searched_layer_signature):
-                try:
-                    test_sig = self.layer_signature_to_key(possible_sig)
-                    pattern_storage = self.next_layer_patterns[test_sig]
-                    pattern_search_logger.info("    Compatible signature: {0} -> resolved: {1}"
-                                               .format(test_sig, pattern_storage.rule_resolved))
-                    matched_rule_pattern_info += pattern_storage.rule_resolved
-                    matched_rule_pattern_info += pattern_storage.explore_one_level(searched_pattern, cur_level + 1)
-                except KeyError:
-                    pass
-        else:
-            pattern_search_logger.debug("  => Using method 2")
-            searched_layer_signature_key = self.layer_signature_to_key(searched_layer_signature)
-            for test_sig, pattern_storage in self.next_layer_patterns.items():
-                if self.is_layer_signature_compatible(searched_layer_signature_key, test_sig):
-                    pattern_search_logger.info("    Compatible signature: {0} -> resolved: {1}"
-                                               .format(test_sig, pattern_storage.rule_resolved))
-                    matched_rule_pattern_info += pattern_storage.rule_resolved
-                    matched_rule_pattern_info += pattern_storage.explore_one_level(searched_pattern, cur_level + 1)
+        # Each element of the stack is a storage node and the instruction subtrees which remain to be matched
+        # (stored in reverse order, so that the next subtree to match is the last element)
+        stack = [(self.root, (pattern,))]
+        while stack:
+            cur_node, remaining_asts = stack.pop()
+            if len(remaining_asts) == 0:
+                matched_rule_pattern_info += cur_node.rule_resolved
+                continue
+            cur_ast = remaining_asts[-1]
+            next_remaining_asts = remaining_asts[:-1]
+            next_nodes = cur_node.next_nodes
+
+            next_node = next_nodes.get(PATTERN_LEAF_KEY)
+            if next_node is not None:
+                stack.append((next_node, next_remaining_asts))
+
+            if cur_ast.is_leaf():
+                if cur_ast.is_constant():
+                    next_node = next_nodes.get(PATTERN_CONSTANT_KEY)
+                    if next_node is not None:
+                        stack.append((next_node, next_remaining_asts))
+                continue
+
+            next_node = next_nodes.get((cur_ast.opcode, 1))
+            if next_node is not None and cur_ast.left is not None:
+                stack.append((next_node, next_remaining_asts + (cur_ast.left,)))
+            next_node = next_nodes.get((cur_ast.opcode, 2))
+            if next_node is not None and cur_ast.left is not None and cur_ast.right is not None:
+                stack.append((next_node, next_remaining_asts + (cur_ast.right, cur_ast.left)))
+        return matched_rule_pattern_info
+
+    def _search_canonical_patterns(self, canonical_pattern: Union[CanonicalNode, AstLeaf]) -> List[RulePatternInfo]:
+        matched_rule_pattern_info = []
+        stack = [(self.canonical_root, (canonical_pattern,))]
+        while stack:
+            cur_node, remaining_asts = stack.pop()
+            if len(remaining_asts) == 0:
+                matched_rule_pattern_info += cur_node.rule_resolved
+                continue
+            cur_ast = remaining_asts[-1]
+            next_remaining_asts = remaining_asts[:-1]
+            next_nodes = cur_node.next_nodes
+
+            next_node = next_nodes.get(PATTERN_LEAF_KEY)
+            if next_node is not None:
+                stack.append((next_node, next_remaining_asts))
+
+            if cur_ast.is_leaf():
+                if cur_ast.is_constant():
+                    next_node = next_nodes.get(PATTERN_CONSTANT_KEY)
+                    if next_node is not None:
+                        stack.append((next_node, next_remaining_asts))
+                continue
+
+            if is_ac_canonical_node(cur_ast):
+                next_node = next_nodes.get((PATTERN_AC_KEY, m_add if cur_ast.opcode == m_neg else cur_ast.opcode))
+                if next_node is not None:
+                    stack.append((next_node, next_remaining_asts))
+                continue
+
+            children = cur_ast.children
+            next_node = next_nodes.get((cur_ast.opcode, 1))
+            if next_node is not None and len(children) >= 1:
+                stack.append((next_node, next_remaining_asts + (children[0],)))
+            next_node = next_nodes.get((cur_ast.opcode, 2))
+            if next_node is not None and len(children) >= 2:
+                stack.append((next_node, next_remaining_asts + (children[1], children[0])))
         return matched_rule_pattern_info
 
 
 class PatternOptimizer(InstructionOptimizer):
-    # The main idea of PatternOptimizer is to generate/store all possible patterns associated to all known rules in a $
+    # The main idea of PatternOptimizer is to store the patterns associated to all known rules in a
     # dictionary-like object (PatternStorage) when the plugin is loaded.
-    # => it means that we generate a very large number of patterns
+    # Fuzzed patterns are not expanded into all their commutative/associative variations: they are stored (and matched)
+    # in their canonical form
     #
     # At runtime, we transform the microcode instruction in a list of keys that we search in the PatternStorage object
     # to speed up the checks
     # => we don't want to test all patterns, so we use the PatternStorage object to (quickly) get the patterns
     # which have the same shape as the microcode instruction
 
+    #
+    # If use_egraph is set (project additional_configuration), the rules are first applied by equality saturation
+    # (see d810.egraph): all the rules are applied on all the subterms of the instruction and the cheapest
+    # equivalent term is kept, instead of the result of the first rule which matches the instruction.
+
     RULE_CLASSES = [PatternMatchingRule]
+    # Maximum number of instructions for which the search result is remembered
+    MATCH_CACHE_SIZE = 4096
+    # Instructions with fewer opcodes are only optimized by the first matching rule
+    EGRAPH_MIN_NB_OPCODES = 2
+    # Rules which are not proven by d810.rule_verifier (Z3 does not conclude, or their checks depend on operands the
+    # verifier does not build) are not used as e-graph rewrites: equality saturation would spread a wrong rewrite to
+    # all the equivalent terms. rule_verifier fails if a rule which is not proven is missing from this list.
+    EGRAPH_EXCLUDED_RULES = ["Mul_MbaRule_1", "Mul_MbaRule_2", "Mul_MbaRule_3", "Mul_MbaRule_4", "Xor_NestedStuff",
+                             "Xor_Rule_4_WithXdu", "CstSimplificationRule14", "Sub1_FactorRule_2", "ReplaceMovHigh"]
 
     def __init__(self, maturities, log_dir=None):
         super().__init__(maturities, log_dir=log_dir)
-        self.pattern_storage = PatternStorage(depth=1)
+        self.pattern_storage = PatternStorage()
+        # Hex-Rays calls the optimizer many times on the same instructions (at each maturity and pass), so we
+        # remember, for each instruction structure, the (rule, pattern) which matched or that no rule matched
+        self.match_cache = LRUCache(self.MATCH_CACHE_SIZE)
+        self.use_egraph = False
+        self.egraph_max_nodes = DEFAULT_EGRAPH_MAX_NODES
+        self.egraph_timeout_ms = DEFAULT_EGRAPH_TIMEOUT_MS
+        self.egraph_max_iterations = DEFAULT_EGRAPH_MAX_ITERATIONS
+        self.egraph_rewrites = None
+        # Instructions for which the equality saturation did not find a cheaper term
+        self.egraph_cache = LRUCache(self.MATCH_CACHE_SIZE)
+        self.egraph_statistics = EGraphStatistics()
+
+    def configure_egraph(self, use_egraph=False, max_nodes=DEFAULT_EGRAPH_MAX_NODES,
+                         timeout_ms=DEFAULT_EGRAPH_TIMEOUT_MS, max_iterations=DEFAULT_EGRAPH_MAX_ITERATIONS):
+        self.use_egraph = use_egraph
+        self.egraph_max_nodes = max_nodes
+        self.egraph_timeout_ms = timeout_ms
+        self.egraph_max_iterations = max_iterations
+        self.egraph_cache.clear()
 
     def add_rule(self, rule: InstructionOptimizationRule):
         is_ok = super().add_rule(rule)
         if not is_ok:
             return False
-        for pattern in rule.pattern_candidates:
-            self.pattern_storage.add_pattern_for_rule(pattern, rule)
+        for compiled_pattern in rule.compiled_patterns:
+            self.pattern_storage.add_pattern_for_rule(compiled_pattern, rule)
+        self.match_cache.clear()
+        self.egraph_rewrites = None
+        self.egraph_cache.clear()
         return True
 
-    def get_optimized_instruction(self, blk: mblock_t, ins: minsn_t) -> Union[None, minsn_t]:
+    def reset_rule_usage_statistic(self):
+        super().reset_rule_usage_statistic()
+        self.match_cache.reset_statistics()
+        self.egraph_statistics.reset()
+
+    def show_rule_usage_statistic(self):
+        super().show_rule_usage_statistic()
+        optimizer_logger.info("Pattern search cache: {0} hits, {1} misses ({2:.1%} hit rate, {3} entries)"
+                              .format(self.match_cache.nb_hits, self.match_cache.nb_misses,
+                                      self.match_cache.hit_rate, len(self.match_cache)))
+        if self.egraph_statistics.nb_runs > 0:
+            optimizer_logger.info("Equality saturation: {0}".format(self.egraph_statistics))
+
+    def get_egraph_rewrites(self) -> List[EGraphRewrite]:
+        if self.egraph_rewrites is None:
+            self.egraph_rewrites = get_ac_rewrites()
+            for rule in self.rules:
+                if rule.name in self.EGRAPH_EXCLUDED_RULES:
+                    continue
+                for pattern in rule.pattern_candidates:
+                    # Patterns on a mov instruction depend on the instruction itself (e.g. its destination)
+                    if pattern is None or pattern.is_leaf() or pattern.opcode == m_mov:
+                        continue
+                    self.egraph_rewrites.append(EGraphRewrite(rule.name, pattern, rule.REPLACEMENT_PATTERN,
+                                                              rule.check_candidate))
+        return self.egraph_rewrites
+
+    def _get_egraph_optimized_instruction(self, ins: minsn_t, ins_info: InstructionInfo, ins_key) \
+            -> Union[None, minsn_t]:
+        if ins_key is not None and self.egraph_cache.get(ins_key) is not None:
+            return None
+        if ins_info.ast is None or ins_info.statistics.nb_opcodes < self.EGRAPH_MIN_NB_OPCODES:
+            return None
+        egraph = EGraph(ins.ea)
+        root_class_id = egraph.add_ast(ins_info.ast)
+        egraph.compute_costs()
+        orig_cost = egraph.get_cost(root_class_id)
+        new_ins = None
+        try:
+            stop_reason = egraph.saturate(self.get_egraph_rewrites(), self.egraph_max_nodes, self.egraph_timeout_ms,
+                                          self.egraph_max_iterations)
+            if egraph.get_cost(root_class_id) < orig_cost:
+                new_ins = egraph.create_minsn(root_class_id, ins.d)
+        except RuntimeError as e:
+            optimizer_logger.error("Error during equality saturation for instruction {0}: {1}"
+                                   .format(format_minsn_t(ins), e))
+            return None
+        self.egraph_statistics.record(egraph, stop_reason, new_ins is not None)
+        if new_ins is None:
+            if ins_key is not None:
+                self.egraph_cache.set(ins_key, True)
+            return None
+        optimizer_logger.info("Equality saturation ({0}, {1} nodes) matched:".format(stop_reason, egraph.nb_nodes))
+        optimizer_logger.info("  orig: {0}".format(format_minsn_t(ins)))
+        optimizer_logger.info("  new : {0}".format(format_minsn_t(new_ins)))
+        return new_ins
+
+    def get_optimized_instruction(self, blk: mblock_t, ins: minsn_t, ins_info: InstructionInfo = None) \
+            -> Union[None, minsn_t]:
         if blk is not None:
             self.cur_maturity = blk.mba.maturity
         if self.cur_maturity not in self.maturities:
             return None
-        tmp = minsn_to_ast(ins)
+
+        ins_key = get_minsn_structural_key(ins)
+        if ins_info is None:
+            ins_info = InstructionInfo(ins)
+        if self.use_egraph:
+            new_ins = self._get_egraph_optimized_instruction(ins, ins_info, ins_key)
+            if new_ins is not None:
+                return new_ins
+
+        cached_matchs = None
+        if ins_key is not None:
+            cached_matchs = self.match_cache.get(ins_key)
+            if cached_matchs is not None and len(cached_matchs) == 0:
+                return None
+
+        tmp = ins_info.ast
         if tmp is None:
+            if ins_key is not None:
+                self.match_cache.set(ins_key, [])
             return None
-
-        all_matchs = self.pattern_storage.get_matching_rule_pattern_info(tmp)
+        canonical_tmp = ins_info.canonical_ast
+
+        if cached_matchs is not None:
+            new_ins = self._apply_rule_patterns(ins, tmp, canonical_tmp, cached_matchs, None)
+            if new_ins is not None:
+                return new_ins
+
+        all_matchs = self.pattern_storage.get_matching_rule_pattern_info(tmp, canonical_tmp)
+        return self._apply_rule_patterns(ins, tmp, canonical_tmp, all_matchs, ins_key)
+
+    def _apply_rule_patterns(self, ins: minsn_t, tmp: AstNode, canonical_tmp: Union[CanonicalNode, AstLeaf],
+                             all_matchs: List[RulePatternInfo], ins_key) -> Union[None, minsn_t]:
+        is_result_cacheable = ins_key is not None
+        # When profiling, rule -> [nb patterns tried, elapsed time, nb matches, nb exceptions] for this instruction
+        rule_costs = {} if self.profiler is not None else None
+        new_ins = None
         for rule_pattern_info in all_matchs:
+            if rule_costs is not None:
+                start_time = time.perf_counter()
+            nb_exceptions = 0
             try:
-                new_ins = rule_pattern_info.rule.check_pattern_and_replace(rule_pattern_info.pattern, tmp)
-                if new_ins is not None:
-                    self.rules_usage_info[rule_pattern_info.rule.name] += 1
-                    optimizer_logger.info("Rule {0} matched:".format(rule_pattern_info.rule.name))
-                    optimizer_logger.info("  orig: {0}".format(format_minsn_t(ins)))
-                    optimizer_logger.info("  new : {0}".format(format_minsn_t(new_ins)))
-                    return new_ins
+                new_ins = rule_pattern_info.rule.check_pattern_and_replace(rule_pattern_info.pattern, tmp,
+                                                                           canonical_tmp)
             except RuntimeError as e:
                 optimizer_logger.error("Error during rule {0} for instruction {1}: {2}"
                                        .format(rule_pattern_info.rule, format_minsn_t(ins), e))
-        return None
-
-# AST equivalent pattern generation stuff
+                is_result_cacheable = False
+                nb_exceptions = 1
+            if rule_costs is not None:
+                rule_cost = rule_costs.setdefault(rule_pattern_info.rule, [0, 0.0, 0, 0])
+                rule_cost[0] += 1
+                rule_cost[1] += time.perf_counter() - start_time
+                rule_cost[2] += int(new_ins is not None)
+                rule_cost[3] += nb_exceptions
+            if new_ins is not None:
+                if is_result_cacheable:
+                    self.match_cache.set(ins_key, [rule_pattern_info])
+                self.rules_usage_info[rule_pattern_info.rule.name] += 1
+                optimizer_logger.info("Rule {0} matched:".format(rule_pattern_info.rule.name))
+                optimizer_logger.info("  orig: {0}".format(format_minsn_t(ins)))
+                optimizer_logger.info("  new : {0}".format(format_minsn_t(new_ins)))
+                break
+        if rule_costs is not None:
+            for rule, (nb_candidates, elapsed_time, nb_matches, nb_exceptions) in rule_costs.items():
+                self.profiler.record(self.name, rule.name, self.cur_maturity, elapsed_time, nb_candidates=nb_candidates,
+                                     nb_matches=nb_matches, nb_exceptions=nb_exceptions)
+        if new_ins is None and is_result_cacheable:
+            self.match_cache.set(ins_key, [])
+        return new_ins
+
+# AST equivalent pattern generation stuff (still used by JumpOptimizationRule)
 # TODO: refactor/clean this
 
 
@@ -7,11 +7,11 @@ from d810.hexrays_helpers import equal_ignore_msb_cst, equal_bnot_mop, AND_TABLE
 
 class Add_HackersDelightRule_1(PatternMatchingRule):
     PATTERN = AstNode(m_sub,
-                      AstLeaf("x_0"),
                       AstNode(m_sub,
+                              AstLeaf("x_0"),
                               AstNode(m_bnot,
-                                      AstLeaf("x_1")),
-                              AstConstant("1", 1)))
+                                      AstLeaf("x_1"))),
+                      AstConstant("1", 1))
     REPLACEMENT_PATTERN = AstNode(m_add, AstLeaf("x_0"), AstLeaf("x_1"))
 
 
@@ -97,7 +97,11 @@ class Add_SpecialConstantRule_2(PatternMatchingRule):
                               AstNode(m_and,
                                       AstLeaf("x_0"),
                                       AstConstant("c_2"))))
-    REPLACEMENT_PATTERN = AstNode(m_add, AstLeaf("x_0"), AstConstant("c_1"))
+    REPLACEMENT_PATTERN = AstNode(m_add,
+                                  AstNode(m_and,
+                                          AstLeaf("x_0"),
+                                          AstConstant("val_ff", 0xff)),
+                                  AstConstant("c_1"))
 
     def check_candidate(self, candidate):
         return (candidate["c_1"].value & 0xff) == candidate["c_2"].value
@@ -193,6 +197,9 @@ class Add_OllvmRule_4(PatternMatchingRule):
                                       AstLeaf('x_1'))))
     REPLACEMENT_PATTERN = AstNode(m_add, AstLeaf('x_0'), AstLeaf('x_1'))
 
+    def check_candidate(self, candidate):
+        return (candidate["val_fe"].value + 2) & AND_TABLE[candidate["val_fe"].size] == 0
+
 
 class AddXor_Rule_1(PatternMatchingRule):
     PATTERN = AstNode(m_sub,
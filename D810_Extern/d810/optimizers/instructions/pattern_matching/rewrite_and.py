@@ -2,7 +2,7 @@ from ida_hexrays import *
 
 from d810.optimizers.instructions.pattern_matching.handler import PatternMatchingRule
 from d810.ast import AstLeaf, AstConstant, AstNode
-from d810.hexrays_helpers import equal_bnot_mop, SUB_TABLE
+from d810.hexrays_helpers import equal_bnot_mop
 
 
 class And_HackersDelightRule_1(PatternMatchingRule):
@@ -248,6 +248,6 @@ class AndGetUpperBits_FactorRule_1(PatternMatchingRule):
     def check_candidate(self, candidate):
         if (2 ** candidate["c_2"].value) != candidate["c_1"].value:
             return False
-        c_res = (SUB_TABLE[candidate["c_1"].size] - candidate["c_1"].value) & candidate["c_3"].value
+        c_res = candidate["c_1"].value * candidate["c_3"].value
         candidate.add_constant_leaf("c_res", c_res, candidate["x_0"].size)
         return True
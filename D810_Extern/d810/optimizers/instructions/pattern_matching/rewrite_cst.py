@@ -2,7 +2,7 @@ from ida_hexrays import *
 
 from d810.ast import AstLeaf, AstConstant, AstNode
 from d810.optimizers.instructions.pattern_matching.handler import PatternMatchingRule
-from d810.hexrays_helpers import equal_bnot_cst, SUB_TABLE, AND_TABLE, equal_bnot_mop
+from d810.hexrays_helpers import equal_bnot_cst, SUB_TABLE, AND_TABLE, MSB_TABLE, equal_bnot_mop
 
 
 class CstSimplificationRule1(PatternMatchingRule):
@@ -246,7 +246,7 @@ class CstSimplificationRule12(PatternMatchingRule):
                                   AstConstant("c_diff"))
 
     def check_candidate(self, candidate):
-        c_diff = candidate["c_2"].value - candidate["c_1"].value
+        c_diff = candidate["c_2"].value - candidate["c_1"].value - 1
         candidate.add_constant_leaf("c_diff", c_diff, candidate["c_1"].size)
         return True
 
@@ -301,6 +301,8 @@ class CstSimplificationRule15(PatternMatchingRule):
     REPLACEMENT_PATTERN = AstNode(m_shr, AstLeaf("x_0"), AstConstant("c_res"))
 
     def check_candidate(self, candidate):
+        if candidate["c_1"].value + candidate["c_2"].value >= 8 * candidate["x_0"].size:
+            return False
         candidate.add_constant_leaf("c_res", candidate["c_1"].value + candidate["c_2"].value, candidate["c_1"].size)
         return True
 
@@ -359,6 +361,8 @@ class CstSimplificationRule19(PatternMatchingRule):
     REPLACEMENT_PATTERN = AstNode(m_and, AstNode(m_shr, AstLeaf("x_0"), AstConstant("c_2")), AstConstant("c_res"))
 
     def check_candidate(self, candidate):
+        if candidate["c_1"].value & MSB_TABLE[candidate["c_1"].size] != 0:
+            return False
         candidate.add_constant_leaf("c_res", candidate["c_1"].value >> candidate["c_2"].value,
                                     candidate["c_1"].size)
         return True
@@ -387,9 +391,11 @@ class CstSimplificationRule20(PatternMatchingRule):
             return False
         if candidate["c_and_1"].value & candidate["c_and_2"].value != 0:
             return False
-        candidate.add_constant_leaf("c_and_res", candidate["c_and_1"].value ^ candidate["c_and_2"].value,
+        # The bits of c_and_1 which are also set in c_xor are always set in the result
+        c_and_1_not_xor = candidate["c_and_1"].value ^ (candidate["c_and_1"].value & candidate["c_xor"].value)
+        candidate.add_constant_leaf("c_and_res", c_and_1_not_xor | candidate["c_and_2"].value,
                                     candidate["c_and_1"].size)
-        candidate.add_constant_leaf("c_xor_res", candidate["c_and_1"].value ^ candidate["c_xor"].value,
+        candidate.add_constant_leaf("c_xor_res", candidate["c_and_1"].value | candidate["c_xor"].value,
                                     candidate["c_and_1"].size)
         return True
 
@@ -412,7 +418,9 @@ class CstSimplificationRule21(PatternMatchingRule):
     def check_candidate(self, candidate):
         if not equal_bnot_cst(candidate["c_and"].mop, candidate["bnot_c_and"].mop):
             return False
-        if candidate["c_xor_1"].mop.nnn.value & candidate["c_xor_2"].mop.nnn.value != 0:
+        if candidate["c_xor_1"].mop.nnn.value & candidate["bnot_c_and"].mop.nnn.value != 0:
+            return False
+        if candidate["c_xor_2"].mop.nnn.value & candidate["c_and"].mop.nnn.value != 0:
             return False
         candidate.add_constant_leaf("c_xor_res", candidate["c_xor_1"].value ^ candidate["c_xor_2"].value,
                                     candidate["c_xor_1"].size)
@@ -443,6 +451,8 @@ class CstSimplificationRule22(PatternMatchingRule):
             return False
         if candidate["c_xor_1"].mop.nnn.value & candidate["bnot_c_and"].mop.nnn.value != 0:
             return False
+        if candidate["c_xor_2"].mop.nnn.value & candidate["c_and"].mop.nnn.value != 0:
+            return False
         candidate.add_constant_leaf("c_xor_res", candidate["c_xor_1"].value ^ candidate["c_xor_2"].value ^ candidate["bnot_c_and"].value,
                                     candidate["c_xor_1"].size)
         return True
@@ -186,12 +186,12 @@ class PredSetbRule1(PatternMatchingRule):
                               AstLeaf("x_0"),
                               AstConstant("c_1")),
                       AstConstant("c_2"))
-    REPLACEMENT_PATTERN = AstNode(m_mov, AstConstant("val_0"))
+    REPLACEMENT_PATTERN = AstNode(m_mov, AstConstant("val_1"))
 
     def check_candidate(self, candidate):
         if candidate["c_1"].value >= candidate["c_2"].value:
             return False
-        candidate.add_constant_leaf("val_0", 0, candidate.size)
+        candidate.add_constant_leaf("val_1", 1, candidate.size)
         return True
 
 
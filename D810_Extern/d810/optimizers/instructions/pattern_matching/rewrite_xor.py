@@ -249,6 +249,9 @@ class Xor_Rule_2(PatternMatchingRule):
                                       AstLeaf('x_2'))))
     REPLACEMENT_PATTERN = AstNode(m_xor, AstLeaf('x_0'), AstLeaf('x_1'))
 
+    def check_candidate(self, candidate):
+        return equal_bnot_mop(candidate["x_2"].mop, candidate["bnot_x2"].mop)
+
 
 # Found sometimes with OLLVM
 class Xor_Rule_3(PatternMatchingRule):
@@ -269,6 +272,9 @@ class Xor_Rule_3(PatternMatchingRule):
                                       AstLeaf('bnot_x2'))))
     REPLACEMENT_PATTERN = AstNode(m_xor, AstNode(m_bnot, AstLeaf('x_0')), AstLeaf('x_1'))
 
+    def check_candidate(self, candidate):
+        return equal_bnot_mop(candidate["x_2"].mop, candidate["bnot_x2"].mop)
+
 
 class Xor_Rule_4(PatternMatchingRule):
     PATTERN = AstNode(m_or,
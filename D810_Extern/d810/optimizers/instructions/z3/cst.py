@@ -1,7 +1,7 @@
 from ida_hexrays import *
+from d810.optimizers.instructions.handler import InstructionInfo
 from d810.optimizers.instructions.z3.handler import Z3Rule
-from d810.ast import AstConstant, AstNode
-from d810.ast import minsn_to_ast
+from d810.ast import AstConstant, AstNode, AstStatistics, AstBinding
 from d810.errors import AstEvaluationException
 from d810.z3_utils import z3_check_mop_equality
 
@@ -14,6 +14,7 @@ class Z3ConstantOptimization(Z3Rule):
         super().__init__()
         self.min_nb_opcode = 3
         self.min_nb_constant = 3
+        self._update_min_ast_statistics()
 
     def configure(self, kwargs):
         super().configure(kwargs)
@@ -21,9 +22,15 @@ class Z3ConstantOptimization(Z3Rule):
             self.min_nb_opcode = kwargs["min_nb_opcode"]
         if "min_nb_constant" in kwargs.keys():
             self.min_nb_constant = kwargs["min_nb_constant"]
+        self._update_min_ast_statistics()
 
-    def check_and_replace(self, blk, instruction):
-        tmp = minsn_to_ast(instruction)
+    def _update_min_ast_statistics(self):
+        # The instruction must have at least min_nb_opcode AstNode, min_nb_constant constants and one variable
+        self.min_ast_statistics = AstStatistics(nb_opcodes=self.min_nb_opcode, nb_leafs=self.min_nb_constant + 1,
+                                                nb_constants=self.min_nb_constant)
+
+    def check_info_and_replace(self, blk, ins_info: InstructionInfo):
+        tmp = ins_info.ast
         if tmp is None:
             return None
         leaf_info_list, cst_leaf_values, opcodes = tmp.get_information()
@@ -39,8 +46,10 @@ class Z3ConstantOptimization(Z3Rule):
                     c_res_mop.make_number(val_0, tmp.mop.size)
                     is_ok = z3_check_mop_equality(tmp.mop, c_res_mop)
                     if is_ok:
-                        tmp.add_leaf("c_res", c_res_mop)
-                        new_instruction = self.get_replacement(tmp)
+                        # ins_info.ast is shared with the next optimizers: c_res is added to a new binding
+                        candidate = AstBinding(tmp.mop, tmp.dst_mop, tmp.dest_size, tmp.ea)
+                        candidate.add_leaf("c_res", c_res_mop)
+                        new_instruction = self.get_replacement(candidate)
                         return new_instruction
                     return None
             except ZeroDivisionError:
@@ -1,4 +1,10 @@
+import logging
 from d810.optimizers.instructions.handler import GenericPatternRule, InstructionOptimizer
+from d810.random_testing import random_testing_statistics
+from d810.z3_cache import z3_verdict_cache
+from d810.z3_backend import z3_backend_statistics
+
+optimizer_logger = logging.getLogger('D810.optimizer')
 
 
 class Z3Rule(GenericPatternRule):
@@ -7,3 +13,18 @@ class Z3Rule(GenericPatternRule):
 
 class Z3Optimizer(InstructionOptimizer):
     RULE_CLASSES = [Z3Rule]
+
+    def reset_rule_usage_statistic(self):
+        super().reset_rule_usage_statistic()
+        random_testing_statistics.reset()
+        z3_verdict_cache.reset_statistics()
+        z3_backend_statistics.reset()
+
+    def show_rule_usage_statistic(self):
+        super().show_rule_usage_statistic()
+        if random_testing_statistics.nb_checks > 0:
+            optimizer_logger.info("Random testing before Z3: {0}".format(random_testing_statistics))
+        if z3_verdict_cache.nb_lookups > 0:
+            optimizer_logger.info("Z3 verdict cache: {0}".format(z3_verdict_cache))
+        if z3_backend_statistics.nb_queries > 0:
+            optimizer_logger.info("Z3 solver time for this function: {0}".format(z3_backend_statistics))
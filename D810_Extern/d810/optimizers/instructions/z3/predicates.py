@@ -2,7 +2,7 @@ from ida_hexrays import *
 
 from d810.optimizers.instructions.z3.handler import Z3Rule
 from d810.ast import AstLeaf, AstConstant, AstNode
-from d810.z3_utils import z3_check_mop_equality, z3_check_mop_inequality
+from d810.z3_utils import z3_check_mop_relations
 
 
 class Z3setzRuleGeneric(Z3Rule):
@@ -13,10 +13,13 @@ class Z3setzRuleGeneric(Z3Rule):
     REPLACEMENT_PATTERN = AstNode(m_mov, AstConstant("val_res"))
 
     def check_candidate(self, candidate):
-        if z3_check_mop_equality(candidate["x_0"].mop, candidate["x_1"].mop):
+        # Both relations are checked in a single batch (random testing refutes at least one of them immediately)
+        is_equal, is_not_equal = z3_check_mop_relations([("eq", candidate["x_0"].mop, candidate["x_1"].mop),
+                                                         ("ne", candidate["x_0"].mop, candidate["x_1"].mop)])
+        if is_equal:
             candidate.add_constant_leaf("val_res", 1, candidate.size)
             return True
-        if z3_check_mop_inequality(candidate["x_0"].mop, candidate["x_1"].mop):
+        if is_not_equal:
             candidate.add_constant_leaf("val_res", 0, candidate.size)
             return True
         return False
@@ -30,10 +33,13 @@ class Z3setnzRuleGeneric(Z3Rule):
     REPLACEMENT_PATTERN = AstNode(m_mov, AstConstant("val_res"))
 
     def check_candidate(self, candidate):
-        if z3_check_mop_equality(candidate["x_0"].mop, candidate["x_1"].mop):
+        # Both relations are checked in a single batch (random testing refutes at least one of them immediately)
+        is_equal, is_not_equal = z3_check_mop_relations([("eq", candidate["x_0"].mop, candidate["x_1"].mop),
+                                                         ("ne", candidate["x_0"].mop, candidate["x_1"].mop)])
+        if is_equal:
             candidate.add_constant_leaf("val_res", 0, candidate.size)
             return True
-        if z3_check_mop_inequality(candidate["x_0"].mop, candidate["x_1"].mop):
+        if is_not_equal:
             candidate.add_constant_leaf("val_res", 1, candidate.size)
             return True
         return False
@@ -48,10 +54,12 @@ class Z3lnotRuleGeneric(Z3Rule):
     def check_candidate(self, candidate):
         val_0_mop = mop_t()
         val_0_mop.make_number(0, candidate["x_0"].size)
-        if z3_check_mop_equality(candidate["x_0"].mop, val_0_mop):
+        is_zero, is_not_zero = z3_check_mop_relations([("eq", candidate["x_0"].mop, val_0_mop),
+                                                       ("ne", candidate["x_0"].mop, val_0_mop)])
+        if is_zero:
             candidate.add_constant_leaf("val_res", 1, candidate.size)
             return True
-        if z3_check_mop_inequality(candidate["x_0"].mop, val_0_mop):
+        if is_not_zero:
             candidate.add_constant_leaf("val_res", 0, candidate.size)
             return True
         return False
@@ -67,12 +75,13 @@ class Z3SmodRuleGeneric(Z3Rule):
     def check_candidate(self, candidate):
         cst_0_mop = mop_t()
         cst_0_mop.make_number(0, candidate.size)
-        if z3_check_mop_equality(candidate.mop, cst_0_mop):
-            candidate.add_leaf("val_res", cst_0_mop)
-            return True
         cst_1_mop = mop_t()
         cst_1_mop.make_number(1, candidate.size)
-        if z3_check_mop_equality(candidate.mop, cst_1_mop):
+        is_zero, is_one = z3_check_mop_relations([("eq", candidate.mop, cst_0_mop), ("eq", candidate.mop, cst_1_mop)])
+        if is_zero:
+            candidate.add_leaf("val_res", cst_0_mop)
+            return True
+        if is_one:
             candidate.add_leaf("val_res", cst_1_mop)
             return True
         return False
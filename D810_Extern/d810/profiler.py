@@ -0,0 +1,126 @@
+from __future__ import annotations
+import os
+import json
+import logging
+from typing import Dict, List, Tuple
+
+from d810.hexrays_formatters import maturity_to_string
+
+profiler_logger = logging.getLogger('D810.profiler')
+
+RULE_PROFILE_FILENAME = "rule_profile.json"
+
+
+class RuleProfile(object):
+    # Cost of a rule: nb_attempts is the number of times the rule was called, nb_candidates the number of patterns
+    # (or candidates) it tried during these calls, and the times are in seconds
+    __slots__ = ["nb_attempts", "nb_candidates", "nb_matches", "nb_exceptions", "total_time", "max_time"]
+
+    def __init__(self):
+        self.nb_attempts = 0
+        self.nb_candidates = 0
+        self.nb_matches = 0
+        self.nb_exceptions = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, elapsed_time: float, nb_candidates: int, nb_matches: int, nb_exceptions: int, nb_attempts: int = 1):
+        self.nb_attempts += nb_attempts
+        self.nb_candidates += nb_candidates
+        self.nb_matches += nb_matches
+        self.nb_exceptions += nb_exceptions
+        self.total_time += elapsed_time
+        self.max_time = max(self.max_time, elapsed_time)
+
+    def merge(self, other: RuleProfile):
+        self.nb_attempts += other.nb_attempts
+        self.nb_candidates += other.nb_candidates
+        self.nb_matches += other.nb_matches
+        self.nb_exceptions += other.nb_exceptions
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+
+    def to_dict(self) -> Dict:
+        return {"attempts": self.nb_attempts, "candidates": self.nb_candidates, "matches": self.nb_matches,
+                "exceptions": self.nb_exceptions, "total_time": self.total_time, "max_time": self.max_time}
+
+
+class RuleProfiler(object):
+    # Opt-in ("profile_rules" in the additional configuration of the project) cost profiler of the instruction and
+    # block rules. Profiles are stored per function, per maturity and per (optimizer, rule), and are saved in the log
+    # directory at the end of each decompilation (glbopt)
+
+    def __init__(self, log_dir=None):
+        self.log_dir = log_dir
+        self.cur_func_ea = None
+        # func_ea -> maturity -> (optimizer name, rule name) -> RuleProfile
+        self.profiles = {}
+
+    def reset(self):
+        self.cur_func_ea = None
+        self.profiles = {}
+
+    def start_function(self, func_ea: int):
+        self.cur_func_ea = func_ea
+
+    def record(self, optimizer_name: str, rule_name: str, maturity: int, elapsed_time: float, nb_candidates: int = 1,
+               nb_matches: int = 0, nb_exceptions: int = 0):
+        maturity_profiles = self.profiles.setdefault(self.cur_func_ea, {})
+        rule_profiles = maturity_profiles.setdefault(maturity, {})
+        rule_key = (optimizer_name, rule_name)
+        rule_profile = rule_profiles.get(rule_key)
+        if rule_profile is None:
+            rule_profile = RuleProfile()
+            rule_profiles[rule_key] = rule_profile
+        rule_profile.add(elapsed_time, nb_candidates, nb_matches, nb_exceptions)
+
+    def get_total_profiles(self) -> Dict[Tuple[str, str], RuleProfile]:
+        total_profiles = {}
+        for maturity_profiles in self.profiles.values():
+            for rule_profiles in maturity_profiles.values():
+                for rule_key, rule_profile in rule_profiles.items():
+                    if rule_key not in total_profiles.keys():
+                        total_profiles[rule_key] = RuleProfile()
+                    total_profiles[rule_key].merge(rule_profile)
+        return total_profiles
+
+    def get_summary(self) -> List[Tuple[str, str, RuleProfile]]:
+        # Total cost of each rule over all the profiled functions, most expensive rules first
+        summary = [(optimizer_name, rule_name, rule_profile)
+                   for (optimizer_name, rule_name), rule_profile in self.get_total_profiles().items()]
+        summary.sort(key=lambda x: x[2].total_time, reverse=True)
+        return summary
+
+    def to_dict(self) -> Dict:
+        functions = []
+        for func_ea, maturity_profiles in self.profiles.items():
+            maturities = {}
+            for maturity, rule_profiles in maturity_profiles.items():
+                maturities[maturity_to_string(maturity)] = [
+                    dict(optimizer=optimizer_name, rule=rule_name, **rule_profile.to_dict())
+                    for (optimizer_name, rule_name), rule_profile in rule_profiles.items()]
+            func_ea_str = "0x{0:x}".format(func_ea) if func_ea is not None else None
+            functions.append({"func_ea": func_ea_str, "maturities": maturities})
+        total = [dict(optimizer=optimizer_name, rule=rule_name, **rule_profile.to_dict())
+                 for optimizer_name, rule_name, rule_profile in self.get_summary()]
+        return {"total": total, "functions": functions}
+
+    def save(self, filename: str = RULE_PROFILE_FILENAME):
+        if self.log_dir is None:
+            return
+        profile_path = os.path.join(self.log_dir, filename)
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            with open(profile_path, "w") as f:
+                json.dump(self.to_dict(), f, indent=2)
+            profiler_logger.info("Rule profile saved in {0}".format(profile_path))
+        except OSError as e:
+            profiler_logger.error("Can't save rule profile in {0}: {1}".format(profile_path, e))
+
+    def show_summary(self, nb_rules: int = 10):
+        for optimizer_name, rule_name, rule_profile in self.get_summary()[:nb_rules]:
+            profiler_logger.info("Rule '{0}' ({1}): {2:.3f}s in {3} attempts ({4} candidates, {5} matches, "
+                                 "{6} exceptions, max {7:.3f}ms)"
+                                 .format(rule_name, optimizer_name, rule_profile.total_time, rule_profile.nb_attempts,
+                                         rule_profile.nb_candidates, rule_profile.nb_matches,
+                                         rule_profile.nb_exceptions, 1000 * rule_profile.max_time))
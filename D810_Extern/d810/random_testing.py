@@ -0,0 +1,237 @@
+import logging
+from typing import List, Union
+from ida_hexrays import *
+
+from d810.hexrays_helpers import get_mop_index
+from d810.ast import mop_to_ast, AstLeaf, AstNode
+
+logger = logging.getLogger('D810')
+
+try:
+    import numpy as np
+    NUMPY_INSTALLED = True
+except ImportError:
+    logger.info("Random testing of expressions disabled. Install NumPy to enable it")
+    NUMPY_INSTALLED = False
+
+# Random testing is used to quickly refute an equality (or inequality) before calling Z3:
+# both expressions are evaluated (with NumPy) on a batch of input vectors, and if the relation does not hold for one
+# of them, Z3 would find this counterexample too, so it does not need to be called.
+# To give the same verdicts as Z3, expressions are evaluated exactly as they are translated by ast_to_z3_expression:
+# each expression has the width of its mop (values are stored in uint64 arrays and masked to this width), the
+# operands of a node are resized to its destination size and division/remainder/shifts follow the SMT-LIB bit-vector
+# semantics (e.g. x / 0 = -1).
+DEFAULT_NB_TESTS = 1024
+MAX_NB_BITS = 64
+RANDOM_TESTING_SEED = 0x810
+CORNER_CASE_VALUES = [0, 1, 2, 3, 0x7f, 0x80, 0xff, 0x100, 0x7fff, 0x8000, 0xffff, 0x10000,
+                      0x7fffffff, 0x80000000, 0xfffffffe, 0xffffffff, 0x100000000,
+                      0x7fffffffffffffff, 0x8000000000000000, 0xfffffffffffffffe, 0xffffffffffffffff]
+
+
+class RandomTestingStatistics(object):
+    def __init__(self):
+        self.nb_checks = 0
+        self.nb_z3_calls_avoided = 0
+        self.nb_unsupported = 0
+
+    def reset(self):
+        self.nb_checks = 0
+        self.nb_z3_calls_avoided = 0
+        self.nb_unsupported = 0
+
+    @property
+    def nb_escalations(self):
+        return self.nb_checks - self.nb_z3_calls_avoided
+
+    def __str__(self):
+        return "{0} checks, {1} Z3 calls avoided, {2} escalated to Z3 ({3} unsupported expressions)"\
+            .format(self.nb_checks, self.nb_z3_calls_avoided, self.nb_escalations, self.nb_unsupported)
+
+
+class RandomTester(object):
+    def __init__(self, nb_tests: int = DEFAULT_NB_TESTS):
+        self.nb_tests = nb_tests
+        self.rng = np.random.default_rng(RANDOM_TESTING_SEED)
+        self.corner_cases = np.array(CORNER_CASE_VALUES, dtype=np.uint64)
+        # Input vector of each variable, generated once: variable i always gets the same values.
+        # A leaf smaller than 8 bytes uses the low bits of its variable (as in create_z3_vars)
+        self.variable_values = []
+
+    def get_variable_values(self, variable_index: int):
+        while len(self.variable_values) <= variable_index:
+            # About half of the values are corner cases (mixed between variables), the others are uniformly random
+            values = self.rng.integers(0, get_mask(MAX_NB_BITS), size=self.nb_tests, dtype=np.uint64, endpoint=True)
+            nb_corner_cases = self.nb_tests // 2
+            values[:nb_corner_cases] = self.rng.choice(self.corner_cases, size=nb_corner_cases)
+            values[:len(self.corner_cases)] = np.roll(self.corner_cases, len(self.variable_values))
+            self.variable_values.append(values)
+        return self.variable_values[variable_index]
+
+    def evaluate_mops(self, mop_list: List[mop_t]):
+        # Returns the values of each mop on the input vectors, or None if a mop can't be evaluated.
+        # Leafs with equal mops share the same input vector (as they share the same Z3 variable in create_z3_vars)
+        known_leaf_mops = []
+        values_list = []
+        with np.errstate(all="ignore"):
+            for mop in mop_list:
+                values = self._evaluate(mop_to_ast(mop), known_leaf_mops)
+                if values is None:
+                    return None
+                values_list.append(values)
+        return values_list
+
+    def _evaluate(self, ast: Union[AstNode, AstLeaf], known_leaf_mops: List[mop_t]):
+        nb_bits = get_nb_bits(ast)
+        if nb_bits is None:
+            return None
+        mask = np.uint64(get_mask(nb_bits))
+        if ast.is_leaf():
+            if ast.is_constant():
+                return np.uint64(ast.value) & mask
+            leaf_index = get_mop_index(ast.mop, known_leaf_mops)
+            if leaf_index == -1:
+                known_leaf_mops.append(ast.mop)
+                leaf_index = len(known_leaf_mops) - 1
+            return self.get_variable_values(leaf_index) & mask
+
+        left = self._evaluate(ast.left, known_leaf_mops)
+        if left is None:
+            return None
+        if ast.opcode in [m_xdu, m_low]:
+            return left & mask
+        elif ast.opcode == m_xds:
+            return sign_extend(left, get_nb_bits(ast.left)) & mask
+        elif ast.opcode == m_high:
+            return (left >> np.uint64(max(get_nb_bits(ast.left) - nb_bits, 0))) & mask
+
+        left = left & mask
+        if ast.opcode == m_neg:
+            return (np.uint64(0) - left) & mask
+        elif ast.opcode == m_bnot:
+            return ~left & mask
+
+        if ast.right is None:
+            return None
+        right = self._evaluate(ast.right, known_leaf_mops)
+        if right is None:
+            return None
+        right = right & mask
+        if ast.opcode == m_add:
+            return (left + right) & mask
+        elif ast.opcode == m_sub:
+            return (left - right) & mask
+        elif ast.opcode == m_mul:
+            return (left * right) & mask
+        elif ast.opcode == m_or:
+            return left | right
+        elif ast.opcode == m_and:
+            return left & right
+        elif ast.opcode == m_xor:
+            return left ^ right
+        elif ast.opcode == m_udiv:
+            return np.where(right == 0, mask, left // np.maximum(right, np.uint64(1))).astype(np.uint64)
+        elif ast.opcode == m_umod:
+            return np.where(right == 0, left, left % np.maximum(right, np.uint64(1))).astype(np.uint64)
+        elif ast.opcode == m_sdiv:
+            return _sdiv(sign_extend(left, nb_bits), sign_extend(right, nb_bits)) & mask
+        elif ast.opcode == m_smod:
+            return _smod(sign_extend(left, nb_bits), sign_extend(right, nb_bits)) & mask
+        elif ast.opcode in [m_shl, m_shr]:
+            shift = np.minimum(right, np.uint64(MAX_NB_BITS - 1))
+            shifted = left << shift if ast.opcode == m_shl else left >> shift
+            return np.where(right >= nb_bits, np.uint64(0), shifted & mask).astype(np.uint64)
+        elif ast.opcode == m_sar:
+            shift = np.minimum(right, np.uint64(nb_bits - 1)).astype(np.int64)
+            return (np.asarray(sign_extend(left, nb_bits)).view(np.int64) >> shift).view(np.uint64) & mask
+        # Comparisons, lnot, flags, ... are not translated by ast_to_z3_expression
+        return None
+
+
+def get_nb_bits(ast: Union[AstNode, AstLeaf]) -> Union[None, int]:
+    # Same width as get_z3_nb_bits, None if the expression can't be evaluated on 64 bits
+    size = ast.mop.size if ast.is_leaf() else ast.dest_size
+    if size is None or size <= 0 or 8 * size > MAX_NB_BITS:
+        return None
+    return 8 * size
+
+
+def get_mask(nb_bits: int) -> int:
+    return (1 << nb_bits) - 1
+
+
+def sign_extend(values, nb_bits: int):
+    # Sign-extends nb_bits values to 64 bits
+    if nb_bits >= MAX_NB_BITS:
+        return values
+    sign_bit = np.uint64(1 << (nb_bits - 1))
+    return ((values & np.uint64(get_mask(nb_bits))) ^ sign_bit) - sign_bit
+
+
+def _get_sign_and_magnitude(values):
+    is_negative = (values >> np.uint64(MAX_NB_BITS - 1)) != 0
+    return is_negative, np.where(is_negative, np.uint64(0) - values, values).astype(np.uint64)
+
+
+def _sdiv(left, right):
+    # SMT-LIB bvsdiv on 64-bit values: quotient rounded toward zero, x / 0 = -1 if x >= 0 else 1
+    left_is_negative, left_magnitude = _get_sign_and_magnitude(left)
+    right_is_negative, right_magnitude = _get_sign_and_magnitude(right)
+    quotient = left_magnitude // np.maximum(right_magnitude, np.uint64(1))
+    quotient = np.where(left_is_negative != right_is_negative, np.uint64(0) - quotient, quotient)
+    quotient_by_zero = np.where(left_is_negative, np.uint64(1), np.uint64(get_mask(MAX_NB_BITS)))
+    return np.where(right == 0, quotient_by_zero, quotient).astype(np.uint64)
+
+
+def _smod(left, right):
+    # SMT-LIB bvsmod on 64-bit values: the remainder has the sign of the divisor, x % 0 = x
+    left_is_negative, left_magnitude = _get_sign_and_magnitude(left)
+    right_is_negative, right_magnitude = _get_sign_and_magnitude(right)
+    remainder = left_magnitude % np.maximum(right_magnitude, np.uint64(1))
+    res = np.where(left_is_negative, np.uint64(0) - remainder, remainder)
+    res = np.where((remainder != 0) & (left_is_negative != right_is_negative), res + right, res)
+    return np.where(right == 0, left, res).astype(np.uint64)
+
+
+random_testing_statistics = RandomTestingStatistics()
+random_tester = None
+
+
+def configure_random_testing(nb_tests: int = DEFAULT_NB_TESTS):
+    # nb_tests = 0 disables random testing: all checks are done with Z3
+    global random_tester
+    random_tester = None
+    if NUMPY_INSTALLED and nb_tests > 0:
+        random_tester = RandomTester(nb_tests)
+
+
+def is_mop_equality_refuted(mop1: mop_t, mop2: mop_t) -> bool:
+    # Returns True if mop1 and mop2 have different values for at least one input vector, i.e. if
+    # z3_check_mop_equality(mop1, mop2) would return False
+    return _is_relation_refuted(mop1, mop2, True)
+
+
+def is_mop_inequality_refuted(mop1: mop_t, mop2: mop_t) -> bool:
+    # Returns True if mop1 and mop2 have the same value for at least one input vector, i.e. if
+    # z3_check_mop_inequality(mop1, mop2) would return False
+    return _is_relation_refuted(mop1, mop2, False)
+
+
+def _is_relation_refuted(mop1: mop_t, mop2: mop_t, check_equality: bool) -> bool:
+    if random_tester is None:
+        return False
+    random_testing_statistics.nb_checks += 1
+    values_list = random_tester.evaluate_mops([mop1, mop2])
+    if values_list is None:
+        random_testing_statistics.nb_unsupported += 1
+        return False
+    if check_equality:
+        is_refuted = bool(np.any(values_list[0] != values_list[1]))
+    else:
+        is_refuted = bool(np.any(values_list[0] == values_list[1]))
+    if is_refuted:
+        random_testing_statistics.nb_z3_calls_avoided += 1
+    return is_refuted
+
+
+configure_random_testing()
@@ -0,0 +1,650 @@
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import hashlib
+import inspect
+import importlib.util
+import argparse
+import itertools
+import concurrent.futures
+from typing import List, Union, Dict, Tuple
+
+from d810.hexrays_standin import install_hexrays_standin
+
+# Standalone verifier of the pattern matching rules, it can run outside of IDA (CI) thanks to the microcode stand-in:
+#   python -m d810.rule_verifier [--jobs N] [--widths 8,16,32,64] [--cache d810_rule_proofs.json] [RuleName ...]
+#
+# For each pattern of a rule and each operand width, candidate instructions are built from the pattern:
+#  - each AstLeaf is instantiated as a register, as a constant or, for a 'bnot_<leaf>' name, as bnot(<leaf>)
+#  - each AstConstant without expected value is a symbolic constant
+# Each candidate goes through the code used at runtime (CompiledPattern.match, check_candidate and get_replacement).
+# The symbolic constants are integers whose value is a Z3 term (SymbolicInt): when the rule code branches on them, each
+# feasible branch is explored and its condition is added to the path condition. For each path where the rule returns
+# a replacement, Z3 proves that the instruction and its replacement are equal under the path condition.
+#
+# Results are cached by a hash of the rule source (and of the modules defining the matching and Z3 semantics), so
+# that only the modified rules are verified again.
+USING_HEXRAYS_STANDIN = install_hexrays_standin()
+
+from ida_hexrays import *
+
+from d810.ast import mop_to_ast, AstNode, AstLeaf, AstConstant
+from d810.errors import RuleVerificationException
+from d810.hexrays_formatters import format_minsn_t
+from d810.z3_utils import Z3_INSTALLED, Z3_COMPARISONS, ast_list_to_z3_expression_list
+from d810.optimizers.instructions.handler import InstructionInfo
+from d810.optimizers.instructions.pattern_matching import PATTERN_MATCHING_RULES, PatternMatchingRule, \
+    PatternOptimizer
+from d810.optimizers.instructions.mba.linear import get_expression_mop
+
+if Z3_INSTALLED:
+    import z3
+
+# Increase when the verification method changes, to invalidate the cached proofs
+VERIFIER_VERSION = 1
+DEFAULT_WIDTHS = [8, 16, 32, 64]
+DEFAULT_PROOF_TIMEOUT_MS = 10000
+DEFAULT_PROOF_CACHE_PATH = "d810_rule_proofs.json"
+MAX_CANDIDATES_PER_PATTERN = 64
+MAX_PATHS_PER_CANDIDATE = 32
+# Python integers manipulated by the rules are emulated on this number of bits (e.g. SUB_TABLE[16] is 2**128)
+SYMBOLIC_NB_BITS = 256
+# Modules defining how a rule is matched, checked, rewritten and translated to Z3: the proofs depend on their code
+PROOF_SEMANTICS_MODULES = ["d810.ast", "d810.ast_canonical", "d810.hexrays_helpers", "d810.z3_utils",
+                           "d810.optimizers.instructions.handler",
+                           "d810.optimizers.instructions.pattern_matching.handler", "d810.hexrays_standin",
+                           "d810.rule_verifier"]
+
+PROOF_PROVEN = "proven"
+PROOF_FAILED = "failed"
+PROOF_UNKNOWN = "unknown"
+PROOF_UNSUPPORTED = "unsupported"
+PROOF_NOT_APPLICABLE = "not applicable"
+# Status of a rule verified on several patterns, candidates or widths: the first one found in this list
+PROOF_STATUS_PRIORITY = [PROOF_FAILED, PROOF_UNKNOWN, PROOF_PROVEN, PROOF_UNSUPPORTED, PROOF_NOT_APPLICABLE]
+# Rules for which Z3 is known not to conclude with the default timeout: they do not fail a --strict run.
+# The products of several bitwise terms of these rules are only proven on 8 bits.
+EXPECTED_UNKNOWN_RULES = ["Mul_MbaRule_1", "Mul_MbaRule_4", "Xor_NestedStuff"]
+
+LEAF_REGISTER = "reg"
+LEAF_CONSTANT = "cst"
+LEAF_BNOT = "bnot"
+
+EXTENSION_OPCODES = [m_xdu, m_xds]
+TRUNCATION_OPCODES = [m_low, m_high]
+BOOLEAN_RESULT_OPCODES = list(Z3_COMPARISONS.keys()) + [m_lnot]
+
+
+def get_worst_status(status_list: List[str]) -> str:
+    for status in PROOF_STATUS_PRIORITY:
+        if status in status_list:
+            return status
+    return PROOF_NOT_APPLICABLE
+
+
+def _to_z3(value):
+    if isinstance(value, SymbolicInt):
+        return value.z3_expr
+    if isinstance(value, int):
+        return z3.BitVecVal(int(value), SYMBOLIC_NB_BITS)
+    raise RuleVerificationException("Unsupported operand {0!r} for a symbolic integer".format(value))
+
+
+class SymbolicInt(object):
+    # Integer whose value is a Z3 term, used as the value of the symbolic constants (mop.nnn.value).
+    # Arithmetic gives new SymbolicInt and comparisons are decided by the PathTracer (which records the branch taken),
+    # so that the rule code (check_candidate, add_constant_leaf, hexrays_helpers, ...) can run unmodified.
+    # Using it where a concrete value is required (e.g. as an index) raises a RuleVerificationException.
+    __slots__ = ["z3_expr", "tracer"]
+
+    def __init__(self, z3_expr, tracer: PathTracer):
+        self.z3_expr = z3_expr
+        self.tracer = tracer
+
+    def _new(self, z3_expr) -> SymbolicInt:
+        return SymbolicInt(z3.simplify(z3_expr), self.tracer)
+
+    def _compare(self, operation, other):
+        if not isinstance(other, (int, SymbolicInt)):
+            return NotImplemented
+        return self.tracer.decide(operation(self.z3_expr, _to_z3(other)))
+
+    def __add__(self, other):
+        return self._new(self.z3_expr + _to_z3(other))
+
+    def __radd__(self, other):
+        return self._new(_to_z3(other) + self.z3_expr)
+
+    def __sub__(self, other):
+        return self._new(self.z3_expr - _to_z3(other))
+
+    def __rsub__(self, other):
+        return self._new(_to_z3(other) - self.z3_expr)
+
+    def __mul__(self, other):
+        return self._new(self.z3_expr * _to_z3(other))
+
+    def __rmul__(self, other):
+        return self._new(_to_z3(other) * self.z3_expr)
+
+    def __and__(self, other):
+        return self._new(self.z3_expr & _to_z3(other))
+
+    def __rand__(self, other):
+        return self._new(_to_z3(other) & self.z3_expr)
+
+    def __or__(self, other):
+        return self._new(self.z3_expr | _to_z3(other))
+
+    def __ror__(self, other):
+        return self._new(_to_z3(other) | self.z3_expr)
+
+    def __xor__(self, other):
+        return self._new(self.z3_expr ^ _to_z3(other))
+
+    def __rxor__(self, other):
+        return self._new(_to_z3(other) ^ self.z3_expr)
+
+    def __lshift__(self, other):
+        return self._new(self.z3_expr << _to_z3(other))
+
+    def __rlshift__(self, other):
+        return self._new(_to_z3(other) << self.z3_expr)
+
+    def __rshift__(self, other):
+        # Z3 >> is an arithmetic shift, as Python >> on integers
+        return self._new(self.z3_expr >> _to_z3(other))
+
+    def __rrshift__(self, other):
+        return self._new(_to_z3(other) >> self.z3_expr)
+
+    def __mod__(self, other):
+        # Z3 % is the signed modulo whose sign follows the divisor, as Python %
+        return self._new(self.z3_expr % _to_z3(other))
+
+    def __rmod__(self, other):
+        return self._new(_to_z3(other) % self.z3_expr)
+
+    def __floordiv__(self, other):
+        other = _to_z3(other)
+        return self._new((self.z3_expr - self.z3_expr % other) / other)
+
+    def __pow__(self, other):
+        if isinstance(other, SymbolicInt) or other < 0:
+            raise RuleVerificationException("Unsupported symbolic exponent {0}".format(other))
+        result = _to_z3(1)
+        for _ in range(other):
+            result = result * self.z3_expr
+        return self._new(result)
+
+    def __rpow__(self, other):
+        # Only powers of 2 (e.g. 2 ** shift) have a bit-vector translation
+        if not isinstance(other, int) or other <= 0 or other & (other - 1) != 0:
+            raise RuleVerificationException("Unsupported symbolic power of {0}".format(other))
+        return self._new(_to_z3(1) << (self.z3_expr * (other.bit_length() - 1)))
+
+    def __neg__(self):
+        return self._new(-self.z3_expr)
+
+    def __invert__(self):
+        return self._new(~self.z3_expr)
+
+    def __pos__(self):
+        return self
+
+    def __eq__(self, other):
+        return self._compare(lambda a, b: a == b, other)
+
+    def __ne__(self, other):
+        return self._compare(lambda a, b: a != b, other)
+
+    def __lt__(self, other):
+        return self._compare(lambda a, b: a < b, other)
+
+    def __le__(self, other):
+        return self._compare(lambda a, b: a <= b, other)
+
+    def __gt__(self, other):
+        return self._compare(lambda a, b: a > b, other)
+
+    def __ge__(self, other):
+        return self._compare(lambda a, b: a >= b, other)
+
+    def __bool__(self):
+        return self.tracer.decide(self.z3_expr != 0)
+
+    def __hash__(self):
+        return self.z3_expr.hash()
+
+    def __index__(self):
+        raise RuleVerificationException("Symbolic integer {0} used as a concrete value".format(self))
+
+    __int__ = __index__
+
+    def __str__(self):
+        return str(self.z3_expr)
+
+
+class PathTracer(object):
+    # Decides the branches on symbolic integers during one run of the rule code: the first decisions are forced
+    # (to explore a path found by a previous run), the next ones take the True branch if it is feasible
+    def __init__(self, forced_decisions: List[bool], timeout_ms: int):
+        self.forced_decisions = forced_decisions
+        self.timeout_ms = timeout_ms
+        self.decisions = []
+        # Condition of the branch taken at each decision
+        self.conditions = []
+        self.solver = z3.Solver()
+        self.solver.set("timeout", timeout_ms)
+
+    def is_feasible(self, condition) -> bool:
+        self.solver.push()
+        self.solver.add(condition)
+        is_feasible = self.solver.check() != z3.unsat
+        self.solver.pop()
+        return is_feasible
+
+    def decide(self, condition) -> bool:
+        condition = z3.simplify(condition)
+        if z3.is_true(condition):
+            return True
+        if z3.is_false(condition):
+            return False
+        decision_index = len(self.decisions)
+        if decision_index < len(self.forced_decisions):
+            decision = self.forced_decisions[decision_index]
+        else:
+            decision = self.is_feasible(condition)
+        taken_condition = condition if decision else z3.Not(condition)
+        self.decisions.append(decision)
+        self.conditions.append(taken_condition)
+        self.solver.add(taken_condition)
+        return decision
+
+    def get_alternative_paths(self) -> List[List[bool]]:
+        # Feasible paths which differ from this one on a decision which was not forced
+        alternative_paths = []
+        solver = z3.Solver()
+        solver.set("timeout", self.timeout_ms)
+        for decision_index in range(len(self.decisions)):
+            if decision_index >= len(self.forced_decisions):
+                solver.push()
+                solver.add(z3.Not(self.conditions[decision_index]))
+                if solver.check() != z3.unsat:
+                    alternative_paths.append(self.decisions[:decision_index] + [not self.decisions[decision_index]])
+                solver.pop()
+            solver.add(self.conditions[decision_index])
+        return alternative_paths
+
+
+class CandidateBuilder(object):
+    # Builds a candidate instruction from a rule pattern, for a width and a choice of instantiation for each leaf
+    def __init__(self, nb_bits: int, leaf_choices: Dict[str, Tuple[str, str]], tracer: PathTracer):
+        self.nb_bits = nb_bits
+        self.leaf_choices = leaf_choices
+        self.tracer = tracer
+        self.register_by_name = {}
+        self.symbolic_constant_by_name = {}
+
+    def _get_symbolic_constant(self, name: str, nb_bits: int) -> SymbolicInt:
+        symbolic_constant = self.symbolic_constant_by_name.get(name)
+        if symbolic_constant is None:
+            z3_var = z3.BitVec("{0}_{1}".format(name, nb_bits), nb_bits)
+            symbolic_constant = SymbolicInt(z3.ZeroExt(SYMBOLIC_NB_BITS - nb_bits, z3_var), self.tracer)
+            self.symbolic_constant_by_name[name] = symbolic_constant
+        return symbolic_constant
+
+    def _build_leaf(self, leaf: AstLeaf, nb_bits: int) -> mop_t:
+        leaf_mop = mop_t()
+        if isinstance(leaf, AstConstant):
+            if leaf.expected_value is not None:
+                leaf_mop.make_number(leaf.expected_value & ((1 << nb_bits) - 1), nb_bits // 8)
+            else:
+                leaf_mop.make_number(self._get_symbolic_constant(leaf.name, nb_bits), nb_bits // 8)
+            return leaf_mop
+        leaf_kind, bnot_leaf_name = self.leaf_choices[leaf.name]
+        if leaf_kind == LEAF_CONSTANT:
+            leaf_mop.make_number(self._get_symbolic_constant(leaf.name, nb_bits), nb_bits // 8)
+        elif leaf_kind == LEAF_BNOT:
+            return self._build_operation(m_bnot, nb_bits, self._build_leaf(AstLeaf(bnot_leaf_name), nb_bits))
+        else:
+            register = self.register_by_name.setdefault(leaf.name, len(self.register_by_name) + 1)
+            leaf_mop.make_reg(register, nb_bits // 8)
+        return leaf_mop
+
+    @staticmethod
+    def _build_operation(opcode: int, nb_bits: int, left: mop_t, right: Union[None, mop_t] = None) -> minsn_t:
+        new_ins = minsn_t(0)
+        new_ins.opcode = opcode
+        new_ins.l = left
+        if right is not None:
+            new_ins.r = right
+        new_ins.d.size = nb_bits // 8
+        new_mop = mop_t()
+        new_mop.create_from_insn(new_ins)
+        return new_mop
+
+    @staticmethod
+    def get_operand_nb_bits(opcode: int, nb_bits: int) -> int:
+        if opcode in EXTENSION_OPCODES:
+            if nb_bits <= 8:
+                raise RuleVerificationException("No smaller operand for {0} bits".format(nb_bits))
+            return nb_bits // 2
+        if opcode in TRUNCATION_OPCODES:
+            if nb_bits >= 64:
+                raise RuleVerificationException("No larger operand for {0} bits".format(nb_bits))
+            return nb_bits * 2
+        return nb_bits
+
+    def _build_operands(self, pattern: AstNode, nb_bits: int) -> Tuple[mop_t, Union[None, mop_t]]:
+        operand_nb_bits = self.get_operand_nb_bits(pattern.opcode, nb_bits)
+        left = self._build(pattern.left, operand_nb_bits)
+        right = self._build(pattern.right, operand_nb_bits) if pattern.right is not None else None
+        return left, right
+
+    def _build(self, pattern: Union[AstNode, AstLeaf], nb_bits: int) -> mop_t:
+        if pattern.is_leaf():
+            return self._build_leaf(pattern, nb_bits)
+        left, right = self._build_operands(pattern, nb_bits)
+        result_nb_bits = 8 if pattern.opcode in BOOLEAN_RESULT_OPCODES else nb_bits
+        return self._build_operation(pattern.opcode, result_nb_bits, left, right)
+
+    def build_instruction(self, pattern: AstNode) -> minsn_t:
+        left, right = self._build_operands(pattern, self.nb_bits)
+        new_ins = minsn_t(0)
+        new_ins.opcode = pattern.opcode
+        new_ins.l = left
+        if right is not None:
+            new_ins.r = right
+        if pattern.opcode == m_mov:
+            result_size = left.size
+        else:
+            result_size = 1 if pattern.opcode in BOOLEAN_RESULT_OPCODES else self.nb_bits // 8
+        new_ins.d.make_reg(0, result_size)
+        return new_ins
+
+
+def get_pattern_leaf_names(pattern: Union[AstNode, AstLeaf]) -> List[str]:
+    leaf_names = []
+    for leaf in pattern.get_leaf_list():
+        if not isinstance(leaf, AstConstant) and leaf.name not in leaf_names:
+            leaf_names.append(leaf.name)
+    return leaf_names
+
+
+def get_leaf_choices_list(pattern: Union[AstNode, AstLeaf]) -> List[Dict[str, Tuple[str, str]]]:
+    # Candidates with registers only come first, then the ones with the fewest constants and bnot
+    leaf_names = get_pattern_leaf_names(pattern)
+    leaf_name_by_short_name = {leaf_name.replace("_", ""): leaf_name for leaf_name in leaf_names}
+    choices_by_leaf = []
+    for leaf_name in leaf_names:
+        leaf_choices = [(LEAF_REGISTER, None), (LEAF_CONSTANT, None)]
+        if leaf_name.startswith("bnot_"):
+            bnot_leaf_name = leaf_name_by_short_name.get(leaf_name[len("bnot_"):].replace("_", ""))
+            if bnot_leaf_name is not None and not bnot_leaf_name.startswith("bnot_"):
+                leaf_choices.insert(1, (LEAF_BNOT, bnot_leaf_name))
+        choices_by_leaf.append(leaf_choices)
+    all_choices = sorted(itertools.product(*choices_by_leaf),
+                         key=lambda choices: len([x for x in choices if x[0] != LEAF_REGISTER]))
+    return [dict(zip(leaf_names, choices)) for choices in all_choices[:MAX_CANDIDATES_PER_PATTERN]]
+
+
+def format_leaf_choices(leaf_choices: Dict[str, Tuple[str, str]]) -> str:
+    return ", ".join(["{0}={1}".format(leaf_name, leaf_kind if bnot_leaf_name is None else
+                                       "bnot({0})".format(bnot_leaf_name))
+                      for leaf_name, (leaf_kind, bnot_leaf_name) in leaf_choices.items()])
+
+
+def prove_replacement(ins: minsn_t, new_ins: minsn_t, path_conditions: List, timeout_ms: int) -> Tuple[str, str]:
+    # Returns the proof status and, if the proof failed, a counterexample
+    z3_ins, z3_new_ins = ast_list_to_z3_expression_list([mop_to_ast(get_expression_mop(ins)),
+                                                         mop_to_ast(get_expression_mop(new_ins))])
+    if z3_ins.size() != z3_new_ins.size():
+        return PROOF_FAILED, "replacement has {0} bits instead of {1}".format(z3_new_ins.size(), z3_ins.size())
+    solver = z3.Solver()
+    solver.set("timeout", timeout_ms)
+    solver.add(*path_conditions)
+    solver.add(z3_ins != z3_new_ins)
+    result = solver.check()
+    if result == z3.unsat:
+        return PROOF_PROVEN, ""
+    if result == z3.sat:
+        model = solver.model()
+        return PROOF_FAILED, "counterexample {0}".format(", ".join(sorted(["{0}={1}".format(x, model[x])
+                                                                        for x in model.decls()])))
+    return PROOF_UNKNOWN, "Z3 returned {0}".format(result)
+
+
+def verify_candidate(rule: PatternMatchingRule, pattern_index: int, nb_bits: int,
+                     leaf_choices: Dict[str, Tuple[str, str]], timeout_ms: int) -> List[Tuple[str, str]]:
+    # Explores the paths of the rule code for one candidate, returns the (status, detail) of each path
+    pattern = rule.pattern_candidates[pattern_index]
+    compiled_pattern = rule.compiled_patterns[pattern_index]
+    path_results = []
+    pending_paths = [[]]
+    while len(pending_paths) > 0 and len(path_results) < MAX_PATHS_PER_CANDIDATE:
+        tracer = PathTracer(pending_paths.pop(), timeout_ms)
+        ins = None
+        try:
+            ins = CandidateBuilder(nb_bits, leaf_choices, tracer).build_instruction(pattern)
+            ins_info = InstructionInfo(ins)
+            new_ins = None
+            if ins_info.ast is not None:
+                new_ins = rule.check_pattern_and_replace(compiled_pattern, ins_info.ast, ins_info.canonical_ast)
+            if new_ins is None:
+                status, detail = PROOF_NOT_APPLICABLE, ""
+            else:
+                status, detail = prove_replacement(ins, new_ins, tracer.conditions, timeout_ms)
+                detail = "{0} => {1}: {2}".format(format_minsn_t(ins), format_minsn_t(new_ins), detail)
+        except Exception as e:
+            # e.g. the rule code uses a symbolic constant as a concrete value, or expects another kind of leaf
+            status, detail = PROOF_UNSUPPORTED, "{0}: {1}".format(e.__class__.__name__, e)
+        if len(tracer.conditions) > 0:
+            detail = "{0} (path: {1})".format(detail, ", ".join([str(x) for x in tracer.conditions]))
+        path_results.append((status, detail))
+        pending_paths += tracer.get_alternative_paths()
+    return path_results
+
+
+def verify_rule_at_width(rule: PatternMatchingRule, nb_bits: int, timeout_ms: int) -> Dict:
+    # Stops at the first failed or unknown proof: the other candidates can not make the rule proven
+    status_list = []
+    nb_candidates = 0
+    for pattern_index, pattern in enumerate(rule.pattern_candidates):
+        if pattern is None or pattern.is_leaf():
+            continue
+        for leaf_choices in get_leaf_choices_list(pattern):
+            nb_candidates += 1
+            for status, detail in verify_candidate(rule, pattern_index, nb_bits, leaf_choices, timeout_ms):
+                status_list.append(status)
+                if status in [PROOF_FAILED, PROOF_UNKNOWN]:
+                    detail = "{0} bits, pattern {1} ({2}): {3}".format(nb_bits, pattern,
+                                                                      format_leaf_choices(leaf_choices), detail)
+                    return {"status": status, "nb_candidates": nb_candidates, "nb_paths": len(status_list),
+                            "details": [detail]}
+    return {"status": get_worst_status(status_list), "nb_candidates": nb_candidates, "nb_paths": len(status_list),
+            "details": []}
+
+
+_worker_rules_by_name = None
+_worker_timeout_ms = DEFAULT_PROOF_TIMEOUT_MS
+
+
+def get_rules_by_name() -> Dict[str, PatternMatchingRule]:
+    rules_by_name = {}
+    for rule in PATTERN_MATCHING_RULES:
+        rule.configure({})
+        rules_by_name[rule.name] = rule
+    return rules_by_name
+
+
+def _init_worker(timeout_ms: int):
+    global _worker_rules_by_name, _worker_timeout_ms
+    _worker_rules_by_name = get_rules_by_name()
+    _worker_timeout_ms = timeout_ms
+
+
+def _verify_rule_task(rule_name: str, nb_bits: int) -> Tuple[str, int, Dict]:
+    start_time = time.perf_counter()
+    result = verify_rule_at_width(_worker_rules_by_name[rule_name], nb_bits, _worker_timeout_ms)
+    result["time"] = time.perf_counter() - start_time
+    return rule_name, nb_bits, result
+
+
+def get_semantics_hash(widths: List[int], timeout_ms: int) -> str:
+    # The timeout is part of the hash: unknown results are verified again with another timeout
+    semantics_hash = hashlib.sha256()
+    semantics_hash.update("{0} {1} {2} {3} {4} {5}".format(VERIFIER_VERSION, widths, timeout_ms,
+                                                           MAX_CANDIDATES_PER_PATTERN, MAX_PATHS_PER_CANDIDATE,
+                                                           z3.get_version_string()).encode())
+    for module_name in PROOF_SEMANTICS_MODULES:
+        with open(importlib.util.find_spec(module_name).origin, "rb") as f:
+            semantics_hash.update(f.read())
+    return semantics_hash.hexdigest()
+
+
+def get_rule_hash(rule: PatternMatchingRule, semantics_hash: str) -> str:
+    rule_hash = hashlib.sha256(semantics_hash.encode())
+    for rule_class in type(rule).__mro__:
+        if rule_class is PatternMatchingRule:
+            break
+        try:
+            rule_hash.update(inspect.getsource(rule_class).encode())
+        except (OSError, TypeError):
+            rule_hash.update("{0} {1} {2}".format(rule_class.__name__, rule.pattern_candidates,
+                                                  rule.REPLACEMENT_PATTERN).encode())
+    return rule_hash.hexdigest()
+
+
+class ProofCache(object):
+    # JSON file: rule name -> hash of the rule source and verification result
+    def __init__(self, path: Union[None, str]):
+        self.path = path
+        self.entries = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f).get("rules", {})
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, rule_name: str, rule_hash: str) -> Union[None, Dict]:
+        entry = self.entries.get(rule_name)
+        if entry is None or entry["hash"] != rule_hash:
+            return None
+        return entry["result"]
+
+    def set(self, rule_name: str, rule_hash: str, result: Dict):
+        self.entries[rule_name] = {"hash": rule_hash, "result": result}
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": VERIFIER_VERSION, "rules": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def verify_rules(rule_names: Union[None, List[str]] = None, widths: List[int] = None, nb_jobs: int = None,
+                 timeout_ms: int = DEFAULT_PROOF_TIMEOUT_MS, cache_path: Union[None, str] = DEFAULT_PROOF_CACHE_PATH) \
+        -> Dict[str, Dict]:
+    # Returns, for each rule, its status, the status for each width and the details of the failed proofs
+    if not Z3_INSTALLED:
+        raise RuleVerificationException("Z3 is required to verify the rules")
+    widths = widths if widths is not None else DEFAULT_WIDTHS
+    rules_by_name = get_rules_by_name()
+    if rule_names is not None:
+        unknown_rule_names = [x for x in rule_names if x not in rules_by_name.keys()]
+        if len(unknown_rule_names) > 0:
+            raise RuleVerificationException("Unknown rules: {0}".format(", ".join(unknown_rule_names)))
+        rules_by_name = {x: rules_by_name[x] for x in rule_names}
+    semantics_hash = get_semantics_hash(widths, timeout_ms)
+    proof_cache = ProofCache(cache_path)
+
+    results = {}
+    rule_hashes = {}
+    tasks = []
+    for rule_name, rule in sorted(rules_by_name.items()):
+        rule_hashes[rule_name] = get_rule_hash(rule, semantics_hash)
+        cached_result = proof_cache.get(rule_name, rule_hashes[rule_name])
+        if cached_result is not None:
+            results[rule_name] = dict(cached_result, cached=True)
+            continue
+        results[rule_name] = {"status": None, "widths": {}, "details": [], "cached": False}
+        tasks += [(rule_name, nb_bits) for nb_bits in widths]
+
+    if len(tasks) > 0:
+        if nb_jobs == 1:
+            _init_worker(timeout_ms)
+            task_results = [_verify_rule_task(rule_name, nb_bits) for rule_name, nb_bits in tasks]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=nb_jobs, initializer=_init_worker,
+                                                        initargs=(timeout_ms,)) as executor:
+                task_results = list(executor.map(_verify_rule_task, *zip(*tasks)))
+        for rule_name, nb_bits, width_result in task_results:
+            results[rule_name]["widths"][str(nb_bits)] = width_result["status"]
+            results[rule_name]["details"] += width_result["details"]
+
+    for rule_name, result in results.items():
+        if result["cached"]:
+            continue
+        result["status"] = get_worst_status(list(result["widths"].values()))
+        proof_cache.set(rule_name, rule_hashes[rule_name], {x: result[x] for x in ["status", "widths", "details"]})
+    proof_cache.save()
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Prove the D-810 pattern matching rules with Z3")
+    parser.add_argument("rules", nargs="*", help="names of the rules to verify (default: all)")
+    parser.add_argument("--jobs", type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--widths", default=",".join([str(x) for x in DEFAULT_WIDTHS]),
+                        help="operand widths in bits (default: %(default)s)")
+    parser.add_argument("--timeout-ms", type=int, default=DEFAULT_PROOF_TIMEOUT_MS,
+                        help="Z3 timeout for each query (default: %(default)s)")
+    parser.add_argument("--cache", default=DEFAULT_PROOF_CACHE_PATH, help="proof cache file (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="verify all the rules and do not save the results")
+    parser.add_argument("--strict", action="store_true",
+                        help="also fail if a proof is unknown (except for the rules of EXPECTED_UNKNOWN_RULES)")
+    parser.add_argument("--verbose", action="store_true", help="print the result of each rule")
+    args = parser.parse_args(argv)
+
+    start_time = time.perf_counter()
+    results = verify_rules(args.rules if len(args.rules) > 0 else None,
+                           [int(x) for x in args.widths.split(",")], args.jobs, args.timeout_ms,
+                           None if args.no_cache else args.cache)
+    nb_rules_by_status = {}
+    for rule_name, result in sorted(results.items()):
+        nb_rules_by_status[result["status"]] = nb_rules_by_status.get(result["status"], 0) + 1
+        if args.verbose or result["status"] in [PROOF_FAILED, PROOF_UNKNOWN]:
+            widths = ", ".join(["{0} bits: {1}".format(x, y) for x, y in sorted(result["widths"].items(),
+                                                                                    key=lambda x: int(x[0]))])
+            print("{0}: {1} ({2})".format(rule_name, result["status"], widths))
+            for detail in result["details"]:
+                print("    {0}".format(detail))
+    print("{0} rules verified in {1:.1f}s ({2} cached): {3}"
+          .format(len(results), time.perf_counter() - start_time,
+                  len([x for x in results.values() if x["cached"]]),
+                  ", ".join(["{0} {1}".format(nb_rules_by_status[x], x) for x in PROOF_STATUS_PRIORITY
+                             if x in nb_rules_by_status])))
+    # The e-graph rewrites (see PatternOptimizer.get_egraph_rewrites) must only come from proven rules
+    unproven_egraph_rule_names = sorted([rule_name for rule_name, result in results.items()
+                                         if result["status"] != PROOF_PROVEN and
+                                         rule_name not in PatternOptimizer.EGRAPH_EXCLUDED_RULES])
+    if len(unproven_egraph_rule_names) > 0:
+        print("Rules not proven but used as e-graph rewrites (add them to PatternOptimizer.EGRAPH_EXCLUDED_RULES): "
+              "{0}".format(", ".join(unproven_egraph_rule_names)))
+        return 1
+    for rule_name, result in results.items():
+        if result["status"] == PROOF_FAILED:
+            return 1
+        if args.strict and result["status"] == PROOF_UNKNOWN and rule_name not in EXPECTED_UNKNOWN_RULES:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -49,9 +49,20 @@ class MopHistory(object):
         self._mc_initial_environment = MicroCodeEnvironment()
         self._mc_current_environment = self._mc_initial_environment.get_copy()
         self._is_dirty = True
+        # _mc_checkpoints[i] is the environment before the execution of the block i of the history. Checkpoints are
+        # exact copies (O(1)) which are never modified, thus after an edit of the history, the microcode is executed
+        # again from the last checkpoint which is still valid instead of from the initial environment.
+        self._mc_checkpoints = []
+        self._nb_valid_checkpoints = 0
+
+    def _set_dirty(self, first_modified_block_index: int):
+        # The checkpoints before the first modified block remain valid
+        self._is_dirty = True
+        self._nb_valid_checkpoints = min(self._nb_valid_checkpoints, first_modified_block_index + 1)
 
     def add_mop_initial_value(self, mop: mop_t, value: int):
         self._is_dirty = True
+        self._nb_valid_checkpoints = 0
         self._mc_initial_environment.define(mop, value)
 
     def get_copy(self) -> MopHistory:
@@ -60,6 +71,8 @@ class MopHistory(object):
         new_mop_history.unresolved_mop_list = [x for x in self.unresolved_mop_list]
         new_mop_history._mc_initial_environment = self._mc_initial_environment.get_copy()
         new_mop_history._mc_current_environment = new_mop_history._mc_initial_environment.get_copy()
+        new_mop_history._mc_checkpoints = self._mc_checkpoints[:self._nb_valid_checkpoints]
+        new_mop_history._nb_valid_checkpoints = self._nb_valid_checkpoints
         return new_mop_history
 
     def is_resolved(self) -> bool:
@@ -83,7 +96,7 @@ class MopHistory(object):
         blk_index = get_blk_index(old_blk, self.block_path)
         if blk_index > 0:
             self.history[blk_index].blk = new_blk
-            self._is_dirty = True
+            self._set_dirty(blk_index)
             return True
         else:
             logger.error("replace_block_in_path: should not happen")
@@ -91,7 +104,7 @@ class MopHistory(object):
 
     def insert_block_in_path(self, blk: mblock_t, where_index: int):
         self.history = self.history[:where_index] + [BlockInfo(blk)] + self.history[where_index:]
-        self._is_dirty = True
+        self._set_dirty(where_index)
 
     def insert_ins_in_block(self, blk: mblock_t, ins: minsn_t, before=True):
         blk_index = get_blk_index(blk, self.block_path)
@@ -102,20 +115,31 @@ class MopHistory(object):
             blk_info.ins_list = [ins] + blk_info.ins_list
         else:
             blk_info.ins_list = blk_info.ins_list + [ins]
-        self._is_dirty = True
+        self._set_dirty(blk_index)
 
     def _execute_microcode(self) -> bool:
         if not self._is_dirty:
             return True
-        formatted_mop_searched_list = "['" + "', '".join([format_mop_t(x) for x in self.searched_mop_list]) + "']"
-        logger.debug("Computing: {0} for path {1}".format(formatted_mop_searched_list, self.block_serial_path))
-        self._mc_current_environment = self._mc_initial_environment.get_copy()
-        for blk_info in self.history:
+        del self._mc_checkpoints[self._nb_valid_checkpoints:]
+        if len(self._mc_checkpoints) == 0:
+            self._mc_checkpoints.append(self._mc_initial_environment.get_copy())
+        start_blk_index = len(self._mc_checkpoints) - 1
+        if logger.isEnabledFor(logging.DEBUG):
+            formatted_mop_searched_list = "['" + "', '".join([format_mop_t(x) for x in self.searched_mop_list]) + "']"
+            logger.debug("Computing: {0} for path {1} from block {2}"
+                         .format(formatted_mop_searched_list, self.block_serial_path, start_blk_index))
+        self._mc_current_environment = self._mc_checkpoints[start_blk_index].get_copy(exact_values=True)
+        for blk_info in self.history[start_blk_index:]:
             for blk_ins in blk_info.ins_list:
-                logger.debug("Executing: {0}.{1}".format(blk_info.blk.serial, format_minsn_t(blk_ins)))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Executing: {0}.{1}".format(blk_info.blk.serial, format_minsn_t(blk_ins)))
                 if not self._mc_interpreter.eval_instruction(blk_info.blk, blk_ins, self._mc_current_environment):
+                    # The checkpoint of the block which can't be executed is kept: executing it again would fail
+                    self._nb_valid_checkpoints = len(self._mc_checkpoints)
                     self._is_dirty = False
                     return False
+            self._mc_checkpoints.append(self._mc_current_environment.get_copy(exact_values=True))
+        self._nb_valid_checkpoints = len(self._mc_checkpoints)
         self._is_dirty = False
         return True
 
@@ -1,4 +1,5 @@
 import ctypes
+from collections import OrderedDict
 
 from d810.hexrays_helpers import MSB_TABLE
 
@@ -67,3 +68,45 @@ def ror(x, n, nb_bits=32):
 
 def rol(x, n, nb_bits=32):
     return ror(x, nb_bits - n, nb_bits)
+
+
+class LRUCache(object):
+    # Bounded dictionary: when full, the least recently used entry is evicted
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.nb_hits = 0
+        self.nb_misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.nb_misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.nb_hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def reset_statistics(self):
+        self.nb_hits = 0
+        self.nb_misses = 0
+
+    @property
+    def hit_rate(self):
+        nb_lookups = self.nb_hits + self.nb_misses
+        if nb_lookups == 0:
+            return 0.0
+        return self.nb_hits / nb_lookups
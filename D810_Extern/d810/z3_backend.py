@@ -0,0 +1,289 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+import subprocess
+from collections import deque
+from typing import List, Union
+
+from d810.errors import D810Z3Exception
+
+logger = logging.getLogger('D810')
+
+try:
+    import z3
+    Z3_INSTALLED = True
+except ImportError:
+    Z3_INSTALLED = False
+
+Z3_SAT = "sat"
+Z3_UNSAT = "unsat"
+Z3_UNKNOWN = "unknown"
+
+# Time budget of a single Z3 query (0 for no limit): a query which is not solved in time is answered as unknown
+DEFAULT_Z3_TIMEOUT_MS = 5000
+# Time given to a worker to answer after the end of the time budget before it is killed and restarted
+WORKER_GRACE_PERIOD = 1.0
+WORKER_STARTUP_TIMEOUT = 30.0
+Z3_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "z3_worker.py")
+
+
+class Z3BackendStatistics(object):
+    def __init__(self):
+        self.nb_queries = 0
+        self.nb_unknown = 0
+        self.total_time = 0.0
+
+    def reset(self):
+        self.nb_queries = 0
+        self.nb_unknown = 0
+        self.total_time = 0.0
+
+    def __str__(self):
+        return "{0} queries in {1:.3f}s ({2} unknown or timed out)"\
+            .format(self.nb_queries, self.total_time, self.nb_unknown)
+
+
+class InProcessZ3Backend(object):
+    # Queries are solved one after the other by the Z3 of the IDA process, with the Z3 timeout.
+    # While a function is decompiled, all queries are checked by the same solver between push and pop, so that the
+    # lemmas learned and the terms built by Z3 are reused by the next queries on the same function
+    def __init__(self, timeout_ms: int = DEFAULT_Z3_TIMEOUT_MS):
+        self.timeout_ms = timeout_ms
+        self.shared_solver = None
+
+    def _create_solver(self):
+        solver = z3.Solver()
+        if self.timeout_ms > 0:
+            solver.set("timeout", self.timeout_ms)
+        return solver
+
+    def open_function_context(self):
+        self.shared_solver = self._create_solver()
+
+    def close_function_context(self):
+        self.shared_solver = None
+
+    def check(self, query_list) -> List[str]:
+        results = []
+        for query in query_list:
+            if self.shared_solver is None:
+                solver = self._create_solver()
+                solver.add(query)
+                results.append(str(solver.check()))
+                continue
+            self.shared_solver.push()
+            try:
+                self.shared_solver.add(query)
+                results.append(str(self.shared_solver.check()))
+            finally:
+                self.shared_solver.pop()
+        return results
+
+    def close(self):
+        self.shared_solver = None
+
+
+class Z3Worker(object):
+    def __init__(self, python_path: str, result_queue: queue.Queue):
+        self.result_queue = result_queue
+        self.process = subprocess.Popen([python_path, Z3_WORKER_SCRIPT], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True,
+                                        bufsize=1, creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+        # Answers are read by a thread (select does not work on pipes on Windows) and sent to the pool queue
+        self.reader_thread = threading.Thread(target=self._read_answers, daemon=True)
+        self.reader_thread.start()
+
+    def _read_answers(self):
+        for line in self.process.stdout:
+            try:
+                self.result_queue.put((self, json.loads(line)))
+            except ValueError:
+                continue
+        # None means that the worker process has exited
+        self.result_queue.put((self, None))
+
+    def send_query(self, query_id: int, smt2: str, timeout_ms: int):
+        self.process.stdin.write(json.dumps({"id": query_id, "smt2": smt2, "timeout_ms": timeout_ms}) + "\n")
+        self.process.stdin.flush()
+
+    def kill(self):
+        try:
+            self.process.kill()
+        except OSError:
+            pass
+
+
+class Z3WorkerPool(object):
+    # Queries are serialized to SMT-LIB2 and solved in parallel by nb_workers processes running z3_worker.py.
+    # If a worker does not answer before the time budget (+ WORKER_GRACE_PERIOD), it is killed and restarted, and the
+    # query is answered as unknown, so that decompilation is never blocked by a single query.
+    def __init__(self, nb_workers: int, timeout_ms: int = DEFAULT_Z3_TIMEOUT_MS, python_path: Union[None, str] = None):
+        self.timeout_ms = timeout_ms
+        self.python_path = python_path if python_path is not None else sys.executable
+        self.result_queue = queue.Queue()
+        self.workers = []
+        try:
+            for _ in range(nb_workers):
+                self.workers.append(self._start_worker())
+        except (OSError, D810Z3Exception):
+            self.close()
+            raise
+
+    def _start_worker(self) -> Z3Worker:
+        try:
+            worker = Z3Worker(self.python_path, self.result_queue)
+        except OSError as e:
+            raise D810Z3Exception("Can't start Z3 worker with {0}: {1}".format(self.python_path, e))
+        deadline = time.perf_counter() + WORKER_STARTUP_TIMEOUT
+        # Answers of the other workers received while waiting are put back in the queue
+        other_answers = []
+        try:
+            while True:
+                try:
+                    answering_worker, answer = self.result_queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    worker.kill()
+                    raise D810Z3Exception("Z3 worker started with {0} is not answering".format(self.python_path))
+                if answering_worker is not worker:
+                    other_answers.append((answering_worker, answer))
+                    continue
+                if answer is None or "ready" not in answer:
+                    worker.kill()
+                    raise D810Z3Exception("Z3 worker started with {0} failed: {1}".format(self.python_path, answer))
+                return worker
+        finally:
+            for other_answer in other_answers:
+                self.result_queue.put(other_answer)
+
+    def _restart_worker(self, worker: Z3Worker) -> Union[None, Z3Worker]:
+        worker.kill()
+        self.workers.remove(worker)
+        try:
+            new_worker = self._start_worker()
+        except D810Z3Exception as e:
+            logger.error("{0}".format(e))
+            return None
+        self.workers.append(new_worker)
+        return new_worker
+
+    def open_function_context(self):
+        # Each query is solved by a new solver in its worker, nothing is shared between queries
+        pass
+
+    def close_function_context(self):
+        pass
+
+    def check(self, query_list) -> List[str]:
+        results = [Z3_UNKNOWN] * len(query_list)
+        pending_queries = deque((query_id, self._to_smt2(query)) for query_id, query in enumerate(query_list))
+        idle_workers = list(self.workers)
+        running_queries = {}
+        max_query_time = self.timeout_ms / 1000 + WORKER_GRACE_PERIOD if self.timeout_ms > 0 else None
+        while len(pending_queries) > 0 or len(running_queries) > 0:
+            while len(pending_queries) > 0 and len(idle_workers) > 0:
+                worker = idle_workers.pop()
+                query_id, smt2 = pending_queries.popleft()
+                deadline = time.perf_counter() + max_query_time if max_query_time is not None else None
+                try:
+                    worker.send_query(query_id, smt2, self.timeout_ms)
+                    running_queries[worker] = (query_id, deadline)
+                except OSError:
+                    worker = self._restart_worker(worker)
+                    if worker is not None:
+                        idle_workers.append(worker)
+            if len(running_queries) == 0:
+                # All the workers are dead: the remaining queries are unknown
+                break
+
+            wait_time = None
+            if max_query_time is not None:
+                wait_time = max(min(deadline for _, deadline in running_queries.values()) - time.perf_counter(), 0)
+            try:
+                worker, answer = self.result_queue.get(timeout=wait_time)
+            except queue.Empty:
+                now = time.perf_counter()
+                for expired_worker, (query_id, deadline) in list(running_queries.items()):
+                    if deadline <= now:
+                        logger.warning("Z3 query {0} timed out: restarting its worker".format(query_id))
+                        del running_queries[expired_worker]
+                        new_worker = self._restart_worker(expired_worker)
+                        if new_worker is not None:
+                            idle_workers.append(new_worker)
+                continue
+
+            if worker not in running_queries.keys():
+                continue
+            query_id, _ = running_queries.pop(worker)
+            if answer is None:
+                new_worker = self._restart_worker(worker)
+                if new_worker is not None:
+                    idle_workers.append(new_worker)
+                continue
+            if answer.get("id") == query_id:
+                results[query_id] = answer["result"]
+            idle_workers.append(worker)
+        return results
+
+    @staticmethod
+    def _to_smt2(query) -> str:
+        solver = z3.Solver()
+        solver.add(query)
+        return solver.sexpr()
+
+    def close(self):
+        for worker in self.workers:
+            try:
+                worker.process.stdin.close()
+            except OSError:
+                pass
+            worker.kill()
+        self.workers = []
+
+
+z3_backend_statistics = Z3BackendStatistics()
+z3_backend = InProcessZ3Backend()
+
+
+def configure_z3_backend(timeout_ms: int = DEFAULT_Z3_TIMEOUT_MS, nb_workers: int = 0,
+                         python_path: Union[None, str] = None):
+    # nb_workers = 0 solves the queries in the IDA process. Inside IDA, sys.executable is IDA itself, so python_path
+    # must be set to a Python interpreter with z3 installed to use workers
+    global z3_backend
+    z3_backend.close()
+    z3_backend = InProcessZ3Backend(timeout_ms)
+    if nb_workers <= 0:
+        return
+    try:
+        z3_backend = Z3WorkerPool(nb_workers, timeout_ms, python_path)
+        logger.info("Z3 queries will be solved by {0} worker processes".format(nb_workers))
+    except D810Z3Exception as e:
+        logger.error("Z3 worker pool disabled, Z3 queries will be solved in IDA: {0}".format(e))
+
+
+def close_z3_backend():
+    z3_backend.close()
+
+
+def open_z3_backend_function_context():
+    z3_backend.open_function_context()
+
+
+def close_z3_backend_function_context():
+    z3_backend.close_function_context()
+
+
+def check_z3_queries(query_list) -> List[str]:
+    # Returns the result (Z3_SAT, Z3_UNSAT or Z3_UNKNOWN) of the satisfiability check of each query (a Z3 boolean
+    # expression)
+    if len(query_list) == 0:
+        return []
+    start_time = time.perf_counter()
+    results = z3_backend.check(query_list)
+    z3_backend_statistics.total_time += time.perf_counter() - start_time
+    z3_backend_statistics.nb_queries += len(query_list)
+    z3_backend_statistics.nb_unknown += sum(1 for result in results if result == Z3_UNKNOWN)
+    return results
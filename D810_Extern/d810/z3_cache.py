@@ -0,0 +1,149 @@
+import logging
+import sqlite3
+from typing import List, Union
+from ida_hexrays import *
+
+from d810.hexrays_helpers import get_mop_index
+from d810.hexrays_formatters import opcode_to_string
+from d810.ast import AstLeaf, AstNode
+from d810.utils import LRUCache
+
+logger = logging.getLogger('D810')
+
+Z3_VERDICT_CACHE_FILENAME = "d810_z3_verdicts.sqlite3"
+# Must be incremented each time the translation of an expression to Z3 (or the key format) changes, so that the
+# verdicts stored on disk by a previous version are not used anymore
+Z3_VERDICT_KEY_VERSION = 2
+
+
+def get_z3_verdict_key(relation: str, ast_list: List[Union[AstNode, AstLeaf]]) -> str:
+    # Canonical string of the checked relation: the variables are renamed x0, x1, ... in order of first appearance
+    # (equal mops get the same name, as in create_z3_vars) and each operand is written with its size, so that the
+    # same obfuscated expression gets the same key whatever its registers/stack variables and its address are
+    known_leaf_mops = []
+    ast_key_list = [_get_ast_key(ast, known_leaf_mops) for ast in ast_list]
+    return "{0}:{1}:{2}".format(Z3_VERDICT_KEY_VERSION, relation, ",".join(ast_key_list))
+
+
+def _get_ast_key(ast: Union[None, AstNode, AstLeaf], known_leaf_mops: List[mop_t]) -> str:
+    if ast is None:
+        return "_"
+    if ast.is_leaf():
+        if ast.mop.t == mop_z:
+            return "_"
+        if ast.is_constant():
+            return "0x{0:x}:{1}".format(ast.value, ast.mop.size)
+        leaf_index = get_mop_index(ast.mop, known_leaf_mops)
+        if leaf_index == -1:
+            known_leaf_mops.append(ast.mop)
+            leaf_index = len(known_leaf_mops) - 1
+        return "x{0}:{1}".format(leaf_index, ast.mop.size)
+    return "({0}:{1} {2} {3})".format(opcode_to_string(ast.opcode), ast.dest_size,
+                                      _get_ast_key(ast.left, known_leaf_mops),
+                                      _get_ast_key(ast.right, known_leaf_mops))
+
+
+class Z3VerdictCache(object):
+    # Verdicts of the Z3 checks (True/False) by relation key: the most recently used ones are kept in memory and, if a
+    # database path is configured, all of them are stored in a sqlite database so that they are reused in the next
+    # IDA sessions (and for other binaries protected by the same obfuscator)
+    MEMORY_CACHE_SIZE = 8192
+    # Number of new verdicts written to the database in a single transaction
+    NB_PENDING_WRITES_BEFORE_FLUSH = 64
+
+    def __init__(self):
+        self.is_enabled = False
+        self.memory_cache = LRUCache(self.MEMORY_CACHE_SIZE)
+        self.db_path = None
+        self.db = None
+        self.pending_writes = []
+        self.nb_disk_hits = 0
+
+    def configure(self, is_enabled: bool = True, db_path: Union[None, str] = None):
+        self.close()
+        self.is_enabled = is_enabled
+        self.memory_cache.clear()
+        self.reset_statistics()
+        if is_enabled and db_path is not None:
+            self._open_database(db_path)
+
+    def _open_database(self, db_path: str):
+        try:
+            self.db = sqlite3.connect(db_path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS z3_verdicts (key TEXT PRIMARY KEY, verdict INTEGER NOT NULL)")
+            self.db.commit()
+            self.db_path = db_path
+        except sqlite3.Error as e:
+            logger.error("Can't open Z3 verdict cache {0}: {1}".format(db_path, e))
+            self.db = None
+
+    def get(self, key: str) -> Union[None, bool]:
+        if not self.is_enabled:
+            return None
+        verdict = self.memory_cache.get(key)
+        if verdict is not None or self.db is None:
+            return verdict
+        try:
+            row = self.db.execute("SELECT verdict FROM z3_verdicts WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Can't read Z3 verdict cache {0}: {1}".format(self.db_path, e))
+            return None
+        if row is None:
+            return None
+        verdict = row[0] != 0
+        self.nb_disk_hits += 1
+        self.memory_cache.set(key, verdict)
+        return verdict
+
+    def set(self, key: str, verdict: bool):
+        if not self.is_enabled:
+            return
+        self.memory_cache.set(key, verdict)
+        if self.db is None:
+            return
+        self.pending_writes.append((key, int(verdict)))
+        if len(self.pending_writes) >= self.NB_PENDING_WRITES_BEFORE_FLUSH:
+            self.flush()
+
+    def flush(self):
+        if self.db is None or len(self.pending_writes) == 0:
+            return
+        try:
+            self.db.executemany("INSERT OR REPLACE INTO z3_verdicts (key, verdict) VALUES (?, ?)",
+                                self.pending_writes)
+            self.db.commit()
+        except sqlite3.Error as e:
+            logger.error("Can't write Z3 verdict cache {0}: {1}".format(self.db_path, e))
+        self.pending_writes = []
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+            self.db_path = None
+
+    def reset_statistics(self):
+        self.memory_cache.reset_statistics()
+        self.nb_disk_hits = 0
+
+    @property
+    def nb_lookups(self):
+        return self.memory_cache.nb_hits + self.memory_cache.nb_misses
+
+    @property
+    def nb_hits(self):
+        return self.memory_cache.nb_hits + self.nb_disk_hits
+
+    @property
+    def hit_rate(self):
+        if self.nb_lookups == 0:
+            return 0.0
+        return self.nb_hits / self.nb_lookups
+
+    def __str__(self):
+        return "{0} hits ({1} from disk) for {2} lookups ({3:.1%} hit rate)"\
+            .format(self.nb_hits, self.nb_disk_hits, self.nb_lookups, self.hit_rate)
+
+
+z3_verdict_cache = Z3VerdictCache()
@@ -1,10 +1,14 @@
 import logging
-from typing import List, Union
+from typing import List, Tuple, Union
 from ida_hexrays import *
 
-from d810.hexrays_helpers import get_mop_index
+from d810.hexrays_helpers import get_mop_index, get_mop_ignore_size_key, equal_mops_ignore_size
 from d810.hexrays_formatters import format_minsn_t, opcode_to_string
 from d810.ast import mop_to_ast, minsn_to_ast, AstLeaf, AstNode
+from d810.random_testing import is_mop_equality_refuted, is_mop_inequality_refuted
+from d810.z3_cache import z3_verdict_cache, get_z3_verdict_key
+from d810.z3_backend import check_z3_queries, open_z3_backend_function_context, \
+    close_z3_backend_function_context, Z3_UNSAT, Z3_UNKNOWN
 from d810.errors import D810Z3Exception
 
 logger = logging.getLogger('D810.plugin')
@@ -27,79 +31,200 @@ except ImportError:
     Z3_INSTALLED = False
 
 
+def get_z3_nb_bits(ast: Union[AstNode, AstLeaf]) -> int:
+    # Width of the Z3 bit-vector of an AST: the size of its mop for a leaf, the size of its destination for a node
+    size = ast.mop.size if ast.is_leaf() else ast.dest_size
+    if size is None or size <= 0:
+        raise D810Z3Exception("Z3 translation: invalid size {0} for {1}".format(size, ast))
+    return 8 * size
+
+
+def z3_resize(z3_expr, nb_bits: int):
+    # Zero-extends or truncates (keeping the low bits) a Z3 bit-vector to nb_bits
+    if z3_expr.size() < nb_bits:
+        return z3.ZeroExt(nb_bits - z3_expr.size(), z3_expr)
+    if z3_expr.size() > nb_bits:
+        return z3.Extract(nb_bits - 1, 0, z3_expr)
+    return z3_expr
+
+
+class Z3FunctionContext(object):
+    # Z3 variables of the function being decompiled: each distinct mop (ignoring its size) is declared once per width
+    # and the same variable is used by all the queries on this function, so that their terms are shared by Z3
+    def __init__(self):
+        self.mops_by_key = {}
+        self.nb_mops = 0
+        self.z3_var_by_mop_index_and_nb_bits = {}
+
+    def get_mop_index(self, mop: mop_t) -> int:
+        same_key_mops = self.mops_by_key.setdefault(get_mop_ignore_size_key(mop), [])
+        for known_mop, mop_index in same_key_mops:
+            if equal_mops_ignore_size(mop, known_mop):
+                return mop_index
+        # The mop is copied since the instruction it belongs to may be modified or freed by Hex-Rays
+        same_key_mops.append((mop_t(mop), self.nb_mops))
+        self.nb_mops += 1
+        return self.nb_mops - 1
+
+    def get_z3_var(self, mop: mop_t, nb_bits: int):
+        z3_var_key = (self.get_mop_index(mop), nb_bits)
+        z3_var = self.z3_var_by_mop_index_and_nb_bits.get(z3_var_key)
+        if z3_var is None:
+            z3_var = z3.BitVec("v_{0}_{1}".format(*z3_var_key), nb_bits)
+            self.z3_var_by_mop_index_and_nb_bits[z3_var_key] = z3_var
+        return z3_var
+
+
+z3_function_context = None
+
+
+def open_z3_function_context():
+    # Called when the decompilation of a function starts, see HexraysDecompilationHook
+    global z3_function_context
+    if not Z3_INSTALLED:
+        return
+    z3_function_context = Z3FunctionContext()
+    open_z3_backend_function_context()
+
+
+def close_z3_function_context():
+    global z3_function_context
+    if not Z3_INSTALLED:
+        return
+    z3_function_context = None
+    close_z3_backend_function_context()
+
+
 def create_z3_vars(leaf_list: List[AstLeaf]):
     if not Z3_INSTALLED:
         raise D810Z3Exception("Z3 is not installed")
+    # Leafs whose mops are equal (ignoring the size, e.g. eax and rax) share the same variable, created with the
+    # largest size: a smaller leaf is the low part of this variable
     known_leaf_list = []
-    known_leaf_z3_var_list = []
+    leaf_index_list = []
+    known_leaf_nb_bits_list = []
     for leaf in leaf_list:
-        if not leaf.is_constant():
-            leaf_index = get_mop_index(leaf.mop, known_leaf_list)
-            if leaf_index == -1:
-                known_leaf_list.append(leaf.mop)
-                leaf_index = len(known_leaf_list) - 1
-                if leaf.mop.size in [1, 2, 4, 8]:
-                    # Normally, we should create variable based on their size
-                    # but for now it can cause issue when instructions like XDU are used, hence this ugly fix
-                    # known_leaf_z3_var_list.append(z3.BitVec("x_{0}".format(leaf_index), 8 * leaf.mop.size))
-                    known_leaf_z3_var_list.append(z3.BitVec("x_{0}".format(leaf_index), 32))
-                    pass
-                else:
-                    known_leaf_z3_var_list.append(z3.BitVec("x_{0}".format(leaf_index), 32))
-            leaf.z3_var = known_leaf_z3_var_list[leaf_index]
-            leaf.z3_var_name = "x_{0}".format(leaf_index)
+        if leaf.is_constant() or leaf.mop.t == mop_z:
+            continue
+        leaf_index = get_mop_index(leaf.mop, known_leaf_list)
+        if leaf_index == -1:
+            known_leaf_list.append(leaf.mop)
+            known_leaf_nb_bits_list.append(0)
+            leaf_index = len(known_leaf_list) - 1
+        known_leaf_nb_bits_list[leaf_index] = max(known_leaf_nb_bits_list[leaf_index], get_z3_nb_bits(leaf))
+        leaf_index_list.append((leaf, leaf_index))
+
+    if z3_function_context is not None:
+        known_leaf_z3_var_list = [z3_function_context.get_z3_var(mop, nb_bits)
+                                  for mop, nb_bits in zip(known_leaf_list, known_leaf_nb_bits_list)]
+    else:
+        known_leaf_z3_var_list = [z3.BitVec("x_{0}".format(leaf_index), nb_bits)
+                                  for leaf_index, nb_bits in enumerate(known_leaf_nb_bits_list)]
+    for leaf, leaf_index in leaf_index_list:
+        leaf.z3_var = z3_resize(known_leaf_z3_var_list[leaf_index], get_z3_nb_bits(leaf))
+        leaf.z3_var_name = "x_{0}".format(leaf_index)
     return known_leaf_z3_var_list
 
 
+def get_z3_constant(value, nb_bits: int):
+    # value is either an int or a symbolic integer of the rule verifier (see d810.rule_verifier), which holds a Z3 term
+    if isinstance(value, int):
+        return z3.BitVecVal(value, nb_bits)
+    return z3_resize(value.z3_expr, nb_bits)
+
+
+Z3_COMPARISONS = {
+    m_setz: lambda a, b: a == b,
+    m_setnz: lambda a, b: a != b,
+    m_setae: lambda a, b: z3.UGE(a, b),
+    m_setb: lambda a, b: z3.ULT(a, b),
+    m_seta: lambda a, b: z3.UGT(a, b),
+    m_setbe: lambda a, b: z3.ULE(a, b),
+    m_setg: lambda a, b: a > b,
+    m_setge: lambda a, b: a >= b,
+    m_setl: lambda a, b: a < b,
+    m_setle: lambda a, b: a <= b,
+}
+
+
+def z3_bool_to_bitvec(z3_bool, nb_bits: int):
+    return z3.If(z3_bool, z3.BitVecVal(1, nb_bits), z3.BitVecVal(0, nb_bits))
+
+
 def ast_to_z3_expression(ast: Union[AstNode, AstLeaf], use_bitvecval=False):
+    # Each expression has the width of its mop: the operands of a node are resized to the size of its destination
+    # (e.g. the shift amount of m_shl) and the extension/truncation opcodes are translated with ZeroExt, SignExt and
+    # Extract. The operands of the comparisons (setz, ...) and of lnot keep their own width.
     if not Z3_INSTALLED:
         raise D810Z3Exception("Z3 is not installed")
+    nb_bits = get_z3_nb_bits(ast)
     if isinstance(ast, AstLeaf):
         if ast.is_constant():
-            return z3.BitVecVal(ast.value, 32)
+            return get_z3_constant(ast.value, nb_bits)
         return ast.z3_var
-    if ast.opcode == m_neg:
-        return -(ast_to_z3_expression(ast.left, use_bitvecval))
+
+    left = ast_to_z3_expression(ast.left, use_bitvecval)
+    if ast.opcode in Z3_COMPARISONS:
+        right = z3_resize(ast_to_z3_expression(ast.right, use_bitvecval), left.size())
+        return z3_bool_to_bitvec(Z3_COMPARISONS[ast.opcode](left, right), nb_bits)
     elif ast.opcode == m_lnot:
-        return not (ast_to_z3_expression(ast.left, use_bitvecval))
+        return z3_bool_to_bitvec(left == 0, nb_bits)
+    if ast.opcode == m_xdu:
+        return z3_resize(left, nb_bits)
+    elif ast.opcode == m_xds:
+        if left.size() < nb_bits:
+            return z3.SignExt(nb_bits - left.size(), left)
+        return z3_resize(left, nb_bits)
+    elif ast.opcode == m_low:
+        return z3_resize(left, nb_bits)
+    elif ast.opcode == m_high:
+        if left.size() > nb_bits:
+            return z3.Extract(left.size() - 1, left.size() - nb_bits, left)
+        return z3_resize(left, nb_bits)
+
+    left = z3_resize(left, nb_bits)
+    if ast.opcode == m_neg:
+        return -left
     elif ast.opcode == m_bnot:
-        return ~(ast_to_z3_expression(ast.left, use_bitvecval))
-    elif ast.opcode == m_add:
-        return (ast_to_z3_expression(ast.left, use_bitvecval)) + (ast_to_z3_expression(ast.right, use_bitvecval))
+        return ~left
+
+    right = z3_resize(ast_to_z3_expression(ast.right, use_bitvecval), nb_bits)
+    if ast.opcode == m_add:
+        return left + right
     elif ast.opcode == m_sub:
-        return (ast_to_z3_expression(ast.left, use_bitvecval)) - (ast_to_z3_expression(ast.right, use_bitvecval))
+        return left - right
     elif ast.opcode == m_mul:
-        return (ast_to_z3_expression(ast.left, use_bitvecval)) * (ast_to_z3_expression(ast.right, use_bitvecval))
+        return left * right
     elif ast.opcode == m_udiv:
-        return z3.UDiv(ast_to_z3_expression(ast.left, use_bitvecval=True),
-                       ast_to_z3_expression(ast.right, use_bitvecval=True))
+        return z3.UDiv(left, right)
     elif ast.opcode == m_sdiv:
-        return (ast_to_z3_expression(ast.left, use_bitvecval)) / (ast_to_z3_expression(ast.right, use_bitvecval))
+        return left / right
     elif ast.opcode == m_umod:
-        return z3.URem(ast_to_z3_expression(ast.left, use_bitvecval), ast_to_z3_expression(ast.right, use_bitvecval))
+        return z3.URem(left, right)
     elif ast.opcode == m_smod:
-        return (ast_to_z3_expression(ast.left, use_bitvecval)) % (ast_to_z3_expression(ast.right, use_bitvecval))
+        return left % right
     elif ast.opcode == m_or:
-        return (ast_to_z3_expression(ast.left, use_bitvecval)) | (ast_to_z3_expression(ast.right, use_bitvecval))
+        return left | right
     elif ast.opcode == m_and:
-        return (ast_to_z3_expression(ast.left, use_bitvecval)) & (ast_to_z3_expression(ast.right, use_bitvecval))
+        return left & right
     elif ast.opcode == m_xor:
-        return (ast_to_z3_expression(ast.left, use_bitvecval)) ^ (ast_to_z3_expression(ast.right, use_bitvecval))
+        return left ^ right
     elif ast.opcode == m_shl:
-        return (ast_to_z3_expression(ast.left, use_bitvecval)) << (ast_to_z3_expression(ast.right, use_bitvecval))
+        return left << right
     elif ast.opcode == m_shr:
-        return z3.LShR(ast_to_z3_expression(ast.left, use_bitvecval), ast_to_z3_expression(ast.right, use_bitvecval))
+        return z3.LShR(left, right)
     elif ast.opcode == m_sar:
-        return (ast_to_z3_expression(ast.left, use_bitvecval)) >> (ast_to_z3_expression(ast.right, use_bitvecval))
-    elif ast.opcode in [m_xdu, m_xds, m_low, m_high]:
-        return ast_to_z3_expression(ast.left, use_bitvecval)
+        return left >> right
     raise D810Z3Exception("Z3 evaluation: Unknown opcode {0} for {1}".format(opcode_to_string(ast.opcode), ast))
 
 
 def mop_list_to_z3_expression_list(mop_list: List[mop_t]):
+    return ast_list_to_z3_expression_list([mop_to_ast(mop) for mop in mop_list])
+
+
+def ast_list_to_z3_expression_list(ast_list: List[Union[AstNode, AstLeaf]]):
     if not Z3_INSTALLED:
         raise D810Z3Exception("Z3 is not installed")
-    ast_list = [mop_to_ast(mop) for mop in mop_list]
     ast_leaf_list = []
     for ast in ast_list:
         ast_leaf_list += ast.get_leaf_list()
@@ -107,26 +232,54 @@ def mop_list_to_z3_expression_list(mop_list: List[mop_t]):
     return [ast_to_z3_expression(ast) for ast in ast_list]
 
 
-def z3_check_mop_equality(mop1: mop_t, mop2: mop_t) -> bool:
+def z3_check_mop_relations(relation_list: List[Tuple[str, mop_t, mop_t]]) -> List[bool]:
+    # relation_list contains ("eq" | "ne", mop1, mop2) tuples: for each of them, returns True if Z3 proves that the
+    # relation holds for all values. The relations which are not in the verdict cache and not refuted by random testing
+    # are sent together to the Z3 backend, so that they are solved in parallel when a worker pool is configured.
+    # A query which is not solved within the time budget is considered as not proven (and its verdict is not cached)
     if not Z3_INSTALLED:
         raise D810Z3Exception("Z3 is not installed")
-    z3_mop1, z3_mop2 = mop_list_to_z3_expression_list([mop1, mop2])
-    s = z3.Solver()
-    s.add(z3.Not(z3_mop1 == z3_mop2))
-    if s.check().r == -1:
-        return True
-    return False
+    verdict_list = [None] * len(relation_list)
+    query_list = []
+    query_info_list = []
+    for i, (relation, mop1, mop2) in enumerate(relation_list):
+        ast_list = [mop_to_ast(mop1), mop_to_ast(mop2)]
+        verdict_key = get_z3_verdict_key(relation, ast_list)
+        verdict_list[i] = z3_verdict_cache.get(verdict_key)
+        if verdict_list[i] is not None:
+            continue
+        # Random testing finds most counterexamples much faster than Z3
+        if relation == "eq":
+            is_refuted = is_mop_equality_refuted(mop1, mop2)
+        else:
+            is_refuted = is_mop_inequality_refuted(mop1, mop2)
+        if is_refuted:
+            verdict_list[i] = False
+            z3_verdict_cache.set(verdict_key, False)
+            continue
+        z3_mop1, z3_mop2 = ast_list_to_z3_expression_list(ast_list)
+        # Mops of different sizes are compared as unsigned values
+        nb_bits = max(z3_mop1.size(), z3_mop2.size())
+        z3_mop1, z3_mop2 = z3_resize(z3_mop1, nb_bits), z3_resize(z3_mop2, nb_bits)
+        if relation == "eq":
+            query_list.append(z3.Not(z3_mop1 == z3_mop2))
+        else:
+            query_list.append(z3_mop1 == z3_mop2)
+        query_info_list.append((i, verdict_key))
+
+    for (i, verdict_key), result in zip(query_info_list, check_z3_queries(query_list)):
+        verdict_list[i] = result == Z3_UNSAT
+        if result != Z3_UNKNOWN:
+            z3_verdict_cache.set(verdict_key, verdict_list[i])
+    return verdict_list
+
+
+def z3_check_mop_equality(mop1: mop_t, mop2: mop_t) -> bool:
+    return z3_check_mop_relations([("eq", mop1, mop2)])[0]
 
 
 def z3_check_mop_inequality(mop1: mop_t, mop2: mop_t) -> bool:
-    if not Z3_INSTALLED:
-        raise D810Z3Exception("Z3 is not installed")
-    z3_mop1, z3_mop2 = mop_list_to_z3_expression_list([mop1, mop2])
-    s = z3.Solver()
-    s.add(z3_mop1 == z3_mop2)
-    if s.check().r == -1:
-        return True
-    return False
+    return z3_check_mop_relations([("ne", mop1, mop2)])[0]
 
 
 def rename_leafs(leaf_list: List[AstLeaf]) -> List[str]:
@@ -156,12 +309,10 @@ def log_z3_instructions(original_ins: minsn_t, new_ins: minsn_t):
 
     var_def_list = rename_leafs(orig_leaf_list + new_leaf_list)
 
-    z3_file_logger.info("print('Testing: {0} == {1}')".format(format_minsn_t(original_ins), format_minsn_t(new_ins)))
-    for var_def in var_def_list:
-        z3_file_logger.info("{0}".format(var_def))
-
-    removed_xdu = "{0}".format(orig_mba_tree).replace("xdu","")
-    z3_file_logger.info("original_expr = {0}".format(removed_xdu))
-    removed_xdu = "{0}".format(new_mba_tree).replace("xdu","")
-    z3_file_logger.info("new_expr = {0}".format(removed_xdu))
-    z3_file_logger.info("prove(original_expr == new_expr)\n")
+    # The snippet is logged as a single record: the file is written by the log writer thread (see d810.log_writer)
+    snippet_lines = ["print('Testing: {0} == {1}')".format(format_minsn_t(original_ins), format_minsn_t(new_ins))]
+    snippet_lines += var_def_list
+    snippet_lines.append("original_expr = {0}".format("{0}".format(orig_mba_tree).replace("xdu", "")))
+    snippet_lines.append("new_expr = {0}".format("{0}".format(new_mba_tree).replace("xdu", "")))
+    snippet_lines.append("prove(original_expr == new_expr)\n")
+    z3_file_logger.info("\n".join(snippet_lines))
@@ -0,0 +1,37 @@
+# Z3 worker process used by Z3WorkerPool (see z3_backend.py): it is run by a standalone Python interpreter (not by
+# IDA) and must not import d810 or any IDA module.
+# Protocol: one JSON object per line on stdin ({"id": ..., "smt2": ..., "timeout_ms": ...}) and one answer per line
+# on stdout ({"id": ..., "result": "sat" | "unsat" | "unknown"}). The first line written is {"ready": true} once Z3 is
+# loaded, or {"error": ...} if it can't be.
+import sys
+import json
+
+
+def write_answer(answer):
+    sys.stdout.write(json.dumps(answer) + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    try:
+        import z3
+    except ImportError as e:
+        write_answer({"error": "Can't import z3: {0}".format(e)})
+        return
+    write_answer({"ready": True})
+
+    for line in sys.stdin:
+        query = json.loads(line)
+        try:
+            solver = z3.Solver()
+            if query["timeout_ms"] > 0:
+                solver.set("timeout", query["timeout_ms"])
+            solver.from_string(query["smt2"])
+            result = str(solver.check())
+        except z3.Z3Exception:
+            result = "unknown"
+        write_answer({"id": query["id"], "result": result})
+
+
+if __name__ == "__main__":
+    main()
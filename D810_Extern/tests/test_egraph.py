@@ -0,0 +1,58 @@
+from d810.hexrays_standin import install_hexrays_standin
+
+install_hexrays_standin()
+
+from ida_hexrays import *
+
+from d810.ast import AstNode, AstLeaf
+from d810.egraph import EGraph, EGraphRewrite
+
+
+def make_reg_leaf(reg: int, size: int) -> AstLeaf:
+    reg_mop = mop_t()
+    reg_mop.make_reg(reg, size)
+    leaf = AstLeaf("x_{0}".format(reg))
+    leaf.mop = reg_mop
+    return leaf
+
+
+def make_node(opcode: int, dest_size: int, left, right=None) -> AstNode:
+    node = AstNode(opcode, left, right)
+    node.dest_size = dest_size
+    return node
+
+
+def test_enodes_of_different_sizes_are_not_hashconsed():
+    egraph = EGraph()
+    low_1_id = egraph.add_ast(make_node(m_low, 1, make_reg_leaf(0, 4)))
+    low_2_id = egraph.add_ast(make_node(m_low, 2, make_reg_leaf(0, 4)))
+    assert egraph.find(low_1_id) != egraph.find(low_2_id)
+    assert egraph.classes[egraph.find(low_1_id)].size == 1
+    assert egraph.classes[egraph.find(low_2_id)].size == 2
+    egraph.rebuild()
+    assert egraph.find(low_1_id) != egraph.find(low_2_id)
+
+
+def test_eclasses_of_different_sizes_are_not_merged():
+    egraph = EGraph()
+    low_1_id = egraph.add_ast(make_node(m_low, 1, make_reg_leaf(0, 4)))
+    low_2_id = egraph.add_ast(make_node(m_low, 2, make_reg_leaf(0, 4)))
+    assert not egraph.union(low_1_id, low_2_id)
+    assert egraph.find(low_1_id) != egraph.find(low_2_id)
+
+
+def test_xor_of_low_with_different_sizes_is_not_simplified():
+    left = make_node(m_xdu, 4, make_node(m_low, 1, make_reg_leaf(0, 4)))
+    right = make_node(m_xdu, 4, make_node(m_low, 2, make_reg_leaf(0, 4)))
+    egraph = EGraph()
+    root_id = egraph.add_ast(make_node(m_xor, 4, left, right))
+    # x ^ x => x & ~x: only fires if both operands of the xor are in the same e-class
+    xor_same_operands = EGraphRewrite("XorSame", AstNode(m_xor, AstLeaf("x_0"), AstLeaf("x_0")),
+                                      AstNode(m_and, AstLeaf("x_0"), AstNode(m_bnot, AstLeaf("x_0"))))
+    egraph.saturate([xor_same_operands])
+    assert egraph.nb_rewrites == 0
+    dest = mop_t()
+    dest.make_reg(8, 4)
+    new_ins = egraph.create_minsn(root_id, dest)
+    assert new_ins.opcode == m_xor
+    assert sorted([new_ins.l.d.l.size, new_ins.r.d.l.size]) == [1, 2]
@@ -0,0 +1,94 @@
+import random
+
+from d810.hexrays_standin import install_hexrays_standin
+
+install_hexrays_standin()
+
+from ida_hexrays import *
+
+from d810.ast import mop_to_ast
+from d810.optimizers.instructions.handler import InstructionInfo
+from d810.optimizers.instructions.mba.linear import get_expression_mop
+from d810.optimizers.instructions.pattern_matching.rewrite_add import Add_HackersDelightRule_1
+
+SIZE = 4
+TEST_VALUES = [0, 1, 2, 0x7fffffff, 0x80000000, 0xffffffff] + [random.Random(x).getrandbits(32) for x in range(16)]
+
+
+def make_reg(reg: int) -> mop_t:
+    reg_mop = mop_t()
+    reg_mop.make_reg(reg, SIZE)
+    return reg_mop
+
+
+def make_number(value: int) -> mop_t:
+    number_mop = mop_t()
+    number_mop.make_number(value, SIZE)
+    return number_mop
+
+
+def make_operation(opcode: int, left: mop_t, right: mop_t = None) -> mop_t:
+    new_ins = minsn_t(0)
+    new_ins.opcode = opcode
+    new_ins.l = left
+    if right is not None:
+        new_ins.r = right
+    new_ins.d.size = SIZE
+    new_mop = mop_t()
+    new_mop.create_from_insn(new_ins)
+    return new_mop
+
+
+def make_instruction(opcode: int, left: mop_t, right: mop_t) -> minsn_t:
+    new_ins = minsn_t(0)
+    new_ins.opcode = opcode
+    new_ins.l = left
+    new_ins.r = right
+    new_ins.d.make_reg(0, SIZE)
+    return new_ins
+
+
+def evaluate_instruction(ins: minsn_t, reg_values) -> int:
+    ins_ast = mop_to_ast(get_expression_mop(ins))
+    leaf_values = {leaf.ast_index: reg_values[leaf.mop.r] for leaf in ins_ast.get_leaf_list() if leaf.mop.t == mop_r}
+    return ins_ast.evaluate(leaf_values)
+
+
+def apply_rule(rule, ins: minsn_t):
+    ins_info = InstructionInfo(ins)
+    for compiled_pattern in rule.compiled_patterns:
+        new_ins = rule.check_pattern_and_replace(compiled_pattern, ins_info.ast, ins_info.canonical_ast)
+        if new_ins is not None:
+            return new_ins
+    return None
+
+
+def check_replacement_value(ins: minsn_t, new_ins: minsn_t):
+    for x_0, x_1 in zip(TEST_VALUES, reversed(TEST_VALUES)):
+        reg_values = {1: x_0, 2: x_1}
+        assert evaluate_instruction(new_ins, reg_values) == evaluate_instruction(ins, reg_values)
+
+
+def get_rule():
+    rule = Add_HackersDelightRule_1()
+    rule.configure({})
+    return rule
+
+
+def test_add_hackers_delight_1_replacement_value():
+    # (x_0 - ~x_1) - 1 => x_0 + x_1
+    ins = make_instruction(m_sub, make_operation(m_sub, make_reg(1), make_operation(m_bnot, make_reg(2))),
+                           make_number(1))
+    new_ins = apply_rule(get_rule(), ins)
+    assert new_ins is not None
+    assert new_ins.opcode == m_add
+    check_replacement_value(ins, new_ins)
+
+
+def test_add_hackers_delight_1_other_parenthesization():
+    # x_0 - (~x_1 - 1) is x_0 + x_1 + 2: if it is rewritten, the value must be kept
+    ins = make_instruction(m_sub, make_reg(1), make_operation(m_sub, make_operation(m_bnot, make_reg(2)),
+                                                              make_number(1)))
+    new_ins = apply_rule(get_rule(), ins)
+    if new_ins is not None:
+        check_replacement_value(ins, new_ins)